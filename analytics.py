@@ -0,0 +1,198 @@
+# analytics.py
+"""Отдельный read-only пул соединений для админских отчётов.
+
+Тяжёлые агрегаты (stats, show_stats, show_statistics, истории ДЗ) идут не
+через общее соединение DatabaseConnection, а через собственные соединения
+в режиме mode=ro поверх WAL. В WAL читатели работают со снимком базы и не
+блокируют запись, а запросы выполняются в отдельном потоке, так что
+сохранение домашек не ждёт отчёта.
+
+- statement timeout: progress handler прерывает запрос по дедлайну;
+- кэш результатов: необязательный, TTL задаётся на каждый запрос;
+- журнал медленных запросов: всё дольше порога пишется в лог с текстом запроса.
+
+fetch_tiered читает таблицу вместе с месячными архивами data_tiering:
+принятые домашки старше ARCHIVE_AFTER_DAYS есть только в архивах, и
+галерея со статистикой времени сдачи без них видели бы одни свежие работы.
+fetch_random_tiered выбирает одну случайную строку по счётчикам слоёв
+(count_tiered), не загружая всю историю в память.
+"""
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+
+from data_tiering import ARCHIVE_DB_DIR, count_tiered, iter_tiered, row_at_tiered
+from db_maintenance import apply_profile
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_POOL_SIZE = int(os.getenv("ANALYTICS_POOL_SIZE", "2"))
+ANALYTICS_STATEMENT_TIMEOUT = float(os.getenv("ANALYTICS_STATEMENT_TIMEOUT", "5"))  # секунды
+ANALYTICS_SLOW_QUERY_SECONDS = float(os.getenv("ANALYTICS_SLOW_QUERY_SECONDS", "0.5"))
+PROGRESS_HANDLER_STEPS = 1000  # как часто SQLite проверяет дедлайн (в инструкциях VM)
+
+
+class AnalyticsTimeoutError(Exception):
+    """Отчётный запрос превысил statement timeout и был прерван."""
+
+
+class AnalyticsPool:
+    """Пул read-only соединений для отчётов."""
+
+    def __init__(self, db_file: str, size: int = ANALYTICS_POOL_SIZE,
+                 statement_timeout: float = ANALYTICS_STATEMENT_TIMEOUT,
+                 slow_query_seconds: float = ANALYTICS_SLOW_QUERY_SECONDS, archive_dir: str = ARCHIVE_DB_DIR):
+        self.db_file = db_file
+        self.archive_dir = archive_dir
+        self.size = size
+        self.statement_timeout = statement_timeout
+        self.slow_query_seconds = slow_query_seconds
+        self._connections = None
+        self._cache = {}
+        self.slow_queries = 0
+        self.timeouts = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = f"file:{os.path.abspath(self.db_file)}?mode=ro"
+        # соединение живёт в пуле и используется из рабочих потоков по очереди
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=self.statement_timeout)
+        apply_profile(conn, read_only=True)
+        conn.execute("PRAGMA query_only=1")
+        return conn
+
+    def _get_queue(self) -> asyncio.Queue:
+        if self._connections is None:
+            self._connections = asyncio.Queue()
+            for _ in range(self.size):
+                self._connections.put_nowait(self._connect())
+            logger.info(f"AnalyticsPool: открыто {self.size} read-only соединений к {self.db_file}")
+        return self._connections
+
+    def _run(self, conn, statements):
+        """Выполняет запросы в одной read-транзакции - все видят один снимок."""
+        def run():
+            conn.execute("BEGIN")
+            try:
+                return [conn.execute(sql, params).fetchall() for sql, params in statements]
+            finally:
+                conn.execute("ROLLBACK")
+
+        return self._with_deadline(conn, run)
+
+    def _run_tiered(self, conn, table, columns, where, params, order_by, descending, user_id):
+        """iter_tiered без явной транзакции: архивы подключаются ATTACH, а он внутри транзакции запрещён."""
+        return [self._with_deadline(conn, lambda: list(iter_tiered(
+            conn, table, columns, where, params, order_by, descending, user_id=user_id,
+            archive_dir=self.archive_dir)))]
+
+    def _run_count_tiered(self, conn, table, where, params, user_id):
+        return [self._with_deadline(conn, lambda: count_tiered(
+            conn, table, where, params, user_id, archive_dir=self.archive_dir))]
+
+    def _run_row_at(self, conn, table, columns, where, params, counts, index):
+        return [self._with_deadline(conn, lambda: row_at_tiered(
+            conn, table, columns, where, params, counts, index, archive_dir=self.archive_dir))]
+
+    def _with_deadline(self, conn, run):
+        deadline = time.monotonic() + self.statement_timeout
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_HANDLER_STEPS)
+        try:
+            return run()
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise AnalyticsTimeoutError(f"Запрос прерван по таймауту {self.statement_timeout} c") from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    async def fetch_snapshot(self, statements: list, ttl: float | None = None) -> list[list[tuple]]:
+        """Выполняет несколько запросов на одном снимке базы. Возвращает список результатов."""
+        statements = [(sql, tuple(params)) for sql, params in statements]
+        return await self._fetch(tuple(statements), self._run, (statements,), ttl,
+                                 lambda: "; ".join(" ".join(sql.split()) for sql, _ in statements))
+
+    async def fetch_tiered(self, table: str, columns: list[str], where: str = "", params=(),
+                           order_by: tuple = (), descending: bool = False, user_id: int | None = None,
+                           ttl: float | None = None) -> list[tuple]:
+        """Строки таблицы из рабочей базы и месячных архивов (user_id - только архивы ученика)."""
+        params = tuple(params)
+        key = ("tiered", table, tuple(columns), where, params, tuple(order_by), descending, user_id)
+        return (await self._fetch(key, self._run_tiered,
+                                  (table, columns, where, params, order_by, descending, user_id), ttl,
+                                  lambda: f"{table} с архивами: {where}"))[0]
+
+    async def count_tiered(self, table: str, where: str = "", params=(), user_id: int | None = None,
+                           ttl: float | None = None) -> list[tuple[str | None, int]]:
+        """[(месяц или None, строк)] по слоям: COUNT(*) в рабочей базе и в каждом архиве."""
+        params = tuple(params)
+        key = ("tiered_count", table, where, params, user_id)
+        return (await self._fetch(key, self._run_count_tiered, (table, where, params, user_id), ttl,
+                                  lambda: f"COUNT {table} с архивами: {where}"))[0]
+
+    async def fetch_random_tiered(self, table: str, columns: list[str], where: str = "", params=(),
+                                  ttl: float | None = None) -> tuple | None:
+        """Случайная строка из всех слоёв: счётчики слоёв (кэшируются на ttl) и одна строка с OFFSET."""
+        counts = await self.count_tiered(table, where, params, ttl=ttl)
+        total = sum(count for _, count in counts)
+        if not total:
+            return None
+        index = random.randrange(total)
+        return (await self._fetch(None, self._run_row_at, (table, columns, where, tuple(params), counts, index),
+                                  None, lambda: f"{table} с архивами, строка {index}: {where}"))[0]
+
+    async def _fetch(self, key, run, args, ttl, describe) -> list:
+        if ttl:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+
+        queue = self._get_queue()
+        conn = await queue.get()
+        started = time.monotonic()
+        try:
+            results = await asyncio.to_thread(run, conn, *args)
+        except AnalyticsTimeoutError:
+            self.timeouts += 1
+            logger.error(f"AnalyticsPool: таймаут запроса {describe()}")
+            raise
+        finally:
+            queue.put_nowait(conn)
+
+        elapsed = time.monotonic() - started
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries += 1
+            logger.warning(f"AnalyticsPool: медленный запрос {elapsed:.3f} c: {describe()}")
+
+        if ttl:
+            self._cache[key] = (time.monotonic() + ttl, results)
+        return results
+
+    async def fetchall(self, sql: str, params=(), ttl: float | None = None) -> list[tuple]:
+        """Все строки одного запроса."""
+        return (await self.fetch_snapshot([(sql, params)], ttl=ttl))[0]
+
+    async def fetchone(self, sql: str, params=(), ttl: float | None = None) -> tuple | None:
+        """Первая строка запроса или None."""
+        rows = await self.fetchall(sql, params, ttl=ttl)
+        return rows[0] if rows else None
+
+    async def scalar(self, sql: str, params=(), ttl: float | None = None):
+        """Первое значение первой строки (или None)."""
+        row = await self.fetchone(sql, params, ttl=ttl)
+        return row[0] if row else None
+
+    def invalidate(self):
+        """Сбрасывает кэш результатов."""
+        self._cache.clear()
+
+    def close(self):
+        """Закрывает все соединения пула."""
+        if self._connections is None:
+            return
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+        self._connections = None
+        logger.info("AnalyticsPool: соединения закрыты")
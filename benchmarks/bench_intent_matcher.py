@@ -0,0 +1,70 @@
+# benchmarks/bench_intent_matcher.py
+"""Пропускная способность распознавания намерений (сообщений в секунду).
+
+Сравнивает автомат IntentMatcher со старой цепочкой проверок подстрок.
+Запуск: python -m benchmarks.bench_intent_matcher [число сообщений]
+"""
+import random
+import sys
+import time
+
+from intent_matcher import CodeWordMatcher, IntentMatcher
+
+SAMPLES = [
+    "Текущий урок",
+    "ту",
+    "покажите предварительные материалы пожалуйста",
+    "гдз",
+    "а какие есть тарифы?",
+    "нужна поддержка, не открывается видео",
+    "тут что-то не так с туманом",
+    "спасибо, всё понятно!",
+    "Добрый день! Подскажите, когда будет следующий урок и можно ли сдать домашку позже?",
+]
+CODE_WORDS = ["роза", "фиалка", "лепесток", "тыква", "слива", "молоко", "бонус", "бонус2"]
+CODE_SAMPLES = ["Роза", "фиалкa", "лепесток!", "тыквв", "слива", "молокко", "бонус", "неизвестно"]
+
+
+def substring_chain(text):
+    """Старая логика handle_text_message - для сравнения."""
+    text = text.lower()
+    if "предварительные" in text or "пм" in text:
+        return "preliminary"
+    if "текущий урок" in text or "ту" in text:
+        return "current_lesson"
+    if "галерея дз" in text or "гдз" in text:
+        return "gallery"
+    if "тарифы" in text or "тб" in text:
+        return "tariffs"
+    if "поддержка" in text or "пд" in text:
+        return "support"
+    return None
+
+
+def measure(func, messages):
+    started = time.perf_counter()
+    for message in messages:
+        func(message)
+    return len(messages) / (time.perf_counter() - started)
+
+
+def main(count=200_000):
+    rng = random.Random(42)
+    messages = [rng.choice(SAMPLES) for _ in range(count)]
+    codes = [rng.choice(CODE_SAMPLES) for _ in range(count // 10)]
+
+    build_started = time.perf_counter()
+    matcher = IntentMatcher()
+    code_matcher = CodeWordMatcher(CODE_WORDS)
+    build_ms = (time.perf_counter() - build_started) * 1000
+
+    print(f"сборка автоматов: {build_ms:.2f} мс")
+    print(f"IntentMatcher:        {measure(matcher.match, messages):>12,.0f} сообщений/с")
+    print(f"цепочка подстрок:     {measure(substring_chain, messages):>12,.0f} сообщений/с")
+    print(f"CodeWordMatcher:      {measure(code_matcher.match, codes):>12,.0f} кодовых слов/с")
+    false_hits = sum(1 for m in SAMPLES if substring_chain(m) and not matcher.match(m))
+    print(f"ложных срабатываний подстрок на выборке: {false_hits} из {len(SAMPLES)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
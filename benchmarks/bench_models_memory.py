@@ -0,0 +1,65 @@
+# benchmarks/bench_models_memory.py
+"""Память на запись: slotted-модели против dict с теми же полями.
+
+Меряются модели, которые бот действительно создаёт:
+- LessonFile - план файлов урока (get_lesson_files, раньше список dict
+  path/type/delay);
+- MediaItem - вложения домашки из альбома (homework_albums.Attachment).
+Для каждой строится список из N объектов тремя способами: dict по полям,
+кортеж и модель. Память меряется tracemalloc, содержимое строк общее для
+всех трёх способов и в разницу не входит.
+Запуск: python -m benchmarks.bench_models_memory [число записей]
+"""
+import random
+import sys
+import tracemalloc
+from dataclasses import fields
+
+from models import Course, LessonFile, MediaItem
+
+FILE_TYPES = ["text", "photo", "video", "audio", "document"]
+
+
+def lesson_files(count):
+    rng = random.Random(42)
+    return [(f"courses/femininity/lesson{i % 40 + 1}_{i}.{rng.choice(['md', 'jpg', 'mp4'])}",
+             rng.choice(FILE_TYPES), rng.choice([0, 0, 60, 600])) for i in range(count)]
+
+
+def media_items(count):
+    return [(f"AgACAgIAAxkBAAI{i:012d}", f"AQAD{i:08d}", random.Random(i).choice(["photo", "video", "document"]))
+            for i in range(count)]
+
+
+def measure(build):
+    """Байт на запись для построенного build() списка."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    items = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return total / len(items)
+
+
+def compare(model, rows):
+    names = [f.name for f in fields(model)]
+    print(f"{model.__name__}, записей: {len(rows):,}")
+    print(f"  dict по полям:   {measure(lambda: [dict(zip(names, row)) for row in rows]):>8.0f} байт/запись")
+    print(f"  кортеж:          {measure(lambda: [tuple(list(row)) for row in rows]):>8.0f} байт/запись")
+    print(f"  модель (slots):  {measure(lambda: [model(*row) for row in rows]):>8.0f} байт/запись")
+
+
+def main(count=100_000):
+    compare(LessonFile, lesson_files(count))
+    compare(MediaItem, media_items(count))
+
+    # Объекты без __dict__: размер экземпляра без содержимого полей
+    course = Course("femininity_premium", "Женственность", "main", "роза", 1500)
+    lesson = LessonFile("courses/femininity/lesson1.md", "text", 0)
+    print(f"экземпляр Course: {sys.getsizeof(course)} байт, LessonFile: {sys.getsizeof(lesson)} байт,"
+          f" dict урока: {sys.getsizeof({'path': lesson.path, 'type': lesson.type, 'delay': 0})} байт")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
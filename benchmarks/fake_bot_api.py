@@ -0,0 +1,94 @@
+# benchmarks/fake_bot_api.py
+"""Фейковый Bot API для воспроизведения записанных update без Telegram.
+
+FakeBotRequest подставляется в ApplicationBuilder.request(): на каждый
+метод отвечает правдоподобным JSON (Message, File, True) и считает вызовы.
+Задержка сети задаётся latency - по умолчанию ответ мгновенный, чтобы
+сравнение сборок мерило бота, а не сеть.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "ReplayBot", "username": "replay_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# методы, которые возвращают Message
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendAudio", "sendDocument", "sendVoice", "sendAnimation",
+    "sendSticker", "sendLocation", "sendContact", "sendDice", "forwardMessage", "editMessageText",
+    "editMessageCaption", "editMessageReplyMarkup", "editMessageMedia",
+}
+
+
+class FakeBotRequest(BaseRequest):
+    """Отвечает на вызовы Bot API локально и считает их по методам."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def reset(self):
+        self.calls.clear()
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _message(self, params: dict) -> dict:
+        self._message_id += 1
+        chat_id = params.get("chat_id", 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = 0
+        message = {"message_id": self._message_id, "date": int(time.time()), "from": BOT_USER,
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}}
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == "sendMediaGroup":
+            media = params.get("media") or []
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [self._message(params) for _ in media]
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            return {"file_id": file_id, "file_unique_id": f"u{hash(file_id) & 0xffffff:x}",
+                    "file_size": 1024, "file_path": f"photos/{file_id}.jpg"}
+        if method == "getChat":
+            return {"id": int(params.get("chat_id", 0)), "type": "private"}
+        if method == "getChatMember":
+            return {"status": "member", "user": {"id": int(params.get("user_id", 0)), "is_bot": False,
+                                                 "first_name": "user"}}
+        if method == "getUpdates":
+            return []
+        # answerCallbackQuery, deleteMessage, setMyCommands и прочие - True
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.json_parameters if request_data else {}
+        body = {"ok": True, "result": self._result(api_method, params)}
+        return 200, json.dumps(body).encode()
@@ -0,0 +1,201 @@
+# benchmarks/replay_updates.py
+"""Воспроизведение записанного потока update и сравнение двух сборок бота.
+
+Запись делает сам бот при заданном UPDATE_RECORD_PATH (update_recorder.py),
+отдельный файл на каждый запуск: updates-YYYYmmdd-HHMMSS.jsonl.gz.
+Здесь журнал скармливается Application.process_update() текущей сборки:
+- база - временная копия --db, id пользователей в ней переписываются теми
+  же псевдо-id, что в записи (нужна та же соль --salt / UPDATE_RECORD_SALT);
+- Bot API - FakeBotRequest (benchmarks/fake_bot_api.py), без сети;
+- без PicklePersistence и планировщика, только обработчики.
+
+Скорость: --speed 1 - в реальном темпе записи, 10 - в 10 раз быстрее,
+0 - без пауз. По каждому типу update (команда, префикс callback_data,
+текст, фото, альбом) считаются задержка обработки, число SQL-запросов
+к общему соединению и вызовов Bot API. Отчёт пишется в JSON.
+
+Запуск:
+  python -m benchmarks.replay_updates updates-20250301-031500.jsonl.gz --salt ... --out before.json
+  (переключиться на другую сборку)
+  python -m benchmarks.replay_updates updates-20250301-031500.jsonl.gz --salt ... --out after.json
+  python -m benchmarks.replay_updates --compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+from update_recorder import ADMIN_GROUP_PSEUDO_ID, UpdateAnonymizer, read_records, remap_user_ids
+
+
+def update_kind(update: dict) -> str:
+    """Группа для отчёта: cmd:/start, cb:approve_admin_check, text, photo, album, ..."""
+    if "callback_query" in update:
+        data = update["callback_query"].get("data") or ""
+        return "cb:" + (re.match(r"[^\d:|]*", data).group().rstrip("_") or "?")
+    message = update.get("message") or update.get("edited_message") or {}
+    text = message.get("text")
+    if text is not None:
+        return "cmd:" + text.split()[0].split("@")[0] if text.startswith("/") else "text"
+    if "photo" in message:
+        return "album" if "media_group_id" in message else "photo"
+    for kind in ("document", "video", "contact", "voice"):
+        if kind in message:
+            return kind
+    return next((key for key in update if key != "update_id"), "other")
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(samples: dict) -> dict:
+    report = {}
+    for kind, items in sorted(samples.items()):
+        latencies = [item[0] for item in items]
+        report[kind] = {
+            "count": len(items),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "p50_ms": round(percentile(latencies, 0.5), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "queries": round(statistics.fmean(item[1] for item in items), 2),
+            "api_calls": round(statistics.fmean(item[2] for item in items), 2),
+        }
+    return report
+
+
+def prepare_database(db_path: str, workdir: str, salt: str | None) -> str:
+    """Копия базы для прогона; оригинал не трогается."""
+    copy_path = os.path.join(workdir, "replay_db.sqlite")
+    source = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    target = sqlite3.connect(copy_path)
+    source.backup(target)
+    source.close()
+    if salt:
+        real_admins = [a for a in (os.getenv("ADMIN_IDS") or "").split(",") if a.strip()]
+        real_group = os.getenv("ADMIN_GROUP_ID")
+        remap_user_ids(target, UpdateAnonymizer(salt, real_admins, int(real_group) if real_group else None))
+    target.close()
+    return copy_path
+
+
+async def replay(path: str, db_path: str, speed: float, salt: str | None, limit: int | None) -> dict:
+    load_dotenv()  # реальные ADMIN_IDS/ADMIN_GROUP_ID для пересчёта id в копии базы
+    header, records = read_records(path)
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    replay_db = prepare_database(db_path, workdir, salt)
+
+    # main читает окружение при импорте: база-копия, псевдо-id админов из заголовка, фейковый токен
+    os.environ["DATABASE_FILE"] = replay_db
+    os.environ["ADMIN_IDS"] = ",".join(str(a) for a in header.get("admin_ids", []))
+    os.environ["ADMIN_GROUP_ID"] = str(header.get("admin_group_id") or ADMIN_GROUP_PSEUDO_ID)
+    os.environ["TELEGRAM_BOT_TOKEN"] = "1:replay"
+    os.environ.pop("UPDATE_RECORD_PATH", None)
+
+    import main
+    from telegram import Update
+    from benchmarks.fake_bot_api import FakeBotRequest
+
+    db = main.DatabaseConnection()
+    main.init_database(db.get_connection(), db.get_cursor())
+    queries = [0]
+    db.get_connection().set_trace_callback(lambda statement: queries.__setitem__(0, queries[0] + 1))
+
+    request = FakeBotRequest()
+    application = main.build_application(request=request, persistence=None)
+    await application.initialize()
+    await main.init_repository(application)
+
+    samples = defaultdict(list)
+    started = time.perf_counter()
+    try:
+        for index, record in enumerate(records):
+            if limit is not None and index >= limit:
+                break
+            if speed > 0:
+                delay = started + record["t"] / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = Update.de_json(record["update"], application.bot)
+            queries[0] = 0
+            calls_before = request.total_calls()
+            t0 = time.perf_counter()
+            await application.process_update(update)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            samples[update_kind(record["update"])].append(
+                (elapsed_ms, queries[0], request.total_calls() - calls_before))
+    finally:
+        await application.shutdown()
+        db.get_connection().set_trace_callback(None)
+        db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "recording": os.path.basename(path),
+        "recorded_at": header.get("recorded_at"),
+        "speed": speed,
+        "updates": sum(len(items) for items in samples.values()),
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "kinds": summarize(samples),
+    }
+
+
+def compare(before: dict, after: dict) -> str:
+    """Таблица разниц по типам update: задержка p50/p95, SQL-запросы, вызовы API."""
+    lines = [f"{'тип update':<32}{'n':>6}{'p50 мс':>18}{'p95 мс':>18}{'запросы':>16}{'API':>12}"]
+    kinds = sorted(set(before["kinds"]) | set(after["kinds"]))
+    for kind in kinds:
+        a, b = before["kinds"].get(kind), after["kinds"].get(kind)
+        if a is None or b is None:
+            lines.append(f"{kind:<32}{'только в ' + ('после' if a is None else 'до'):>24}")
+            continue
+
+        def cell(field, width):
+            delta = b[field] - a[field]
+            pct = f" {delta / a[field] * 100:+.0f}%" if a[field] else ""
+            return f"{a[field]:g}->{b[field]:g}{pct}".rjust(width)
+
+        lines.append(f"{kind:<32}{b['count']:>6}{cell('p50_ms', 18)}{cell('p95_ms', 18)}"
+                     f"{cell('queries', 16)}{cell('api_calls', 12)}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных update")
+    parser.add_argument("recording", nargs="?", help="журнал updates.jsonl.gz")
+    parser.add_argument("--db", default="bot_db.sqlite", help="база, копия которой используется для прогона")
+    parser.add_argument("--speed", type=float, default=0, help="1 - темп записи, 0 - без пауз")
+    parser.add_argument("--salt", default=os.getenv("UPDATE_RECORD_SALT"), help="соль записи для id в базе")
+    parser.add_argument("--limit", type=int, help="воспроизвести только первые N update")
+    parser.add_argument("--out", help="файл JSON-отчёта")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="сравнить два отчёта")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f_before, open(args.compare[1], encoding="utf-8") as f_after:
+            print(compare(json.load(f_before), json.load(f_after)))
+        return
+    if not args.recording:
+        parser.error("нужен журнал или --compare")
+
+    report = asyncio.run(replay(args.recording, args.db, args.speed, args.salt, args.limit))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output, file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
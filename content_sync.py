@@ -0,0 +1,202 @@
+# content_sync.py
+"""Синхронизация справочников курсов и уроков при старте.
+
+Раньше каждый старт построчно делал INSERT OR IGNORE из courses.json и
+всех lessons.json, с info-логом на строку. В lessons нет уникального
+ключа, поэтому каждый старт ещё и дублировал все уроки. Кроме того, при
+импорте main файлы lessons.json перечитывались и могли быть переписаны.
+
+Теперь:
+- у каждого входного файла считается sha256, и он сравнивается с
+  content_sync. Неизменившиеся файлы не разбираются и не пишутся;
+- изменившиеся применяются executemany в одной транзакции. courses
+  обновляются upsert'ом по course_id. lessons - upsert'ом по (course_id,
+  lesson), video_file_id при этом сохраняется, а уроки, которых больше
+  нет в файле, удаляются;
+- файл не в utf-8 читается как ISO-8859-1 в памяти, на диск ничего не
+  пишется.
+
+StartupTimer отмечает фазы старта, и в лог попадает одна строка с их
+длительностями.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+
+from time_utils import now_epoch
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class SyncResult:
+    source: str
+    changed: bool
+    rows: int = 0
+    removed: int = 0
+
+
+def create_content_sync_table(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Таблица хэшей и уникальный ключ уроков (дубликаты прошлых стартов схлопываются)."""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS content_sync (
+            source TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            synced_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_lessons_course_lesson'").fetchone() is None:
+        with conn:
+            # сохраняем самую раннюю строку урока, переносим в неё закэшированный video_file_id
+            conn.execute(
+                """
+                UPDATE lessons SET video_file_id = (
+                    SELECT MAX(d.video_file_id) FROM lessons d
+                    WHERE d.course_id = lessons.course_id AND d.lesson = lessons.lesson)
+                WHERE video_file_id IS NULL
+                """
+            )
+            removed = conn.execute(
+                "DELETE FROM lessons WHERE lesson_id NOT IN (SELECT MIN(lesson_id) FROM lessons GROUP BY course_id, lesson)"
+            ).rowcount
+            conn.execute("CREATE UNIQUE INDEX idx_lessons_course_lesson ON lessons(course_id, lesson)")
+        logger.info(f"create_content_sync_table: удалено дубликатов уроков: {removed}")
+    conn.commit()
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_json(path: str):
+    """JSON из файла: utf-8 (с BOM или без), иначе ISO-8859-1. Файл не переписывается."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        logger.warning(f"read_json: {path} не в utf-8, читаем как ISO-8859-1")
+        text = raw.decode("ISO-8859-1")
+    return json.loads(text)
+
+
+def _course_rows(data) -> list[tuple]:
+    return [(c.get("course_id"), c.get("course_name"), c.get("course_type"), c.get("code_word"), c.get("price_rub"))
+            for c in data]
+
+
+def _lesson_rows(course_id: str, data) -> list[tuple] | None:
+    if not all(isinstance(item, dict) and item.get("lesson") is not None for item in data):
+        return None
+    return [(course_id, item["lesson"], item.get("lesson_name"), item.get("description"), item.get("video_url"))
+            for item in data]
+
+
+def _apply_courses(conn: sqlite3.Connection, rows: list[tuple]) -> int:
+    before = conn.total_changes
+    # OR IGNORE - как и раньше, строки, не прошедшие CHECK (course_type 'bonus'), пропускаются
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO courses (course_id, course_name, course_type, code_word, price_rub) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(course_id) DO UPDATE SET course_name = excluded.course_name, course_type = excluded.course_type,
+            code_word = excluded.code_word, price_rub = excluded.price_rub
+        """,
+        rows,
+    )
+    skipped = len(rows) - (conn.total_changes - before)
+    if skipped:
+        logger.warning(f"sync_content: {skipped} курсов не прошли ограничения таблицы courses и пропущены")
+    return 0  # курсы не удаляем: на них ссылаются покупки
+
+
+def _apply_lessons(conn: sqlite3.Connection, course_id: str, rows: list[tuple]) -> int:
+    conn.executemany(
+        """
+        INSERT INTO lessons (course_id, lesson, lesson_name, description, video_url) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(course_id, lesson) DO UPDATE SET lesson_name = excluded.lesson_name,
+            description = excluded.description, video_url = excluded.video_url
+        """,
+        rows,
+    )
+    return conn.execute(
+        "DELETE FROM lessons WHERE course_id = ? AND lesson NOT IN (SELECT value FROM json_each(?))",
+        (course_id, json.dumps([row[1] for row in rows])),
+    ).rowcount
+
+
+def sync_content(conn: sqlite3.Connection, courses_file: str = "courses.json",
+                 courses_dir: str = "courses") -> list[SyncResult]:
+    """Применяет изменившиеся courses.json и courses/*/lessons.json одной транзакцией."""
+    stored = dict(conn.execute("SELECT source, sha256 FROM content_sync"))
+    inputs = []  # (источник, путь, course_id или None для courses.json)
+    if os.path.isfile(courses_file):
+        inputs.append((courses_file, courses_file, None))
+    else:
+        logger.error(f"sync_content: файл {courses_file} не найден")
+    if os.path.isdir(courses_dir):
+        for name in sorted(os.listdir(courses_dir)):
+            lessons_file = os.path.join(courses_dir, name, "lessons.json")
+            if os.path.isfile(lessons_file):
+                inputs.append((lessons_file, lessons_file, name))
+
+    results, pending = [], []
+    for source, path, course_id in inputs:
+        digest = file_digest(path)
+        if stored.get(source) == digest:
+            results.append(SyncResult(source, changed=False))
+            continue
+        try:
+            data = read_json(path)
+        except json.JSONDecodeError as e:
+            logger.error(f"sync_content: ошибка JSON в {path}: {e}")
+            continue
+        rows = _course_rows(data) if course_id is None else _lesson_rows(course_id, data)
+        if rows is None:
+            logger.error(f"sync_content: в {path} не у всех уроков есть номер (lesson)")
+            continue
+        pending.append((source, digest, course_id, rows))
+
+    if pending:
+        now = now_epoch()
+        with conn:
+            for source, digest, course_id, rows in pending:
+                removed = _apply_courses(conn, rows) if course_id is None else _apply_lessons(conn, course_id, rows)
+                conn.execute("INSERT OR REPLACE INTO content_sync VALUES (?, ?, ?, ?)", (source, digest, len(rows), now))
+                results.append(SyncResult(source, changed=True, rows=len(rows), removed=removed))
+    changed = [r for r in results if r.changed]
+    logger.info(f"sync_content: изменилось {len(changed)} из {len(inputs)} файлов"
+                + "".join(f"; {r.source}: {r.rows} строк, удалено {r.removed}" for r in changed))
+    return results
+
+
+class StartupTimer:
+    """Длительности фаз старта: mark(name) закрывает фазу, начатую предыдущей отметкой."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+
+    def mark(self, name: str) -> float:
+        now = time.perf_counter()
+        seconds = now - self.last
+        self.phases.append((name, seconds))
+        self.last = now
+        return seconds
+
+    def report(self) -> str:
+        parts = ", ".join(f"{name} {seconds:.3f} с" for name, seconds in self.phases)
+        return f"Старт за {self.last - self.started:.3f} с: {parts}"
@@ -0,0 +1,126 @@
+# course_catalog.py
+"""Каталог курсов с индексами и явный base_course_id в user_courses.
+
+course_id в courses.json - это базовый курс и тариф: femininity_premium,
+autogenic_self_check. Раньше код делил его по "_", и получалось два бага:
+- тариф self_check превращался в "self";
+- проверка "есть ли у ученика этот курс" шла запросом
+  course_id LIKE 'femininity%'. Такой запрос сканирует записи ученика и
+  путает курсы с общим префиксом (bonus_course и bonus_course_new).
+
+split_course_id отделяет только известные тарифы (KNOWN_TARIFFS).
+Идентификатор без такого суффикса - сам себе базовый курс с тарифом default.
+
+CourseCatalog загружается один раз при старте и держит индексы по кодовому
+слову (активация курса), полному course_id (название курса в меню) и
+базовому курсу (тарифы курса в смене тарифа).
+
+В user_courses есть колонка base_course_id с индексом (user_id,
+base_course_id). Её заполняют триггеры на вставку и смену course_id, с тем
+же правилом в SQL. Поэтому все пути записи, включая репозиторий и старый
+код, получают её без изменений, а проверка владения - один индексный поиск.
+"""
+import logging
+import sqlite3
+from typing import TYPE_CHECKING
+
+from db_schema import ensure_column
+
+if TYPE_CHECKING:  # models импортирует split_course_id отсюда
+    from models import Course
+
+logger = logging.getLogger(__name__)
+
+KNOWN_TARIFFS = ("self_check", "admin_check", "premium")
+DEFAULT_TARIFF = "default"
+
+
+def split_course_id(course_id: str) -> tuple[str, str]:
+    """femininity_self_check -> (femininity, self_check); bonus_course -> (bonus_course, default)."""
+    for tariff in KNOWN_TARIFFS:
+        suffix = f"_{tariff}"
+        if course_id.endswith(suffix) and len(course_id) > len(suffix):
+            return course_id[:-len(suffix)], tariff
+    return course_id, DEFAULT_TARIFF
+
+
+def base_course_sql(expr: str) -> str:
+    """То же правило, что split_course_id, в виде SQL-выражения над expr."""
+    cases = " ".join(
+        f"WHEN substr({expr}, -{len(tariff) + 1}) = '_{tariff}' AND length({expr}) > {len(tariff) + 1}"
+        f" THEN substr({expr}, 1, length({expr}) - {len(tariff) + 1})"
+        for tariff in KNOWN_TARIFFS
+    )
+    return f"CASE {cases} ELSE {expr} END"
+
+
+class CourseCatalog:
+    """Курсы из courses.json с индексами по кодовому слову, course_id и базовому курсу."""
+
+    def __init__(self, courses):
+        self.by_code_word = {}
+        self.by_id = {}
+        self.by_base = {}
+        for course in courses:
+            self.by_code_word[course.code_word] = course
+            self.by_id[course.course_id] = course
+            self.by_base.setdefault(split_course_id(course.course_id)[0], []).append(course)
+        logger.info(f"CourseCatalog: {len(self.by_id)} курсов, базовых {len(self.by_base)}")
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def by_code(self, code_word: str) -> "Course | None":
+        return self.by_code_word.get(code_word)
+
+    def get(self, course_id: str) -> "Course | None":
+        return self.by_id.get(course_id)
+
+    def base_course_id(self, course_id: str) -> str:
+        return split_course_id(course_id)[0]
+
+    def tariff(self, course_id: str) -> str:
+        return split_course_id(course_id)[1]
+
+    def variants(self, base_course_id: str) -> "list[Course]":
+        """Все тарифы базового курса."""
+        return list(self.by_base.get(base_course_id, ()))
+
+
+def create_base_course_column(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """user_courses.base_course_id: колонка, индекс, заполнение и триггеры."""
+    ensure_column(conn, "user_courses", "base_course_id", "TEXT")
+    cursor.executescript(
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_user_courses_base ON user_courses(user_id, base_course_id);
+
+        CREATE TRIGGER IF NOT EXISTS trg_user_courses_base_insert AFTER INSERT ON user_courses
+        WHEN NEW.base_course_id IS NULL AND NEW.course_id IS NOT NULL
+        BEGIN
+            UPDATE user_courses SET base_course_id = {base_course_sql("NEW.course_id")}
+            WHERE user_id = NEW.user_id AND course_id = NEW.course_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_user_courses_base_update AFTER UPDATE OF course_id ON user_courses
+        BEGIN
+            UPDATE user_courses SET base_course_id = {base_course_sql("NEW.course_id")}
+            WHERE user_id = NEW.user_id AND course_id = NEW.course_id;
+        END;
+        """
+    )
+    cursor.execute(
+        f"UPDATE user_courses SET base_course_id = {base_course_sql('course_id')}"
+        " WHERE base_course_id IS NULL AND course_id IS NOT NULL"
+    )
+    if cursor.rowcount:
+        logger.info(f"create_base_course_column: base_course_id заполнен для {cursor.rowcount} записей")
+    conn.commit()
+
+
+def owned_variant(cursor: sqlite3.Cursor, user_id: int, base_course_id: str) -> tuple | None:
+    """(course_id, tariff) записи ученика на этот базовый курс или None - поиск по idx_user_courses_base."""
+    cursor.execute(
+        "SELECT course_id, tariff FROM user_courses WHERE user_id = ? AND base_course_id = ?",
+        (user_id, base_course_id),
+    )
+    return cursor.fetchone()
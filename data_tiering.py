@@ -0,0 +1,353 @@
+# data_tiering.py
+"""Горячие и холодные данные: перенос закрытых записей в месячные архивы.
+
+homeworks, transactions и homework_rejections только растут. Рабочие
+запросы нужны только к свежим строкам, а индексы и страницы старых строк
+занимают page cache. Ночная задача переносит закрытые записи старше
+ARCHIVE_AFTER_DAYS в файлы ARCHIVE_DB_DIR/archive_YYYY-MM.sqlite, по
+месяцу записи:
+- homeworks - только принятые (status = 'approved'), месяц по времени
+  принятия; вместе с ними переносятся их homework_attachments;
+- transactions и homework_rejections - все старые строки.
+
+Перенос идёт пачками и в два шага: копия в архив (INSERT OR IGNORE по
+ключу) коммитится раньше удаления из основной базы. Поэтому при сбое между
+шагами строка временно есть в обоих слоях, но не теряется, а повторный
+запуск доводит перенос до конца. В транзакции удаления текст отказов и
+комментариев копируется в archived_fts (search_index), чтобы поиск
+админов находил и архивные строки.
+
+В основной базе остаётся маленький указатель archived_rows: в каких месяцах
+есть строки ученика. История, выгрузки, галерея и статистика времени
+сдачи (AnalyticsPool.fetch_tiered) читают через iter_tiered: к
+read-only соединению ATTACH-ами подключаются только нужные месяцы, и запрос
+выполняется над UNION ALL горячей таблицы и архивов. Случайная работа
+галереи не читает строки: count_tiered считает COUNT(*) по слоям, а
+row_at_tiered берёт одну строку с OFFSET из выбранного слоя. Если архивов больше,
+чем SQLite позволяет подключить к одному соединению, они читаются
+несколькими соединениями, и результаты сливаются по порядку сортировки.
+"""
+import heapq
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from db_maintenance import apply_profile
+from search_index import keep_archived_text
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB_DIR = os.getenv("ARCHIVE_DB_DIR", "archive_db")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_MOVE_BATCH = 500
+# Перед ночным обслуживанием - incremental_vacuum сразу вернёт освободившиеся страницы
+ARCHIVE_MINUTE = 0
+# SQLITE_MAX_ATTACHED по умолчанию 10; одно место оставляем про запас
+MAX_ATTACHED = 9
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@dataclass(frozen=True, slots=True)
+class TierTable:
+    """Таблица, которую можно разносить по слоям."""
+    name: str
+    key: str
+    time_expr: str  # по этому времени выбирается месяц архива
+    closed: str | None = None  # условие "запись закрыта и больше не меняется"
+    children: tuple = ()  # (таблица, колонка-ссылка на key, колонки уникального ключа)
+
+
+TIERED_TABLES = {
+    "homeworks": TierTable(
+        "homeworks", "hw_id", "COALESCE(final_approval_time, approval_time, submission_time, timestamp)",
+        closed="status = 'approved'",
+        children=(("homework_attachments", "hw_id", ("hw_id", "position")),),
+    ),
+    "transactions": TierTable("transactions", "id", "timestamp"),
+    "homework_rejections": TierTable("homework_rejections", "rejection_id", "rejected_at"),
+}
+
+
+def create_tiering_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Указатель архивов: в каком месяце сколько строк ученика."""
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS archived_rows (
+            table_name TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            PRIMARY KEY (table_name, user_id, month)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_archived_rows_month ON archived_rows(table_name, month);
+        """
+    )
+    conn.commit()
+
+
+def archive_path(archive_dir: str, month: str) -> str:
+    return os.path.join(archive_dir, f"archive_{month}.sqlite")
+
+
+def _alias(month: str) -> str:
+    return f"cold_{month.replace('-', '_')}"
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _prepare_cold_table(conn: sqlite3.Connection, alias: str, table: str, unique: tuple):
+    """Таблица в архиве с колонками горячей; недостающие (добавленные позже) колонки дописываются."""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {alias}.{table} AS SELECT * FROM main.{table} WHERE 0")
+    existing = set(_columns(conn, alias, table))
+    columns = _columns(conn, "main", table)
+    for column in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {alias}.{table} ADD COLUMN {column}")
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {alias}.ux_{table} ON {table}({', '.join(unique)})")
+    if "user_id" in columns:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_{table}_user ON {table}(user_id)")
+
+
+def _move_month(conn: sqlite3.Connection, spec: TierTable, month: str, keys: list, archive_dir: str) -> int:
+    alias = _alias(month)
+    os.makedirs(archive_dir, exist_ok=True)
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (archive_path(archive_dir, month),))
+    try:
+        marks = ", ".join("?" * len(keys))
+        tables = [(spec.name, spec.key, (spec.key,))] + list(spec.children)
+        tables = [t for t in tables if _columns(conn, "main", t[0])]
+        # шаг 1: копия в архив - транзакция только в архивном файле
+        with conn:
+            for table, ref, unique in tables:
+                _prepare_cold_table(conn, alias, table, unique)
+                columns = ", ".join(_columns(conn, "main", table))
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {alias}.{table} ({columns})"
+                    f" SELECT {columns} FROM main.{table} WHERE {ref} IN ({marks})",
+                    keys,
+                )
+        # шаг 2: удаление из основной базы и отметка в указателе
+        with conn:
+            conn.execute(
+                f"""
+                INSERT INTO archived_rows (table_name, user_id, month, rows)
+                SELECT ?, user_id, ?, COUNT(*) FROM main.{spec.name}
+                WHERE {spec.key} IN ({marks}) AND user_id IS NOT NULL
+                GROUP BY user_id
+                ON CONFLICT (table_name, user_id, month) DO UPDATE SET rows = rows + excluded.rows
+                """,
+                (spec.name, month, *keys),
+            )
+            keep_archived_text(conn, spec.name, keys)
+            for table, ref, _ in tables:
+                conn.execute(f"DELETE FROM main.{table} WHERE {ref} IN ({marks})", keys)
+    finally:
+        conn.execute(f"DETACH DATABASE {alias}")
+    return len(keys)
+
+
+def archive_batch(conn: sqlite3.Connection, spec: TierTable, cutoff: str, archive_dir: str = ARCHIVE_DB_DIR,
+                  batch_size: int = ARCHIVE_MOVE_BATCH) -> int:
+    """Переносит одну пачку закрытых строк старше cutoff. Возвращает число перенесённых строк."""
+    conn.commit()  # ATTACH невозможен внутри открытой транзакции
+    closed = f"{spec.closed} AND " if spec.closed else ""
+    rows = conn.execute(
+        f"""
+        SELECT {spec.key}, strftime('%Y-%m', {spec.time_expr}) AS month FROM main.{spec.name}
+        WHERE {closed}{spec.time_expr} < ? AND month IS NOT NULL
+        ORDER BY {spec.key} LIMIT ?
+        """,
+        (cutoff, batch_size),
+    ).fetchall()
+    by_month = defaultdict(list)
+    for key, month in rows:
+        by_month[month].append(key)
+    return sum(_move_month(conn, spec, month, keys, archive_dir) for month, keys in sorted(by_month.items()))
+
+
+def archive_cutoff(older_than_days: int = ARCHIVE_AFTER_DAYS, now: datetime | None = None) -> str:
+    return ((now or datetime.now()) - timedelta(days=older_than_days)).strftime(TIME_FORMAT)
+
+
+def archive_closed(conn: sqlite3.Connection, archive_dir: str = ARCHIVE_DB_DIR,
+                   older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_MOVE_BATCH,
+                   now: datetime | None = None) -> dict:
+    """Переносит всё, что пора архивировать. Возвращает {таблица: перенесено строк}."""
+    cutoff = archive_cutoff(older_than_days, now)
+    moved = {}
+    for spec in TIERED_TABLES.values():
+        if not _columns(conn, "main", spec.name):
+            continue
+        total = 0
+        while count := archive_batch(conn, spec, cutoff, archive_dir, batch_size):
+            total += count
+        moved[spec.name] = total
+    logger.info(f"archive_closed: до {cutoff} перенесено {moved}")
+    return moved
+
+
+def archived_months(conn: sqlite3.Connection, table: str, user_id: int | None = None) -> list[str]:
+    """Месяцы, в архивах которых есть строки таблицы (ученика, если задан user_id)."""
+    try:
+        if user_id is None:
+            rows = conn.execute("SELECT DISTINCT month FROM archived_rows WHERE table_name = ? ORDER BY month",
+                                (table,))
+        else:
+            rows = conn.execute("SELECT month FROM archived_rows WHERE table_name = ? AND user_id = ? ORDER BY month",
+                                (table, user_id))
+        return [row[0] for row in rows]
+    except sqlite3.OperationalError:  # база без указателя - архивов нет
+        return []
+
+
+def _tier_select(conn: sqlite3.Connection, schema: str, table: str, columns: list[str]) -> str:
+    existing = set(_columns(conn, schema, table))
+    fields = ", ".join(column if column in existing else f"NULL AS {column}" for column in columns)
+    return f"SELECT {fields} FROM {schema}.{table}"
+
+
+def _main_file(conn: sqlite3.Connection) -> str:
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+
+
+def _read_only(db_file: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+    apply_profile(conn, read_only=True)
+    return conn
+
+
+def iter_tiered(conn: sqlite3.Connection, table: str, columns: list[str], where: str = "", params=(),
+                order_by: tuple = (), descending: bool = False, user_id: int | None = None,
+                months: list[str] | None = None, archive_dir: str = ARCHIVE_DB_DIR):
+    """Строки таблицы из горячей базы и архивов в порядке order_by.
+
+    conn - соединение с основной базой без открытой транзакции (архивы
+    подключаются к нему). months по умолчанию берутся из archived_rows
+    (только месяцы ученика, если задан user_id). where может ссылаться на
+    любые колонки таблицы, order_by - только на колонки из columns.
+    """
+    if months is None:
+        months = archived_months(conn, table, user_id)
+    months = [month for month in months if os.path.exists(archive_path(archive_dir, month))]
+    direction = " DESC" if descending else ""
+    tail = (f" WHERE {where}" if where else "") + (
+        " ORDER BY " + ", ".join(f"{column}{direction}" for column in order_by) if order_by else "")
+    # первое соединение - переданное (горячая таблица и первые архивы), остальные открываются отдельно
+    chunks = [months[:MAX_ATTACHED]] + [months[i:i + MAX_ATTACHED]
+                                        for i in range(MAX_ATTACHED, len(months), MAX_ATTACHED)]
+    table_columns = _columns(conn, "main", table)
+    opened, attached, streams = [], [], []
+    try:
+        for number, chunk in enumerate(chunks):
+            chunk_conn = conn if number == 0 else _read_only(_main_file(conn))
+            if number:
+                opened.append(chunk_conn)
+            selects = [_tier_select(chunk_conn, "main", table, table_columns)] if number == 0 else []
+            for month in chunk:
+                alias = _alias(month)
+                chunk_conn.execute(f"ATTACH DATABASE ? AS {alias}", (archive_path(archive_dir, month),))
+                attached.append((chunk_conn, alias))
+                selects.append(_tier_select(chunk_conn, alias, table, table_columns))
+            sql = f"SELECT {', '.join(columns)} FROM ({' UNION ALL '.join(selects)}){tail}"
+            streams.append(chunk_conn.execute(sql, params))
+        if len(streams) == 1:
+            yield from streams[0]
+            return
+        positions = [columns.index(column) for column in order_by]
+        # NULL в SQLite меньше любого значения - так же и в ключе слияния
+        sort_key = lambda row: tuple((row[i] is not None, row[i]) for i in positions)
+        yield from heapq.merge(*streams, key=sort_key, reverse=descending)
+    finally:
+        for stream in streams:
+            stream.close()
+        for chunk_conn, alias in attached:
+            if chunk_conn is conn:
+                chunk_conn.execute(f"DETACH DATABASE {alias}")
+        for chunk_conn in opened:
+            chunk_conn.close()
+
+
+def _tier_sources(conn: sqlite3.Connection, table: str, months: list[str], archive_dir: str):
+    """(месяц или None для горячей таблицы, FROM-выражение) - по одному слою, архив подключён на время шага."""
+    table_columns = _columns(conn, "main", table)
+    yield None, f"({_tier_select(conn, 'main', table, table_columns)})"
+    for month in months:
+        path = archive_path(archive_dir, month)
+        if not os.path.exists(path):
+            continue
+        alias = _alias(month)
+        conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+        try:
+            yield month, f"({_tier_select(conn, alias, table, table_columns)})"
+        finally:
+            conn.execute(f"DETACH DATABASE {alias}")
+
+
+def count_tiered(conn: sqlite3.Connection, table: str, where: str = "", params=(), user_id: int | None = None,
+                 archive_dir: str = ARCHIVE_DB_DIR) -> list[tuple[str | None, int]]:
+    """[(месяц или None, строк)] по слоям с ненулевым числом строк - COUNT(*) в каждом, без чтения строк."""
+    tail = f" WHERE {where}" if where else ""
+    counts = []
+    for month, source in _tier_sources(conn, table, archived_months(conn, table, user_id), archive_dir):
+        count = conn.execute(f"SELECT COUNT(*) FROM {source}{tail}", params).fetchone()[0]
+        if count:
+            counts.append((month, count))
+    return counts
+
+
+def row_at_tiered(conn: sqlite3.Connection, table: str, columns: list[str], where: str, params,
+                  counts: list[tuple[str | None, int]], index: int,
+                  archive_dir: str = ARCHIVE_DB_DIR) -> tuple | None:
+    """Строка номер index в порядке слоёв count_tiered: LIMIT 1 OFFSET только в нужном слое."""
+    for month, count in counts:
+        if index < count:
+            break
+        index -= count
+    else:
+        return None
+    tail = f" WHERE {where}" if where else ""
+    tiers = _tier_sources(conn, table, [month] if month else [], archive_dir)
+    try:
+        for tier, source in tiers:
+            if tier == month:
+                return conn.execute(f"SELECT {', '.join(columns)} FROM {source}{tail} LIMIT 1 OFFSET ?",
+                                    (*params, index)).fetchone()
+    finally:
+        tiers.close()  # отключает архив сразу, а не при сборке генератора
+    return None
+
+
+def read_tiered(db_file: str, table: str, columns: list[str], where: str = "", params=(),
+                order_by: tuple = (), descending: bool = False, user_id: int | None = None,
+                archive_dir: str = ARCHIVE_DB_DIR) -> list[tuple]:
+    """iter_tiered на отдельном read-only соединении (для вызова из потока)."""
+    conn = _read_only(db_file)
+    try:
+        return list(iter_tiered(conn, table, columns, where, params, order_by, descending, user_id,
+                                archive_dir=archive_dir))
+    finally:
+        conn.close()
+
+
+def tier_stats(conn: sqlite3.Connection, archive_dir: str = ARCHIVE_DB_DIR) -> dict:
+    """Сводка для админа: строк в горячих таблицах и в архивах, размер архивов."""
+    hot = {name: conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
+           for name in TIERED_TABLES if _columns(conn, "main", name)}
+    cold = dict(conn.execute("SELECT table_name, SUM(rows) FROM archived_rows GROUP BY table_name").fetchall())
+    files = sorted(f for f in os.listdir(archive_dir) if f.startswith("archive_")) if os.path.isdir(archive_dir) else []
+    size = sum(os.path.getsize(os.path.join(archive_dir, f)) for f in files)
+    return {"hot": hot, "cold": cold, "archives": len(files), "archive_bytes": size}
+
+
+def format_tier_stats(stats: dict) -> str:
+    text = "🧊 Архив данных:\n"
+    for name, count in stats["hot"].items():
+        text += f"{name}: в рабочей базе {count}, в архиве {stats['cold'].get(name, 0)}\n"
+    text += f"Месячных архивов: {stats['archives']}, {stats['archive_bytes'] / 1024 / 1024:.2f} МБ"
+    return text
@@ -0,0 +1,292 @@
+# db_backup.py
+"""Резервные копии базы без остановки бота.
+
+Копия снимается online backup API SQLite на отдельном соединении в
+потоке, по BACKUP_PAGES_PER_STEP страниц за шаг с короткой паузой между
+шагами. Основное соединение и обработчики продолжают работать.
+
+Источник держит открытую read-транзакцию на всё время копирования. В WAL
+она не мешает записи, а копия получается целым снимком на момент начала.
+Без неё каждая запись бота заставляла бы backup начинать заново.
+
+Дальше:
+- копия проверяется через PRAGMA integrity_check, считаются строки таблиц;
+- сжимается в BACKUP_DIR/bot_db-YYYYmmdd-HHMMSS.sqlite.gz;
+- проверка восстановления: архив распаковывается во временный файл,
+  открывается, проходит quick_check, и число строк сверяется со снимком;
+- ротация: последние BACKUP_KEEP_DAILY копий плюс самая свежая копия
+  каждой из последних BACKUP_KEEP_WEEKLY недель.
+
+Месячные архивы data_tiering (archive_db/archive_YYYY-MM.sqlite) входят в
+тот же набор. Строки из них удалены из рабочей базы, поэтому без копии
+архива их не восстановить. Каждый архив копируется, проверяется и
+сжимается так же, как основная база, в
+bot_db-<метка>.archive_YYYY-MM.sqlite.gz. Ротация удаляет набор целиком.
+Восстановление архива - тот же --restore в archive_db/archive_YYYY-MM.sqlite.
+
+CLI:
+    python db_backup.py                      # снять копию bot_db.sqlite
+    python db_backup.py --verify <файл.gz>   # проверить восстановление
+    python db_backup.py --restore <файл.gz> --to restored.sqlite
+"""
+import argparse
+import glob
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_HOUR = int(os.getenv("BACKUP_HOUR", "3"))
+BACKUP_MINUTE = 15
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1000"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))  # секунды между шагами
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "7"))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "4"))
+
+BACKUP_NAME = re.compile(r"^bot_db-(\d{8}-\d{6})\.sqlite\.gz$")
+ARCHIVE_NAME = re.compile(r"^archive_\d{4}-\d{2}\.sqlite$")
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class BackupError(Exception):
+    """Копия не прошла проверку."""
+
+
+@dataclass
+class BackupResult:
+    path: str
+    pages: int
+    raw_bytes: int
+    compressed_bytes: int
+    seconds: float
+    steps: int
+    row_counts: dict
+    removed: list
+    archives: dict = field(default_factory=dict)  # файл копии архива -> число строк по таблицам
+
+
+def _row_counts(conn: sqlite3.Connection) -> dict:
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        " AND sql NOT LIKE 'CREATE VIRTUAL%' ORDER BY name")]
+    return {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+
+def snapshot_copy(db_file: str, target_file: str, pages: int = BACKUP_PAGES_PER_STEP,
+                  pause: float = BACKUP_STEP_PAUSE) -> tuple[int, int]:
+    """Копирует базу backup API шагами по pages страниц. Возвращает (страниц, шагов)."""
+    source = sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True)
+    target = sqlite3.connect(target_file)
+    steps = 0
+    total = 0
+
+    def progress(status, remaining, page_count):
+        nonlocal steps, total
+        steps += 1
+        total = page_count
+        if remaining and pause:
+            time.sleep(pause)  # отдаём диск и GIL боту между шагами
+
+    try:
+        # снимок на всё время копирования: запись бота не перезапускает backup
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=progress)
+        source.rollback()
+    finally:
+        target.close()
+        source.close()
+    return total, steps
+
+
+def _compress(raw_file: str, gz_file: str):
+    tmp = gz_file + ".tmp"
+    with open(raw_file, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+    os.replace(tmp, gz_file)
+
+
+def restore_backup(gz_file: str, target_file: str):
+    """Распаковывает копию в target_file (файл не должен использоваться ботом)."""
+    tmp = target_file + ".tmp"
+    with gzip.open(gz_file, "rb") as src, open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+    os.replace(tmp, target_file)
+
+
+def verify_backup(gz_file: str, expected_counts: dict | None = None) -> dict:
+    """Проверка восстановления: распаковка, quick_check и сверка числа строк. Возвращает число строк."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        restored = os.path.join(tmp_dir, "restored.sqlite")
+        restore_backup(gz_file, restored)
+        conn = sqlite3.connect(restored)
+        try:
+            check = conn.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                raise BackupError(f"{gz_file}: quick_check: {check}")
+            counts = _row_counts(conn)
+        finally:
+            conn.close()
+    if expected_counts is not None and counts != expected_counts:
+        differ = sorted(t for t in set(counts) | set(expected_counts) if counts.get(t) != expected_counts.get(t))
+        raise BackupError(f"{gz_file}: после восстановления не совпадает число строк в {', '.join(differ)}")
+    return counts
+
+
+def backup_files(backup_dir: str) -> list[tuple[datetime, str]]:
+    """Копии в каталоге, от новых к старым."""
+    if not os.path.isdir(backup_dir):
+        return []
+    files = []
+    for name in os.listdir(backup_dir):
+        match = BACKUP_NAME.match(name)
+        if match:
+            files.append((datetime.strptime(match.group(1), "%Y%m%d-%H%M%S"), os.path.join(backup_dir, name)))
+    return sorted(files, reverse=True)
+
+
+def rotate_backups(backup_dir: str, keep_daily: int = BACKUP_KEEP_DAILY,
+                   keep_weekly: int = BACKUP_KEEP_WEEKLY) -> list[str]:
+    """Удаляет копии вне набора хранения. Возвращает удалённые пути."""
+    files = backup_files(backup_dir)
+    keep = {path for _, path in files[:keep_daily]}
+    weeks = []
+    for stamp, path in files:
+        week = stamp.isocalendar()[:2]
+        if week not in weeks:
+            weeks.append(week)
+            if len(weeks) > keep_weekly:
+                break
+            keep.add(path)
+    removed = [path for _, path in files if path not in keep]
+    for path in removed:
+        for member in [path, *_archive_copies(path)]:
+            os.remove(member)
+    if removed:
+        logger.info(f"rotate_backups: удалено {len(removed)} старых копий")
+    return removed
+
+
+def _archive_copies(gz_file: str) -> list[str]:
+    """Копии месячных архивов, снятые вместе с копией базы gz_file."""
+    return sorted(glob.glob(glob.escape(gz_file[:-len(".sqlite.gz")]) + ".archive_*.sqlite.gz"))
+
+
+def _backup_file(db_file: str, gz_file: str, pages: int, pause: float) -> tuple[int, int, int, dict]:
+    """Копия одного файла базы: снимок, integrity_check, сжатие. Возвращает (страниц, шагов, байт, строки)."""
+    raw_file = os.path.join(os.path.dirname(gz_file), "." + os.path.basename(gz_file)[:-len(".gz")])
+    try:
+        page_count, steps = snapshot_copy(db_file, raw_file, pages, pause)
+        conn = sqlite3.connect(raw_file)
+        try:
+            check = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            if check != "ok":
+                raise BackupError(f"integrity_check копии {db_file}: {check}")
+            counts = _row_counts(conn)
+        finally:
+            conn.close()
+        raw_bytes = os.path.getsize(raw_file)
+        _compress(raw_file, gz_file)
+    finally:
+        if os.path.exists(raw_file):
+            os.remove(raw_file)
+    return page_count, steps, raw_bytes, counts
+
+
+def run_backup(db_file: str, backup_dir: str = BACKUP_DIR, pages: int = BACKUP_PAGES_PER_STEP,
+               pause: float = BACKUP_STEP_PAUSE, now: datetime | None = None,
+               archive_dir: str | None = None) -> BackupResult:
+    """Полный цикл: копия, проверка, сжатие, проверка восстановления, ротация. Блокирующий - вызывать в потоке.
+
+    archive_dir - каталог месячных архивов data_tiering: они копируются в тот же набор.
+    """
+    started = time.monotonic()
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = (now or datetime.now()).strftime("%Y%m%d-%H%M%S")
+    gz_file = os.path.join(backup_dir, f"bot_db-{stamp}.sqlite.gz")
+    archives = sorted(name for name in os.listdir(archive_dir) if ARCHIVE_NAME.match(name)) \
+        if archive_dir and os.path.isdir(archive_dir) else []
+    made = []
+    try:
+        made.append(gz_file)
+        page_count, steps, raw_bytes, counts = _backup_file(db_file, gz_file, pages, pause)
+        compressed_bytes = os.path.getsize(gz_file)
+        verify_backup(gz_file, counts)
+        archive_counts = {}
+        for name in archives:
+            archive_gz = f"{gz_file[:-len('.sqlite.gz')]}.{name}.gz"
+            made.append(archive_gz)
+            archive_pages, archive_steps, archive_bytes, archive_rows = _backup_file(
+                os.path.join(archive_dir, name), archive_gz, pages, pause)
+            verify_backup(archive_gz, archive_rows)
+            page_count += archive_pages
+            steps += archive_steps
+            raw_bytes += archive_bytes
+            compressed_bytes += os.path.getsize(archive_gz)
+            archive_counts[archive_gz] = archive_rows
+    except (BackupError, OSError, sqlite3.Error):
+        # непроверенный набор не должен вытеснить хорошие при ротации
+        for path in made:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    removed = rotate_backups(backup_dir)
+    result = BackupResult(path=gz_file, pages=page_count, raw_bytes=raw_bytes, compressed_bytes=compressed_bytes,
+                          seconds=round(time.monotonic() - started, 2), steps=steps, row_counts=counts,
+                          removed=removed, archives=archive_counts)
+    logger.info(f"run_backup: {gz_file} и архивов {len(archive_counts)}, {page_count} страниц за {steps} шагов,"
+                f" {result.seconds} с")
+    return result
+
+
+def format_backup_report(result: BackupResult) -> str:
+    mb = lambda n: f"{n / 1024 / 1024:.2f} МБ"
+    text = "💾 Резервная копия базы готова и проверена восстановлением\n"
+    text += f"Файл: {os.path.basename(result.path)}\n"
+    text += f"Размер: {mb(result.raw_bytes)}, сжато {mb(result.compressed_bytes)}\n"
+    text += f"Время: {result.seconds:g} с, {result.pages} страниц за {result.steps} шагов\n"
+    text += f"Таблиц: {len(result.row_counts)}, строк: {sum(result.row_counts.values())}"
+    if result.archives:
+        archived_rows = sum(sum(counts.values()) for counts in result.archives.values())
+        text += f"\nМесячных архивов: {len(result.archives)}, строк в них: {archived_rows}"
+    if result.removed:
+        text += f"\nУдалено старых копий: {len(result.removed)}"
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Резервные копии базы бота")
+    parser.add_argument("--db", default="bot_db.sqlite")
+    parser.add_argument("--dir", default=BACKUP_DIR)
+    parser.add_argument("--archive-dir", default="archive_db", help="каталог месячных архивов")
+    parser.add_argument("--verify", metavar="ФАЙЛ", help="проверить восстановление копии")
+    parser.add_argument("--restore", metavar="ФАЙЛ", help="распаковать копию")
+    parser.add_argument("--to", help="куда восстановить (для --restore)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.verify:
+        counts = verify_backup(args.verify)
+        print(f"{args.verify}: ok, таблиц {len(counts)}, строк {sum(counts.values())}")
+    elif args.restore:
+        if not args.to:
+            parser.error("--restore требует --to")
+        if os.path.exists(args.to):
+            parser.error(f"{args.to} уже существует - укажите новый файл")
+        restore_backup(args.restore, args.to)
+        print(f"{args.restore} -> {args.to}")
+    else:
+        print(format_backup_report(run_backup(args.db, args.dir, archive_dir=args.archive_dir)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# db_maintenance.py
+"""Профиль настроек SQLite и обслуживание базы.
+
+apply_profile() вызывается на каждом соединении (основном, отчётном,
+выгрузки). Плановые задачи:
+- checkpoint():       частый PASSIVE-checkpoint WAL, чтобы -wal не разрастался;
+- run_maintenance():  в тихие часы incremental_vacuum, ANALYZE, PRAGMA optimize
+                      и TRUNCATE-checkpoint;
+- db_stats():         размеры базы и WAL, страницы и настройки из PRAGMA
+                      для админской команды /dbstats.
+
+run_maintenance() блокирующий (первый запуск делает полный VACUUM) -
+вызывать в потоке на отдельном соединении, см. run_maintenance_file().
+"""
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Порядок важен: journal_mode до synchronous
+TUNING_PROFILE = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),  # в WAL безопасно: теряется максимум последняя транзакция при сбое ОС
+    ("busy_timeout", int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))),
+    ("cache_size", -int(os.getenv("SQLITE_CACHE_KB", "16384"))),  # отрицательное - в КиБ
+    ("mmap_size", int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))),
+    ("temp_store", "MEMORY"),
+)
+# На read-only соединениях режим журнала не меняем
+READ_ONLY_SKIP = {"journal_mode"}
+
+MAINTENANCE_HOUR = int(os.getenv("DB_MAINTENANCE_HOUR", "4"))  # тихие часы, локальное время
+MAINTENANCE_MINUTE = 30
+CHECKPOINT_INTERVAL_MINUTES = 10
+INCREMENTAL_VACUUM_PAGES = 2000
+
+
+def apply_profile(conn: sqlite3.Connection, read_only: bool = False) -> dict:
+    """Применяет TUNING_PROFILE к соединению. Возвращает фактические значения."""
+    applied = {}
+    for pragma, value in TUNING_PROFILE:
+        if read_only and pragma in READ_ONLY_SKIP:
+            continue
+        row = conn.execute(f"PRAGMA {pragma}={value}").fetchone()
+        applied[pragma] = row[0] if row else value
+    logger.debug(f"apply_profile: {applied}")
+    return applied
+
+
+def checkpoint(conn: sqlite3.Connection, mode: str = "PASSIVE") -> tuple:
+    """WAL checkpoint. Возвращает (busy, страниц в WAL, перенесено страниц)."""
+    result = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    logger.info(f"checkpoint {mode}: busy={result[0]} log={result[1]} checkpointed={result[2]}")
+    return result
+
+
+def ensure_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """Переводит базу в auto_vacuum=INCREMENTAL (разово, через полный VACUUM). True - если переводили."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    logger.info("ensure_incremental_vacuum: база переведена в auto_vacuum=INCREMENTAL")
+    return True
+
+
+def run_maintenance(conn: sqlite3.Connection, vacuum_pages: int = INCREMENTAL_VACUUM_PAGES) -> dict:
+    """Ночное обслуживание. Возвращает длительность каждого шага в секундах."""
+    conn.commit()  # шаги ниже не должны попасть в чужую открытую транзакцию
+    timings = {}
+
+    def step(name, func):
+        started = time.monotonic()
+        try:
+            func()
+        except sqlite3.Error as e:
+            logger.error(f"run_maintenance: шаг {name} не выполнен: {e}")
+        timings[name] = round(time.monotonic() - started, 3)
+
+    step("auto_vacuum", lambda: ensure_incremental_vacuum(conn))
+    step("incremental_vacuum", lambda: conn.execute(f"PRAGMA incremental_vacuum({vacuum_pages})").fetchall())
+    step("analyze", lambda: conn.execute("ANALYZE"))
+    step("optimize", lambda: conn.execute("PRAGMA optimize"))
+    conn.commit()
+    # checkpoint последним - переносит в базу и всё, что записали шаги выше
+    step("checkpoint", lambda: checkpoint(conn, "TRUNCATE"))
+    logger.info(f"run_maintenance: {timings}")
+    return timings
+
+
+def run_maintenance_file(db_file: str, vacuum_pages: int = INCREMENTAL_VACUUM_PAGES) -> dict:
+    """run_maintenance на собственном соединении: не трогает транзакции общего соединения бота."""
+    conn = sqlite3.connect(db_file)
+    try:
+        apply_profile(conn)
+        return run_maintenance(conn, vacuum_pages)
+    finally:
+        conn.close()
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def db_stats(conn: sqlite3.Connection, db_file: str) -> dict:
+    """Сводка по базе для /dbstats."""
+    pragma = lambda name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+    return {
+        "db_bytes": _file_size(db_file),
+        "wal_bytes": _file_size(f"{db_file}-wal"),
+        "page_size": pragma("page_size"),
+        "page_count": pragma("page_count"),
+        "freelist_count": pragma("freelist_count"),
+        "journal_mode": pragma("journal_mode"),
+        "auto_vacuum": {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}.get(pragma("auto_vacuum")),
+        "cache_size": pragma("cache_size"),
+        "mmap_size": pragma("mmap_size"),
+        "wal_autocheckpoint": pragma("wal_autocheckpoint"),
+    }
+
+
+def format_db_stats(stats: dict) -> str:
+    """Текст для админа."""
+    mb = lambda n: f"{n / 1024 / 1024:.2f} МБ"
+    text = "🗄 Состояние базы:\n"
+    text += f"Файл базы: {mb(stats['db_bytes'])}, WAL: {mb(stats['wal_bytes'])}\n"
+    text += (f"Страниц: {stats['page_count']} по {stats['page_size']} Б,"
+             f" свободных: {stats['freelist_count']}\n")
+    text += f"Журнал: {stats['journal_mode']}, auto_vacuum: {stats['auto_vacuum']}\n"
+    text += f"cache_size: {stats['cache_size']}, mmap_size: {mb(stats['mmap_size'])}\n"
+    text += f"wal_autocheckpoint: {stats['wal_autocheckpoint']} страниц"
+    return text
@@ -0,0 +1,161 @@
+# db_schema.py
+"""Базовая схема SQLite и мелкие помощники для миграций без отдельного фреймворка.
+
+BASE_SCHEMA - единственное описание основных таблиц: его выполняют
+create_all_tables при старте бота и SQLiteRepository.init_schema на чистых
+базах (тесты). Колонки, добавленные позже, докладывают create_*_tables и
+ensure_column.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        full_name TEXT NOT NULL DEFAULT 'ЧЕБУРАШКА',
+        birthday TEXT,
+        registration_date TEXT,
+        referral_count INTEGER DEFAULT 0,
+        penalty_task TEXT,
+        preliminary_material_index INTEGER DEFAULT 0,
+        tariff TEXT,
+        continuous_flow BOOLEAN DEFAULT 0,
+        next_lesson_time DATETIME,
+        active_course_id TEXT,
+        user_code TEXT,
+        last_bonus_date TEXT,
+        trust_credit INTEGER DEFAULT 0,
+        support_requests INTEGER DEFAULT 0,
+        morning_time TEXT,
+        evening_time TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS homeworks (
+        hw_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        course_id TEXT,
+        lesson INTEGER,
+        file_id TEXT,
+        file_type TEXT,
+        message_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        feedback TEXT,
+        timestamp TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        lesson_sent_time DATETIME,
+        first_submission_time DATETIME,
+        submission_time DATETIME,
+        approval_time DATETIME,
+        final_approval_time DATETIME,
+        admin_comment TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS homework_rejections (
+        rejection_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        course_id TEXT NOT NULL,
+        lesson INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS user_tokens (
+        user_id INTEGER PRIMARY KEY,
+        tokens INTEGER DEFAULT 3
+    );
+
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        action TEXT,
+        amount INTEGER,
+        reason TEXT,
+        timestamp TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+    );
+
+    CREATE TABLE IF NOT EXISTS lootboxes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        box_type TEXT,
+        reward TEXT,
+        probability REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS admins (
+        admin_id INTEGER PRIMARY KEY,
+        level INTEGER DEFAULT 1
+    );
+
+    CREATE TABLE IF NOT EXISTS admin_codes (
+        code_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER,
+        code TEXT,
+        created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        used BOOLEAN DEFAULT FALSE,
+        FOREIGN KEY(admin_id) REFERENCES admins(admin_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS user_settings (
+        user_id INTEGER PRIMARY KEY,
+        morning_notification TIME,
+        evening_notification TIME,
+        show_example_homework BOOLEAN DEFAULT 1,
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS products (
+        product_id INTEGER PRIMARY KEY,
+        product_name TEXT NOT NULL,
+        price INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS user_courses (
+        user_id INTEGER,
+        course_id TEXT,
+        course_type TEXT CHECK(course_type IN ('main', 'auxiliary')),
+        progress INTEGER DEFAULT 0,
+        purchase_date TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+        tariff TEXT,
+        PRIMARY KEY (user_id, course_id),
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS courses (
+        course_id TEXT PRIMARY KEY,
+        course_name TEXT,
+        course_type TEXT CHECK(course_type IN ('main', 'auxiliary')),
+        code_word TEXT,
+        price_rub INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS lessons (
+        lesson_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id TEXT,
+        lesson INTEGER,
+        lesson_name TEXT,
+        description TEXT,
+        video_url TEXT,
+        video_file_id TEXT,
+        FOREIGN KEY (course_id) REFERENCES courses(course_id)
+    );
+
+    -- Индексы
+    CREATE INDEX IF NOT EXISTS idx_user_courses ON user_courses(user_id, course_id);
+    CREATE INDEX IF NOT EXISTS idx_homeworks ON homeworks(user_id, course_id, lesson);
+    CREATE INDEX IF NOT EXISTS idx_rejections ON homework_rejections(user_id, course_id, lesson);
+"""
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    """Имена колонок таблицы (пустое множество, если таблицы нет)."""
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def ensure_column(conn: sqlite3.Connection, table: str, column: str, definition: str) -> bool:
+    """Добавляет колонку, если её ещё нет. True - если колонка была добавлена."""
+    if column in table_columns(conn, table):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    logger.info(f"ensure_column: в {table} добавлена колонка {column} {definition}")
+    return True
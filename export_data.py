@@ -0,0 +1,218 @@
+# export_data.py
+"""Потоковая выгрузка таблиц бота в CSV или JSONL (gzip).
+
+Строки читаются fetchmany-пачками, поэтому память не зависит от размера
+таблицы. Каждая пачка пишется в файл отдельным закрытым членом gzip
+(формат допускает несколько членов подряд). Только после этого рядом
+сохраняется <файл>.state с последним ключом и размером файла.
+
+Повторный запуск обрезает файл до сохранённого размера, то есть до
+последнего целого члена. Так отбрасываются недописанный член и строки
+после последнего state, и только потом выгрузка продолжается со
+следующего ключа. Итог читается gzip.open целиком и без дублей.
+
+Для таблиц из data_tiering.TIERED_TABLES с archive_dir выгрузка идёт по
+горячей базе и месячным архивам вместе, в общем порядке ключа.
+
+CLI:
+    python export_data.py homeworks --format jsonl --since "2025-01-01 00:00:00"
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from itertools import islice
+
+from data_tiering import ARCHIVE_DB_DIR, TIERED_TABLES, archived_months, iter_tiered
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = "exports"
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 45 * 1024 * 1024  # лимит Bot API на документ - 50 МБ, берём с запасом
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# таблица -> (ключ для сортировки и продолжения, колонка времени для фильтра)
+EXPORT_TABLES = {
+    "homeworks": ("hw_id", "submission_time"),
+    "transactions": ("id", "timestamp"),
+    "users": ("user_id", "registration_date"),
+    "user_courses": ("rowid", "purchase_date"),
+    "homework_rejections": ("rejection_id", "rejected_at"),
+}
+
+
+@dataclass
+class ExportResult:
+    path: str
+    rows: int
+    last_key: object
+    resumed: bool
+
+
+def _state_path(path: str) -> str:
+    return f"{path}.state"
+
+
+def _load_state(path: str):
+    try:
+        with open(_state_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save_state(path: str, state: dict):
+    tmp = _state_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, _state_path(path))
+
+
+def default_export_path(table: str, fmt: str, export_dir: str = EXPORT_DIR) -> str:
+    return os.path.join(export_dir, f"{table}.{fmt}.gz")
+
+
+def export_table(conn: sqlite3.Connection, table: str, path: str, fmt: str = "csv",
+                 since: str | None = None, until: str | None = None,
+                 resume: bool = True, batch_size: int = EXPORT_BATCH_SIZE,
+                 archive_dir: str | None = None) -> ExportResult:
+    """Выгружает таблицу в gzip-файл. since/until - границы по колонке времени, until не включая.
+
+    archive_dir - каталог месячных архивов: строки из них выгружаются вместе с горячими.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Таблица {table} не поддерживается для выгрузки")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    key_column, time_column = EXPORT_TABLES[table]
+
+    state = _load_state(path) if resume else None
+    filters = {"table": table, "format": fmt, "since": since, "until": until}
+    if state and (state.get("filters") != filters or state.get("done") or "offset" not in state
+                  or not os.path.exists(path) or os.path.getsize(path) < state["offset"]):
+        state = None  # другие параметры, выгрузка уже завершена или файл не тот - начинаем заново
+    resumed = state is not None
+    last_key = state["last_key"] if state else None
+    rows_total = state["rows"] if state else 0
+
+    conditions, params = [], []
+    if since:
+        conditions.append(f"{time_column} >= ?")
+        params.append(since)
+    if until:
+        conditions.append(f"{time_column} < ?")
+        params.append(until)
+    if last_key is not None:
+        conditions.append(f"{key_column} > ?")
+        params.append(last_key)
+    if archive_dir is not None and table in TIERED_TABLES:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        # месяц архива не раньше месяца записи - более ранние архивы не подключаем
+        months = [m for m in archived_months(conn, table) if since is None or m >= since[:7]]
+        key_index = columns.index(key_column)
+        rows = ((row[key_index], row) for row in iter_tiered(
+            conn, table, columns, " AND ".join(conditions), params, (key_column,), months=months,
+            archive_dir=archive_dir))
+    else:
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = conn.execute(
+            f"SELECT {key_column} AS export_key, * FROM {table} {where} ORDER BY {key_column}", params
+        )
+        columns = [c[0] for c in cursor.description][1:]
+        rows = ((row[0], row[1:]) for row in cursor)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "r+b" if resumed else "wb") as out:
+        if resumed:
+            out.truncate(state["offset"])  # хвост после последнего state - недописанный член или повтор строк
+            out.seek(state["offset"])
+        header = not resumed and fmt == "csv"
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch and not header:
+                break
+            text = io.StringIO(newline="")
+            writer = csv.writer(text) if fmt == "csv" else None
+            if header:
+                writer.writerow(columns)
+                header = False
+            for _, values in batch:
+                if writer:
+                    writer.writerow(values)
+                else:
+                    text.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + "\n")
+            out.write(gzip.compress(text.getvalue().encode("utf-8"), compresslevel=6))
+            out.flush()
+            os.fsync(out.fileno())  # член на диске до state: после сбоя state не указывает дальше файла
+            if batch:
+                last_key = batch[-1][0]
+                rows_total += len(batch)
+            _save_state(path, {"filters": filters, "last_key": last_key, "rows": rows_total, "offset": out.tell(),
+                               "done": False})
+
+    _save_state(path, {"filters": filters, "last_key": last_key, "rows": rows_total, "done": True})
+    logger.info(f"export_table: {table} -> {path}, строк {rows_total}, продолжение={resumed}")
+    return ExportResult(path=path, rows=rows_total, last_key=last_key, resumed=resumed)
+
+
+def split_file(path: str, chunk_bytes: int = EXPORT_CHUNK_BYTES) -> list[str]:
+    """Режет файл на части не больше chunk_bytes (склеиваются обратно через cat)."""
+    if os.path.getsize(path) <= chunk_bytes:
+        return [path]
+    parts = []
+    with open(path, "rb") as src:
+        index = 1
+        while True:
+            # копируем блоками, чтобы не держать целую часть в памяти
+            part_path = f"{path}.part{index:02d}"
+            written = 0
+            with open(part_path, "wb") as dst:
+                while written < chunk_bytes:
+                    block = src.read(min(io.DEFAULT_BUFFER_SIZE * 64, chunk_bytes - written))
+                    if not block:
+                        break
+                    dst.write(block)
+                    written += len(block)
+            if written == 0:
+                os.remove(part_path)
+                break
+            parts.append(part_path)
+            index += 1
+    return parts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка таблиц бота в CSV/JSONL (gzip)")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--db", default="bot_db.sqlite")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--since", help="с момента (включительно), формат YYYY-MM-DD HH:MM:SS")
+    parser.add_argument("--until", help="до момента (не включая)")
+    parser.add_argument("--out", help="путь к файлу, по умолчанию exports/<таблица>.<формат>.gz")
+    parser.add_argument("--restart", action="store_true", help="не продолжать прерванную выгрузку")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DB_DIR, help="каталог месячных архивов")
+    parser.add_argument("--hot-only", action="store_true", help="без строк из месячных архивов")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    conn = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
+    try:
+        result = export_table(
+            conn, args.table, args.out or default_export_path(args.table, args.format), args.format,
+            since=args.since, until=args.until, resume=not args.restart, batch_size=args.batch_size,
+            archive_dir=None if args.hot_only else args.archive_dir,
+        )
+    finally:
+        conn.close()
+    print(f"{result.path}: {result.rows} строк")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# flood_control.py
+"""Входной контроль нагрузки перед обработчиками.
+
+Один ученик, который часто жмёт кнопки или пишет текст, вызывает повторные
+show_main_menu и запросы к базе и тормозит остальных. FloodControl стоит
+TypeHandler'ом в группе -1, до всех обработчиков (но после записи update
+рекордером), и решает по каждому update:
+
+1. Админы (ADMIN_IDS) и группа админов проходят всегда.
+2. Склейка: повтор того же callback_data от того же ученика в пределах
+   FLOOD_COALESCE_SECONDS отбрасывается. Кнопке отвечаем пустым answer(),
+   чтобы не крутилась.
+3. Token bucket на ученика: FLOOD_RATE update в секунду, запас FLOOD_BURST.
+   Без токена update отбрасывается, кроме высокоприоритетных: сдача ДЗ
+   фото и документами, контакт, /start и /cancel.
+4. Сброс нагрузки: если в очереди Application ждёт больше
+   FLOOD_QUEUE_LIMIT update, отбрасываются низкоприоритетные (меню,
+   галерея, статистика). Выше FLOOD_QUEUE_HARD_LIMIT - всё, кроме
+   высокоприоритетных. PTB обрабатывает update по одному, поэтому очередь
+   и есть общая очередь бота: сброс на входе экономит работу обработчиков.
+
+Счётчики пропущенных, склеенных и отброшенных update доступны в /floodstats.
+"""
+import logging
+import os
+import time
+from collections import Counter
+
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop
+
+logger = logging.getLogger(__name__)
+
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "1.0"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "5"))
+FLOOD_COALESCE_SECONDS = float(os.getenv("FLOOD_COALESCE_SECONDS", "2.0"))
+FLOOD_QUEUE_LIMIT = int(os.getenv("FLOOD_QUEUE_LIMIT", "50"))
+FLOOD_QUEUE_HARD_LIMIT = int(os.getenv("FLOOD_QUEUE_HARD_LIMIT", "200"))
+# Раз в сколько секунд повторять ученику "не так быстро"
+FLOOD_NOTICE_SECONDS = 30.0
+# Состояния учеников, которые не писали столько секунд, удаляются
+FLOOD_IDLE_SECONDS = 600.0
+
+HIGH, NORMAL, LOW = "high", "normal", "low"
+LOW_PRIORITY_CALLBACKS = {"menu_back", "gallery", "gallery_next", "statistics", "tariffs", "course_settings",
+                          "support"}
+LOW_PRIORITY_COMMANDS = {"/menu", "/stats", "/top"}
+HIGH_PRIORITY_COMMANDS = {"/start", "/cancel"}
+
+PASSED, COALESCED, RATE_LIMITED, SHED = "passed", "coalesced", "rate_limited", "shed"
+
+
+def classify(update) -> tuple[str, str | None]:
+    """(приоритет, ключ склейки) для update. Ключ есть только у callback."""
+    if update.callback_query:
+        data = update.callback_query.data or ""
+        return (LOW if data in LOW_PRIORITY_CALLBACKS else NORMAL), f"cb:{data}"
+    message = update.message
+    if message is None:
+        return NORMAL, None
+    if message.photo or message.document or message.contact or message.successful_payment:
+        return HIGH, None
+    if message.text and message.text.startswith("/"):
+        command = message.text.split()[0].split("@")[0]
+        if command in HIGH_PRIORITY_COMMANDS:
+            return HIGH, None
+        if command in LOW_PRIORITY_COMMANDS:
+            return LOW, None
+    return NORMAL, None
+
+
+class FloodControl:
+    """Token bucket на ученика, склейка повторных callback и сброс при перегрузке."""
+
+    def __init__(self, admin_ids=(), admin_chat_id: int | None = None, rate: float = FLOOD_RATE,
+                 burst: float = FLOOD_BURST, coalesce_seconds: float = FLOOD_COALESCE_SECONDS,
+                 queue_limit: int = FLOOD_QUEUE_LIMIT, hard_limit: int = FLOOD_QUEUE_HARD_LIMIT,
+                 clock=time.monotonic):
+        self.admin_ids = {str(admin_id) for admin_id in admin_ids}
+        self.admin_chat_id = admin_chat_id
+        self.rate = rate
+        self.burst = burst
+        self.coalesce_seconds = coalesce_seconds
+        self.queue_limit = queue_limit
+        self.hard_limit = hard_limit
+        self.clock = clock
+        self._buckets = {}  # user_id -> [токены, время обновления]
+        self._recent = {}  # (user_id, ключ склейки) -> время последнего пропущенного
+        self._notified = {}  # user_id -> когда последний раз предупреждали
+        self._last_prune = clock()
+        self.counters = Counter()  # (решение, приоритет) -> количество
+
+    def _take_token(self, user_id: int, now: float) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+        bucket[0] = tokens
+        return False
+
+    def _prune(self, now: float):
+        if now - self._last_prune < FLOOD_IDLE_SECONDS:
+            return
+        self._last_prune = now
+        self._buckets = {uid: b for uid, b in self._buckets.items() if now - b[1] < FLOOD_IDLE_SECONDS}
+        self._recent = {key: t for key, t in self._recent.items() if now - t < self.coalesce_seconds}
+        self._notified = {uid: t for uid, t in self._notified.items() if now - t < FLOOD_NOTICE_SECONDS}
+
+    def admit(self, user_id: int, priority: str, coalesce_key: str | None, backlog: int) -> str:
+        """Решение по одному update: passed, coalesced, rate_limited или shed."""
+        now = self.clock()
+        self._prune(now)
+        verdict = PASSED
+        if coalesce_key is not None:
+            seen = self._recent.get((user_id, coalesce_key))
+            if seen is not None and now - seen < self.coalesce_seconds:
+                verdict = COALESCED
+        if verdict == PASSED and priority != HIGH:
+            if backlog > self.hard_limit or (priority == LOW and backlog > self.queue_limit):
+                verdict = SHED
+            elif not self._take_token(user_id, now):
+                verdict = RATE_LIMITED
+        if verdict == PASSED and coalesce_key is not None:
+            self._recent[(user_id, coalesce_key)] = now
+        self.counters[(verdict, priority)] += 1
+        return verdict
+
+    def should_notify(self, user_id: int) -> bool:
+        """Предупреждать ученика о частых нажатиях не чаще раза в FLOOD_NOTICE_SECONDS."""
+        now = self.clock()
+        if now - self._notified.get(user_id, -FLOOD_NOTICE_SECONDS) < FLOOD_NOTICE_SECONDS:
+            return False
+        self._notified[user_id] = now
+        return True
+
+    def is_admin(self, update) -> bool:
+        user = update.effective_user
+        chat = update.effective_chat
+        return (user is not None and str(user.id) in self.admin_ids) or (
+            chat is not None and self.admin_chat_id is not None and chat.id == self.admin_chat_id)
+
+    async def gate(self, update, context):
+        """TypeHandler(Update): пропускает update дальше или останавливает ApplicationHandlerStop."""
+        user = update.effective_user
+        if user is None or self.is_admin(update):
+            self.counters[(PASSED, "admin" if user else NORMAL)] += 1
+            return
+        priority, coalesce_key = classify(update)
+        verdict = self.admit(user.id, priority, coalesce_key, context.application.update_queue.qsize())
+        if verdict == PASSED:
+            return
+        logger.info(f"FloodControl: update от {user.id} отброшен ({verdict}, {priority})")
+        # ответ ученику - любезность: если не ушёл, update всё равно отбрасываем
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(
+                    "Слишком часто, подождите немного 🙏" if verdict != COALESCED else None)
+            elif verdict == RATE_LIMITED and update.message and self.should_notify(user.id):
+                await update.message.reply_text("Не так быстро 🙂 Следующие сообщения обработаю через пару секунд.")
+        except TelegramError as e:
+            logger.warning(f"FloodControl: ответ {user.id} не отправлен: {e}")
+        raise ApplicationHandlerStop
+
+    def metrics(self) -> dict:
+        totals = Counter()
+        for (verdict, _), count in self.counters.items():
+            totals[verdict] += count
+        return {"totals": dict(totals), "by_priority": {f"{v}/{p}": c for (v, p), c in self.counters.items()},
+                "tracked_users": len(self._buckets)}
+
+
+def format_flood_metrics(metrics: dict) -> str:
+    totals = metrics["totals"]
+    text = "🚦 Контроль нагрузки:\n"
+    text += (f"Пропущено: {totals.get(PASSED, 0)}, склеено повторов: {totals.get(COALESCED, 0)}\n"
+             f"Отброшено по лимиту ученика: {totals.get(RATE_LIMITED, 0)},"
+             f" при перегрузке: {totals.get(SHED, 0)}\n")
+    text += f"Учеников под наблюдением: {metrics['tracked_users']}\n"
+    details = [f"{key}: {count}" for key, count in sorted(metrics["by_priority"].items())
+               if not key.startswith(PASSED)]
+    if details:
+        text += "Подробно: " + ", ".join(details)
+    return text.rstrip()
@@ -0,0 +1,118 @@
+# homework_albums.py
+"""Сборка альбомов домашних заданий по media_group_id.
+
+Telegram присылает каждую фотографию альбома отдельным update. Коллектор
+копит вложения одного альбома, пока не пройдёт ALBUM_DEBOUNCE_SECONDS
+тишины, и один раз вызывает обработчик со всем списком. В итоге одна
+домашка, одно сообщение админам и один ответ ученику.
+
+При медленной сети часть альбома может прийти уже после паузы. Обработчик
+альбома возвращает hw_id сохранённой домашки, и коллектор помнит его
+ALBUM_LATE_SECONDS. Опоздавшие части того же media_group_id собираются
+так же, с паузой, и уходят в late_handler с этим hw_id. Они дописываются
+к той же домашке, а не создают вторую.
+"""
+import asyncio
+import logging
+import sqlite3
+
+from models import MediaItem
+
+logger = logging.getLogger(__name__)
+
+ALBUM_DEBOUNCE_SECONDS = 1.5
+ALBUM_LATE_SECONDS = 120
+
+
+# Вложение домашки - общая модель медиа
+Attachment = MediaItem
+
+
+def create_homework_attachments_table(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Вложения домашки. homeworks.file_id остаётся первым вложением для старых экранов."""
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS homework_attachments (
+            hw_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            file_type TEXT NOT NULL,
+            PRIMARY KEY (hw_id, position),
+            FOREIGN KEY (hw_id) REFERENCES homeworks(hw_id)
+        );
+        """
+    )
+    conn.commit()
+
+
+def insert_attachments(cursor: sqlite3.Cursor, hw_id: int, attachments: list[Attachment], start: int = 0):
+    """Пишет вложения домашки с позиции start (коммит - на вызывающей стороне)."""
+    cursor.executemany(
+        "INSERT INTO homework_attachments (hw_id, position, file_id, file_unique_id, file_type) VALUES (?, ?, ?, ?, ?)",
+        [(hw_id, position, a.file_id, a.file_unique_id, a.file_type)
+         for position, a in enumerate(attachments, start=start)],
+    )
+
+
+def append_attachments(cursor: sqlite3.Cursor, hw_id: int, attachments: list[Attachment]):
+    """Дописывает вложения после уже сохранённых у домашки hw_id."""
+    start = cursor.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM homework_attachments WHERE hw_id = ?",
+                           (hw_id,)).fetchone()[0]
+    insert_attachments(cursor, hw_id, attachments, start)
+
+
+class AlbumCollector:
+    """Копит части альбома и отдаёт их обработчику после паузы debounce."""
+
+    def __init__(self, handler, late_handler=None, debounce: float = ALBUM_DEBOUNCE_SECONDS,
+                 late_window: float = ALBUM_LATE_SECONDS):
+        self.handler = handler  # async handler(update, context, attachments) -> hw_id или None
+        self.late_handler = late_handler  # async late_handler(update, context, hw_id, attachments)
+        self.debounce = debounce
+        self.late_window = late_window
+        self._albums = {}  # key -> [update, context, attachments, task]
+        self._saved = {}  # key -> future с hw_id обработанного альбома (живёт late_window)
+
+    def pending(self) -> int:
+        return len(self._albums)
+
+    def add(self, key, attachment: Attachment, update, context):
+        """Добавляет часть альбома и перезапускает таймер тишины."""
+        album = self._albums.get(key)
+        if album is None:
+            # отвечаем на первый update альбома - у него есть сообщение для reply
+            album = self._albums[key] = [update, context, [], None]
+        else:
+            album[3].cancel()
+        album[2].append(attachment)
+        album[3] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key):
+        try:
+            await asyncio.sleep(self.debounce)
+        except asyncio.CancelledError:
+            return
+        update, context, attachments, _ = self._albums.pop(key)
+        saved = self._saved.get(key)
+        hw_id = None
+        if saved is not None and self.late_handler is not None:
+            hw_id = await asyncio.shield(saved)  # первая часть альбома могла ещё сохраняться
+        try:
+            if hw_id is not None:
+                logger.info(f"AlbumCollector: опоздавшие части альбома {key} ({len(attachments)}) - к домашке {hw_id}")
+                await self.late_handler(update, context, hw_id, attachments)
+                return
+            logger.info(f"AlbumCollector: альбом {key} собран, вложений {len(attachments)}")
+            saved = self._saved[key] = asyncio.get_running_loop().create_future()
+            asyncio.get_running_loop().call_later(self.late_window, self._forget, key, saved)
+            hw_id = await self.handler(update, context, attachments)
+        except Exception as e:
+            logger.error(f"AlbumCollector: ошибка обработки альбома {key}: {e}")
+        finally:
+            if saved is not None and not saved.done():
+                saved.set_result(hw_id)
+
+    def _forget(self, key, saved):
+        if self._saved.get(key) is saved:
+            del self._saved[key]
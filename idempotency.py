@@ -0,0 +1,53 @@
+# idempotency.py
+"""Однократная обработка действий админов и платёжных кнопок.
+
+Повторное нажатие кнопки или повторная доставка callback от Telegram
+дают тот же ключ действия, например "approve_homework:42". Он строится
+из id объекта и названия действия.
+
+Порядок в обработчике:
+1. is_processed() - дешёвая проверка по первичному ключу до любой работы
+   с базой и сетью; дубль сразу отвечает "уже обработано";
+2. claim_action() - INSERT ключа в той же транзакции, что и сам эффект
+   (смена статуса, начисление коинов). Если эффект упал, откатывается и
+   ключ. Если ключ уже занят параллельным нажатием, эффект не выполняется;
+3. уведомления отправляются только после успешного claim.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+def create_processed_actions_table(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS processed_actions (
+            action_key TEXT PRIMARY KEY,
+            actor_id INTEGER,
+            processed_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+        ) WITHOUT ROWID
+        """
+    )
+    conn.commit()
+
+
+def action_key(action: str, *parts) -> str:
+    """'approve_homework', 42 -> 'approve_homework:42'."""
+    return ":".join([action, *(str(part) for part in parts)])
+
+
+def is_processed(conn: sqlite3.Connection, key: str) -> bool:
+    return conn.execute("SELECT 1 FROM processed_actions WHERE action_key = ?", (key,)).fetchone() is not None
+
+
+def claim_action(cursor: sqlite3.Cursor, key: str, actor_id: int | None = None) -> bool:
+    """Записывает ключ в текущей транзакции. False - действие уже выполнялось."""
+    cursor.execute(
+        "INSERT OR IGNORE INTO processed_actions (action_key, actor_id) VALUES (?, ?)",
+        (key, actor_id),
+    )
+    if cursor.rowcount == 1:
+        return True
+    logger.info(f"claim_action: повтор действия {key} от {actor_id} пропущен")
+    return False
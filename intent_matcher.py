@@ -0,0 +1,146 @@
+# intent_matcher.py
+"""Распознавание намерений в свободном тексте и кодовых слов.
+
+IntentMatcher: автомат Ахо-Корасик по словам, а не по буквам. Фразы из
+таблицы намерений разбиваются на токены, поэтому "ту" срабатывает только
+на отдельное слово "ту" и не срабатывает внутри "тут" или "туман".
+Автомат строится один раз, текст проходится за один проход.
+
+CodeWordMatcher: кодовые слова курсов с нормализацией (регистр, ё/е,
+пунктуация) и ограниченным расстоянием Левенштейна для опечаток.
+Неоднозначные совпадения отвергаются.
+"""
+import re
+from collections import deque
+
+WORD_RE = re.compile(r"[0-9a-zа-я]+")
+
+# Порядок строк - приоритет, если в тексте несколько намерений
+INTENTS = (
+    ("preliminary", ("предварительные", "предварительные материалы", "пм")),
+    ("current_lesson", ("текущий урок", "ту")),
+    ("gallery", ("галерея дз", "гдз")),
+    ("tariffs", ("тарифы", "тб")),
+    ("support", ("поддержка", "пд")),
+)
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, всё кроме букв и цифр - пробел."""
+    return " ".join(tokenize(text))
+
+
+def tokenize(text: str) -> list[str]:
+    return WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+class IntentMatcher:
+    """Пословный автомат Ахо-Корасик над таблицей намерений."""
+
+    def __init__(self, intents=INTENTS):
+        self.priority = {}
+        self._goto = [{}]  # состояние -> {токен: состояние}
+        self._fail = [0]
+        self._output = [[]]  # состояние -> [(приоритет, намерение)]
+        for priority, (intent, phrases) in enumerate(intents):
+            self.priority[intent] = priority
+            for phrase in phrases:
+                self._add(tokenize(phrase), priority, intent)
+        self._build_failure_links()
+
+    def _add(self, tokens, priority, intent):
+        if not tokens:
+            raise ValueError(f"Пустая фраза для намерения {intent}")
+        state = 0
+        for token in tokens:
+            nxt = self._goto[state].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append((priority, intent))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(token, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find_all(self, text: str) -> set[str]:
+        """Все намерения, встретившиеся в тексте."""
+        found = set()
+        state = 0
+        for token in tokenize(text):
+            while state and token not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(token, 0)
+            for _, intent in self._output[state]:
+                found.add(intent)
+        return found
+
+    def match(self, text: str) -> str | None:
+        """Намерение с наивысшим приоритетом или None."""
+        found = self.find_all(text)
+        return min(found, key=self.priority.__getitem__) if found else None
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int | None:
+    """Расстояние Левенштейна, если оно не больше limit, иначе None (с ранним выходом)."""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def max_typos(word: str) -> int:
+    """Сколько опечаток допускаем: короткие слова - только точно."""
+    if len(word) <= 3:
+        return 0
+    if len(word) <= 6:
+        return 1
+    return 2
+
+
+class CodeWordMatcher:
+    """Поиск кодового слова курса с учётом нормализации и опечаток."""
+
+    def __init__(self, code_words):
+        self._by_normalized = {}
+        for code_word in code_words:
+            self._by_normalized.setdefault(normalize(code_word), code_word)
+
+    def match(self, text: str) -> str | None:
+        """Исходное кодовое слово каталога или None (нет совпадения или оно неоднозначно)."""
+        candidate = normalize(text)
+        if not candidate:
+            return None
+        exact = self._by_normalized.get(candidate)
+        if exact is not None:
+            return exact
+        limit = max_typos(candidate)
+        best, best_distance, ambiguous = None, limit + 1, False
+        for normalized, code_word in self._by_normalized.items():
+            distance = bounded_levenshtein(candidate, normalized, min(limit, max_typos(normalized)))
+            if distance is None:
+                continue
+            if distance < best_distance:
+                best, best_distance, ambiguous = code_word, distance, False
+            elif distance == best_distance:
+                ambiguous = True
+        return None if ambiguous else best
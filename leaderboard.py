@@ -0,0 +1,236 @@
+# leaderboard.py
+"""Рейтинги учеников: по балансу жетонов и по средней скорости сдачи уроков курса.
+
+Рейтинги живут в памяти как отсортированные списки (Ranking):
+- top(n) - срез списка, стоимость зависит от n, а не от числа учеников;
+- rank()  - бинарный поиск.
+
+Изменения приходят из базы инкрементально. Триггеры на user_tokens и на
+принятие домашек пишут номера изменившихся учеников в журнал
+leaderboard_changes. refresh() читает только новые записи журнала и
+точечно обновляет рейтинги. Так учитываются все пути начисления жетонов
+и приёма ДЗ, включая старые обработчики.
+
+Снимок рейтингов сохраняется в LEADERBOARD_SNAPSHOT вместе с номером
+последнего учтённого изменения. При старте снимок загружается и
+дочитывается журнал, полный пересчёт нужен только без снимка.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+from bisect import bisect_left, insort
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SNAPSHOT = "leaderboard.pkl"
+LEADERBOARD_SNAPSHOT_VERSION = 1
+LEADERBOARD_TOP_N = 10
+LEADERBOARD_SAVE_MINUTES = 10
+
+
+def create_leaderboard_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Журнал изменений, агрегаты скорости и триггеры, которые их ведут."""
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS leaderboard_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            board TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            course_id TEXT
+        );
+        CREATE TABLE IF NOT EXISTS course_speed (
+            user_id INTEGER NOT NULL,
+            course_id TEXT NOT NULL,
+            total_seconds REAL NOT NULL DEFAULT 0,
+            approved INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, course_id)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_leaderboard_tokens_insert AFTER INSERT ON user_tokens
+        BEGIN
+            INSERT INTO leaderboard_changes (board, user_id) VALUES ('tokens', NEW.user_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_leaderboard_tokens_update AFTER UPDATE OF tokens ON user_tokens
+        WHEN NEW.tokens IS NOT OLD.tokens
+        BEGIN
+            INSERT INTO leaderboard_changes (board, user_id) VALUES ('tokens', NEW.user_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_leaderboard_tokens_delete AFTER DELETE ON user_tokens
+        BEGIN
+            INSERT INTO leaderboard_changes (board, user_id) VALUES ('tokens', OLD.user_id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_leaderboard_speed AFTER UPDATE OF status ON homeworks
+        WHEN NEW.status = 'approved' AND OLD.status IS NOT 'approved'
+             AND COALESCE(NEW.submission_time, NEW.timestamp) IS NOT NULL
+        BEGIN
+            INSERT INTO course_speed (user_id, course_id, total_seconds, approved)
+            VALUES (
+                NEW.user_id, NEW.course_id,
+                MAX(0, ROUND((JULIANDAY(COALESCE(NEW.approval_time, strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')))
+                              - JULIANDAY(COALESCE(NEW.submission_time, NEW.timestamp))) * 86400)),
+                1
+            )
+            ON CONFLICT (user_id, course_id) DO UPDATE SET
+                total_seconds = total_seconds + excluded.total_seconds,
+                approved = approved + 1;
+            INSERT INTO leaderboard_changes (board, user_id, course_id) VALUES ('speed', NEW.user_id, NEW.course_id);
+        END;
+        """
+    )
+    # Разовое заполнение агрегатов скорости по уже принятым домашкам
+    if conn.execute("SELECT COUNT(*) FROM course_speed").fetchone()[0] == 0:
+        cursor.execute(
+            """
+            INSERT INTO course_speed (user_id, course_id, total_seconds, approved)
+            SELECT user_id, course_id,
+                   SUM(MAX(0, ROUND((JULIANDAY(approval_time) - JULIANDAY(COALESCE(submission_time, timestamp))) * 86400))),
+                   COUNT(*)
+            FROM homeworks
+            WHERE status = 'approved' AND approval_time IS NOT NULL
+              AND COALESCE(submission_time, timestamp) IS NOT NULL
+            GROUP BY user_id, course_id
+            """
+        )
+    conn.commit()
+
+
+class Ranking:
+    """Отсортированный по ключу список учеников. Меньший ключ - выше место."""
+
+    def __init__(self):
+        self._keys = {}  # user_id -> ключ
+        self._order = []  # [(ключ, user_id)] по возрастанию
+
+    def __len__(self):
+        return len(self._order)
+
+    def update(self, user_id: int, key) -> None:
+        """Ставит ученику новый ключ (None - убрать из рейтинга)."""
+        old = self._keys.pop(user_id, None)
+        if old is not None:
+            del self._order[bisect_left(self._order, (old, user_id))]
+        if key is not None:
+            self._keys[user_id] = key
+            insort(self._order, (key, user_id))
+
+    def rank(self, user_id: int) -> int | None:
+        """Место ученика (с 1) или None, если его нет в рейтинге."""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return bisect_left(self._order, (key, user_id)) + 1
+
+    def key(self, user_id: int):
+        return self._keys.get(user_id)
+
+    def top(self, n: int) -> list[tuple]:
+        """Первые n мест: [(ключ, user_id)]."""
+        return self._order[:n]
+
+
+class Leaderboard:
+    """Рейтинг по жетонам и по скорости прохождения каждого курса."""
+
+    def __init__(self, conn: sqlite3.Connection, snapshot_path: str = LEADERBOARD_SNAPSHOT):
+        self.conn = conn
+        self.snapshot_path = snapshot_path
+        self.tokens = Ranking()  # ключ: -баланс
+        self.speed = {}  # course_id -> Ranking, ключ: среднее время сдачи в секундах
+        self.watermark = 0  # последний учтённый seq журнала
+
+    # загрузка и сохранение
+    def load(self) -> str:
+        """Загружает снимок (или строит рейтинги с нуля) и дочитывает журнал. Возвращает источник."""
+        source = "snapshot" if self._load_snapshot() else "rebuild"
+        if source == "rebuild":
+            self._rebuild()
+        applied = self.refresh()
+        logger.info(f"Leaderboard: загружен из {source}, учеников {len(self.tokens)}, догнали изменений {applied}")
+        return source
+
+    def _load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning(f"Leaderboard: снимок повреждён ({e}), пересчитываем")
+            return False
+        if data.get("version") != LEADERBOARD_SNAPSHOT_VERSION:
+            return False
+        self.tokens, self.speed, self.watermark = data["tokens"], data["speed"], data["watermark"]
+        return True
+
+    def _rebuild(self):
+        # отметку берём до чтения таблиц: изменения во время пересчёта дочитает refresh()
+        self.watermark = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM leaderboard_changes").fetchone()[0]
+        self.tokens = Ranking()
+        for user_id, tokens in self.conn.execute("SELECT user_id, tokens FROM user_tokens"):
+            self.tokens.update(user_id, -(tokens or 0))
+        self.speed = {}
+        for user_id, course_id, total, approved in self.conn.execute(
+            "SELECT user_id, course_id, total_seconds, approved FROM course_speed WHERE approved > 0"
+        ):
+            self.speed.setdefault(course_id, Ranking()).update(user_id, total / approved)
+
+    def save(self):
+        """Сохраняет снимок и чистит учтённую часть журнала."""
+        tmp = f"{self.snapshot_path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({
+                "version": LEADERBOARD_SNAPSHOT_VERSION,
+                "tokens": self.tokens,
+                "speed": self.speed,
+                "watermark": self.watermark,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.snapshot_path)
+        with self.conn:
+            self.conn.execute("DELETE FROM leaderboard_changes WHERE seq <= ?", (self.watermark,))
+        logger.info(f"Leaderboard: снимок сохранён, watermark={self.watermark}")
+
+    # инкрементальное обновление
+    def refresh(self) -> int:
+        """Применяет новые записи журнала. Возвращает число затронутых учеников."""
+        rows = self.conn.execute(
+            "SELECT seq, board, user_id, course_id FROM leaderboard_changes WHERE seq > ? ORDER BY seq",
+            (self.watermark,),
+        ).fetchall()
+        if not rows:
+            return 0
+        token_users = {user_id for _, board, user_id, _ in rows if board == "tokens"}
+        speed_keys = {(user_id, course_id) for _, board, user_id, course_id in rows if board == "speed"}
+        for user_id in token_users:
+            row = self.conn.execute("SELECT tokens FROM user_tokens WHERE user_id = ?", (user_id,)).fetchone()
+            self.tokens.update(user_id, -(row[0] or 0) if row else None)
+        for user_id, course_id in speed_keys:
+            row = self.conn.execute(
+                "SELECT total_seconds, approved FROM course_speed WHERE user_id = ? AND course_id = ?",
+                (user_id, course_id),
+            ).fetchone()
+            ranking = self.speed.setdefault(course_id, Ranking())
+            ranking.update(user_id, row[0] / row[1] if row and row[1] else None)
+        self.watermark = rows[-1][0]
+        return len(token_users) + len(speed_keys)
+
+    # запросы
+    def top_tokens(self, n: int = LEADERBOARD_TOP_N) -> list[tuple[int, int]]:
+        """[(user_id, баланс)] первых n."""
+        return [(user_id, -key) for key, user_id in self.tokens.top(n)]
+
+    def token_rank(self, user_id: int) -> tuple[int | None, int]:
+        """(место, всего в рейтинге)."""
+        return self.tokens.rank(user_id), len(self.tokens)
+
+    def top_speed(self, course_id: str, n: int = LEADERBOARD_TOP_N) -> list[tuple[int, float]]:
+        """[(user_id, среднее время в секундах)] первых n по курсу."""
+        ranking = self.speed.get(course_id)
+        return [(user_id, key) for key, user_id in ranking.top(n)] if ranking else []
+
+    def speed_rank(self, course_id: str, user_id: int) -> tuple[int | None, int]:
+        ranking = self.speed.get(course_id)
+        if not ranking:
+            return None, 0
+        return ranking.rank(user_id), len(ranking)
@@ -0,0 +1,275 @@
+# lesson_delivery.py
+"""Доставка урока по шагам с курсором в базе.
+
+Урок - это план из шагов: текст, затем для каждого файла сообщение о
+задержке (если есть delay) и сам файл. У каждого шага стабильный ключ
+("text", "delay:lesson2_1.jpeg", "file:lesson2_1.jpeg").
+
+Курсор хранится в двух таблицах:
+- lesson_delivery - одна строка на (ученик, курс, урок): номер прогона,
+  позиция, время начала, последнего шага и завершения;
+- lesson_delivery_items - состояние каждого шага прогона.
+
+Перед отправкой шаг помечается 'sending', после отправки - 'sent', и
+позиция курсора сдвигается. Поэтому:
+- повтор или перезапуск продолжает с первого неотправленного шага, а не
+  шлёт текст и тяжёлые файлы заново;
+- если процесс упал между отправкой и отметкой, шаг найдётся в статусе
+  'sending'. Он отправится ещё раз - это возможный дубль, и он
+  учитывается в duplicates;
+- шаг, который не ушёл DELIVERY_MAX_ATTEMPTS раз, пропускается ('skipped'),
+  чтобы урок не застревал навсегда;
+- повторная доставка уже завершённого урока начинает новый прогон (run + 1)
+  и пишется в лог - так видны двойные отправки урока по таймеру.
+"""
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+
+from models import LessonFile
+from time_utils import now_epoch
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MAX_ATTEMPTS = 3
+DELIVERY_RESUME_MINUTES = 5
+# Незавершённые доставки старше этого считаются прерванными и подхватываются фоновой задачей
+DELIVERY_STALE_SECONDS = 120
+
+
+@dataclass(frozen=True, slots=True)
+class DeliveryItem:
+    """Шаг доставки урока."""
+    key: str
+    kind: str  # text | delay | file
+    text: str | None = None
+    parse_mode: str | None = None
+    file: LessonFile | None = None
+
+
+@dataclass(slots=True)
+class DeliveryReport:
+    run: int
+    total: int
+    sent: int = 0
+    skipped: int = 0
+    resumed_from: int = 0
+    completed: bool = False
+
+
+def create_lesson_delivery_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS lesson_delivery (
+            user_id INTEGER NOT NULL,
+            course_dir TEXT NOT NULL,
+            lesson INTEGER NOT NULL,
+            run INTEGER NOT NULL DEFAULT 1,
+            position INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            started_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL,
+            completed_at INTEGER,
+            PRIMARY KEY (user_id, course_dir, lesson)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_lesson_delivery_pending ON lesson_delivery(updated_at)
+            WHERE completed_at IS NULL;
+
+        CREATE TABLE IF NOT EXISTS lesson_delivery_items (
+            user_id INTEGER NOT NULL,
+            course_dir TEXT NOT NULL,
+            lesson INTEGER NOT NULL,
+            run INTEGER NOT NULL,
+            item_key TEXT NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('sending', 'sent', 'failed', 'skipped')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            sent_at INTEGER,
+            PRIMARY KEY (user_id, course_dir, lesson, run, item_key)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.commit()
+
+
+def build_plan(lesson_text: tuple | None, lesson_files, delay_message) -> list:
+    """(текст, parse_mode) и LessonFile урока -> список DeliveryItem.
+
+    delay_message() выбирает текст сообщения о задержке (случайная фраза).
+    """
+    plan = []
+    if lesson_text:
+        plan.append(DeliveryItem("text", "text", lesson_text[0], lesson_text[1]))
+    for lesson_file in lesson_files:
+        name = os.path.basename(lesson_file.path)
+        if lesson_file.delay > 0:
+            plan.append(DeliveryItem(f"delay:{name}", "delay", delay_message(), file=lesson_file))
+        plan.append(DeliveryItem(f"file:{name}", "file", file=lesson_file))
+    return plan
+
+
+class LessonDelivery:
+    """Курсор доставки уроков поверх общего соединения."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._active = set()  # доставки, идущие в этом процессе
+
+    def is_active(self, user_id: int, course_dir: str, lesson: int) -> bool:
+        return (user_id, course_dir, lesson) in self._active
+
+    def _begin(self, user_id: int, course_dir: str, lesson: int, total: int) -> tuple[int, dict]:
+        """Номер прогона и состояния его шагов {ключ: (status, attempts)}."""
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT run, completed_at FROM lesson_delivery WHERE user_id = ? AND course_dir = ? AND lesson = ?",
+                (user_id, course_dir, lesson),
+            ).fetchone()
+            if row is None:
+                run = 1
+                self.conn.execute(
+                    """
+                    INSERT INTO lesson_delivery (user_id, course_dir, lesson, total, started_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (user_id, course_dir, lesson, total, now_epoch(), now_epoch()),
+                )
+            elif row[1] is not None:
+                run = row[0] + 1
+                logger.warning(f"LessonDelivery: урок {lesson} курса {course_dir} уже доставлен {user_id},"
+                               f" повторная доставка, прогон {run}")
+                self.conn.execute(
+                    """
+                    UPDATE lesson_delivery
+                    SET run = ?, position = 0, total = ?, started_at = ?, updated_at = ?, completed_at = NULL
+                    WHERE user_id = ? AND course_dir = ? AND lesson = ?
+                    """,
+                    (run, total, now_epoch(), now_epoch(), user_id, course_dir, lesson),
+                )
+            else:
+                run = row[0]
+                self.conn.execute(
+                    "UPDATE lesson_delivery SET total = ? WHERE user_id = ? AND course_dir = ? AND lesson = ?",
+                    (total, user_id, course_dir, lesson),
+                )
+        states = {
+            key: (status, attempts)
+            for key, status, attempts in self.conn.execute(
+                """
+                SELECT item_key, status, attempts FROM lesson_delivery_items
+                WHERE user_id = ? AND course_dir = ? AND lesson = ? AND run = ?
+                """,
+                (user_id, course_dir, lesson, run),
+            )
+        }
+        return run, states
+
+    def _mark(self, ids: tuple, run: int, key: str, status: str, position: int | None = None):
+        with self.conn:
+            if status == "sending":
+                row = self.conn.execute(
+                    """
+                    SELECT status, duplicates FROM lesson_delivery_items
+                    WHERE user_id = ? AND course_dir = ? AND lesson = ? AND run = ? AND item_key = ?
+                    """,
+                    (*ids, run, key),
+                ).fetchone()
+                # предыдущая попытка оборвалась посреди отправки - возможно, шаг уже дошёл
+                duplicate = row is not None and row[0] == "sending"
+                self.conn.execute(
+                    """
+                    INSERT INTO lesson_delivery_items (user_id, course_dir, lesson, run, item_key, status, attempts)
+                    VALUES (?, ?, ?, ?, ?, 'sending', 1)
+                    ON CONFLICT (user_id, course_dir, lesson, run, item_key) DO UPDATE
+                    SET status = 'sending', attempts = attempts + 1, duplicates = duplicates + ?
+                    """,
+                    (*ids, run, key, int(duplicate)),
+                )
+                if duplicate:
+                    logger.warning(f"LessonDelivery: {key} урока {ids} отправляется повторно после обрыва"
+                                   f" (возможный дубль №{row[1] + 1})")
+                return
+            self.conn.execute(
+                """
+                UPDATE lesson_delivery_items SET status = ?, sent_at = ?
+                WHERE user_id = ? AND course_dir = ? AND lesson = ? AND run = ? AND item_key = ?
+                """,
+                (status, now_epoch() if status == "sent" else None, *ids, run, key),
+            )
+            if position is not None:
+                self.conn.execute(
+                    """
+                    UPDATE lesson_delivery SET position = ?, updated_at = ?
+                    WHERE user_id = ? AND course_dir = ? AND lesson = ?
+                    """,
+                    (position, now_epoch(), *ids),
+                )
+
+    async def deliver(self, user_id: int, course_dir: str, lesson: int, plan: list, send_item) -> DeliveryReport:
+        """Отправляет неотправленные шаги плана по порядку.
+
+        send_item(item) -> bool: False - шаг не ушёл (сеть, Telegram), доставка
+        останавливается и продолжится при следующем вызове.
+        """
+        ids = (user_id, course_dir, lesson)
+        if ids in self._active:
+            logger.info(f"LessonDelivery: доставка {ids} уже идёт, повторный вызов пропущен")
+            return DeliveryReport(run=0, total=len(plan))
+        self._active.add(ids)
+        try:
+            run, states = self._begin(user_id, course_dir, lesson, len(plan))
+            report = DeliveryReport(run=run, total=len(plan))
+            for position, item in enumerate(plan, start=1):
+                status, attempts = states.get(item.key, (None, 0))
+                if status in ("sent", "skipped"):
+                    report.resumed_from = position
+                    continue
+                if attempts >= DELIVERY_MAX_ATTEMPTS:
+                    logger.error(f"LessonDelivery: {item.key} урока {ids} не ушёл за {attempts} попыток, пропущен")
+                    self._mark(ids, run, item.key, "skipped", position)
+                    report.skipped += 1
+                    continue
+                self._mark(ids, run, item.key, "sending")
+                if not await send_item(item):
+                    self._mark(ids, run, item.key, "failed")
+                    logger.warning(f"LessonDelivery: {ids} остановлена на шаге {position}/{len(plan)} ({item.key})")
+                    return report
+                self._mark(ids, run, item.key, "sent", position)
+                report.sent += 1
+            with self.conn:
+                self.conn.execute(
+                    """
+                    UPDATE lesson_delivery SET completed_at = ?, updated_at = ?
+                    WHERE user_id = ? AND course_dir = ? AND lesson = ?
+                    """,
+                    (now_epoch(), now_epoch(), *ids),
+                )
+            report.completed = True
+            return report
+        finally:
+            self._active.discard(ids)
+
+    def pending(self, stale_seconds: int = DELIVERY_STALE_SECONDS) -> list:
+        """Прерванные доставки: (user_id, course_dir, lesson), не идущие сейчас в процессе."""
+        rows = self.conn.execute(
+            """
+            SELECT user_id, course_dir, lesson FROM lesson_delivery
+            WHERE completed_at IS NULL AND updated_at <= ?
+            ORDER BY updated_at
+            """,
+            (now_epoch() - stale_seconds,),
+        ).fetchall()
+        return [row for row in rows if row not in self._active]
+
+    def duplicates(self, user_id: int | None = None) -> list:
+        """Шаги, которые могли дойти дважды: (user_id, course_dir, lesson, run, item_key, duplicates)."""
+        query = """
+            SELECT user_id, course_dir, lesson, run, item_key, duplicates FROM lesson_delivery_items
+            WHERE duplicates > 0
+        """
+        params = ()
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params = (user_id,)
+        return self.conn.execute(query + " ORDER BY user_id, lesson, run", params).fetchall()
@@ -0,0 +1,125 @@
+# lesson_progress.py
+"""Битовые маски уроков в user_courses.
+
+Каждая запись user_courses хранит два INTEGER:
+- submitted_mask: бит N установлен, если по уроку N сдавалась домашка;
+- approved_mask:  бит N установлен, если домашка по уроку N принята.
+
+Маски поддерживают триггеры на homeworks (INSERT и смена status на
+'approved'). Поэтому их обновляют все пути сдачи и приёма, включая
+старые обработчики. Прогресс и пропущенные уроки считаются по
+submitted_mask, "сколько осталось" и "курс пройден" - по approved_mask,
+одной строкой user_courses и без сканов homeworks.
+
+Число уроков курса считается по одному listdir каталога курса при каждом
+вызове. Кэш тут не нужен: это один системный вызов, а без кэша уроки,
+добавленные в каталог на ходу, видны сразу.
+
+SQLite INTEGER - 64 бита со знаком, поэтому в маске уроки 1..MAX_MASK_LESSON.
+"""
+import logging
+import os
+import sqlite3
+
+from db_schema import ensure_column
+
+logger = logging.getLogger(__name__)
+
+MAX_MASK_LESSON = 62
+COURSES_DIR = "courses"
+LESSON_TEXT_EXTENSIONS = (".md", ".html", ".txt")
+
+
+def create_lesson_mask_columns(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Колонки масок, триггеры и разовое заполнение масок по существующим homeworks."""
+    ensure_column(conn, "user_courses", "submitted_mask", "INTEGER")
+    ensure_column(conn, "user_courses", "approved_mask", "INTEGER")
+    cursor.executescript(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_homework_submitted_mask
+        AFTER INSERT ON homeworks
+        WHEN NEW.lesson BETWEEN 1 AND {MAX_MASK_LESSON}
+        BEGIN
+            UPDATE user_courses
+            SET submitted_mask = COALESCE(submitted_mask, 0) | (1 << NEW.lesson)
+            WHERE user_id = NEW.user_id AND course_id = NEW.course_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_homework_approved_mask
+        AFTER UPDATE OF status ON homeworks
+        WHEN NEW.status = 'approved' AND NEW.lesson BETWEEN 1 AND {MAX_MASK_LESSON}
+        BEGIN
+            UPDATE user_courses
+            SET approved_mask = COALESCE(approved_mask, 0) | (1 << NEW.lesson)
+            WHERE user_id = NEW.user_id AND course_id = NEW.course_id;
+        END;
+        """
+    )
+    # Заполняем только записи без масок: после первого запуска это новые зачисления без домашек
+    cursor.execute(
+        f"""
+        UPDATE user_courses
+        SET submitted_mask = COALESCE((
+                SELECT SUM(DISTINCT 1 << h.lesson) FROM homeworks h
+                WHERE h.user_id = user_courses.user_id AND h.course_id = user_courses.course_id
+                  AND h.lesson BETWEEN 1 AND {MAX_MASK_LESSON}
+            ), 0),
+            approved_mask = COALESCE((
+                SELECT SUM(DISTINCT 1 << h.lesson) FROM homeworks h
+                WHERE h.user_id = user_courses.user_id AND h.course_id = user_courses.course_id
+                  AND h.status = 'approved' AND h.lesson BETWEEN 1 AND {MAX_MASK_LESSON}
+            ), 0)
+        WHERE submitted_mask IS NULL OR approved_mask IS NULL
+        """
+    )
+    if cursor.rowcount:
+        logger.info(f"create_lesson_mask_columns: маски заполнены для {cursor.rowcount} записей user_courses")
+    conn.commit()
+
+
+def has_lesson(mask: int | None, lesson: int) -> bool:
+    return bool(mask) and 1 <= lesson <= MAX_MASK_LESSON and bool(mask >> lesson & 1)
+
+
+def lessons_in_mask(mask: int | None) -> list[int]:
+    """Номера уроков, отмеченных в маске, по возрастанию."""
+    return [lesson for lesson in range(1, MAX_MASK_LESSON + 1) if has_lesson(mask, lesson)]
+
+
+def missing_lessons(mask: int | None, before: int) -> list[int]:
+    """Уроки 1..before-1 без отметки в маске (пропущенные до текущего урока)."""
+    return [lesson for lesson in range(1, min(before, MAX_MASK_LESSON + 1)) if not has_lesson(mask, lesson)]
+
+
+def format_ranges(lessons: list[int]) -> str:
+    """[1, 2, 3, 5, 7, 8] -> '1..3, 5, 7..8'."""
+    ranges = []
+    start = end = None
+    for lesson in lessons:
+        if start is None:
+            start = end = lesson
+        elif lesson == end + 1:
+            end = lesson
+        else:
+            ranges.append(str(start) if start == end else f"{start}..{end}")
+            start = end = lesson
+    if start is not None:
+        ranges.append(str(start) if start == end else f"{start}..{end}")
+    return ", ".join(ranges)
+
+
+def lesson_count(course_base: str, courses_dir: str = COURSES_DIR) -> int:
+    """Сколько подряд идущих уроков lessonN.{md,html,txt} есть у курса."""
+    try:
+        names = set(os.listdir(os.path.join(courses_dir, course_base)))
+    except OSError:
+        return 0
+    count = 0
+    while any(f"lesson{count + 1}{ext}" in names for ext in LESSON_TEXT_EXTENSIONS):
+        count += 1
+    return count
+
+
+def remaining_lessons(approved_mask: int | None, count: int) -> list[int]:
+    """Уроки 1..count, домашка по которым ещё не принята."""
+    return missing_lessons(approved_mask, count + 1)
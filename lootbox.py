@@ -0,0 +1,184 @@
+# lootbox.py
+"""Розыгрыш наград из лутбоксов методом алиасов Уолкера.
+
+Таблица lootboxes читается один раз. Для каждого box_type вероятности
+проверяются и нормируются, затем строится AliasTable. Один розыгрыш -
+это одно случайное число и одно сравнение, O(1) при любом числе наград.
+
+Изменения lootboxes отслеживаются триггерами. Они увеличивают
+lootbox_meta.version, а LootboxEngine сверяет версию не чаще раза в
+LOOTBOX_CHECK_SECONDS и перестраивает таблицы, если она изменилась.
+"""
+import logging
+import math
+import random
+import sqlite3
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+LOOTBOX_CHECK_SECONDS = 60
+LOOTBOX_MAX_BATCH = 50
+# Допустимое отклонение суммы вероятностей от 1 без предупреждения в журнале
+LOOTBOX_SUM_TOLERANCE = 1e-6
+
+
+class LootboxTableError(ValueError):
+    """Таблица наград лутбокса некорректна или лутбокс не найден."""
+
+
+def create_lootbox_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Версия таблицы lootboxes и триггеры, которые её увеличивают."""
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS lootbox_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        INSERT OR IGNORE INTO lootbox_meta (id, version) VALUES (1, 0);
+
+        CREATE TRIGGER IF NOT EXISTS trg_lootboxes_insert AFTER INSERT ON lootboxes
+        BEGIN UPDATE lootbox_meta SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS trg_lootboxes_update AFTER UPDATE ON lootboxes
+        BEGIN UPDATE lootbox_meta SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS trg_lootboxes_delete AFTER DELETE ON lootboxes
+        BEGIN UPDATE lootbox_meta SET version = version + 1 WHERE id = 1; END;
+        """
+    )
+    conn.commit()
+
+
+def normalize_rewards(box_type: str, rows: list[tuple[str, float]]) -> list[tuple[str, float]]:
+    """Проверяет награды и приводит сумму вероятностей к 1.
+
+    Одинаковые награды складываются. Отрицательные, нечисловые и нулевые
+    в сумме вероятности дают LootboxTableError.
+    """
+    weights = {}
+    for reward, probability in rows:
+        if not reward:
+            raise LootboxTableError(f"Лутбокс {box_type}: пустое название награды")
+        try:
+            probability = float(probability)
+        except (TypeError, ValueError):
+            raise LootboxTableError(f"Лутбокс {box_type}: вероятность награды {reward!r} не число")
+        if not math.isfinite(probability) or probability < 0:
+            raise LootboxTableError(f"Лутбокс {box_type}: недопустимая вероятность {probability} у {reward!r}")
+        weights[reward] = weights.get(reward, 0.0) + probability
+
+    total = sum(weights.values())
+    if total <= 0:
+        raise LootboxTableError(f"Лутбокс {box_type}: сумма вероятностей равна нулю")
+    if abs(total - 1.0) > LOOTBOX_SUM_TOLERANCE:
+        logger.warning(f"Лутбокс {box_type}: сумма вероятностей {total}, нормируем к 1")
+    return [(reward, weight / total) for reward, weight in weights.items() if weight > 0]
+
+
+class AliasTable:
+    """Таблица алиасов (вариант Vose) для выборки из дискретного распределения."""
+
+    def __init__(self, rewards: list[tuple[str, float]]):
+        n = len(rewards)
+        self.rewards = [reward for reward, _ in rewards]
+        self.probabilities = [probability for _, probability in rewards]
+        self.accept = [0.0] * n
+        self.alias = [0] * n
+
+        scaled = [p * n for p in self.probabilities]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.accept[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # остатки из-за погрешности округления - столбцы без алиаса
+        for i in small + large:
+            self.accept[i] = 1.0
+            self.alias[i] = i
+
+    def __len__(self):
+        return len(self.rewards)
+
+    def sample(self, rng: random.Random) -> str:
+        """Одна награда: выбор столбца и одно сравнение."""
+        u = rng.random() * len(self.rewards)
+        column = int(u)
+        return self.rewards[column if u - column < self.accept[column] else self.alias[column]]
+
+    def sample_many(self, count: int, rng: random.Random) -> list[str]:
+        return [self.sample(rng) for _ in range(count)]
+
+
+class LootboxEngine:
+    """Таблицы алиасов для всех лутбоксов, перестраиваются при изменении lootboxes."""
+
+    def __init__(self, conn: sqlite3.Connection, rng: random.Random | None = None,
+                 check_interval: float = LOOTBOX_CHECK_SECONDS):
+        self.conn = conn
+        self.rng = rng or random.SystemRandom()
+        self.check_interval = check_interval
+        self.tables = {}  # box_type -> AliasTable
+        self.version = None
+        self._checked_at = None
+
+    def _current_version(self):
+        row = self.conn.execute("SELECT version FROM lootbox_meta WHERE id = 1").fetchone()
+        return row[0] if row else None
+
+    def load(self) -> dict:
+        """Читает lootboxes и строит таблицы. Некорректные лутбоксы пропускаются с ошибкой в журнале."""
+        self.version = self._current_version()
+        grouped = defaultdict(list)
+        for box_type, reward, probability in self.conn.execute(
+            "SELECT box_type, reward, probability FROM lootboxes ORDER BY id"
+        ):
+            grouped[box_type].append((reward, probability))
+        tables = {}
+        for box_type, rows in grouped.items():
+            try:
+                tables[box_type] = AliasTable(normalize_rewards(box_type, rows))
+            except LootboxTableError as e:
+                logger.error(f"LootboxEngine: {e}")
+        self.tables = tables
+        self._checked_at = time.monotonic()
+        logger.info(f"LootboxEngine: загружены лутбоксы {sorted(tables)} (версия {self.version})")
+        return tables
+
+    def invalidate(self):
+        """Перечитать таблицу при следующем розыгрыше."""
+        self._checked_at = None
+
+    def _ensure_fresh(self):
+        if self._checked_at is None:
+            self.load()
+        elif time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            if self._current_version() != self.version:
+                self.load()
+
+    def box_types(self) -> list[str]:
+        self._ensure_fresh()
+        return sorted(self.tables)
+
+    def _table(self, box_type: str) -> AliasTable:
+        self._ensure_fresh()
+        table = self.tables.get(box_type)
+        if table is None:
+            raise LootboxTableError(f"Лутбокс '{box_type}' не найден")
+        return table
+
+    def has_box(self, box_type: str) -> bool:
+        self._ensure_fresh()
+        return box_type in self.tables
+
+    def roll(self, box_type: str) -> str:
+        return self._table(box_type).sample(self.rng)
+
+    def roll_many(self, box_type: str, count: int) -> list[str]:
+        """Открывает count лутбоксов одного типа."""
+        if not 1 <= count <= LOOTBOX_MAX_BATCH:
+            raise LootboxTableError(f"Можно открыть от 1 до {LOOTBOX_MAX_BATCH} лутбоксов за раз")
+        return self._table(box_type).sample_many(count, self.rng)
@@ -12,6 +12,7 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     InputMediaDocument,
+    InputMediaVideo,
     KeyboardButton,
     ReplyKeyboardMarkup,
     # ReplyKeyboardRemove,  # <--- Добавьте эту строку
@@ -24,6 +25,7 @@ from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
     Application  # <--- Добавьте это
 
 )
@@ -35,17 +37,50 @@ from dotenv import load_dotenv
 import os
 import re
 import asyncio
-from telegram.error import TelegramError
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
 import json
 import random
 
+from analytics import AnalyticsPool, AnalyticsTimeoutError
+from db_maintenance import (CHECKPOINT_INTERVAL_MINUTES, MAINTENANCE_HOUR, MAINTENANCE_MINUTE, apply_profile,
+                            checkpoint, db_stats, format_db_stats, run_maintenance_file)
+from intent_matcher import CodeWordMatcher, IntentMatcher
+from homework_albums import (AlbumCollector, Attachment, append_attachments, create_homework_attachments_table,
+                             insert_attachments)
+from media_archiver import ARCHIVE_INTERVAL_SECONDS, MediaArchiver, create_media_archive_tables, enqueue_media
+from db_schema import BASE_SCHEMA
+from lesson_progress import create_lesson_mask_columns, format_ranges, lesson_count, missing_lessons, remaining_lessons
+from write_coordinator import WriteCoordinator
+from db_backup import BACKUP_DIR, BACKUP_HOUR, BACKUP_MINUTE, format_backup_report, run_backup
+from data_tiering import (ARCHIVE_AFTER_DAYS, ARCHIVE_DB_DIR, ARCHIVE_MINUTE, TIERED_TABLES, archive_batch,
+                          archive_cutoff, create_tiering_tables, format_tier_stats, tier_stats)
+from export_data import EXPORT_FORMATS, EXPORT_TABLES, default_export_path, export_table, split_file
+from repository import DB_BACKEND, create_repository
+from leaderboard import LEADERBOARD_SAVE_MINUTES, Leaderboard, create_leaderboard_tables
+from idempotency import action_key, claim_action, create_processed_actions_table, is_processed
+from models import Course, LessonFile
+from course_catalog import CourseCatalog, create_base_course_column, owned_variant
+from content_sync import StartupTimer, create_content_sync_table, sync_content
+from update_recorder import UpdateRecorder
+from preliminary_materials import PreliminaryMaterials, create_preliminary_tables
+from search_index import (SEARCH_PAGE_SIZE, SEARCH_SOURCES, add_support_ticket, create_search_tables,
+                          format_search_results, parse_results, search_statements, sync_lesson_index)
+from flood_control import FloodControl, format_flood_metrics
+from request_pools import build_bot_request, format_pool_metrics
+from lesson_delivery import DELIVERY_RESUME_MINUTES, LessonDelivery, build_plan, create_lesson_delivery_tables
+from time_utils import create_epoch_columns, format_epoch, month_day, now_epoch
+from lootbox import LOOTBOX_MAX_BATCH, LootboxEngine, create_lootbox_tables
+from monthly_accrual import (ACCRUAL_DAY, ACCRUAL_HOUR, ACCRUAL_MINUTE, MONTHLY_TRUST_INCREASE,
+                             create_monthly_accrual_tables, format_accrual_report, run_monthly_accrual)
+
 # Константы для команд (на английском языке)
 CMD_LESSON = "lesson"
 CMD_INFO = "info"
 CMD_HOMEWORK = "homework"
 CMD_ADMINS = "admins"
 
-DATABASE_FILE = "bot_db.sqlite"
+# переопределяется окружением, например копией базы при воспроизведении записи (benchmarks/replay_updates.py)
+DATABASE_FILE = os.getenv("DATABASE_FILE", "bot_db.sqlite")
 
 TARIFFS_FILE = "tariffs.json"
 
@@ -73,6 +108,7 @@ class DatabaseConnection:
             cls._instance = super(DatabaseConnection, cls).__new__(cls)
             try:
                 cls._instance.conn = sqlite3.connect(db_file)
+                apply_profile(cls._instance.conn)  # WAL, synchronous, кэш, mmap, busy_timeout
                 cls._instance.cursor = cls._instance.conn.cursor()
                 logger.info(f"DatabaseConnection: Подключение к {db_file}")
             except sqlite3.Error as e:
@@ -95,20 +131,134 @@ class DatabaseConnection:
             self.cursor = None
 
 
-class Course:
-    def __init__(self, course_id, course_name, course_type, code_word, price_rub=None, price_tokens=None):
-        self.course_id = course_id
-        self.course_name = course_name
-        self.course_type = course_type
-        self.code_word = code_word
+REPOSITORY = None
+
+
+def get_repository():
+    """Репозиторий бота поверх общего SQLite-соединения."""
+    global REPOSITORY
+    if REPOSITORY is None:
+        # остальные обработчики пишут в SQLite напрямую - другой бэкенд разделил бы данные на две базы
+        if DB_BACKEND.lower() != "sqlite":
+            raise RuntimeError(f"DB_BACKEND={DB_BACKEND} не поддерживается ботом: данные хранятся в SQLite")
+        REPOSITORY = create_repository("sqlite", conn=DatabaseConnection().get_connection())
+    return REPOSITORY
+
+
+WRITER = None
+
+
+def get_writer():
+    """Координатор записи на своём соединении: его коммиты не задевают транзакции общего соединения."""
+    global WRITER
+    if WRITER is None:
+        conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+        apply_profile(conn)
+        WRITER = WriteCoordinator(conn)
+    return WRITER
+
+
+async def run_once(key: str, actor_id: int, effect) -> tuple[bool, object]:
+    """Выполняет effect(cursor) в одной транзакции с записью ключа действия.
+
+    Возвращает (False, None), если действие с этим ключом уже выполнялось.
+    """
+    def unit(cur):
+        if not claim_action(cur, key, actor_id):
+            return False, None
+        return True, effect(cur)
+
+    return await get_writer().submit(unit)
+
+
+ANALYTICS = None
+STATS_CACHE_TTL = 60  # секунды, общие счётчики для админов не обязаны быть точными до секунды
+
+
+def get_analytics():
+    """Read-only пул для отчётов - не конкурирует с записью учеников."""
+    global ANALYTICS
+    if ANALYTICS is None:
+        ANALYTICS = AnalyticsPool(DATABASE_FILE)
+    return ANALYTICS
+
+
+LEADERBOARD = None
+
+
+def get_leaderboard():
+    """Рейтинги учеников в памяти, догоняются по журналу изменений."""
+    global LEADERBOARD
+    if LEADERBOARD is None:
+        LEADERBOARD = Leaderboard(DatabaseConnection().get_connection())
+        LEADERBOARD.load()
+    return LEADERBOARD
+
+
+LOOTBOXES = None
+
+
+def get_lootbox_engine():
+    """Таблицы алиасов лутбоксов, строятся один раз и обновляются при изменении lootboxes."""
+    global LOOTBOXES
+    if LOOTBOXES is None:
+        LOOTBOXES = LootboxEngine(DatabaseConnection().get_connection())
+    return LOOTBOXES
+
+
+UPDATE_RECORDER = None
+
+
+def get_update_recorder():
+    """Рекордер входящих update, только если задан UPDATE_RECORD_PATH."""
+    global UPDATE_RECORDER
+    if UPDATE_RECORDER is None:
+        UPDATE_RECORDER = UpdateRecorder.from_env(ADMIN_IDS, ADMIN_GROUP_ID, code_words=COURSE_DATA)
+    return UPDATE_RECORDER
+
+
+PRELIMINARY = None
+
+
+def get_preliminary_store():
+    """Манифест предварительных материалов и кэш их file_id."""
+    global PRELIMINARY
+    if PRELIMINARY is None:
+        PRELIMINARY = PreliminaryMaterials(DatabaseConnection().get_connection())
+    return PRELIMINARY
 
-        # Extract tariff from course_id
-        self.tariff = course_id.split('_')[1] if '_' in course_id else 'default'
-        self.price_rub = price_rub
-        self.price_tokens = price_tokens
 
-    def __str__(self):
-        return f"Course(id={self.course_id}, name={self.course_name}, type={self.course_type}, code={self.code_word}, price_rub={self.price_rub}, price_tokens={self.price_tokens})"
+FLOOD_CONTROL = None
+
+
+def get_flood_control():
+    """Входной контроль нагрузки; админы и группа админов не ограничиваются."""
+    global FLOOD_CONTROL
+    if FLOOD_CONTROL is None:
+        FLOOD_CONTROL = FloodControl(ADMIN_IDS, ADMIN_GROUP_ID)
+    return FLOOD_CONTROL
+
+
+BOT_REQUEST = None
+
+
+def get_bot_request():
+    """Транспорт Bot API с отдельными пулами для быстрых вызовов и загрузок файлов."""
+    global BOT_REQUEST
+    if BOT_REQUEST is None:
+        BOT_REQUEST = build_bot_request()
+    return BOT_REQUEST
+
+
+LESSON_DELIVERY = None
+
+
+def get_lesson_delivery():
+    """Курсор доставки уроков (продолжение после сбоев и перезапусков)."""
+    global LESSON_DELIVERY
+    if LESSON_DELIVERY is None:
+        LESSON_DELIVERY = LessonDelivery(DatabaseConnection().get_connection())
+    return LESSON_DELIVERY
 
 
 class CustomFormatter(logging.Formatter):
@@ -127,6 +277,7 @@ for handler in logging.getLogger().handlers:
     handler.setFormatter(CustomFormatter('%(asctime)s - %(levelname)s - %(message)s'))
 
 logger = logging.getLogger(__name__)
+STARTUP_TIMER = StartupTimer()  # фазы старта: импорт, схема, справочники, сборка, подключение к Telegram
 
 # Настройка уровня логирования для библиотеки httpx
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -283,6 +434,9 @@ def load_course_data(filename):
 
 
 COURSE_DATA = load_course_data(COURSE_DATA_FILE)
+COURSE_CATALOG = CourseCatalog(COURSE_DATA.values())
+CODE_WORD_MATCHER = CodeWordMatcher(COURSE_DATA)
+INTENT_MATCHER = IntentMatcher()
 
 
 # Функция для загрузки фраз из текстового файла
@@ -314,6 +468,8 @@ TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID"))
 # Get admin IDs from env, default to empty list if not set
 ADMIN_IDS = os.getenv("ADMIN_IDS", "").split(",") if os.getenv("ADMIN_IDS") else []
+# Служебный чат, куда загружаются предварительные материалы ради file_id
+PRELIMINARY_CACHE_CHAT_ID = int(os.getenv("PRELIMINARY_CACHE_CHAT_ID", ADMIN_GROUP_ID))
 
 # персистентность
 persistence = PicklePersistence(filepath="bot_data.pkl")
@@ -347,36 +503,6 @@ DEFAULT_LESSON_DELAY_HOURS = 3
 logger.info(
     f"ПОЕХАЛИ {DEFAULT_LESSON_DELAY_HOURS=} {DEFAULT_LESSON_INTERVAL=} время старта {time.strftime('%d/%m/%Y %H:%M:%S')}")
 
-# Словарь для кэширования данных
-USER_CACHE = {}
-
-
-def get_user_data(user_id: int):  # Добавил conn и cursor
-    """Получает данные пользователя из кэша или базы данных."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-    
-    if user_id in USER_CACHE:
-        return USER_CACHE[user_id]
-
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    data = cursor.fetchone()
-
-    if data:
-        USER_CACHE[user_id] = data
-        return data
-
-    return None
-
-
-def clear_user_cache(user_id: int):  # Добавил conn и cursor
-    """Очищает кэш для указанного пользователя."""
-    
-    logger.info(f" clear_user_cache {user_id} очистили")
-    if user_id in USER_CACHE:
-        del USER_CACHE[user_id]
-
 
 async def safe_reply(update: Update, context: CallbackContext, text: str, parse_mode: ParseMode = None,
                      reply_markup: InlineKeyboardMarkup | None = None):
@@ -411,6 +537,19 @@ async def safe_reply(update: Update, context: CallbackContext, text: str, parse_
         logger.error(f"Ошибка при отправке сообщения: {e}")
 
 
+def credit_coins(cursor: sqlite3.Cursor, user_id: int, amount: int):
+    """Начисляет коины в текущей транзакции вызывающего (без commit)."""
+    cursor.execute(
+        """
+        INSERT INTO user_tokens (user_id, tokens) 
+        VALUES (?, ?)
+        ON CONFLICT(user_id) DO 
+        UPDATE SET tokens = tokens + ?
+        """,
+        (user_id, amount, amount),
+    )
+
+
 # отсыпать ему монет!
 def add_coins(user_id: int, amount: int):
     """Добавляет коины пользователю в базе данных."""
@@ -419,15 +558,7 @@ def add_coins(user_id: int, amount: int):
     cursor = db.get_cursor()
 
     try:
-        cursor.execute(
-            """
-            INSERT INTO user_tokens (user_id, tokens) 
-            VALUES (?, ?)
-            ON CONFLICT(user_id) DO 
-            UPDATE SET tokens = tokens + ?
-            """,
-            (user_id, amount, amount),
-        )
+        credit_coins(cursor, user_id, amount)
         conn.commit()
         logger.info(f"Пользователю {user_id} добавлено {amount} коинов.")
     except sqlite3.Error as e:
@@ -458,20 +589,12 @@ def is_birthday(user_id: int) -> bool:
     cursor = db.get_cursor()
 
     try:
-        cursor.execute("SELECT birthday FROM users WHERE user_id = ?", (user_id,))
+        cursor.execute("SELECT birthday_md FROM users WHERE user_id = ?", (user_id,))
         result = cursor.fetchone()
-        if result and result[0]:
-            birthday_str = result[0]  # Получаем строку с датой дня рождения
-            birthday = datetime.strptime(birthday_str, '%Y-%m-%d').date()
-            today = date.today()
-            return birthday.month == today.month and birthday.day == today.day
-        return False
+        return bool(result) and result[0] == month_day(date.today())
     except sqlite3.Error as e:
         logger.error(f"Ошибка при проверке дня рождения пользователя {user_id}: {e}")
         return False
-    except ValueError as e:
-        logger.error(f"Ошибка при преобразовании даты дня рождения пользователя {user_id}: {e}. Убедитесь, что формат даты верный (YYYY-MM-DD).")
-        return False
 
 async def check_and_award_birthday_bonus(context: CallbackContext):
     """Проверяет, у кого сегодня день рождения, и начисляет бонус."""
@@ -479,21 +602,21 @@ async def check_and_award_birthday_bonus(context: CallbackContext):
     conn = db.get_connection()
     cursor = db.get_cursor()
     try:
-        cursor.execute("SELECT user_id FROM users")  # Получаем всех пользователей
+        # Только именинники - по индексу idx_users_birthday_md
+        cursor.execute("SELECT user_id FROM users WHERE birthday_md = ?", (month_day(date.today()),))
         users = cursor.fetchall()
 
+        bonus_amount = bonuses_config.get("birthday_bonus", 5)
         for user in users:
             user_id = user[0]
-            if is_birthday(user_id):
-                bonus_amount = bonuses_config.get("birthday_bonus", 5)
-                add_coins(user_id, bonus_amount)
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=f"🎉 С днем рождения! Вам начислено {bonus_amount} коинов в честь вашего дня рождения!",
-                    )
-                except TelegramError as e:
-                    logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
+            add_coins(user_id, bonus_amount)
+            try:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=f"🎉 С днем рождения! Вам начислено {bonus_amount} коинов в честь вашего дня рождения!",
+                )
+            except TelegramError as e:
+                logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
 
     except sqlite3.Error as e:
         logger.error(f"Ошибка при выборке пользователей для проверки дня рождения: {e}")
@@ -636,7 +759,12 @@ async def handle_code_words(update: Update, context: CallbackContext):
     logger.info(f" handle_code_words {user_id}   {user_code}")
     logger.info(f"345 COURSE_DATA {COURSE_DATA}   ")
 
-    if user_code in COURSE_DATA:
+    # Кодовое слово ищем с нормализацией и допуском на опечатку
+    matched_code = CODE_WORD_MATCHER.match(user_code)
+    if matched_code is not None:
+        if matched_code != user_code:
+            logger.info(f" handle_code_words: '{user_code}' распознано как '{matched_code}'")
+        user_code = matched_code
         try:
             # Активируем курс
             await activate_course(update, context, user_id, user_code)
@@ -770,7 +898,7 @@ async def get_current_lesson(update: Update, context: CallbackContext):
             return
 
         active_course_id_full = active_course_data[0]
-        active_course_id = active_course_id_full.split("_")[0]
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
         logger.info(f"active_course_id: {active_course_id}")
 
         # Получаем progress (номер урока) из user_courses
@@ -851,17 +979,16 @@ async def send_lesson_files(update: Update, context: CallbackContext, lesson_fil
     """Отправляет файлы урока, используя функцию send_file."""
     user_id = update.effective_user.id
     for i, file_info in enumerate(lesson_files, start=1):
-        file_path = file_info["path"]
-        file_type = file_info["type"]
-        delay = file_info["delay"]
-        delay_message = file_info["delay_message"]  # Добавляем получение delay_message
+        file_path = file_info.path
+        file_type = file_info.type
+        delay = file_info.delay
+        delay_message = None
         logger.info(f"000 Файл {i}: {file_path=}, {file_type=}, {delay=}")
 
         # Задержка перед отправкой
         if delay > 0:
-            # Выбираем случайное сообщение из DELAY_MESSAGES
-            if not delay_message:
-                delay_message = random.choice(DELAY_MESSAGES)  # Заменяем выбор сообщения
+            # Выбираем случайное сообщение из DELAY_MESSAGES, как build_plan
+            delay_message = random.choice(DELAY_MESSAGES)
             logger.info(f"Ожидание {delay} секунд перед отправкой файла {file_path}. Сообщение: {delay_message}")
             await context.bot.send_message(chat_id=user_id, text=delay_message)
             delay = HARD_CODE_DELAY  # todo починить HARD_CODE_DELAY при рефакторинге
@@ -880,56 +1007,65 @@ async def send_lesson_files(update: Update, context: CallbackContext, lesson_fil
 async def process_lesson(user_id, lesson_number, active_course_id, context):
     """Обрабатывает текст урока и отправляет связанные файлы."""
     logger.info(f"800 process_lesson {user_id=} {lesson_number=}, {active_course_id=}, {context=}")
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    await deliver_lesson(context.bot, user_id, lesson_number, active_course_id)
 
-    try:
-        # 1. Читаем текст урока
-        lesson_data = get_lesson_text(lesson_number, active_course_id)
-        if lesson_data:
-            lesson_text, parse_mode = lesson_data
-            try:
-                await context.bot.send_message(chat_id=user_id, text=lesson_text, parse_mode=parse_mode)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке текста урока: {e}")
-                await context.bot.send_message(chat_id=user_id, text="Ошибка при отправке текста урока.")
-        else:
-            await context.bot.send_message(chat_id=user_id, text="Текст урока не найден.")
 
-        # 2. Получаем файлы для урока
+async def deliver_lesson(bot, user_id, lesson_number, active_course_id):
+    """Доставляет урок по шагам с курсором: после сбоя или перезапуска продолжает с неотправленного шага."""
+    try:
+        # 1. План: текст урока, затем файлы с сообщениями о задержке
+        lesson_data = get_lesson_text(lesson_number, active_course_id) or ("Текст урока не найден.", None)
         lesson_files = await get_lesson_files(user_id, lesson_number, active_course_id)
+        plan = build_plan(lesson_data, lesson_files, lambda: random.choice(DELAY_MESSAGES))
 
-        # 3. Отправляем файлы с задержкой и обрабатываем ошибки
-        for file_info in lesson_files:
-            file_path = file_info["path"]
-            file_name = os.path.basename(file_path)
-            file_type = file_info["type"]
-            delay = file_info["delay"]
-
-            try:
+        async def send_item(item):
+            if item.kind == "text":
+                try:
+                    await bot.send_message(chat_id=user_id, text=item.text, parse_mode=item.parse_mode)
+                except (NetworkError, TimedOut, RetryAfter) as e:
+                    logger.warning(f"Текст урока не отправлен, повторим позже: {e}")
+                    return False
+                except Exception as e:
+                    logger.error(f"Ошибка при отправке текста урока: {e}")
+                    await bot.send_message(chat_id=user_id, text="Ошибка при отправке текста урока.")
+                return True
+            if item.kind == "delay":
                 # Если есть задержка, отправляем сообщение о задержке
-                if delay > 0:
-                    delay_message = random.choice(DELAY_MESSAGES)
-                    logger.info(
-                        f"Ожидание {delay} секунд перед отправкой файла {file_path}. Сообщение: {delay_message}")
-                    await context.bot.send_message(chat_id=user_id, text=delay_message)
-                    await asyncio.sleep(delay)
-
-                # Отправляем файл, используя функцию send_file
-                await send_file_with_file_id(context.bot, user_id, active_course_id, lesson_number, file_path,
-                                             file_name, file_type)
-
-            except FileNotFoundError:
-                logger.error(f"Файл не найден: {file_path}")
-                await context.bot.send_message(chat_id=user_id, text=f"Файл не найден: {file_path}")
-            except Exception as e:
-                logger.error(f"Ошибка при отправке файла {file_path}: {e}")
-                await context.bot.send_message(chat_id=user_id, text=f"Ошибка при отправке файла: {e}")
+                logger.info(f"Ожидание {item.file.delay} секунд перед отправкой файла {item.file.path}."
+                            f" Сообщение: {item.text}")
+                await bot.send_message(chat_id=user_id, text=item.text)
+                await asyncio.sleep(item.file.delay)
+                return True
+            # Отправляем файл, используя функцию send_file
+            return await send_file_with_file_id(bot, user_id, active_course_id, lesson_number, item.file.path,
+                                                os.path.basename(item.file.path), item.file.type)
+
+        # 2. Отправляем шаги, курсор сохраняется после каждого
+        report = await get_lesson_delivery().deliver(user_id, active_course_id, lesson_number, plan, send_item)
+        logger.info(f"Доставка урока {lesson_number} для {user_id}: {report}")
+
+        # 3. Урок отправлен - в фоне выпускаем file_id предварительных материалов следующего
+        if report.completed:
+            get_preliminary_store().warm_in_background(bot, PRELIMINARY_CACHE_CHAT_ID, active_course_id,
+                                                       lesson_number + 1)
 
     except Exception as e:
         logger.error(f"Ошибка при обработке урока: {e}")
-        await context.bot.send_message(chat_id=user_id, text="Произошла ошибка при обработке урока.")
+        try:
+            await bot.send_message(chat_id=user_id, text="Произошла ошибка при обработке урока.")
+        except TelegramError as send_error:
+            logger.error(f"deliver_lesson: не удалось сообщить {user_id} об ошибке: {send_error}")
+
+
+async def resume_lesson_deliveries_job(bot):
+    """Дослать уроки, доставка которых прервалась (сбой сети, перезапуск бота)."""
+    for user_id, course_dir, lesson in get_lesson_delivery().pending():
+        logger.info(f"resume_lesson_deliveries_job: продолжаем урок {lesson} курса {course_dir} для {user_id}")
+        try:
+            await deliver_lesson(bot, user_id, lesson, course_dir)
+        except Exception as e:
+            # один ученик (например, заблокировавший бота) не должен останавливать остальные доставки
+            logger.error(f"resume_lesson_deliveries_job: урок {lesson} курса {course_dir} для {user_id}: {e}")
 
 
 async def send_file_with_file_id(bot, chat_id: int, course_id: str, lesson_number: int, file_path: str,
@@ -944,6 +1080,10 @@ async def send_file_with_file_id(bot, chat_id: int, course_id: str, lesson_numbe
         lesson_number: Номер урока.
         file_path: Путь к файлу.
         file_name: Имя файла (для отправки как документа).
+
+    Returns:
+        True, если шаг урока закрыт (файл отправлен или его нет на диске - повтор не поможет),
+        False при сбое отправки - доставка урока продолжит с этого файла позже.
     """
     db = DatabaseConnection()
     conn = db.get_connection()
@@ -955,7 +1095,7 @@ async def send_file_with_file_id(bot, chat_id: int, course_id: str, lesson_numbe
         if not os.path.exists(file_path):
             logger.error(f"Файл не найден: {file_path}")
             await bot.send_message(chat_id=chat_id, text="Файл не найден. Пожалуйста, обратитесь в поддержку.")
-            return  # Важно: выходим из функции, если файл не найден
+            return True  # Важно: выходим из функции, если файл не найден
 
         # 2. Получаем video_file_id из базы данных (если есть)
         cursor.execute(
@@ -982,19 +1122,18 @@ async def send_file_with_file_id(bot, chat_id: int, course_id: str, lesson_numbe
                 else:
                     await bot.send_document(chat_id=chat_id, document=file_id, filename=file_name)
                 logger.info(f"Файл {file_name} успешно отправлен с использованием video_file_id.")
-                return  # Выходим из функции, если отправка прошла успешно
+                return True  # Выходим из функции, если отправка прошла успешно
 
             except TelegramError as e:
                 logger.warning(f"Не удалось отправить файл с video_file_id: {e}. Попытка отправки как нового файла.")
                 # Если не удалось отправить с video_file_id, отправляем как новый файл
-                await send_as_new_file(bot, chat_id, course_id, lesson_number, file_path, file_name, file_type)
-                return  # Выходим из функции
+                return await send_as_new_file(bot, chat_id, course_id, lesson_number, file_path, file_name,
+                                              file_type)
 
         else:
             # Если video_file_id не найден, отправляем как новый файл
             logger.info(f"video_file_id не найден, отправляем {file_name} как новый файл.")
-            await send_as_new_file(bot, chat_id, course_id, lesson_number, file_path, file_name, file_type)
-            return  # Выходим из функции
+            return await send_as_new_file(bot, chat_id, course_id, lesson_number, file_path, file_name, file_type)
 
     except sqlite3.Error as e:
         logger.error(f"Ошибка базы данных при отправке файла {file_name}: {e}")
@@ -1002,17 +1141,19 @@ async def send_file_with_file_id(bot, chat_id: int, course_id: str, lesson_numbe
             chat_id=chat_id,
             text="Произошла ошибка базы данных при отправке файла. Пожалуйста, попробуйте позже."
         )
+        return False
     except Exception as e:
         logger.exception(f"Ошибка при отправке файла {file_name}: {e}")
         await bot.send_message(
             chat_id=chat_id,
             text="Произошла ошибка при отправке файла. Пожалуйста, попробуйте позже."
         )
+        return False
 
 
 async def send_as_new_file(bot, chat_id: int, course_id: str, lesson_number: int, file_path: str, file_name: str,
                            file_type: str):
-    """Отправляет файл как новый, получает его video_file_id и сохраняет в базе данных."""
+    """Отправляет файл как новый, получает его video_file_id и сохраняет в базе данных. True - файл отправлен."""
     db = DatabaseConnection()
     conn = db.get_connection()
     cursor = db.get_cursor()
@@ -1039,18 +1180,18 @@ async def send_as_new_file(bot, chat_id: int, course_id: str, lesson_number: int
             -1].file_id if msg.photo else msg.video.file_id if msg.video else msg.audio.file_id if msg.audio else None  # Берем нужный file_id
         if file_id:
             logger.info(f"Получен file_id: {file_id}")
-            cursor.execute(
+            await get_writer().submit(lambda cur: cur.execute(
                 """
                 UPDATE lessons
                 SET video_file_id = ?
                 WHERE course_id = ? AND lesson = ?
                 """,
                 (file_id, course_id, lesson_number),
-            )
-            conn.commit()
+            ))
             logger.info(f"video_file_id {file_id} сохранен в базе данных для файла {file_name}.")
         else:
             logger.error(f"Не удалось получить file_id для {file_name}!")
+        return True
 
     except Exception as e:
         # Обрабатываем любые исключения, которые могут возникнуть
@@ -1060,6 +1201,7 @@ async def send_as_new_file(bot, chat_id: int, course_id: str, lesson_number: int
             chat_id=chat_id,
             text="Произошла ошибка при отправке файла. Пожалуйста, попробуйте позже или обратитесь в поддержку."
         )
+        return False
 
 
 def get_lesson_text(lesson_number, course_id):
@@ -1122,12 +1264,11 @@ async def get_next_bonus_info( user_id: int) -> dict:
         next_bonus = "Ежемесячный бонус уже начислен в этом месяце"
 
     # 2. Birthday bonus
-    cursor.execute("SELECT birthday FROM users WHERE user_id = ?", (user_id,))
+    cursor.execute("SELECT birthday, birthday_md FROM users WHERE user_id = ?", (user_id,))
     user_data = cursor.fetchone()
-    birthday_str = user_data[0] if user_data else None
-    if birthday_str:
-        birthday = datetime.strptime(birthday_str, "%Y-%m-%d").date()
-        if birthday.month == today.month and birthday.day == today.day:
+    birthday_str, birthday_md = user_data if user_data else (None, None)
+    if birthday_md:
+        if birthday_md == month_day(today):
             next_bonus += f"\n+{bonuses_config.get('birthday_bonus', 5)} (Бонус на день рождения)"
         else:
             next_bonus += f"\nБонус на день рождения будет начислен {birthday_str}"
@@ -1238,8 +1379,8 @@ async def show_main_menu( update: Update, context: CallbackContext):
 
         active_course_id_full = active_course_data[0]
         # Short name
-        active_course_id = active_course_id_full.split("_")[0]
-        active_tariff = active_course_id_full.split("_")[1] if len(active_course_id_full.split("_")) > 1 else "default"
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
+        active_tariff = COURSE_CATALOG.tariff(active_course_id_full)
 
         # Получаем данные о типе курса и прогрессе
         cursor.execute(
@@ -1486,8 +1627,8 @@ async def old_get_main_menu_message( user: Update.effective_user) -> str:
 
         active_course_id_full = active_course_data[0]
         # Short name
-        active_course_id = active_course_id_full.split("_")[0]
-        active_tariff = active_course_id_full.split("_")[1] if len(active_course_id_full.split("_")) > 1 else "default"
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
+        active_tariff = COURSE_CATALOG.tariff(active_course_id_full)
 
         # Data of course
         cursor.execute(
@@ -1533,7 +1674,8 @@ async def old_get_main_menu_message( user: Update.effective_user) -> str:
         logger.info(f"563 {homework=}  --------- ")
 
         message = f"Приветствую, {full_name}! ✅\n"
-        message += f"        Курс: {active_course_id} \n"  # TODO получить course_name из course_id
+        course = COURSE_CATALOG.get(active_course_id_full)
+        message += f"        Курс: {course.course_name if course else active_course_id} \n"
         message += homework
 
         return message
@@ -1807,24 +1949,20 @@ async def activate_course(update: Update, context: CallbackContext, user_id: int
     cursor = db.get_cursor()
 
     try:
-        # Получаем данные о курсе из COURSE_DATA по кодовому слову
-        course = COURSE_DATA[user_code]
+        # Получаем данные о курсе из каталога по кодовому слову
+        course = COURSE_CATALOG.by_code(user_code)
+        if course is None:
+            logger.warning(f"activate_course: кодового слова {user_code!r} нет в каталоге")
+            await safe_reply(update, context, "Курс с таким кодовым словом не найден.")
+            return
         course_id_full = course.course_id  # Полное название курса (например, femininity_premium)
-        course_id = course_id_full.split("_")[0]  # Базовое название курса (например, femininity)
+        course_id = COURSE_CATALOG.base_course_id(course_id_full)  # Базовое название курса (например, femininity)
         course_type = course.course_type  # 'main' или 'auxiliary'
-        tariff = course_id_full.split("_")[1] if len(
-            course_id_full.split("_")) > 1 else "default"  # Тариф (premium, self_check и т.д.)
+        tariff = COURSE_CATALOG.tariff(course_id_full)  # Тариф (premium, self_check и т.д.)
         logger.info(f"544 activate_course {tariff} название курса из файла {course_id_full}")
 
         # Проверяем, есть ли уже какой-то курс с таким базовым названием у пользователя
-        cursor.execute(
-            """
-            SELECT course_id, tariff FROM user_courses
-            WHERE user_id = ? AND course_id LIKE ?
-        """,
-            (user_id, f"{course_id}%"),
-        )
-        existing_course = cursor.fetchone()
+        existing_course = owned_variant(cursor, user_id, course_id)
 
 
         # продолжается
@@ -1855,20 +1993,42 @@ async def activate_course(update: Update, context: CallbackContext, user_id: int
                 return
 
             else:
-                # Обновляем тариф существующего курса
-                cursor.execute(
+                # Обновляем тариф существующего курса и active_course_id в users - одной записью
+                def switch_tariff(cur):
+                    cur.execute(
+                        """
+                        UPDATE user_courses
+                        SET course_id = ?, tariff = ?
+                        WHERE user_id = ? AND course_id = ?
+                    """,
+                        (course_id_full, tariff, user_id, existing_course_id),
+                    )
+                    cur.execute(
+                        """
+                        UPDATE users
+                        SET active_course_id = ?
+                        WHERE user_id = ?
+                    """,
+                        (course_id_full, user_id),
+                    )
+
+                await get_writer().submit(switch_tariff)
+                await safe_reply(update, context, f"Вы перешли с тарифа {existing_tariff} на тариф {tariff}.")
+                logger.info(
+                    f"Обновлен тариф пользователя {user_id} с {existing_tariff} на {tariff} для курса {course_id}")
+
+                return  # Важно: завершаем функцию после обновления
+        else:
+            # Курса с таким базовым названием еще нет - создаем новый и делаем его активным
+            def add_course(cur):
+                cur.execute(
                     """
-                    UPDATE user_courses
-                    SET course_id = ?, tariff = ?
-                    WHERE user_id = ? AND course_id = ?
+                    INSERT INTO user_courses (user_id, course_id, course_type, progress, tariff)
+                    VALUES (?, ?, ?, ?, ?)
                 """,
-                    (course_id_full, tariff, user_id, existing_course_id),
+                    (user_id, course_id_full, course_type, 1, tariff),
                 )
-                conn.commit()
-                await safe_reply(update, context, f"Вы перешли с тарифа {existing_tariff} на тариф {tariff}.")
-
-                # Обновляем active_course_id в users
-                cursor.execute(
+                cur.execute(
                     """
                     UPDATE users
                     SET active_course_id = ?
@@ -1876,34 +2036,9 @@ async def activate_course(update: Update, context: CallbackContext, user_id: int
                 """,
                     (course_id_full, user_id),
                 )
-                conn.commit()
-                logger.info(
-                    f"Обновлен тариф пользователя {user_id} с {existing_tariff} на {tariff} для курса {course_id}")
-
-                return  # Важно: завершаем функцию после обновления
-        else:
-            # Курса с таким базовым названием еще нет - создаем новый
-            cursor.execute(
-                """
-                INSERT INTO user_courses (user_id, course_id, course_type, progress, tariff)
-                VALUES (?, ?, ?, ?, ?)
-            """,
-                (user_id, course_id_full, course_type, 1, tariff),
-            )
-            conn.commit()
 
+            await get_writer().submit(add_course)
             await safe_reply(update, context, f"Курс {course_id} ({tariff}) активирован!")
-
-            # Обновляем active_course_id в users
-            cursor.execute(
-                """
-                UPDATE users
-                SET active_course_id = ?
-                WHERE user_id = ?
-            """,
-                (course_id_full, user_id),
-            )
-            conn.commit()
             logger.info(
                 f"Курс {course_id} типа {course_type} активирован для пользователя {user_id} с тарифом {tariff}")
 
@@ -2001,16 +2136,46 @@ def create_admin_keyboard(user_id: int, course_id: str, lesson: int) -> InlineKe
 
 
 
+def extract_attachment(message):
+    """Достаёт вложение домашки из сообщения (фото, видео или документ) или None."""
+    if message and message.photo:
+        media, file_type = message.photo[-1], "photo"
+    elif message and message.video:
+        media, file_type = message.video, "video"
+    elif message and message.document:
+        media, file_type = message.document, "document"
+    else:
+        return None
+    return Attachment(media.file_id, media.file_unique_id, file_type)
+
+
 async def handle_homework_submission(update: Update, context: CallbackContext):
-    """Обрабатывает отправку домашнего задания."""
+    """Обрабатывает отправку домашнего задания. Части альбома собираются в одну домашку."""
     user_id = update.effective_user.id
-    course_id = context.user_data.get("current_course_id")
-    lesson = context.user_data.get("current_lesson")
-
     logger.info(f"1599 ==== handle_homework_submission ========================= {user_id=}")
+
+    message = update.message or update.callback_query.message
+    attachment = extract_attachment(message)
+    if attachment is None:
+        logger.warning(f" Ни одного файла file_id not file_id {user_id=}")
+        await safe_reply(update, context, "Пожалуйста, отправьте фото, видео или документ.")
+        return
+
+    if message.media_group_id:
+        # альбом: ждём остальные части, submit_homework вызовется один раз
+        HOMEWORK_ALBUMS.add((user_id, message.media_group_id), attachment, update, context)
+        return
+
+    await submit_homework(update, context, [attachment])
+
+
+async def submit_homework(update: Update, context: CallbackContext, attachments: list):
+    """Сохраняет домашку с вложениями, отправляет её админам и отвечает ученику. Возвращает hw_id или None."""
+    user_id = update.effective_user.id
     db = DatabaseConnection()
     conn = db.get_connection()
     cursor = db.get_cursor()
+    hw_id = None
 
     try:
         # 1. Получаем текущий курс пользователя
@@ -2054,40 +2219,25 @@ async def handle_homework_submission(update: Update, context: CallbackContext):
 
         lesson = progress_data[0]
         logger.info(f"1601 user_id {user_id=}  progress_data {progress_data=}  lesson {lesson=}")
-        # 3. Получаем информацию о загруженном файле
-        message = update.message or update.callback_query.message
-        if message and message.photo:
-            file_id = message.photo[-1].file_id
-            file_type = "photo"
-        elif message and message.video:
-            file_id = message.video.file_id
-            file_type = "video"
-        elif message and message.document:
-            file_id = message.document.file_id
-            file_type = "document"
-        else:
-            logger.warning(f" Ни одного файла file_id not file_id {user_id=}")
-            await safe_reply(update, context, "Пожалуйста, отправьте фото, видео или документ.")
-            return
 
-        try:
-            file_info = await context.bot.get_file(file_id)
-            logger.info(f"1602 file_info {file_info=}")
-        except Exception as e:
-            logger.error(f"Ошибка при получении информации о файле: {e}")
-            await safe_reply(update, context, "Ошибка при получении информации о файле.")
-            return
+        # 3-4. Домашка, её вложения и очередь архиватора - одной единицей записи, без get_file
+        def save_homework(cur):
+            first = attachments[0]
+            cur.execute(
+                """
+                INSERT INTO homeworks (user_id, course_id, lesson, file_id, file_unique_id, file_type, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, active_course_id, lesson, first.file_id, first.file_unique_id, first.file_type, "pending"),
+            )
+            new_hw_id = cur.lastrowid
+            insert_attachments(cur, new_hw_id, attachments)
+            for attachment in attachments:
+                enqueue_media(cur, attachment.file_id, attachment.file_unique_id)
+            return new_hw_id
 
-        # 4. Сохраняем информацию о домашнем задании в базе данных
-        cursor.execute(
-            """
-            INSERT INTO homeworks (user_id, course_id, lesson, file_id, file_type, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, active_course_id, lesson, file_id, file_type, "pending"),
-        )
-        conn.commit()
-        logger.info(f"1603  Домашка user_id {user_id=} сохранена в базе данных")
+        hw_id = await get_writer().submit(save_homework)
+        logger.info(f"1603  Домашка {hw_id=} user_id {user_id=} сохранена в базе данных, вложений {len(attachments)}")
 
         # 5. Формируем ответ в зависимости от тарифа
         if tariff == "self_check":
@@ -2095,23 +2245,13 @@ async def handle_homework_submission(update: Update, context: CallbackContext):
             callback_data = f"approve_self_check|{user_id}|{active_course_id.replace('_', '|')}|{lesson}"  # вот тут
             keyboard = [[InlineKeyboardButton("✅ СамоПринять домашнее задание", callback_data=callback_data)]]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
+            await safe_reply(update, context,
                 f"Домашнее задание по уроку {lesson} отправлено. Вы самостоятельно подтверждаете выполнение.",
                 reply_markup=reply_markup)
         else:
-            # 5. Отправляем домашнее задание админу
-
             # 5. Отправляем домашнее задание админу
             # Создаем клавиатуру для админа
-            if active_course_id:  # Проверяем, что active_course_id не None
-                logger.info(f"5554  есть курс {active_course_id=}")
-                reply_markup = create_admin_keyboard(user_id, active_course_id, lesson)  # Исправлено: используем active_course_id
-            else:
-                logger.error("555 :-( active_course_id is None, cannot create admin keyboard.")
-                await safe_reply(update, context, "Произошла ошибка при обработке домашнего задания.")
-                return
-
-
+            reply_markup = create_admin_keyboard(user_id, active_course_id, lesson)
 
             # Получаем историю отказов для текущего урока
             logger.info(f"1604  Получаем историю отказов для текущего урока")
@@ -2137,16 +2277,17 @@ async def handle_homework_submission(update: Update, context: CallbackContext):
                 logger.info(f"1606  нет отказов то")
 
             logger.info(f"160666  {ADMIN_GROUP_ID=} Пользователь {user_id=} отправил домашнее задание по курсу {active_course_id=}, урок {lesson=}. {history_text=}  {reply_markup=}")
-            if active_course_id:
-                await context.bot.send_message(
-                    ADMIN_GROUP_ID,
-                    f"Пользователь {user_id} отправил домашнее задание по курсу {active_course_id}, урок {lesson}.\n\n{history_text}",
-                    reply_markup=reply_markup,
+            if len(attachments) > 1:
+                # альбом: одна медиагруппа и одно сообщение с клавиатурой
+                await context.bot.send_media_group(
+                    chat_id=ADMIN_GROUP_ID, media=[build_input_media(a) for a in attachments]
                 )
-            else:
-                logger.error("active_course_id is None, cannot send homework to admin.")
-                await safe_reply(update, context, "Произошла ошибка при обработке домашнего задания.")
-                return
+            await context.bot.send_message(
+                ADMIN_GROUP_ID,
+                f"Пользователь {user_id} отправил домашнее задание по курсу {active_course_id}, урок {lesson}"
+                f" (файлов: {len(attachments)}).\n\n{history_text}",
+                reply_markup=reply_markup,
+            )
             logger.info(f"1607  Отправили админу {ADMIN_GROUP_ID=}")
             await safe_reply(update, context, f"ДЗ {lesson} отправлено админам.")
             logger.info(f"1608  после safe_reply")
@@ -2159,6 +2300,56 @@ async def handle_homework_submission(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"1609 Непредвиденная ошибка при отправке ДЗ: {e}")
         await safe_reply(update, context, "Произошла ошибка при обработке домашнего задания. Попробуйте позже.")
+    return hw_id
+
+
+async def append_homework_attachments(update: Update, context: CallbackContext, hw_id: int, attachments: list):
+    """Дописывает опоздавшие части альбома к уже сохранённой домашке hw_id и досылает их админам."""
+    user_id = update.effective_user.id
+
+    def save_attachments(cur):
+        append_attachments(cur, hw_id, attachments)
+        for attachment in attachments:
+            enqueue_media(cur, attachment.file_id, attachment.file_unique_id)
+        return cur.execute("SELECT course_id, lesson FROM homeworks WHERE hw_id = ?", (hw_id,)).fetchone()
+
+    try:
+        course_id, lesson = await get_writer().submit(save_attachments)
+        logger.info(f"Домашка {hw_id=} user_id {user_id=}: дописано опоздавших вложений {len(attachments)}")
+        cursor = DatabaseConnection().get_cursor()
+        cursor.execute("SELECT tariff FROM users WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row and row[0] != "self_check":
+            if len(attachments) > 1:
+                await context.bot.send_media_group(
+                    chat_id=ADMIN_GROUP_ID, media=[build_input_media(a) for a in attachments]
+                )
+            else:
+                await context.bot.copy_message(ADMIN_GROUP_ID, update.effective_chat.id, update.effective_message.message_id)
+            await context.bot.send_message(
+                ADMIN_GROUP_ID,
+                f"Пользователь {user_id} дослал файлы к домашнему заданию по курсу {course_id}, урок {lesson}"
+                f" (ещё файлов: {len(attachments)}).",
+            )
+        await safe_reply(update, context, f"Файлы добавлены к ДЗ {lesson}.")
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД при добавлении файлов к ДЗ {hw_id=}: {e}")
+        await safe_reply(update, context, "Ошибка базы данных. Попробуйте позже.")
+    except Exception as e:
+        logger.error(f"Непредвиденная ошибка при добавлении файлов к ДЗ {hw_id=}: {e}")
+        await safe_reply(update, context, "Произошла ошибка при обработке домашнего задания. Попробуйте позже.")
+
+
+def build_input_media(attachment):
+    """InputMedia для отправки вложения домашки в медиагруппе."""
+    if attachment.file_type == "photo":
+        return InputMediaPhoto(media=attachment.file_id)
+    if attachment.file_type == "video":
+        return InputMediaVideo(media=attachment.file_id)
+    return InputMediaDocument(media=attachment.file_id)
+
+
+HOMEWORK_ALBUMS = AlbumCollector(submit_homework, append_homework_attachments)
 
 async def callback_data_history(update: Update, context: CallbackContext):
     """  Обработчик для кнопки "Посмотреть историю всех непринятых домашек этого курса".
@@ -2253,23 +2444,13 @@ async def handle_history_callback(update: Update, context: CallbackContext):
     course_id = data[2].replace('|', '_')  # Восстанавливаем исходный формат course_id
     lesson = int(data[3]) if len(data) > 3 else None  # Урок может отсутствовать
 
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
     try:
         if action == "history_callback":
-            # Получаем историю отказов для текущего урока
-            cursor.execute(
-                """
-                SELECT rejected_at, reason
-                FROM homework_rejections
-                WHERE user_id = ? AND course_id = ? AND lesson = ?
-                ORDER BY rejected_at DESC
-                """,
-                (user_id, course_id, lesson),
+            # Получаем историю отказов для текущего урока (с архивными месяцами)
+            rejections = await fetch_history(
+                "homework_rejections", ["rejected_at", "reason"], "user_id = ? AND course_id = ? AND lesson = ?",
+                (user_id, course_id, lesson), ("rejected_at",), descending=True, user_id=user_id,
             )
-            rejections = cursor.fetchall()
 
             if rejections:
                 message = "📜 *История Отказов:*\n\n"
@@ -2279,17 +2460,12 @@ async def handle_history_callback(update: Update, context: CallbackContext):
                 message = "📜 У вас пока нет истории отказов."
 
         else:
-            # Получаем историю всех домашних заданий по курсу
-            cursor.execute(
-                """
-                SELECT lesson, status, rejection_reason, submission_time
-                FROM homeworks
-                WHERE user_id = ? AND course_id = ?
-                ORDER BY lesson ASC, submission_time ASC
-                """,
-                (user_id, course_id),
+            # Получаем историю всех домашних заданий по курсу (причина отказа лежит в admin_comment)
+            homeworks = await fetch_history(
+                "homeworks", ["lesson", "status", "admin_comment", "submission_time"],
+                "user_id = ? AND course_id = ?", (user_id, course_id), ("lesson", "submission_time"),
+                user_id=user_id,
             )
-            homeworks = cursor.fetchall()
 
             if not homeworks:
                 await query.edit_message_text(text="История домашних заданий пуста для этого курса.")
@@ -2309,7 +2485,7 @@ async def handle_history_callback(update: Update, context: CallbackContext):
             parse_mode="Markdown",  # Для форматирования текста
         )
 
-    except sqlite3.Error as e:
+    except (sqlite3.Error, AnalyticsTimeoutError) as e:
         logger.error(f"Ошибка при получении истории: {e}")
         await query.edit_message_text(text="Произошла ошибка при получении истории.")
     except Exception as e:
@@ -2450,21 +2626,11 @@ def build_homework_review_keyboard(user_id: int, course_id: str, lesson: int, ha
 async def show_homework_details(update: Update, context: CallbackContext, user_id: int, course_id: str, lesson: int):
     """Отображает детали домашнего задания и историю отказов."""
     logger.info(f"444  show_homework_details {user_id=}  {course_id=}  {lesson=}")
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
-    # Получаем историю отказов для текущего урока
-    cursor.execute(
-        """
-        SELECT reason, rejected_at
-        FROM homework_rejections
-        WHERE user_id = ? AND course_id = ? AND lesson = ?
-        ORDER BY rejected_at DESC
-        """,
-        (user_id, course_id, lesson),
+    # Получаем историю отказов для текущего урока (с архивными месяцами)
+    rejections = await fetch_history(
+        "homework_rejections", ["reason", "rejected_at"], "user_id = ? AND course_id = ? AND lesson = ?",
+        (user_id, course_id, lesson), ("rejected_at",), descending=True, user_id=user_id,
     )
-    rejections = cursor.fetchall()
 
     # Формируем текст истории
     if rejections:
@@ -2498,23 +2664,16 @@ async def calculate_time_to_next_lesson( user_id, active_course_id_full):
     # Получаем время последнего урока
     cursor.execute(
         """
-        SELECT submission_time FROM homeworks
+        SELECT MAX(submitted_at) FROM homeworks
         WHERE user_id = ? AND course_id = ?
-        ORDER BY submission_time DESC
-        LIMIT 1
     """,
         (user_id, active_course_id_full),
     )
-    last_submission_data = cursor.fetchone()
+    last_submitted_at = cursor.fetchone()[0]
 
-    if last_submission_data:
-        last_submission_time = datetime.strptime(last_submission_data[0], "%Y-%m-%d %H:%M:%S")
-        next_lesson_time = last_submission_time + timedelta(hours=DEFAULT_LESSON_INTERVAL)
-    else:
-        next_lesson_time = datetime.now() + timedelta(hours=DEFAULT_LESSON_INTERVAL)
-
-    time_left = next_lesson_time - datetime.now()
-    return time_left if time_left.total_seconds() > 0 else timedelta(seconds=0)
+    now = now_epoch()
+    next_lesson_at = (last_submitted_at or now) + DEFAULT_LESSON_INTERVAL * 3600
+    return timedelta(seconds=max(0, next_lesson_at - now))
 
 
 async def save_admin_comment( update: Update, context: CallbackContext):
@@ -2628,6 +2787,9 @@ async def handle_admin_rejection( update: Update, context: CallbackContext):
 
 
 # Обрабатывает выбор тарифа
+TARIFF_TITLES = {"self_check": "Self-Check", "admin_check": "Admin-Check", "premium": "Premium"}
+
+
 async def change_tariff( update: Update, context: CallbackContext):
     """Обрабатывает выбор тарифа."""
     db = DatabaseConnection()
@@ -2654,21 +2816,13 @@ async def change_tariff( update: Update, context: CallbackContext):
 
         active_course_id = active_course_data[0]
 
-        # Создаем кнопки с вариантами тарифов
+        # Создаем кнопки с тарифами, которые есть у этого курса в каталоге
+        tariffs = [COURSE_CATALOG.tariff(course.course_id)
+                   for course in COURSE_CATALOG.variants(COURSE_CATALOG.base_course_id(active_course_id))]
         keyboard = [
-            [
-                InlineKeyboardButton(
-                    "Self-Check",
-                    callback_data=f"set_tariff|{active_course_id}|self_check",
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    "Admin-Check",
-                    callback_data=f"set_tariff|{active_course_id}|admin_check",
-                )
-            ],
-            [InlineKeyboardButton("Premium", callback_data=f"set_tariff|{active_course_id}|premium")],
+            [InlineKeyboardButton(TARIFF_TITLES.get(tariff, tariff),
+                                  callback_data=f"set_tariff|{active_course_id}|{tariff}")]
+            for tariff in tariffs or TARIFF_TITLES
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await safe_reply(update, context, "Выберите новый тариф:", reply_markup=reply_markup)
@@ -2682,23 +2836,13 @@ async def change_tariff( update: Update, context: CallbackContext):
 # Отображает список курсов пользователя
 async def my_courses( update: Update, context: CallbackContext):
     """Отображает список курсов пользователя."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    repo = get_repository()
 
     user_id = update.effective_user.id
     logger.info(f"my_courses  {user_id}")
     try:
-        # Получаем список курсов пользователя из базы данных
-        cursor.execute(
-            """
-            SELECT course_id, course_type
-            FROM user_courses
-            WHERE user_id = ?
-        """,
-            (user_id,),
-        )
-        courses_data = cursor.fetchall()
+        # Получаем список курсов пользователя из репозитория
+        courses_data = await repo.list_user_courses(user_id)
 
         if not courses_data:
             await safe_reply(update, context, "У вас нет активных курсов.")
@@ -2706,8 +2850,8 @@ async def my_courses( update: Update, context: CallbackContext):
 
         # Формируем текстовое сообщение со списком курсов
         message_text = "Ваши курсы:\n"
-        for course_id, course_type in courses_data:
-            message_text += f"- {course_id} ({course_type})\n"
+        for course in courses_data:
+            message_text += f"- {course['course_id']} ({course['course_type']})\n"
 
         await safe_reply(update, context, message_text)
         return
@@ -2723,55 +2867,45 @@ async def my_courses( update: Update, context: CallbackContext):
 # статистика домашек *
 async def show_statistics( update: Update, context: CallbackContext):
     """Shows statistics for lessons and homework, considering all users, deviations, and course completion."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    analytics = get_analytics()
 
     user_id = update.effective_user.id
     logger.info(f" Show stat: {user_id=}")
 
     try:
         # Get active_course_id from user
-        cursor.execute("SELECT active_course_id FROM users WHERE user_id = ?", (user_id,))
-        active_course_data = cursor.fetchone()
+        active_course_data = await analytics.fetchone("SELECT active_course_id FROM users WHERE user_id = ?", (user_id,))
 
         if not active_course_data or not active_course_data[0]:
             await update.message.reply_text("Activate course first .")
             return
 
         active_course_id_full = active_course_data[0]
-        active_course_id = active_course_id_full.split("_")[0]
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
 
-        # Get all users who have completed homework for this course
-        cursor.execute(
-            """
-            SELECT user_id, AVG((JULIANDAY(final_approval_time) - JULIANDAY(lesson_sent_time)) * 24 * 60 * 60)
-            FROM homeworks
-            WHERE course_id = ? AND final_approval_time IS NOT NULL
-            GROUP BY user_id
-        """,
-            (active_course_id_full,),
+        # Get all users who have completed homework for this course (агрегат по курсу кэшируем).
+        # Принятые домашки со временем уезжают в месячные архивы - читаем вместе с ними
+        completed = await analytics.fetch_tiered(
+            "homeworks", ["user_id", "final_approved_at", "lesson_sent_at"],
+            "course_id = ? AND final_approved_at IS NOT NULL", (active_course_id_full,), ttl=STATS_CACHE_TTL,
         )
-        all_user_stats = cursor.fetchall()
+        all_user_stats = average_by_user(completed)
 
         if not all_user_stats:
             await update.message.reply_text("No available  data.")
             return
 
         # Calculate average completion time across all users
-        total_times = [time for user, time in all_user_stats if time is not None]
+        total_times = [time for user, time in all_user_stats.items() if time is not None]
         average_time_all = sum(total_times) / len(total_times) if total_times else 0
 
         # Get user's average completion time
-        cursor.execute(
-            """
-            SELECT AVG((JULIANDAY(final_approval_time) - JULIANDAY(lesson_sent_time)) * 24 * 60 * 60)
-            FROM homeworks
-            WHERE course_id = ? AND user_id = ? AND final_approval_time IS NOT NULL
-        """,
-            (active_course_id_full, user_id),
+        user_completed = await analytics.fetch_tiered(
+            "homeworks", ["user_id", "final_approved_at", "lesson_sent_at"],
+            "course_id = ? AND user_id = ? AND final_approved_at IS NOT NULL", (active_course_id_full, user_id),
+            user_id=user_id,
         )
-        user_average_time = cursor.fetchone()[0] or 0
+        user_average_time = average_by_user(user_completed).get(user_id) or 0
 
         # Calculate deviation from the average
         diff_percentage = ((user_average_time - average_time_all) / average_time_all) * 100 if average_time_all else 0
@@ -2784,7 +2918,7 @@ async def show_statistics( update: Update, context: CallbackContext):
             deviation_text = f"Slower {abs(diff_percentage):.2f}%."
 
         # Get average homework completion time
-        average_homework_time = get_average_homework_time(user_id)
+        average_homework_time = await get_average_homework_time(user_id)
 
         # Build statistics message
         stats_message = f"Statistics for {active_course_id_full}:\n"
@@ -2801,7 +2935,7 @@ async def show_statistics( update: Update, context: CallbackContext):
 
 # Getting info about lesson.*
 async def format_progress( user_id, course_id):
-    """Getting info about lesson."""
+    """Getting info about lesson - по маске сданных уроков, без сканов homeworks."""
     db = DatabaseConnection()
     conn = db.get_connection()
     cursor = db.get_cursor()
@@ -2809,7 +2943,7 @@ async def format_progress( user_id, course_id):
     # Get progress of course
     cursor.execute(
         """
-        SELECT progress
+        SELECT progress, submitted_mask
         FROM user_courses
         WHERE user_id = ? AND course_id = ?
     """,
@@ -2821,68 +2955,12 @@ async def format_progress( user_id, course_id):
     if not progress_data:
         return "No Progress"
 
-    progress = progress_data[0] if progress_data else 0
-
-
-    # Get total amount
-    cursor.execute(
-        """
-        SELECT DISTINCT lesson FROM homeworks
-        WHERE course_id = ?
-        ORDER BY lesson ASC
-    """,
-        (course_id,),
-    )
-    lessons_available = [row[0] for row in cursor.fetchall()]
-    lessons_available = [x for x in lessons_available if isinstance(x, int)]  # Remove from list
-    lessons_available.sort()
-
-    # Find what lesson was
-    lessons_completed = []
-    cursor.execute(
-        """
-        SELECT DISTINCT lesson FROM homeworks
-        WHERE course_id = ? and user_id = ?
-        ORDER BY lesson ASC
-    """,
-        (
-            course_id,
-            user_id,
-        ),
-    )
-    lessons_completed = [row[0] for row in cursor.fetchall()]
-    lessons_completed = [x for x in lessons_completed if isinstance(x, int)]  # Remove from list
-    lessons_completed.sort()
-
-    # Make report
-    skipped_lessons = sorted(list(set(lessons_available) - set(lessons_completed)))
-
-    # Make short log
-    skipped_ranges = []
-    start = None
-    end = None
-
-    for i in range(len(skipped_lessons)):
-        if start is None:
-            start = skipped_lessons[i]
-            end = skipped_lessons[i]
-        elif skipped_lessons[i] == end + 1:
-            end = skipped_lessons[i]
-        else:
-            if start == end:
-                skipped_ranges.append(str(start))
-            else:
-                skipped_ranges.append(f"{start}..{end}")
-            start = skipped_lessons[i]
-            end = skipped_lessons[i]
-
-    if start is not None:
-        if start == end:
-            skipped_ranges.append(str(start))
-        else:
-            skipped_ranges.append(f"{start}..{end}")
+    progress, submitted_mask = progress_data
+    progress = progress or 0
 
-    skipped_text = f'({", ".join(skipped_ranges)} - skipped)' if skipped_ranges else ""
+    # Пропущенные - уроки до текущего, по которым домашка не сдавалась
+    skipped_ranges = format_ranges(missing_lessons(submitted_mask, progress))
+    skipped_text = f'({skipped_ranges} - skipped)' if skipped_ranges else ""
     # Return full value
     return f"Lesson {progress} {skipped_text}"
 
@@ -2890,24 +2968,13 @@ async def format_progress( user_id, course_id):
 # "Отображает историю домашних заданий пользователя
 async def hw_history( update: Update, context: CallbackContext):
     """Отображает историю домашних заданий пользователя."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    repo = get_repository()
 
     user_id = update.effective_user.id
     logger.info(f"hw_history  {user_id}")
     try:
-        # Получаем историю домашних заданий пользователя из базы данных
-        cursor.execute(
-            """
-            SELECT course_id, lesson, status, submission_time
-            FROM homeworks
-            WHERE user_id = ?
-            ORDER BY submission_time DESC
-        """,
-            (user_id,),
-        )
-        homeworks_data = cursor.fetchall()
+        # Получаем историю домашних заданий пользователя из репозитория
+        homeworks_data = await repo.list_homeworks(user_id)
 
         if not homeworks_data:
             await safe_reply(update, context, "У вас нет истории домашних заданий.")
@@ -2915,8 +2982,9 @@ async def hw_history( update: Update, context: CallbackContext):
 
         # Формируем текстовое сообщение с историей ДЗ
         message_text = "История ваших домашних заданий:\n"
-        for course_id, lesson, status, submission_time in homeworks_data:
-            message_text += f" Курс: {course_id}, Урок: {lesson}, Статус: {status}, Дата отправки: {submission_time}\n"
+        for hw in homeworks_data:
+            message_text += (f" Курс: {hw['course_id']}, Урок: {hw['lesson']}, Статус: {hw['status']},"
+                             f" Дата отправки: {hw['submission_time']}\n")
 
         # await update.callback_query.message.reply_text(message_text)
         await safe_reply(update, context, message_text)
@@ -3047,36 +3115,49 @@ async def self_approve_homework( update: Update, context: CallbackContext):
     """Обрабатывает самопроверку домашнего задания."""
     db = DatabaseConnection()
     conn = db.get_connection()
-    cursor = db.get_cursor()
 
     user_id = update.effective_user.id
     try:
         # Извлекаем hw_id из текста сообщения
         hw_id = int(context.args[0])
 
-        # Обновляем статус домашнего задания в базе данных
-        cursor.execute(
-            """
-            UPDATE homeworks
-            SET status = 'approved', approval_time = (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
-            WHERE hw_id = ? AND user_id = ?
-        """,
-            (hw_id, user_id),
-        )
-        conn.commit()
+        key = action_key("self_approve_homework", hw_id)
+        if is_processed(conn, key):
+            await update.message.reply_text("Это домашнее задание уже подтверждено.")
+            return
+
+        bonus_amount = bonuses_config.get("homework_bonus", 3)
+
+        def approve(cur):
+            # Обновляем статус и добавляем бонусы токены одной транзакцией с ключом действия
+            cur.execute(
+                """
+                UPDATE homeworks
+                SET status = 'approved', approval_time = (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+                WHERE hw_id = ? AND user_id = ? AND status = 'pending'
+            """,
+                (hw_id, user_id),
+            )
+            if not cur.rowcount:
+                # чужая, несуществующая или уже принятая домашка - откатывает и ключ действия
+                raise LookupError(hw_id)
+            credit_coins(cur, user_id, bonus_amount)
+
+        claimed, _ = await run_once(key, user_id, approve)
+        if not claimed:
+            await update.message.reply_text("Это домашнее задание уже подтверждено.")
+            return
 
         # Отправляем сообщение об успешной самопроверке
         await update.message.reply_text("Домашнее задание подтверждено вами.")
-
-        # и добавляем бонусы токены
-        bonus_amount = bonuses_config.get("homework_bonus", 3)
-        add_coins(user_id, bonus_amount)
         # Отправка подтверждения пользователю
         await context.bot.send_message(chat_id=user_id, text=f"✅ Домашка принята! Вам начислено {bonus_amount} коинов.")
 
     except (IndexError, ValueError):
         # Обрабатываем ошибки, если не удалось извлечь hw_id
         await update.message.reply_text("Неверный формат команды. Используйте /self_approve<hw_id>.")
+    except LookupError:  # после IndexError - он тоже LookupError
+        await update.message.reply_text("Домашнее задание не найдено.")
     except Exception as e:
         # Обрабатываем другие возможные ошибки
         logger.error(f"Ошибка при самопроверке домашнего задания: {e}")
@@ -3126,13 +3207,19 @@ async def handle_approve_payment(update: Update, context: CallbackContext, user_
     """Handles the "Approve Payment" button."""
     db = DatabaseConnection()
     conn = db.get_connection()
-    cursor = db.get_cursor()
 
     # Проверяем, является ли update CallbackQuery
     if update.callback_query:
         query = update.callback_query
         admin_id = update.effective_user.id
 
+        # Повторное нажатие или повторная доставка callback - без повторных уведомлений.
+        # Ключ - сообщение с кнопкой: повторная покупка того же тарифа приходит новым сообщением
+        key = action_key("approve_payment", query.message.chat_id, query.message.message_id)
+        if is_processed(conn, key):
+            await safe_reply(update, context, "Эта оплата уже одобрена.")
+            return
+
         try:
             # Load tariffs from file
             with open(TARIFFS_FILE, "r", encoding="utf-8") as f:
@@ -3147,6 +3234,10 @@ async def handle_approve_payment(update: Update, context: CallbackContext, user_
                 # Add logic for activating the tariff for the user here
                 # This could involve updating the user's subscription status,
                 # adding the user to a course, etc.
+                claimed, _ = await run_once(key, admin_id, lambda cur: None)
+                if not claimed:
+                    await safe_reply(update, context, "Эта оплата уже одобрена.")
+                    return
 
                 await safe_reply(update, context,
                                  f"Оплата тарифа {selected_tariff['title']} для пользователя {user_id} одобрена администратором {admin_id}."
@@ -3318,7 +3409,7 @@ async def show_lesson( update: Update, context: CallbackContext):
             return
 
         active_course_id_full = active_course_data[0]
-        active_course_id = active_course_id_full.split("_")[0]
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
         logger.info(f"active_course_id {active_course_id} +")
 
         # Получаем progress (номер урока) из user_courses
@@ -3345,9 +3436,9 @@ async def show_lesson( update: Update, context: CallbackContext):
         lesson_files = get_lesson_files(user_id, lesson, active_course_id)
         if lesson_files:
             for file_info in lesson_files:
-                file_path = file_info["path"]
-                delay = file_info["delay"]
-                file_type = file_info["type"]
+                file_path = file_info.path
+                delay = file_info.delay
+                file_type = file_info.type
 
                 if delay > 0:
                     logger.info(f"на  {file_path} задержка {delay}  asyncio.sleep ===============================")
@@ -3449,7 +3540,7 @@ async def get_lesson_files(user_id=1, lesson_number=1, active_course_id="feminin
                         delay = delay_value * 3600
                     elif delay_unit in ("min", "m"):
                         delay = delay_value * 60
-                lesson_files.append({"path": file_path, "type": file_type, "delay": delay})
+                lesson_files.append(LessonFile(file_path, file_type, delay))
 
         logger.info(f"33 lesson_files={lesson_files[:2]}")
         return lesson_files
@@ -3478,68 +3569,48 @@ async def send_preliminary_material( update: Update, context: CallbackContext):
             await safe_reply(update, context, "Эта функция работает только через CallbackQuery.")
             return
 
-        # Получаем active_course_id из users
-        cursor.execute("SELECT active_course_id FROM users WHERE user_id = ?", (user_id,))
-        active_course_data = cursor.fetchone()
+        # Курс и прогресс одним запросом
+        cursor.execute(
+            """
+            SELECT u.active_course_id, uc.progress
+            FROM users u
+            LEFT JOIN user_courses uc ON uc.user_id = u.user_id AND uc.course_id = u.active_course_id
+            WHERE u.user_id = ?
+            """,
+            (user_id,),
+        )
+        course_data = cursor.fetchone()
 
-        if not active_course_data or not active_course_data[0]:
+        if not course_data or not course_data[0]:
             await safe_reply(update, context, "Для начала активируйте кодовое слово курса.")
             return
 
-        active_course_id_full = active_course_data[0]
-        active_course_id = active_course_id_full.split("_")[0]
-
-        # Получаем progress (номер урока) из user_courses
-        cursor.execute(
-            "SELECT progress FROM user_courses WHERE user_id = ? AND course_id = ?",
-            (user_id, active_course_id_full),
-        )
-        progress_data = cursor.fetchone()
+        active_course_id_full, lesson = course_data
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
 
-        if not progress_data:
+        if lesson is None:
             await safe_reply(update, context, "Прогресс курса не найден. Пожалуйста, начните курс сначала.")
             return
 
-        lesson = progress_data[0]
         next_lesson = lesson + 1
 
-        # Получаем список предварительных материалов
-        materials = get_preliminary_materials(active_course_id, next_lesson)
+        # Материалы из манифеста; прогретые уходят по file_id альбомами
+        try:
+            sent = await get_preliminary_store().send(context.bot, user_id, active_course_id, next_lesson,
+                                                      f"Предварительный материал к уроку {next_lesson}")
+        except FileNotFoundError as e:
+            logger.error(f"Файл не найден: {e.filename}")
+            await safe_reply(update, context, f"Файл {os.path.basename(e.filename or '')} не найден.")
+            return
+        except TelegramError as e:
+            logger.error(f"Ошибка при отправке предварительных материалов: {e}")
+            await safe_reply(update, context, "Произошла ошибка при отправке предварительных материалов.")
+            return
 
-        if not materials:
+        if not sent:
             await safe_reply(update, context, "Предварительные материалы для следующего урока отсутствуют.")
             return
 
-        # Отправляем материалы
-        for material_file in materials:
-            material_path = f"courses/{active_course_id}/{material_file}"
-
-            try:
-                with open(material_path, "rb") as file:
-                    if material_file.endswith((".jpg", ".jpeg", ".png", ".gif")):
-                        await context.bot.send_photo(chat_id=user_id, photo=file,
-                                                     caption=f"Предварительный материал к уроку {next_lesson}")
-                    elif material_file.endswith((".mp4", ".avi", ".mov")):
-                        await context.bot.send_video(chat_id=user_id, video=file,
-                                                     caption=f"Предварительный материал к уроку {next_lesson}")
-                    elif material_file.endswith((".mp3", ".wav", ".ogg")):
-                        await context.bot.send_audio(chat_id=user_id, audio=file,
-                                                     caption=f"Предварительный материал к уроку {next_lesson}")
-                    else:
-                        await context.bot.send_document(chat_id=user_id, document=file,
-                                                        caption=f"Предварительный материал к уроку {next_lesson}")
-
-            except FileNotFoundError:
-                logger.error(f"Файл не найден: {material_path}")
-                await safe_reply(update, context, f"Файл {material_file} не найден.")
-            except TelegramError as e:
-                logger.error(f"Ошибка при отправке файла {material_file}: {e}")
-                await safe_reply(update, context, f"Произошла ошибка при отправке файла {material_file}.")
-            except Exception as e:
-                logger.error(f"Неожиданная ошибка при отправке файла {material_file}: {e}")
-                await safe_reply(update, context,
-                                 f"Произошла непредвиденная ошибка при отправке файла {material_file}.")
-
         await safe_reply(update, context, "Все предварительные материалы для следующего урока отправлены.")
         logger.info(' 227 Все предварительные материалы для следующего урока отправлены.')
 
@@ -3689,17 +3760,6 @@ async def handle_buy_tariff(update: Update, context: CallbackContext, tariff_id:
         await safe_reply(update, context, "Произошла непредвиденная ошибка при обработке покупки. Попробуйте позже.")
 
 
-async def get_gallery_count(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
-    """ Считает количество работ в галерее (реализация зависит от способа хранения галереи). """
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
-    cursor.execute('SELECT COUNT(*) FROM homeworks WHERE status = "approved"')
-    logger.info(f"get_gallery_count -------------<")
-    return cursor.fetchone()[0]
-
-
 # галерея
 async def show_gallery( update: Update, context: CallbackContext):
     db = DatabaseConnection()
@@ -3831,21 +3891,15 @@ async def get_random_homework(update: Update, context: CallbackContext):
             return
 
         # 2. Get a random homework submission for the course, with images.
-        cursor.execute(
-            """
-            SELECT hw_id,file_id,file_type  -- Only the file_id and hw_id, file_type are necessary
-            FROM homeworks
-            WHERE course_id = ? AND file_type in ('photo','document')
-            ORDER BY RANDOM()
-            LIMIT 1
-            """,
-            (course_id,),
+        # Принятые работы старше ARCHIVE_AFTER_DAYS лежат в месячных архивах - выбираем из всех слоёв:
+        # кэшируются только счётчики слоёв, читается одна строка
+        work = await get_analytics().fetch_random_tiered(
+            "homeworks", ["hw_id", "file_id", "file_type"], "course_id = ? AND file_type in ('photo','document')",
+            (course_id,), ttl=STATS_CACHE_TTL,
         )
 
-        homework = cursor.fetchone()
-
-        if homework:
-            hw_id, file_id, file_type = homework  # Unpack the values
+        if work:
+            hw_id, file_id, file_type = work
             logger.info(f"file_id={file_id}  and hw_id {hw_id}")
 
             # Send the file
@@ -3913,14 +3967,15 @@ async def button_handler(update: Update, context: CallbackContext):
         if str(user_id) in ADMIN_IDS:
             if data.startswith("approve_payment_"):
                 logger.info(f" 1560 approve_payment_ ")
-                payment_id = data.split("_")[-1]
-                await handle_approve_payment(update, context, payment_id)
+                # approve_payment_{user_id}_{tariff_id}, в tariff_id тоже бывает "_"
+                _, _, payment_user_id, tariff_id = data.split("_", 3)
+                await handle_approve_payment(update, context, payment_user_id, tariff_id)
                 return
 
             elif data.startswith("decline_payment_"):
                 logger.info(f" 1561 decline_payment_ ")
-                payment_id = data.split("_")[-1]
-                await handle_decline_payment(update, context, payment_id)
+                _, _, payment_user_id, tariff_id = data.split("_", 3)
+                await handle_decline_payment(update, context, payment_user_id, tariff_id)
                 return
 
             elif data.startswith("approve_homework_"):
@@ -4241,26 +4296,12 @@ async def handle_text_message(update: Update, context: CallbackContext):
             logger.info("Ignoring message as user is waiting for code.")
             return  # Ignore message if waiting for code word
 
-        # Handle specific commands
-        if "предварительные" in text or "пм" in text:
-            await send_preliminary_material(update, context)
-            return
-
-        if "текущий урок" in text or "ту" in text:
-            await get_current_lesson(update, context)
-            return
-
-        if "галерея дз" in text or "гдз" in text:
-            await show_gallery(update, context)
-            return
-
-        if "тарифы" in text or "тб" in text:
-            logger.info("Showing tariffs.")
-            await show_tariffs(update, context)
-            return
-
-        if "поддержка" in text or "пд" in text:
-            await start_support_request(update, context)  # Call function to start support request
+        # Handle specific commands - намерение ищем по целым словам (таблица INTENTS в intent_matcher)
+        intent = INTENT_MATCHER.match(text)
+        handler = TEXT_INTENT_HANDLERS.get(intent)
+        if handler:
+            logger.info(f"Intent {intent} for user {user_id}")
+            await handler(update, context)
             return
 
         # Unknown command
@@ -4283,6 +4324,16 @@ async def start_support_request( update: Update,  context: CallbackContext):
     return WAIT_FOR_SUPPORT_TEXT
 
 
+# намерение из intent_matcher.INTENTS -> обработчик текстового сообщения
+TEXT_INTENT_HANDLERS = {
+    "preliminary": send_preliminary_material,
+    "current_lesson": get_current_lesson,
+    "gallery": show_gallery,
+    "tariffs": show_tariffs,
+    "support": start_support_request,
+}
+
+
 # Отправляет запрос в поддержку администратору. *
 async def get_support_text( update: Update, context: CallbackContext):
     """Gets the support request text and sends it to the admin."""
@@ -4320,19 +4371,21 @@ async def get_support_text( update: Update, context: CallbackContext):
 
 async def send_support_request_to_admin( update: Update,  context: CallbackContext):
     """Sends the support request to the administrator."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
     user_id = update.effective_user.id
     support_text = context.user_data.get("support_text", "No text provided")
     support_photo = context.user_data.get("support_photo")
     logger.info(
         f"Sending support request to admin from user {user_id}: Text='{support_text[:50]}...', Photo={support_photo}")
 
+    def save_ticket(cur):
+        # обращение сохраняется для /search, счётчик - как раньше
+        cur.execute("UPDATE users SET support_requests = support_requests + 1 WHERE user_id = ?", (user_id,))
+        return add_support_ticket(cur, user_id, context.user_data.get("support_text"), support_photo, now_epoch())
+
     try:
+        ticket_id = await get_writer().submit(save_ticket)
         # Construct message for the admin
-        caption = f"Новый запрос в поддержку!\nUser ID: {user_id}\nТекст: {support_text}"
+        caption = f"Новый запрос в поддержку #{ticket_id}!\nUser ID: {user_id}\nТекст: {support_text}"
 
         # Send message to the administrator
         if support_photo:
@@ -4340,13 +4393,6 @@ async def send_support_request_to_admin( update: Update,  context: CallbackConte
         else:
             await context.bot.send_message(chat_id=ADMIN_GROUP_ID, text=caption)
 
-        # Increase the support request counter
-        cursor.execute(
-            "UPDATE users SET support_requests = support_requests + 1 WHERE user_id = ?",
-            (user_id,),
-        )
-        conn.commit()
-
         await safe_reply(update, context, "Ваш запрос в поддержку отправлен. Ожидайте ответа.")
 
     except Exception as e:
@@ -4369,7 +4415,7 @@ async def add_tokens( user_id: int, amount: int, reason: str, update: Update, co
             # Получаем информацию о пользователе (дата рождения, дата регистрации, количество рефералов)
             cursor.execute(
                 """
-                SELECT birthday, registration_date, referral_count FROM users WHERE user_id = ?
+                SELECT birthday_md, registration_date, referral_count FROM users WHERE user_id = ?
             """,
                 (user_id,),
             )
@@ -4380,10 +4426,7 @@ async def add_tokens( user_id: int, amount: int, reason: str, update: Update, co
                 await safe_reply(update, context, "Пользователь не найден.")  # reply to admin
                 return  # Прерываем выполнение, если пользователь не найден
 
-            birthday_str, registration_date_str, referral_count = user_data
-            birthday = (
-                datetime.strptime(birthday_str, "%Y-%m-%d").date() if birthday_str else None
-            )
+            birthday_md, registration_date_str, referral_count = user_data
             registration_date = (
                 datetime.strptime(registration_date_str, "%Y-%m-%d").date()
                 if registration_date_str
@@ -4404,7 +4447,7 @@ async def add_tokens( user_id: int, amount: int, reason: str, update: Update, co
 
             # Бонус на день рождения (если указана дата рождения)
             birthday_bonus_amount = bonuses_config.get("birthday_bonus", 5)
-            if birthday and birthday.month == today.month and birthday.day == today.day:
+            if birthday_md == month_day(today):
                 amount += birthday_bonus_amount
                 reason += f" + Бонус на день рождения ({birthday_bonus_amount})"
                 logger.info(f"Начислен бонус на день рождения пользователю {user_id}")
@@ -4539,7 +4582,7 @@ def maybe_add_ad(message_list):
 #
 #         active_course_id_full = active_course_data[0]
 #         # Обрезаем название курса до первого символа "_"
-#         active_course_id = active_course_id_full.split("_")[0]
+#         active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
 #         logger.info(f"active_course_id {active_course_id} +")
 #
 #         # Получаем progress (номер урока) из user_courses
@@ -4668,7 +4711,7 @@ def get_balance_info( user_id: int):
     trust_credit = credit_data[0] if credit_data else 0
 
     #  Set monthly_trust_increase
-    monthly_trust_increase = 2
+    monthly_trust_increase = MONTHLY_TRUST_INCREASE
 
     return tokens, trust_credit, monthly_trust_increase
 
@@ -4953,13 +4996,12 @@ async def approve_homework(update: Update, context: CallbackContext):
     """Обрабатывает одобрение домашнего задания администратором."""
     query = update.callback_query
     logger.info(f"\n 663  approve_homework query: {query.data}")
-    await query.answer()  # Отправляем подтверждение
-    logger.info(f" 6633 после    await query.answer()")
 
     # Разбираем callback_data
     data = query.data.split('|')  # Формат: "approve_admin_check|{user_id}|{course_id}|{lesson}"
     logger.info(f" 66333 {data=}")
     if len(data) != 4:
+        await query.answer()
         await query.edit_message_text("Ошибка: некорректные данные.")
         return
 
@@ -4973,26 +5015,54 @@ async def approve_homework(update: Update, context: CallbackContext):
     cursor = db.get_cursor()
 
     try:
-        # Получаем текущее время
-        approval_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # Обновляем статус домашнего задания на "approved"
+        # Ключ действия - последняя сдача этого урока
         cursor.execute(
             """
-            UPDATE homeworks
-            SET status = 'approved',
-                approval_time = ?,
-                final_approval_time = ?
-            WHERE user_id = ? AND lesson = ? AND course_id = ? AND status = 'pending'
+            SELECT hw_id FROM homeworks
+            WHERE user_id = ? AND course_id = ? AND lesson = ?
+            ORDER BY hw_id DESC LIMIT 1
             """,
-            (approval_time, approval_time, user_id_to_approve, lesson, course_id),
+            (user_id_to_approve, course_id, lesson),
         )
-        conn.commit()
-        logger.info(f" 663333  {cursor.rowcount=}")
+        row = cursor.fetchone()
+        key = action_key("approve_homework", row[0] if row else f"{user_id_to_approve}:{course_id}:{lesson}")
+        if is_processed(conn, key):
+            # двойное нажатие или повторная доставка callback - ни записи, ни уведомлений
+            await query.answer("Уже обработано")
+            return
+        await query.answer()  # Отправляем подтверждение
+        logger.info(f" 6633 после    await query.answer()")
+
+        # Получаем текущее время
+        approval_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        bonus_amount = bonuses_config.get("homework_bonus", 3)
+
+        def approve(cur):
+            # Статус, коины и ключ действия - одной транзакцией
+            cur.execute(
+                """
+                UPDATE homeworks
+                SET status = 'approved',
+                    approval_time = ?,
+                    final_approval_time = ?
+                WHERE user_id = ? AND lesson = ? AND course_id = ? AND status = 'pending'
+                """,
+                (approval_time, approval_time, user_id_to_approve, lesson, course_id),
+            )
+            if not cur.rowcount:
+                raise LookupError(key)  # нечего принимать - откатывает и ключ, настоящее одобрение пройдёт позже
+            credit_coins(cur, user_id_to_approve, bonus_amount)
+            return cur.rowcount
+
+        try:
+            claimed, updated = await run_once(key, update.effective_user.id, approve)
+        except LookupError:
+            claimed, updated = True, 0
+        logger.info(f" 663333  {claimed=} {updated=}")
         # Проверяем успешность обновления
-        if cursor.rowcount == 0:
+        if not claimed or not updated:
             await query.edit_message_text("Не удалось обновить статус задания или задание уже было принято.")
-            logger.info(f" 6633332221   cursor.rowcount == 0 ")
+            logger.info(f" 6633332221   задание не обновлено ")
             return
 
             # У админа - редактируем сообщение, чтобы убрать кнопки
@@ -5002,9 +5072,7 @@ async def approve_homework(update: Update, context: CallbackContext):
         await context.bot.send_message(chat_id=user_id_to_approve, text=f"Домашнее задание по уроку {lesson} принято!")
         await query.edit_message_text("Домашнее задание подтверждено администратором.")
 
-        # Начисляем коины
-        bonus_amount = bonuses_config.get("homework_bonus", 3)
-        add_coins(user_id_to_approve, bonus_amount)
+        # Коины начислены вместе со статусом
         await context.bot.send_message(
             chat_id=user_id_to_approve,
             text=f"✅ Домашка принята! Вам начислено {bonus_amount} коинов.",
@@ -5299,32 +5367,40 @@ async def show_token_balance( update: Update, context: CallbackContext):
 
 @handle_telegram_errors
 async def buy_lootbox( update: Update, context: CallbackContext):
-    """Обрабатывает покупку лутбокса."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
+    """Обрабатывает покупку лутбокса: /buy_lootbox light [количество]."""
     user_id = update.effective_user.id
 
     try:
         # Проверяем тип лутбокса
         box_type = context.args[0].lower()  # Например, 'light' или 'full'
+        count = int(context.args[1]) if len(context.args) > 1 else 1
+        engine = get_lootbox_engine()
+        if not engine.has_box(box_type):
+            await update.message.reply_text(f"Лутбокс '{box_type}' недоступен. Есть: {', '.join(engine.box_types())}")
+            return
+        if not 1 <= count <= LOOTBOX_MAX_BATCH:
+            await update.message.reply_text(f"Можно открыть от 1 до {LOOTBOX_MAX_BATCH} лутбоксов за раз.")
+            return
 
         # Стоимость лутбокса
         cost = 1 if box_type == "light" else 3
 
-        # Списываем жетоны
-        spend_tokens(user_id, cost, f"purchase_{box_type}_lootbox")
+        # Списываем жетоны за все лутбоксы одной транзакцией
+        spend_tokens(user_id, cost * count, f"purchase_{box_type}_lootbox" + (f" x{count}" if count > 1 else ""))
 
-        # Получаем награду
-        reward = roll_lootbox(conn, box_type)
+        # Получаем награды
+        rewards = get_lootbox_engine().roll_many(box_type, count)
 
         # Отправляем сообщение с результатом
-        await update.message.reply_text(f"Вы открыли лутбокс '{box_type}' и получили: {reward}")
-        logger.info(f"Пользователь {user_id} купил лутбокс '{box_type}' и получил: {reward}")
+        if count == 1:
+            await update.message.reply_text(f"Вы открыли лутбокс '{box_type}' и получили: {rewards[0]}")
+        else:
+            summary = ", ".join(f"{reward} x{rewards.count(reward)}" for reward in dict.fromkeys(rewards))
+            await update.message.reply_text(f"Вы открыли {count} лутбоксов '{box_type}' и получили: {summary}")
+        logger.info(f"Пользователь {user_id} купил {count} лутбоксов '{box_type}' и получил: {rewards}")
 
     except IndexError:
-        await update.message.reply_text("Использование: /buy_lootbox [light/full]")
+        await update.message.reply_text("Использование: /buy_lootbox [light/full] [количество]")
     except ValueError as e:
         await update.message.reply_text(str(e))
     except sqlite3.Error as e:
@@ -5334,50 +5410,24 @@ async def buy_lootbox( update: Update, context: CallbackContext):
         logger.error(f"Необработанная ошибка при покупке лутбокса пользователем {user_id}: {e}")
         await update.message.reply_text("Произошла необработанная ошибка. Попробуйте позже.")
 
-@handle_telegram_errors
 def roll_lootbox(conn: sqlite3.Connection, box_type: str):
-    """Определяет награду из лутбокса."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
+    """Определяет награду из лутбокса (таблица алиасов, O(1))."""
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT reward, probability FROM lootboxes WHERE box_type = ?", (box_type,))
-        rewards = cursor.fetchall()
-
-        # Генерируем случайное число
-        rand = random.random()
-
-        cumulative_probability = 0.0
-        for reward, probability in rewards:
-            cumulative_probability += probability
-            if rand <= cumulative_probability:
-                logger.info(f"Выпала награда {reward} из лутбокса {box_type}")
-                return reward
-        return "ничего"  # Если ничего не выпало
+        reward = get_lootbox_engine().roll(box_type)
+        logger.info(f"Выпала награда {reward} из лутбокса {box_type}")
+        return reward
     except sqlite3.Error as e:
         logger.error(f"Ошибка при определении награды из лутбокса {box_type}: {e}")
         return "ошибка"
 
 @handle_telegram_errors
 async def reminders( update: Update, context: CallbackContext):
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    repo = get_repository()
 
     user_id = update.effective_user.id
-    cursor.execute(
-        "SELECT morning_notification, evening_notification FROM user_settings WHERE user_id = ?",
-        (user_id,),
-    )
-    settings = cursor.fetchone()
-    if not settings:
-        cursor.execute("INSERT INTO user_settings (user_id) VALUES (?)", (user_id,))
-        conn.commit()
-        settings = (None, None)
-
-    morning, evening = settings
+    settings = await repo.get_settings(user_id) or {}
+    morning = settings.get("morning_notification")
+    evening = settings.get("evening_notification")
     text = "⏰ Настройка напоминаний:\n"
     text += f"🌅 Утреннее напоминание: {morning or 'не установлено'}\n"
     text += f"🌇 Вечернее напоминание: {evening or 'не установлено'}\n\n"
@@ -5392,24 +5442,14 @@ async def reminders( update: Update, context: CallbackContext):
 @handle_telegram_errors
 async def set_morning( update: Update, context: CallbackContext):
     """Устанавливает утреннее напоминание."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    repo = get_repository()
 
     user_id = update.effective_user.id
     try:
         time1 = context.args[0]
         if not re.match(r"^\d{2}:\d{2}$", time1):
             raise ValueError
-        cursor.execute(
-            """
-            UPDATE user_settings
-            SET morning_notification = ?
-            WHERE user_id = ?
-        """,
-            (time1, user_id),
-        )
-        conn.commit()
+        await repo.set_notification(user_id, "morning", time1)
         # Проверяем, откуда пришел запрос (сообщение или callback query)
         if update.message:
             await update.message.reply_text(f"Утреннее напоминание установлено на {time1}.")
@@ -5429,21 +5469,12 @@ async def set_morning( update: Update, context: CallbackContext):
 
 async def disable_reminders( update: Update, context: CallbackContext):
     """Отключает все напоминания."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    repo = get_repository()
 
     user_id = update.effective_user.id
     logger.info(f"disable_reminders ")
-    cursor.execute(
-        """
-        UPDATE user_settings
-        SET morning_notification = NULL, evening_notification = NULL
-        WHERE user_id = ?
-        """,
-        (user_id,),
-    )
-    conn.commit()
+    await repo.set_notification(user_id, "morning", None)
+    await repo.set_notification(user_id, "evening", None)
     # Проверяем, откуда пришел запрос (сообщение или callback query)
     if update.message:
         await update.message.reply_text("Напоминания отключены.")
@@ -5499,30 +5530,32 @@ def add_user_to_scheduler( user_id: int, time2: datetime,  context: CallbackCont
 
 
 async def stats( update: Update, context: CallbackContext):
-    # Активные пользователи за последние 3 дня
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-
-    active_users = cursor.execute(
-        """
-        SELECT COUNT(DISTINCT user_id) 
-        FROM homeworks 
-        WHERE submission_time >= DATETIME('now', '-3 days')
-    """
-    ).fetchone()[0]
+    # Все три счётчика считаем на одном снимке read-only пула
+    analytics = get_analytics()
+    try:
+        active_users, recent_homeworks, total_users = [
+            rows[0][0] for rows in await analytics.fetch_snapshot([
+                # Активные пользователи за последние 3 дня
+                ("""
+                SELECT COUNT(DISTINCT user_id)
+                FROM homeworks
+                WHERE submitted_at >= ?
+                """, (now_epoch() - 3 * 86400,)),
+                # Домашние задания за последние сутки
+                ("""
+                SELECT COUNT(*)
+                FROM homeworks
+                WHERE submitted_at >= ?
+                """, (now_epoch() - 86400,)),
+                # Общее количество пользователей
+                ("SELECT COUNT(*) FROM users", ()),
+            ], ttl=STATS_CACHE_TTL)
+        ]
+    except (sqlite3.Error, AnalyticsTimeoutError) as e:
+        logger.error(f"stats: ошибка отчёта {e}")
+        await update.message.reply_text("Не удалось получить статистику, попробуйте позже.")
+        return
     logger.info(f"statsactive_users={active_users} uuuserzz ")
-    # Домашние задания за последние сутки
-    recent_homeworks = cursor.execute(
-        """
-        SELECT COUNT(*) 
-        FROM homeworks 
-        WHERE submission_time >= DATETIME('now', '-1 day')
-    """
-    ).fetchone()[0]
-
-    # Общее количество пользователей
-    total_users = cursor.execute("SELECT COUNT(*) FROM users").fetchone()[0]
 
     text = "📊 Статистика:\n"
     text += f"👥 Активных пользователей за последние 3 дня: {active_users}\n"
@@ -5533,19 +5566,13 @@ async def stats( update: Update, context: CallbackContext):
 
 
 async def set_evening( update: Update, context: CallbackContext):
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    repo = get_repository()
     user_id = update.effective_user.id
     try:
         time = context.args[0]
         if not re.match(r"^\d{2}:\d{2}$", time):
             raise ValueError
-        cursor.execute(
-            "UPDATE user_settings SET evening_notification = ? WHERE user_id = ?",
-            (time, user_id),
-        )
-        conn.commit()
+        await repo.set_notification(user_id, "evening", time)
         await update.message.reply_text(f"🌇 Вечернее напоминание установлено на {time}.")
     except (IndexError, ValueError):
         await update.message.reply_text("Неверный формат времени. Используйте формат HH:MM.")
@@ -5609,14 +5636,29 @@ async def send_file(user_id: int, file_path: str, file_type: str, delay: int, de
         logger.error(f"Ошибка при отправке файла {file_path}: {e}")
         await context.bot.send_message(chat_id=user_id, text="Произошла ошибка при отправке файла. Пожалуйста, обратитесь в поддержку.")
 
-# Добавляем новую функцию для отправки нового файла и сохранения file_id в базе данных
-async def send_as_new_file(bot, chat_id: int, course_id: str, lesson_number: int, file_path: str, file_name: str):
-    """Отправляет файл как новый, получает его file_id и сохраняет в базе данных."""
+# 25-03 решили заапдейтить
+async def old_send_file(bot, chat_id, file_path, file_name):
+    """
+    Отправляет файл пользователю с улучшенной обработкой ошибок и подробным логированием.
+
+    Args:
+        bot: Объект бота Telegram.
+        chat_id: ID чата, куда нужно отправить файл.
+        file_path: Путь к файлу.
+        file_name: Имя файла (для отправки как документа).
+    """
     db = DatabaseConnection()
     conn = db.get_connection()
     cursor = db.get_cursor()
-    logger.info(f"267 send_as_new_file Начинаем отправку файла: {file_name} ({file_path}) в чат {chat_id}")
+    logger.info(f"224 send_file Начинаем отправку файла: {file_name} ({file_path}) в чат {chat_id}")
+
     try:
+        # Проверяем, существует ли файл
+        if not os.path.exists(file_path):
+            logger.error(f"Файл не найден: {file_path}")
+            await bot.send_message(chat_id=chat_id, text="Файл не найден. Пожалуйста, обратитесь в поддержку.")
+            return  # Важно: выходим из функции, если файл не найден
+
         # Определяем MIME-тип файла
         mime_type = mimetypes.guess_type(file_path)[0]
         if not mime_type:
@@ -5631,88 +5673,13 @@ async def send_as_new_file(bot, chat_id: int, course_id: str, lesson_number: int
             # Отправляем файл в зависимости от MIME-типа
             if mime_type.startswith('image/'):
                 logger.info(f"Отправляем файл как изображение.")
-                msg = await bot.send_photo(chat_id=chat_id, photo=file)
+                await bot.send_photo(chat_id=chat_id, photo=file)
             elif mime_type.startswith('video/'):
                 logger.info(f"Отправляем файл как видео.")
-                msg = await bot.send_video(chat_id=chat_id, video=file)
+                await bot.send_video(chat_id=chat_id, video=file)
             elif mime_type.startswith('audio/'):
                 logger.info(f"Отправляем файл как аудио.")
-                msg = await bot.send_audio(chat_id=chat_id, audio=file)
-            else:
-                logger.info(f"Отправляем файл как документ.")
-                msg = await bot.send_document(chat_id=chat_id, document=file, filename=file_name)
-        # Сохраняем file_id в базу данных
-        file_id = msg.document.file_id if msg.document else msg.photo[
-            -1].file_id if msg.photo else msg.video.file_id if msg.video else msg.audio.file_id if msg.audio else None  # Берем нужный file_id
-        if file_id:
-            logger.info(f"Получен file_id: {file_id}")
-            cursor.execute(
-                """
-                UPDATE lessons
-                SET video_file_id = ?
-                WHERE course_id = ? AND lesson = ?
-                """,
-                (file_id, course_id, lesson_number),
-            )
-            conn.commit()
-            logger.info(f"File_id {file_id} сохранен в базе данных для файла {file_name}.")
-        else:
-            logger.error(f"Не удалось получить file_id для {file_name}!")
-
-    except Exception as e:
-        # Обрабатываем любые исключения, которые могут возникнуть
-        logger.exception(
-            f"Ошибка при отправке файла {file_name} в чат {chat_id}: {e}")  # Используем logger.exception для трассировки стека
-        await bot.send_message(
-            chat_id=chat_id,
-            text="Произошла ошибка при отправке файла. Пожалуйста, попробуйте позже или обратитесь в поддержку."
-        )
-
-
-# 25-03 решили заапдейтить
-async def old_send_file(bot, chat_id, file_path, file_name):
-    """
-    Отправляет файл пользователю с улучшенной обработкой ошибок и подробным логированием.
-
-    Args:
-        bot: Объект бота Telegram.
-        chat_id: ID чата, куда нужно отправить файл.
-        file_path: Путь к файлу.
-        file_name: Имя файла (для отправки как документа).
-    """
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-    logger.info(f"224 send_file Начинаем отправку файла: {file_name} ({file_path}) в чат {chat_id}")
-
-    try:
-        # Проверяем, существует ли файл
-        if not os.path.exists(file_path):
-            logger.error(f"Файл не найден: {file_path}")
-            await bot.send_message(chat_id=chat_id, text="Файл не найден. Пожалуйста, обратитесь в поддержку.")
-            return  # Важно: выходим из функции, если файл не найден
-
-        # Определяем MIME-тип файла
-        mime_type = mimetypes.guess_type(file_path)[0]
-        if not mime_type:
-            logger.warning(
-                f"Не удалось определить MIME-тип для файла: {file_path}. Используем 'application/octet-stream'.")
-            mime_type = 'application/octet-stream'
-
-        logger.info(f"Определен MIME-тип файла: {mime_type}")
-
-        # Открываем файл для чтения в бинарном режиме
-        with open(file_path, "rb") as file:
-            # Отправляем файл в зависимости от MIME-типа
-            if mime_type.startswith('image/'):
-                logger.info(f"Отправляем файл как изображение.")
-                await bot.send_photo(chat_id=chat_id, photo=file)
-            elif mime_type.startswith('video/'):
-                logger.info(f"Отправляем файл как видео.")
-                await bot.send_video(chat_id=chat_id, video=file)
-            elif mime_type.startswith('audio/'):
-                logger.info(f"Отправляем файл как аудио.")
-                await bot.send_audio(chat_id=chat_id, audio=file)
+                await bot.send_audio(chat_id=chat_id, audio=file)
             else:
                 logger.info(f"Отправляем файл как документ.")
                 await bot.send_document(chat_id=chat_id, document=file, filename=file_name)
@@ -5766,7 +5733,7 @@ async def get_lesson_after_code(update: Update, context: CallbackContext, course
     progress_data = cursor.fetchone()
 
     lesson_number = 1 if not progress_data else progress_data[0]
-    await process_lesson(user.id, lesson_number, active_course_id_full.split("_")[0], context)
+    await process_lesson(user.id, lesson_number, COURSE_CATALOG.base_course_id(active_course_id_full), context)
 
 
 #  Qwen 15  Замена send_lesson_by_timer
@@ -5815,7 +5782,7 @@ async def send_lesson_by_timer( user_id: int, context: CallbackContext):
     conn.commit()
 
     # Process the lesson
-    await process_lesson(user_id, lesson, active_course_id_full.split("_")[0], context)
+    await process_lesson(user_id, lesson, COURSE_CATALOG.base_course_id(active_course_id_full), context)
 
 
 async def show_homework( update: Update, context: CallbackContext):
@@ -5834,16 +5801,10 @@ async def show_homework( update: Update, context: CallbackContext):
 # Функция для получения предварительных материалов строго ненадо
 def get_preliminary_materials(course_id, lesson):
     """
-    Возвращает список всех предварительных материалов для урока.
+    Возвращает список всех предварительных материалов для урока (имена файлов, p1, p2, ...).
+    Берётся из манифеста, собранного на старте, - без чтения папки курса.
     """
-    lesson_dir = f"courses/{course_id}/"
-    materials = []
-    logger.info(f"553 get_preliminary_materials {lesson_dir=} ")
-    for filename in os.listdir(lesson_dir):
-        if filename.startswith(f"lesson{lesson}_p") and os.path.isfile(os.path.join(lesson_dir, filename)):
-            materials.append(filename)
-    materials.sort()  # Сортируем по порядку (p1, p2, ...)
-    return materials
+    return [os.path.basename(material.path) for material in get_preliminary_store().materials(course_id, lesson)]
 
 
 async def check_last_lesson( update: Update, context: CallbackContext):
@@ -5874,33 +5835,23 @@ async def check_last_lesson( update: Update, context: CallbackContext):
             logger.info("17 check_last_lesson: No active course found for user.")
             return None
 
-        active_course_id = active_course_data[0].split("_")[0]
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_data[0])
         logger.info(f"17check_last_lesson: active_course_id='{active_course_id}'")
 
         # Get the number of available lesson files for the course
-        count = 0
-        while True:
-            lesson_paths = [
-                f"courses/{active_course_id}/lesson{count + 1}.md",
-                f"courses/{active_course_id}/lesson{count + 1}.html",
-                f"courses/{active_course_id}/lesson{count + 1}.txt",
-            ]
-            found = any(os.path.exists(path) for path in lesson_paths)
-            if not found:
-                break
-            count += 1
-        logger.warning(f"check_last_lesson: Number of available lessons = {count}")
+        count = lesson_count(active_course_id)
+        logger.info(f"check_last_lesson: Number of available lessons = {count}")
 
-        # Get the user's current progress
+        # Принятые уроки - по маске approved_mask, без сканов homeworks
         cursor.execute(
-            "SELECT progress FROM user_courses WHERE user_id = ? AND course_id LIKE ?",
-            (user_id, f"{active_course_id}%"),
+            "SELECT approved_mask FROM user_courses WHERE user_id = ? AND base_course_id = ?",
+            (user_id, active_course_id),
         )
         progress_data = cursor.fetchone()
-        current_lesson = progress_data[0] if progress_data else 0
+        remaining = remaining_lessons(progress_data[0] if progress_data else None, count)
 
-        # If the current lesson is the last one
-        if current_lesson >= count:
+        # If every lesson is approved
+        if not remaining:
             keyboard = [
                 [
                     InlineKeyboardButton(
@@ -5914,7 +5865,8 @@ async def check_last_lesson( update: Update, context: CallbackContext):
                              reply_markup=reply_markup,
                              )
         else:
-            await safe_reply(update, context, "В этом курсе еще есть уроки. Продолжайте обучение!")
+            await safe_reply(update, context,
+                             f"В этом курсе еще есть уроки (осталось {len(remaining)}: {format_ranges(remaining)}). Продолжайте обучение!")
         # Returns count, so that we know how many lessons there
         return count
 
@@ -5951,7 +5903,7 @@ async def old_send_preliminary_material( update: Update,  context: CallbackConte
 
         active_course_id_full = active_course_data[0]
         # Trim the course name to the first "_"
-        active_course_id = active_course_id_full.split("_")[0]
+        active_course_id = COURSE_CATALOG.base_course_id(active_course_id_full)
 
         # Get progress (lesson number) from user_courses
         cursor.execute(
@@ -6047,19 +5999,24 @@ async def add_preliminary_button( user_id, course_type):
     return None
 
 
-def get_average_homework_time( user_id):
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
-    cursor.execute(
-        """
-        SELECT AVG((JULIANDAY(approval_time) - JULIANDAY(submission_time)) * 24 * 60 * 60)
-        FROM homeworks
-        WHERE user_id = ? AND status = 'approved'
-    """,
-        (user_id,),
+def average_by_user(rows) -> dict:
+    """{user_id: среднее (конец - начало)} по строкам (user_id, конец, начало); NULL-разности не считаются."""
+    totals = {}
+    for user_id, finished, started in rows:
+        if finished is None or started is None:
+            continue
+        total, count = totals.get(user_id, (0, 0))
+        totals[user_id] = (total + finished - started, count + 1)
+    return {user_id: total / count for user_id, (total, count) in totals.items()}
+
+
+async def get_average_homework_time( user_id):
+    # принятые домашки старше ARCHIVE_AFTER_DAYS лежат в архивах ученика
+    rows = await get_analytics().fetch_tiered(
+        "homeworks", ["user_id", "approved_at", "submitted_at"], "user_id = ? AND status = 'approved'", (user_id,),
+        user_id=user_id,
     )
-    result = cursor.fetchone()[0]
+    result = average_by_user(rows).get(user_id)
 
     logger.info(f"{result} - get_average_homework_time")
 
@@ -6247,64 +6204,64 @@ async def gift_tariff( update: Update, context: CallbackContext):
         return ConversationHandler.END
 
 
+def enroll_purchased_course(cursor: sqlite3.Cursor, user_id: int, tariff_id: str) -> str:
+    """Записывает купленный курс в текущей транзакции. Возвращает 'exists', 'no_tariff' или 'added'."""
+    # Check if the course already exists for the user
+    cursor.execute(
+        """
+        SELECT 1 FROM user_courses
+        WHERE user_id = ? AND course_id = ?
+    """,
+        (user_id, tariff_id),
+    )
+    if cursor.fetchone():
+        logger.info(f"add_purchased_course: Course {tariff_id} already exists for user {user_id}.")
+        return "exists"
+
+    # Load tariff data from tariffs.json
+    tariffs = load_tariffs()
+    tariff = next((t for t in tariffs if t["id"] == tariff_id), None)
+    if not tariff:
+        logger.error(f"add_purchased_course: Tariff with id {tariff_id} not found in tariffs.json")
+        return "no_tariff"
+
+    course_type = tariff.get("course_type", "main")  # Get course type from tariff
+    tariff_name = COURSE_CATALOG.tariff(tariff_id)
+
+    # Add the course to user_courses
+    cursor.execute(
+        """
+        INSERT INTO user_courses (user_id, course_id, course_type, progress, tariff)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+        (user_id, tariff_id, course_type, 1, tariff_name),
+    )  # Start with progress = 1
+
+    # Update active_course_id in users
+    cursor.execute(
+        """
+        UPDATE users
+        SET active_course_id = ?
+        WHERE user_id = ?
+    """,
+        (tariff_id, user_id),
+    )
+    logger.info(f"add_purchased_course: Course {tariff_id} added to user {user_id}")
+    return "added"
+
+
 async def add_purchased_course( user_id: int, tariff_id: str,  context: CallbackContext):
     """Adds a purchased course to the user's profile."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
     update = context.update
     logger.info(f"add_purchased_course: User {user_id} attempting to add course {tariff_id}")
     try:
-# Check if the course already exists for the user
-        cursor.execute(
-            """
-            SELECT * FROM user_courses
-            WHERE user_id = ? AND course_id = ?
-        """,
-            (user_id, tariff_id),
-        )
-        existing_course = cursor.fetchone()
-
-        if existing_course:
+        result = await get_writer().submit(lambda cur: enroll_purchased_course(cur, user_id, tariff_id))
+        if result == "exists":
             await safe_reply(update, context, "Этот курс уже есть в вашем профиле.")
-            logger.info(f"add_purchased_course: Course {tariff_id} already exists for user {user_id}.")
-            return  # Course already exists
-
-        # Load tariff data from tariffs.json
-        tariffs = load_tariffs()
-        tariff = next((t for t in tariffs if t["id"] == tariff_id), None)
-
-        if not tariff:
-            logger.error(f"add_purchased_course: Tariff with id {tariff_id} not found in tariffs.json")
+        elif result == "no_tariff":
             await safe_reply(update, context, "Произошла ошибка при добавлении курса. Попробуйте позже.")
-            return  # Tariff not found
-
-        course_type = tariff.get("course_type", "main")  # Get course type from tariff
-        tariff_name = tariff_id.split("_")[1] if len(tariff_id.split("_")) > 1 else "default"
-
-        # Add the course to user_courses
-        cursor.execute(
-            """
-            INSERT INTO user_courses (user_id, course_id, course_type, progress, tariff)
-            VALUES (?, ?, ?, ?, ?)
-        """,
-            (user_id, tariff_id, course_type, 1, tariff_name),
-        )  # Start with progress = 1
-        conn.commit()
-
-        # Update active_course_id in users
-        cursor.execute(
-            """
-            UPDATE users
-            SET active_course_id = ?
-            WHERE user_id = ?
-        """,
-            (tariff_id, user_id),
-        )
-        conn.commit()
-
-        logger.info(f"add_purchased_course: Course {tariff_id} added to user {user_id}")
-        await safe_reply(update, context, "Новый курс был добавлен вам в профиль.")
+        else:
+            await safe_reply(update, context, "Новый курс был добавлен вам в профиль.")
 
     except Exception as e:
         logger.error(f"add_purchased_course: An error occurred for user {user_id}: {e}")
@@ -6313,9 +6270,7 @@ async def add_purchased_course( user_id: int, tariff_id: str,  context: Callback
 
 async def show_stats( update: Update, context: CallbackContext):
     """Показывает статистику для администратора."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    analytics = get_analytics()
 
     admin_id = update.effective_user.id
 
@@ -6325,13 +6280,13 @@ async def show_stats( update: Update, context: CallbackContext):
         return
 
     try:
-        # Получаем общее количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-
-        # Получаем количество активных курсов
-        cursor.execute("SELECT COUNT(DISTINCT course_id) FROM user_courses")
-        total_courses = cursor.fetchone()[0]
+        # Пользователи и активные курсы - одним снимком
+        users_rows, courses_rows = await analytics.fetch_snapshot([
+            ("SELECT COUNT(*) FROM users", ()),
+            ("SELECT COUNT(DISTINCT course_id) FROM user_courses", ()),
+        ], ttl=STATS_CACHE_TTL)
+        total_users = users_rows[0][0]
+        total_courses = courses_rows[0][0]
 
         # Формируем сообщение со статистикой
         stats_message = (
@@ -6349,6 +6304,325 @@ async def show_stats( update: Update, context: CallbackContext):
         await safe_reply(update, context, "Произошла ошибка при получении статистики.")
 
 
+EXPORTS_RUNNING = set()  # (таблица, формат) выгрузок в фоне: у них общий файл и состояние докачки
+
+
+def run_export(table, fmt, since, until):
+    """Выгрузка в отдельном read-only соединении (вызывается из потока)."""
+    conn = sqlite3.connect(f"file:{os.path.abspath(DATABASE_FILE)}?mode=ro", uri=True)
+    apply_profile(conn, read_only=True)
+    try:
+        return export_table(conn, table, default_export_path(table, fmt), fmt, since=since, until=until,
+                            archive_dir=ARCHIVE_DB_DIR)
+    finally:
+        conn.close()
+
+
+async def export_command( update: Update, context: CallbackContext):
+    """/export <таблица> [csv|jsonl] [с YYYY-MM-DD] [по YYYY-MM-DD] - выгрузка в админский чат."""
+    admin_id = update.effective_user.id
+    if str(admin_id) not in ADMIN_IDS:
+        await safe_reply(update, context, "У вас нет прав для выполнения этой команды.")
+        return
+
+    args = context.args or []
+    table = args[0] if args else None
+    fmt = args[1] if len(args) > 1 else "csv"
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+        await safe_reply(update, context,
+                         f"Использование: /export <{'|'.join(EXPORT_TABLES)}> [csv|jsonl] [с YYYY-MM-DD] [по YYYY-MM-DD]")
+        return
+    try:
+        since = datetime.strptime(args[2], "%Y-%m-%d").strftime("%Y-%m-%d %H:%M:%S") if len(args) > 2 else None
+        until = datetime.strptime(args[3], "%Y-%m-%d").strftime("%Y-%m-%d %H:%M:%S") if len(args) > 3 else None
+    except ValueError:
+        await safe_reply(update, context, "Даты укажите в формате YYYY-MM-DD.")
+        return
+
+    if (table, fmt) in EXPORTS_RUNNING:
+        await safe_reply(update, context, f"Выгрузка {table} уже идёт.")
+        return
+    logger.info(f"export_command {admin_id=} {table=} {fmt=} {since=} {until=}")
+    await safe_reply(update, context, f"⏳ Выгружаю {table}, бот продолжает работать...")
+    # выгрузка и отправка частей идут минутами - в фоне, чтобы не держать очередь апдейтов
+    EXPORTS_RUNNING.add((table, fmt))
+    context.application.create_task(export_job(update, context, table, fmt, since, until))
+
+
+async def export_job(update: Update, context: CallbackContext, table, fmt, since, until):
+    """Фоновая часть /export: выгрузка в потоке и отправка частей в группу админов."""
+    try:
+        result = await asyncio.to_thread(run_export, table, fmt, since, until)
+        parts = await asyncio.to_thread(split_file, result.path)
+        for number, part in enumerate(parts, start=1):
+            with open(part, "rb") as file:
+                await context.bot.send_document(
+                    chat_id=ADMIN_GROUP_ID, document=file, filename=os.path.basename(part),
+                    caption=f"{table}: {result.rows} строк, часть {number}/{len(parts)}",
+                )
+            if part != result.path:
+                os.remove(part)
+    except (sqlite3.Error, OSError, TelegramError) as e:
+        logger.error(f"export_job: ошибка выгрузки {table}: {e}")
+        await safe_reply(update, context, "Ошибка при выгрузке, повторный запуск продолжит с места остановки.")
+    finally:
+        EXPORTS_RUNNING.discard((table, fmt))
+
+
+async def db_stats_command( update: Update, context: CallbackContext):
+    """/dbstats - размер базы и WAL, страницы, попадания в page cache."""
+    admin_id = update.effective_user.id
+    if str(admin_id) not in ADMIN_IDS:
+        await safe_reply(update, context, "У вас нет прав для выполнения этой команды.")
+        return
+    db = DatabaseConnection()
+    try:
+        conn = db.get_connection()
+        text = format_db_stats(db_stats(conn, DATABASE_FILE)) + "\n\n" + format_tier_stats(tier_stats(conn))
+        await safe_reply(update, context, text)
+    except sqlite3.Error as e:
+        logger.error(f"db_stats_command: {e}")
+        await safe_reply(update, context, "Не удалось получить состояние базы.")
+
+
+async def run_search(query: str, sources, page: int):
+    """Страница поиска на read-only пуле: (текст, клавиатура листания или None)."""
+    statements = search_statements(query, sources, page)
+    if statements is None:
+        return "Введите слова для поиска.", None
+    hits, total = parse_results(await get_analytics().fetch_snapshot(statements))
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page|{page - 1}"))
+    if (page + 1) * SEARCH_PAGE_SIZE < total:
+        buttons.append(InlineKeyboardButton("Дальше ➡️", callback_data=f"search_page|{page + 1}"))
+    return format_search_results(query, hits, total, page), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def search_command( update: Update, context: CallbackContext):
+    """/search [support|rejections|comments|lessons] <слова> - поиск по обращениям, отказам, комментариям и урокам."""
+    admin_id = update.effective_user.id
+    if str(admin_id) not in ADMIN_IDS:
+        await safe_reply(update, context, "У вас нет прав для выполнения этой команды.")
+        return
+    args = context.args or []
+    sources = None
+    if args and args[0] in SEARCH_SOURCES:
+        sources = [args.pop(0)]
+    query = " ".join(args)
+    if not query:
+        await safe_reply(update, context, f"Использование: /search [{'|'.join(SEARCH_SOURCES)}] <слова>")
+        return
+    # запрос для листания - в user_data: в callback_data (64 байта) он может не поместиться
+    context.user_data["search"] = (query, sources)
+    try:
+        text, markup = await run_search(query, sources, 0)
+    except (sqlite3.Error, AnalyticsTimeoutError) as e:
+        logger.error(f"search_command: {e}")
+        await safe_reply(update, context, "Ошибка поиска.")
+        return
+    await safe_reply(update, context, text, reply_markup=markup)
+
+
+async def search_page_callback(update: Update, context: CallbackContext):
+    """Листание результатов /search."""
+    query = update.callback_query
+    await query.answer()
+    if str(update.effective_user.id) not in ADMIN_IDS or "search" not in context.user_data:
+        return
+    search_query, sources = context.user_data["search"]
+    try:
+        text, markup = await run_search(search_query, sources, int(query.data.split("|")[1]))
+        await query.edit_message_text(text=text, reply_markup=markup)
+    except (sqlite3.Error, AnalyticsTimeoutError, TelegramError) as e:
+        logger.error(f"search_page_callback: {e}")
+
+
+async def net_stats_command( update: Update, context: CallbackContext):
+    """/netstats - нагрузка и задержки пулов Bot API (быстрые вызовы и загрузки)."""
+    admin_id = update.effective_user.id
+    if str(admin_id) not in ADMIN_IDS:
+        await safe_reply(update, context, "У вас нет прав для выполнения этой команды.")
+        return
+    await safe_reply(update, context, format_pool_metrics(get_bot_request()))
+
+
+async def flood_stats_command( update: Update, context: CallbackContext):
+    """/floodstats - сколько update пропущено, склеено и отброшено контролем нагрузки."""
+    admin_id = update.effective_user.id
+    if str(admin_id) not in ADMIN_IDS:
+        await safe_reply(update, context, "У вас нет прав для выполнения этой команды.")
+        return
+    await safe_reply(update, context, format_flood_metrics(get_flood_control().metrics()))
+
+
+def format_duration(seconds: float) -> str:
+    """Секунды -> '2 д 5 ч', '3 ч 10 мин', '15 мин'."""
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    return f"{minutes} мин"
+
+
+async def top_command( update: Update, context: CallbackContext):
+    """/top - топ по жетонам; /top speed - топ по скорости сдачи активного курса. Плюс место ученика."""
+    user_id = update.effective_user.id
+    board = get_leaderboard()
+    db = DatabaseConnection()
+    cursor = db.get_cursor()
+    try:
+        board.refresh()
+        by_speed = bool(context.args) and context.args[0].lower() in ("speed", "скорость")
+
+        def name_of(uid):
+            cursor.execute("SELECT full_name FROM users WHERE user_id = ?", (uid,))
+            row = cursor.fetchone()
+            return row[0] if row and row[0] else f"ID {uid}"
+
+        if by_speed:
+            cursor.execute("SELECT active_course_id FROM users WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+            if not row or not row[0]:
+                await safe_reply(update, context, "Сначала активируйте курс.")
+                return
+            course_id = row[0]
+            top = board.top_speed(course_id)
+            rank, total = board.speed_rank(course_id, user_id)
+            text = f"🏃 Быстрее всех сдают уроки курса {course_id}:\n"
+            text += "\n".join(f"{i}. {name_of(uid)} - {format_duration(avg)}" for i, (uid, avg) in enumerate(top, 1))
+        else:
+            top = board.top_tokens()
+            rank, total = board.token_rank(user_id)
+            text = "🏆 Больше всех антКоинов:\n"
+            text += "\n".join(f"{i}. {name_of(uid)} - {tokens}" for i, (uid, tokens) in enumerate(top, 1))
+        if not top:
+            text += "пока никого нет"
+        text += f"\n\nВаше место: {rank} из {total}" if rank else "\n\nВас пока нет в рейтинге."
+        await safe_reply(update, context, text)
+    except sqlite3.Error as e:
+        logger.error(f"top_command: {e}")
+        await safe_reply(update, context, "Не удалось получить рейтинг.")
+
+
+async def leaderboard_save_job():
+    """Догоняет рейтинги и сохраняет снимок для быстрого старта."""
+    try:
+        board = get_leaderboard()
+        board.refresh()
+        board.save()
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"leaderboard_save_job: {e}")
+
+
+async def monthly_accrual_job(bot):
+    """Раз в месяц: trust credit и ежемесячный бонус всем ученикам, отчёт в группу админов.
+
+    В потоке и на своём соединении: начисление по всем ученикам не
+    останавливает обработчики и не смешивается с транзакциями общего соединения.
+    """
+    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+    try:
+        apply_profile(conn)
+        bonus = load_bonuses().get("monthly_bonus", 1)
+        report = await asyncio.to_thread(run_monthly_accrual, conn, bonus)
+    except sqlite3.Error as e:
+        logger.error(f"monthly_accrual_job: {e}")
+        return
+    finally:
+        conn.close()
+    if not report.skipped:
+        try:
+            await bot.send_message(chat_id=ADMIN_GROUP_ID, text=format_accrual_report(report))
+        except TelegramError as e:
+            logger.error(f"monthly_accrual_job: не удалось отправить отчёт: {e}")
+
+
+async def db_checkpoint_job():
+    """Частый PASSIVE checkpoint - WAL не разрастается между ночными обслуживаниями."""
+    try:
+        checkpoint(DatabaseConnection().get_connection())
+    except sqlite3.Error as e:
+        logger.error(f"db_checkpoint_job: {e}")
+
+
+BACKUP_LOCK = asyncio.Lock()
+
+
+async def backup_job(bot):
+    """Резервная копия базы в потоке (online backup API шагами) и отчёт в группу админов."""
+    if BACKUP_LOCK.locked():
+        logger.info("backup_job: копия уже снимается, пропуск")
+        return
+    async with BACKUP_LOCK:
+        try:
+            result = await asyncio.to_thread(run_backup, DATABASE_FILE, BACKUP_DIR, archive_dir=ARCHIVE_DB_DIR)
+            text = format_backup_report(result)
+        except Exception as e:  # о любой неудаче копии админы должны узнать
+            logger.error(f"backup_job: резервная копия не создана: {e}")
+            text = f"⚠️ Резервная копия базы не создана: {e}"
+    try:
+        await bot.send_message(chat_id=ADMIN_GROUP_ID, text=text)
+    except TelegramError as e:
+        logger.error(f"backup_job: не удалось отправить отчёт: {e}")
+
+
+async def backup_command( update: Update, context: CallbackContext):
+    """/backup - снять резервную копию сейчас (отчёт придёт в группу админов)."""
+    admin_id = update.effective_user.id
+    if str(admin_id) not in ADMIN_IDS:
+        await safe_reply(update, context, "У вас нет прав для выполнения этой команды.")
+        return
+    if BACKUP_LOCK.locked():
+        await safe_reply(update, context, "Резервная копия уже снимается, отчёт придёт в группу админов.")
+        return
+    await safe_reply(update, context, "⏳ Снимаю резервную копию, бот продолжает работать...")
+    context.application.create_task(backup_job(context.bot))
+
+
+async def archive_closed_job():
+    """Перенос закрытых домашек, старых транзакций и отказов в месячные архивы.
+
+    Пачками в потоке и на своём соединении: commit и ATTACH переноса не
+    трогают транзакции общего соединения бота, а бот не замирает на время переноса.
+    """
+    cutoff = archive_cutoff(ARCHIVE_AFTER_DAYS)
+    moved = {}
+    conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+    try:
+        apply_profile(conn)
+        for spec in TIERED_TABLES.values():
+            while count := await asyncio.to_thread(archive_batch, conn, spec, cutoff, ARCHIVE_DB_DIR):
+                moved[spec.name] = moved.get(spec.name, 0) + count
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"archive_closed_job: перенос остановлен, продолжится в следующий запуск: {e}")
+    finally:
+        conn.close()
+    if moved:
+        logger.info(f"archive_closed_job: до {cutoff} перенесено в архивы {moved}")
+        get_analytics().invalidate()
+
+
+async def fetch_history(table: str, columns: list, where: str, params, order_by: tuple, descending: bool = False,
+                        user_id: int | None = None) -> list:
+    """История из рабочей базы вместе с месячными архивами ученика - через read-only пул отчётов."""
+    return await get_analytics().fetch_tiered(table, columns, where, params, order_by, descending, user_id=user_id)
+
+
+async def db_maintenance_job():
+    """Ночное обслуживание базы: incremental vacuum, ANALYZE, optimize, checkpoint.
+
+    В потоке и на своём соединении: VACUUM и ANALYZE не останавливают обработчики.
+    """
+    try:
+        await asyncio.to_thread(run_maintenance_file, DATABASE_FILE)
+    except sqlite3.Error as e:
+        logger.error(f"db_maintenance_job: {e}")
+
+
 # Отклоняет скидку администратором.*
 async def admin_approve_discount( update: Update, context: CallbackContext):
     """Подтверждает скидку администратором."""
@@ -6386,22 +6660,37 @@ async def admin_reject_discount( update: Update, context: CallbackContext):
 # Подтверждает покупку админом. *
 async def admin_approve_purchase( update: Update,  context: CallbackContext):
     """Подтверждает покупку админом."""
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+    conn = DatabaseConnection().get_connection()
     query = update.callback_query
-    await query.answer()
-    data = query.data.split("_")
+    # admin_approve_purchase_{user_id}_{tariff_id}: tariff_id целиком, с "_" (tea_abonement, course_discount)
+    data = query.data.split("_", 4)
     buyer_user_id = int(data[3])  # Индекс 3, а не 2, чтобы получить user_id
     tariff_id = data[4]
+
+    # Повторное нажатие - без записи в базу и повторных уведомлений.
+    # Ключ - сообщение с чеком: повторная покупка того же тарифа (tea_set) приходит новым сообщением
+    key = action_key("approve_purchase", query.message.chat_id, query.message.message_id)
+    if is_processed(conn, key):
+        await query.answer("Покупка уже подтверждена")
+        return
+    await query.answer()
     try:
-        # Добавляем купленный курс пользователю
-        await add_purchased_course(buyer_user_id, tariff_id, context)
+        def enroll(cur):
+            if enroll_purchased_course(cur, buyer_user_id, tariff_id) == "no_tariff":
+                raise LookupError(tariff_id)  # откатывает и ключ - после исправления тарифа можно повторить
+
+        # Добавляем купленный курс пользователю - одной транзакцией с ключом действия
+        claimed, _ = await run_once(key, update.effective_user.id, enroll)
+        if not claimed:
+            await query.message.reply_text("Покупка уже подтверждена.")
+            return
         await query.message.reply_text(f"Покупка для пользователя {buyer_user_id} подтверждена!")
         await context.bot.send_message(
             chat_id=buyer_user_id,
             text="Ваш чек был подтверждён, приятного пользования курсом",
         )
+    except LookupError:
+        await query.message.reply_text(f"Тариф {tariff_id} не найден, покупка не подтверждена.")
     except Exception as e:
         logger.error(f"Ошибка при подтверждении покупки: {e}")
         await query.message.reply_text("Произошла ошибка при подтверждении покупки.")
@@ -6412,7 +6701,7 @@ async def admin_reject_purchase( update: Update,    context: CallbackContext):
     """Отклоняет покупку админом."""
     query = update.callback_query
     await query.answer()
-    data = query.data.split("_")
+    data = query.data.split("_", 4)
     buyer_user_id = int(data[3])
     tariff_id = data[4]
     await query.message.reply_text("Покупка отклонена.")
@@ -6594,41 +6883,26 @@ async def get_next_lesson_time( user_id):
     conn = db.get_connection()
     cursor = db.get_cursor()
     try:
-        cursor.execute(
-            """
-            SELECT next_lesson_time, submission_time FROM users WHERE user_id = ?
-        """,
-            (user_id,),
-        )
+        cursor.execute("SELECT next_lesson_at FROM users WHERE user_id = ?", (user_id,))
         result = cursor.fetchone()
 
         if result and result[0]:
-            next_lesson_time_str = result[0]
-            try:
-                next_lesson_time = datetime.strptime(next_lesson_time_str, "%Y-%m-%d %H:%M:%S")
-                return next_lesson_time.strftime("%Y-%m-%d %H:%M:%S")
-            except ValueError as e:
-                logger.error(f"Ошибка при парсинге времени: {e}, строка: {next_lesson_time_str}")
-                return "время указано в неверном формате"
+            return format_epoch(result[0])
         else:
-            # Если время не определено, устанавливаем его на 3 часа после submission_time
+            # Если время не определено, устанавливаем его на DEFAULT_LESSON_DELAY_HOURS после сдачи
             cursor.execute(
                 """
-                SELECT submission_time FROM homeworks 
+                SELECT MAX(submitted_at) FROM homeworks
                 WHERE user_id = ? AND status = 'pending'
-                ORDER BY submission_time DESC LIMIT 1
             """,
                 (user_id,),
             )
-            submission_result = cursor.fetchone()
+            submitted_at = cursor.fetchone()[0]
 
-            if submission_result and submission_result[0]:
-                submission_time_str = submission_result[0]
-                submission_time = datetime.strptime(submission_time_str, "%Y-%m-%d %H:%M:%S")
-                next_lesson_time = submission_time + timedelta(hours=DEFAULT_LESSON_DELAY_HOURS)
-                next_lesson_time_str = next_lesson_time.strftime("%Y-%m-%d %H:%M:%S")
+            if submitted_at:
+                next_lesson_time_str = format_epoch(submitted_at + DEFAULT_LESSON_DELAY_HOURS * 3600)
 
-                # Обновляем время в базе данных
+                # Обновляем время в базе данных (next_lesson_at пересчитает триггер)
                 cursor.execute(
                     """
                     UPDATE users SET next_lesson_time = ? WHERE user_id = ?
@@ -6688,280 +6962,12 @@ def create_all_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
     logger.info("Таблицы SQL  создавайтес!!!!!!!!!!!!!!!!")
 
     try:
-        cursor.executescript(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                full_name TEXT NOT NULL DEFAULT 'ЧЕБУРАШКА',
-                birthday TEXT,
-                registration_date TEXT,
-                referral_count INTEGER DEFAULT 0,
-                penalty_task TEXT,
-                preliminary_material_index INTEGER DEFAULT 0,
-                tariff TEXT,
-                continuous_flow BOOLEAN DEFAULT 0,
-                next_lesson_time DATETIME,
-                active_course_id TEXT,
-                user_code TEXT,
-                last_bonus_date TEXT,
-                trust_credit INTEGER DEFAULT 0,
-                support_requests INTEGER DEFAULT 0,
-                morning_time TEXT,   
-                evening_time TEXT    
-            );
-
-            CREATE TABLE IF NOT EXISTS homeworks (
-                hw_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                course_id TEXT,  
-                lesson INTEGER,
-                file_id TEXT,
-                file_type TEXT,
-                message_id INTEGER,
-                status TEXT DEFAULT 'pending',
-                feedback TEXT,
-                timestamp TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
-                lesson_sent_time DATETIME,
-                first_submission_time DATETIME,
-                submission_time DATETIME,
-                approval_time DATETIME,
-                final_approval_time DATETIME,
-                admin_comment TEXT,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            );
-            
-            CREATE TABLE IF NOT EXISTS homework_rejections (
-                rejection_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                course_id TEXT NOT NULL,
-                lesson INTEGER NOT NULL,
-                reason TEXT NOT NULL,
-                rejected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-
-
-            CREATE TABLE IF NOT EXISTS user_tokens (
-                user_id INTEGER PRIMARY KEY,
-                tokens INTEGER DEFAULT 3
-            );
-
-            CREATE TABLE IF NOT EXISTS transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action TEXT, 
-                amount INTEGER,
-                reason TEXT, 
-                timestamp TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
-            );
-
-            CREATE TABLE IF NOT EXISTS lootboxes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                box_type TEXT, 
-                reward TEXT, 
-                probability REAL 
-            );
-
-            CREATE TABLE IF NOT EXISTS admins (
-                admin_id INTEGER PRIMARY KEY,
-                level INTEGER DEFAULT 1
-            );
-
-            CREATE TABLE IF NOT EXISTS admin_codes (
-                code_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id INTEGER,
-                code TEXT,
-                created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
-                used BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY(admin_id) REFERENCES admins(admin_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS user_settings (
-                user_id INTEGER PRIMARY KEY,
-                morning_notification TIME,
-                evening_notification TIME,
-                show_example_homework BOOLEAN DEFAULT 1,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS products (
-                product_id INTEGER PRIMARY KEY,
-                product_name TEXT NOT NULL,
-                price INTEGER NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS user_courses (
-                user_id INTEGER,
-                course_id TEXT,
-                course_type TEXT CHECK(course_type IN ('main', 'auxiliary')),
-                progress INTEGER DEFAULT 0,
-                purchase_date TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
-                tariff TEXT,
-                PRIMARY KEY (user_id, course_id),
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            );
-            CREATE TABLE IF NOT EXISTS courses (
-                course_id TEXT PRIMARY KEY,
-                course_name TEXT,
-                course_type TEXT CHECK(course_type IN ('main', 'auxiliary')),
-                code_word TEXT,
-                price_rub INTEGER
-            );
-
-            CREATE TABLE IF NOT EXISTS lessons (
-                lesson_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                course_id TEXT,
-                lesson INTEGER,
-                lesson_name TEXT,
-                description TEXT,
-                video_url TEXT,
-                video_file_id TEXT,
-                FOREIGN KEY (course_id) REFERENCES courses(course_id)
-            );
-             -- Создание индексов
-            CREATE INDEX IF NOT EXISTS idx_user_courses ON user_courses(user_id, course_id);
-            CREATE INDEX IF NOT EXISTS idx_homeworks ON homeworks(user_id, course_id, lesson);
-            """
-        )
+        cursor.executescript(BASE_SCHEMA)
         conn.commit()
         logger.info("База данных успешно создана/сохранена.")
     except sqlite3.Error as e:
         logger.error(f"Ошибка при создании базы данных: {e}")
 
-# черновик - не используем
-def populate_courses_table(conn, cursor, filename=COURSE_DATA_FILE):
-    """Загружает данные о курсах из JSON файла и заполняет таблицу courses."""
-    try:
-        with open(filename, "r", encoding="utf-8") as f:
-            courses_data = json.load(f)
-
-            for course_data in courses_data:
-                course_id = course_data.get("course_id")
-                course_name = course_data.get("course_name")
-                course_type = course_data.get("course_type")
-                code_word = course_data.get("code_word")
-                price_rub = course_data.get("price_rub")
-
-                cursor.execute(
-                    """
-                    INSERT OR IGNORE INTO courses (course_id, course_name, course_type, code_word, price_rub)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (course_id, course_name, course_type, code_word, price_rub),
-                )
-            conn.commit()
-            logger.info(f"Таблица courses успешно заполнена данными из {filename}")
-    except FileNotFoundError:
-        logger.error(f"Файл {filename} не найден.")
-    except json.JSONDecodeError:
-        logger.error(f"Ошибка при чтении JSON из файла {filename}.")
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при заполнении таблицы courses: {e}")
-
-
-def validate_json_structure(data):
-    """Проверяет структуру JSON данных."""
-    required_keys = {"lesson", "lesson_name", "description", "video_url"}
-    for item in data:
-        if not all(key in item for key in required_keys):
-            return False
-    return True
-
-
-def convert_to_utf8(file_path):
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            f.read()  # Проверяем возможность чтения
-        print(f"{file_path} уже в utf-8.")
-    except UnicodeDecodeError:
-        try:
-            with open(file_path, "r", encoding="ISO-8859-1") as f:
-                content = f.read()
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(content)
-            print(f"{file_path} переконвертирован в utf-8.")
-        except Exception as e:
-            print(f"Не удалось обработать {file_path}: {e}")
-
-# Проверяем все файлы lessons.json
-courses_dir = "courses"
-for course_dir in os.listdir(courses_dir):
-    course_path = os.path.join(courses_dir, course_dir)
-    lessons_file = os.path.join(course_path, "lessons.json")
-    if os.path.isfile(lessons_file):
-        convert_to_utf8(lessons_file)
-
-
-def populate_lessons_table(conn, cursor, course_directory):
-    """Загружает данные об уроках из JSON файла в папке курса и заполняет таблицу lessons."""
-    logger.info(f"300 populate_lessons_table Загружаем уроки из {course_directory}")
-    lessons_file = os.path.join(course_directory, "lessons.json")
-
-    try:
-        with open(lessons_file, "r", encoding="utf-8") as f:
-            logger.info(f"301 Попытка открыть файл с кодировкой utf-8")
-            lessons_data = json.load(f)
-            logger.info(f"302 после попытки utf-8 {lessons_data[:2]}")
-
-            for lesson_data in lessons_data:
-                lesson_number = lesson_data.get("lesson")
-                lesson_name = lesson_data.get("lesson_name")
-                description = lesson_data.get("description")
-                video_url = lesson_data.get("video_url")
-                course_id = os.path.basename(course_directory) # Получаем course_id из названия папки
-                logger.info (f" 578 Загружаем для {course_id=} {lesson_number=} {lesson_name=}")
-
-                cursor.execute(
-                    """
-                    INSERT OR IGNORE INTO lessons (course_id, lesson, lesson_name, description, video_url)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (course_id, lesson_number, lesson_name, description, video_url),
-                )
-            conn.commit()
-            logger.info(f"Таблица lessons успешно заполнена данными из {lessons_file}")
-    except FileNotFoundError:
-        logger.warning(f"Файл {lessons_file} не найден. Пропускаем загрузку уроков.")
-    except UnicodeDecodeError as e:
-        # Обработка ошибки кодировки
-        logger.error(f"Ошибка кодировки при чтении файла {lessons_file}: {e}")
-        logger.error(f"Сохраните файл {lessons_file} в кодировке utf-8 и попробуйте снова.")
-        convert_to_utf8(lessons_file)  # вот сюда
-    except json.JSONDecodeError:
-        logger.error(f"Ошибка при чтении JSON из файла {lessons_file}.")
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при заполнении таблицы lessons: {e}")
-        # Попытка открыть файл с кодировкой ISO-8859-1 (или другой подходящей)
-        try:
-            with open(lessons_file, "r", encoding="ISO-8859-1") as f:
-                logger.info(f" 308 Попытка открыть файл с кодировкой ISO-8859-1")
-                lessons_data = json.load(f)
-                logger.info(f"309 после попытки {lessons_data}")
-
-                for lesson_data in lessons_data:
-                    lesson_number = lesson_data.get("lesson")
-                    lesson_name = lesson_data.get("lesson_name")
-                    description = lesson_data.get("description")
-                    video_url = lesson_data.get("video_url")
-                    course_id = os.path.basename(course_directory)
-
-                    logger.info(f"Загружаем для {course_id=} {lesson_number=} {lesson_name=}")
-
-                    cursor.execute(
-                        """
-                        INSERT OR IGNORE INTO lessons (course_id, lesson, lesson_name, description, video_url)
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        (course_id, lesson_number, lesson_name, description, video_url),
-                    )
-                conn.commit()
-                logger.info(f"Таблица lessons успешно заполнена данными из {lessons_file}")
-        except Exception as e:
-            logger.error(f"Не удалось обработать файл {lessons_file} даже с другой кодировкой: {e}")
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка при чтении JSON из файла {lessons_file}: {e}. Пропускаем загрузку уроков.")
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при заполнении таблицы lessons: {e}")
-
 
 async def cancel (update, context):
     await update.message.reply_text("Разговор завершён.")
@@ -7000,47 +7006,79 @@ async def schedule_birthday_checks(application: Application):
 
 
 
-def main():
-    # Database connection
-    # Использование:
-    db = DatabaseConnection()
-    conn = db.get_connection()
-    cursor = db.get_cursor()
+async def init_repository(application: Application):
+    """Готовит схему выбранного бэкенда репозитория до начала polling."""
+    STARTUP_TIMER.mark("подключение к Telegram")  # post_init вызывается после getMe в initialize()
+    await get_repository().init_schema()
+    STARTUP_TIMER.mark("репозиторий")
+    logger.info(STARTUP_TIMER.report())
 
-    #conn, cursor = create_connection() старый вариант - переехали на Синглтон
 
+async def close_repository(application: Application):
+    """Закрывает пул соединений репозитория, отчётный пул и писателя, сохраняет снимок рейтингов."""
+    await leaderboard_save_job()
+    await get_repository().close()
+    get_analytics().close()
+    if WRITER is not None:
+        WRITER.close()
+    if UPDATE_RECORDER is not None:
+        UPDATE_RECORDER.close()
+
+
+def init_database(conn, cursor):
+    """Схема, миграции и справочники курсов/уроков. Вызывается до сборки приложения."""
     if conn and cursor:
         create_all_tables(conn, cursor)
-        #populate_courses_table(conn, cursor)  # Заполняем таблицу courses ЧЕРНОВИК - ЕСТЬ ЛУЧШЕ populate_lessons_table
-
-        populate_courses_table(conn, cursor)  # Заполняем таблицу courses
-        # Загружаем данные об уроках из JSON файлов в папках курсов
+        create_media_archive_tables(conn, cursor)
+        create_homework_attachments_table(conn, cursor)
+        create_lesson_mask_columns(conn, cursor)
+        create_leaderboard_tables(conn, cursor)
+        create_monthly_accrual_tables(conn, cursor)
+        create_lootbox_tables(conn, cursor)
+        create_processed_actions_table(conn, cursor)
+        create_epoch_columns(conn, cursor)
+        create_preliminary_tables(conn, cursor)
+        create_lesson_delivery_tables(conn, cursor)
+        create_tiering_tables(conn, cursor)
+        create_search_tables(conn, cursor, ARCHIVE_DB_DIR)
+        create_base_course_column(conn, cursor)
+        create_content_sync_table(conn, cursor)
+        init_lootboxes(conn, cursor)
+        STARTUP_TIMER.mark("схема")
+
+        # Справочники курсов и уроков: только изменившиеся courses.json и lessons.json, одной транзакцией
         courses_dir = "courses"  # Папка с курсами
-        for course_dir in os.listdir(courses_dir):
-            course_path = os.path.join(courses_dir, course_dir)
-            if os.path.isdir(course_path):
-                populate_lessons_table(conn, cursor, course_path)
-
-        # Проверка существующих индексов
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='index'")
-        indexes = cursor.fetchall()
-
-        if indexes:
-            logger.info("0 Существующие индексы в базе данных:")
-            for index in indexes:
-                logger.info(f" - {index[0]}")
-        else:
-            logger.info("Индексы в базе данных отсутствуют.")
+        sync_content(conn, COURSE_DATA_FILE, courses_dir)
+        STARTUP_TIMER.mark("курсы и уроки")
+        sync_lesson_index(conn, courses_dir)  # поиск по текстам уроков - только изменившиеся файлы
+        STARTUP_TIMER.mark("поиск по урокам")
     else:
         logger.error("Бяда 2 Database connection failed - cannot create tables")
 
 
+def build_application(request=None, persistence=persistence):
+    """Собирает Application со всеми обработчиками.
 
-    # Check if TOKEN is None before building application
-    if TOKEN is None:
-        raise ValueError("Bot token not found. Please set the TOKEN environment variable.")
+    request - свой BaseRequest (фейковый Bot API при воспроизведении записи),
+    persistence=None - без bot_data.pkl.
+    """
+    builder = ApplicationBuilder().token(TOKEN).post_init(init_repository).post_shutdown(close_repository)
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if request is None:
+        # Раздельные пулы: загрузки файлов не занимают соединения для answer() и send_message
+        builder = builder.request(get_bot_request())
+    else:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
-    application = ApplicationBuilder().token(TOKEN).persistence(persistence).build()
+    # Запись входящих update для воспроизведения (UPDATE_RECORD_PATH), до всех остальных групп
+    recorder = get_update_recorder()
+    if recorder is not None:
+        application.add_handler(TypeHandler(Update, recorder.handle), group=-2)
+
+    # Контроль нагрузки: лимит на ученика, склейка повторных нажатий, сброс меню при перегрузке
+    application.add_handler(TypeHandler(Update, get_flood_control().gate), group=-1)
 
     # Подключение middleware - ненадо. он всё ломает с гарантией
     # application.add_handler(MessageHandler(filters.ALL, logging_middleware))
@@ -7076,6 +7114,7 @@ def main():
     #application.add_handler(CallbackQueryHandler(reject_homework, pattern='^reject_homework'))
     application.add_handler(CallbackQueryHandler(reject_homework, pattern='^decline_homework'))
     application.add_handler(CallbackQueryHandler(handle_history_callback, pattern='^history_callback'))
+    application.add_handler(CallbackQueryHandler(search_page_callback, pattern=r'^search_page\|'))
 
 
     application.add_handler(conv_handler)
@@ -7088,6 +7127,13 @@ def main():
     application.add_handler(CommandHandler("set_evening",  set_evening ))
     application.add_handler(CommandHandler("disable_reminders",  disable_reminders ))
     application.add_handler(CommandHandler("stats",  stats ))
+    application.add_handler(CommandHandler("export",  export_command ))
+    application.add_handler(CommandHandler("dbstats",  db_stats_command ))
+    application.add_handler(CommandHandler("netstats",  net_stats_command ))
+    application.add_handler(CommandHandler("floodstats",  flood_stats_command ))
+    application.add_handler(CommandHandler("backup",  backup_command ))
+    application.add_handler(CommandHandler("search",  search_command ))
+    application.add_handler(CommandHandler("top",  top_command ))
 
     # неизвестные команды
     application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
@@ -7097,6 +7143,27 @@ def main():
 
     # Обработчик ошибок
     application.add_error_handler(handle_error)
+    return application
+
+
+def main():
+    # Database connection
+    # Использование:
+    db = DatabaseConnection()
+    conn = db.get_connection()
+    cursor = db.get_cursor()
+
+    #conn, cursor = create_connection() старый вариант - переехали на Синглтон
+    get_repository()  # проверка DB_BACKEND до любой работы с базой
+    STARTUP_TIMER.mark("импорт")
+
+    init_database(conn, cursor)
+
+    # Check if TOKEN is None before building application
+    if TOKEN is None:
+        raise ValueError("Bot token not found. Please set the TOKEN environment variable.")
+
+    application = build_application()
 
     # Запуск планировщика задач
     scheduler = AsyncIOScheduler()
@@ -7112,9 +7179,55 @@ def main():
         kwargs={'context': CallbackContext(application.bot, application.bot_data)}
     )
 
+    # Фоновая архивация медиа домашек (скачивание вне пути сдачи ДЗ)
+    archiver = MediaArchiver(application.bot, conn)
+    scheduler.add_job(
+        archiver.run_once,
+        trigger='interval',
+        seconds=ARCHIVE_INTERVAL_SECONDS,
+        max_instances=1,
+    )
+
+    # Обслуживание SQLite: частые checkpoint и ночное обслуживание в тихие часы
+    scheduler.add_job(db_checkpoint_job, trigger='interval', minutes=CHECKPOINT_INTERVAL_MINUTES, max_instances=1)
+    scheduler.add_job(db_maintenance_job, trigger='cron', hour=MAINTENANCE_HOUR, minute=MAINTENANCE_MINUTE)
+    # Резервная копия базы без остановки бота, отчёт админам
+    scheduler.add_job(backup_job, trigger='cron', hour=BACKUP_HOUR, minute=BACKUP_MINUTE, args=[application.bot],
+                      max_instances=1)
+    # Архивация старых закрытых записей - до обслуживания, vacuum вернёт освободившиеся страницы
+    scheduler.add_job(archive_closed_job, trigger='cron', hour=MAINTENANCE_HOUR, minute=ARCHIVE_MINUTE,
+                      max_instances=1)
+
+    # Рейтинги: загрузка снимка при старте и периодическое сохранение
+    get_leaderboard()
+    scheduler.add_job(leaderboard_save_job, trigger='interval', minutes=LEADERBOARD_SAVE_MINUTES, max_instances=1)
+
+    # Ежемесячные начисления; первый запуск сразу - догоняет месяц, пропущенный пока бот был выключен
+    scheduler.add_job(
+        monthly_accrual_job,
+        trigger='cron',
+        day=ACCRUAL_DAY,
+        hour=ACCRUAL_HOUR,
+        minute=ACCRUAL_MINUTE,
+        args=[application.bot],
+        next_run_time=datetime.now(),
+        max_instances=1,
+    )
+
+    # Уроки, доставка которых прервалась: сразу после старта и затем периодически
+    scheduler.add_job(
+        resume_lesson_deliveries_job,
+        trigger='interval',
+        minutes=DELIVERY_RESUME_MINUTES,
+        args=[application.bot],
+        next_run_time=datetime.now(),
+        max_instances=1,
+    )
+
     scheduler.start()
 
     # Start the bot
+    STARTUP_TIMER.mark("приложение и планировщик")
     logger.info("Бот запущен...")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
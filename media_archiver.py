@@ -0,0 +1,160 @@
+# media_archiver.py
+"""Фоновый архиватор медиа домашних заданий.
+
+При сдаче ДЗ в media_archive ставится только запись со статусом pending.
+Сдача не ждёт сети. Раз в ARCHIVE_INTERVAL_SECONDS архиватор скачивает
+ожидающие файлы, не больше ARCHIVE_CONCURRENCY одновременно, и кладёт их в
+хранилище по содержимому: media_store/ab/cd/<sha256>.
+
+Дедупликация в два уровня:
+- по file_unique_id: один и тот же файл Telegram скачивается один раз;
+- по sha256: одинаковое содержимое под разными file_unique_id хранится одним файлом.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from db_schema import ensure_column
+
+logger = logging.getLogger(__name__)
+
+MEDIA_STORE_DIR = os.getenv("MEDIA_STORE_DIR", "media_store")
+ARCHIVE_CONCURRENCY = int(os.getenv("ARCHIVE_CONCURRENCY", "4"))
+ARCHIVE_BATCH_SIZE = 50
+ARCHIVE_MAX_ATTEMPTS = 5
+ARCHIVE_INTERVAL_SECONDS = 60
+
+
+def create_media_archive_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Таблица статусов архивации и ссылка homeworks.file_unique_id."""
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS media_archive (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'archived', 'failed')),
+            sha256 TEXT,
+            path TEXT,
+            size INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            queued_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+            archived_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_media_archive_status ON media_archive(status);
+        CREATE INDEX IF NOT EXISTS idx_media_archive_sha256 ON media_archive(sha256);
+        """
+    )
+    ensure_column(conn, "homeworks", "file_unique_id", "TEXT")
+    conn.commit()
+
+
+def enqueue_media(cursor: sqlite3.Cursor, file_id: str, file_unique_id: str):
+    """Ставит файл в очередь архивации (повтор того же file_unique_id игнорируется).
+
+    Коммит - на вызывающей стороне, вместе с записью домашки.
+    """
+    cursor.execute(
+        "INSERT OR IGNORE INTO media_archive (file_unique_id, file_id) VALUES (?, ?)",
+        (file_unique_id, file_id),
+    )
+
+
+def store_path(store_dir: str, sha256: str) -> str:
+    return os.path.join(store_dir, sha256[:2], sha256[2:4], sha256)
+
+
+def write_blob(store_dir: str, data: bytes) -> tuple[str, str, bool]:
+    """Пишет содержимое в хранилище. Возвращает (sha256, путь, был ли файл уже в хранилище)."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = store_path(store_dir, sha256)
+    if os.path.exists(path):
+        return sha256, path, True
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # загрузки идут параллельно в потоках: у каждой записи свой временный файл, а os.link атомарно
+    # создаёт blob только если его ещё нет - из одновременных записей одного blob побеждает одна,
+    # остальные считаются дубликатами
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f"{sha256}.", suffix=".tmp",
+                                     delete=False) as f:
+        f.write(data)
+    try:
+        os.link(f.name, path)
+        existed = False
+    except FileExistsError:
+        existed = True
+    finally:
+        os.remove(f.name)
+    return sha256, path, existed
+
+
+class MediaArchiver:
+    """Скачивает ожидающие файлы из media_archive с ограниченной параллельностью."""
+
+    def __init__(self, bot, conn: sqlite3.Connection, store_dir: str = MEDIA_STORE_DIR,
+                 concurrency: int = ARCHIVE_CONCURRENCY, max_attempts: int = ARCHIVE_MAX_ATTEMPTS):
+        self.bot = bot
+        self.conn = conn
+        self.store_dir = store_dir
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+
+    async def _download(self, file_unique_id: str, file_id: str):
+        async with self._semaphore:
+            tg_file = await self.bot.get_file(file_id)
+            data = bytes(await tg_file.download_as_bytearray())
+        sha256, path, existed = await asyncio.to_thread(write_blob, self.store_dir, data)
+        return file_unique_id, sha256, path, len(data), existed
+
+    async def run_once(self, limit: int = ARCHIVE_BATCH_SIZE) -> dict:
+        """Один проход по очереди. Возвращает счётчики archived/deduplicated/failed."""
+        if self._lock.locked():
+            return {"archived": 0, "deduplicated": 0, "failed": 0}  # предыдущий проход ещё идёт
+        async with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT file_unique_id, file_id FROM media_archive
+                WHERE status = 'pending' OR (status = 'failed' AND attempts < ?)
+                ORDER BY queued_at LIMIT ?
+                """,
+                (self.max_attempts, limit),
+            ).fetchall()
+            counters = {"archived": 0, "deduplicated": 0, "failed": 0}
+            if not rows:
+                return counters
+
+            results = await asyncio.gather(
+                *(self._download(uid, fid) for uid, fid in rows), return_exceptions=True
+            )
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with self.conn:
+                for (file_unique_id, _), result in zip(rows, results):
+                    if isinstance(result, Exception):
+                        counters["failed"] += 1
+                        logger.warning(f"MediaArchiver: {file_unique_id} не скачан: {result}")
+                        self.conn.execute(
+                            """
+                            UPDATE media_archive SET status = 'failed', attempts = attempts + 1, error = ?
+                            WHERE file_unique_id = ?
+                            """,
+                            (str(result), file_unique_id),
+                        )
+                        continue
+                    _, sha256, path, size, existed = result
+                    counters["archived"] += 1
+                    counters["deduplicated"] += existed
+                    self.conn.execute(
+                        """
+                        UPDATE media_archive
+                        SET status = 'archived', sha256 = ?, path = ?, size = ?, attempts = attempts + 1,
+                            error = NULL, archived_at = ?
+                        WHERE file_unique_id = ?
+                        """,
+                        (sha256, path, size, now, file_unique_id),
+                    )
+            logger.info(f"MediaArchiver: проход завершён {counters}")
+            return counters
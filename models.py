@@ -0,0 +1,48 @@
+# models.py
+"""Компактные модели предметной области, общие для модулей бота.
+
+Все модели - dataclass(frozen=True, slots=True):
+- нет __dict__ на экземпляр, поля лежат в слотах, что заметно меньше
+  dict с теми же полями (см. benchmarks/bench_models_memory.py);
+- неизменяемость: объект из кэша нельзя случайно поправить по месту,
+  его заменяют перечитанным;
+- экземпляры хэшируются и сериализуются pickle (PicklePersistence).
+"""
+from dataclasses import dataclass
+
+from course_catalog import split_course_id
+
+
+@dataclass(frozen=True, slots=True)
+class Course:
+    course_id: str
+    course_name: str
+    course_type: str
+    code_word: str
+    price_rub: int | None = None
+    price_tokens: int | None = None
+
+    @property
+    def tariff(self) -> str:
+        """Тариф из course_id: femininity_premium -> premium, femininity_self_check -> self_check."""
+        return split_course_id(self.course_id)[1] if self.course_id else 'default'
+
+    def __str__(self):
+        return (f"Course(id={self.course_id}, name={self.course_name}, type={self.course_type},"
+                f" code={self.code_word}, price_rub={self.price_rub}, price_tokens={self.price_tokens})")
+
+
+@dataclass(frozen=True, slots=True)
+class LessonFile:
+    """Файл урока на диске: путь, тип для отправки и задержка в секундах."""
+    path: str
+    type: str  # text | photo | video | audio | document
+    delay: int = 0
+
+
+@dataclass(frozen=True, slots=True)
+class MediaItem:
+    """Медиа из сообщения Telegram (вложение домашки, материал урока)."""
+    file_id: str
+    file_unique_id: str
+    file_type: str  # photo | video | document
@@ -0,0 +1,178 @@
+# monthly_accrual.py
+"""Ежемесячное массовое начисление: рост trust credit и ежемесячный бонус.
+
+Вместо поштучного recalculate_trust() и ленивого бонуса в add_tokens()
+задача проходит по users диапазонами user_id (ACCRUAL_CHUNK_SIZE записей).
+Для каждого диапазона одна транзакция из нескольких set-based запросов:
+- строки журнала transactions для всех подходящих учеников;
+- рост trust_credit и отметка last_trust_month;
+- бонус в user_tokens (UPSERT) и отметка last_bonus_date.
+
+Повторный запуск за тот же месяц ничего не начисляет. Законченный месяц
+записан в monthly_accruals, а ученики, уже получившие начисление, отмечены
+своими колонками. Поэтому и прерванный запуск безопасно продолжить.
+"""
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import date
+
+from db_schema import ensure_column
+
+logger = logging.getLogger(__name__)
+
+MONTHLY_TRUST_INCREASE = 2
+ACCRUAL_CHUNK_SIZE = 1000
+ACCRUAL_DAY = 1
+ACCRUAL_HOUR = 0
+ACCRUAL_MINUTE = 10
+
+TRUST_REASON = "Ежемесячный рост кредита доверия"
+BONUS_REASON = "Ежемесячный бонус"
+
+
+@dataclass
+class AccrualReport:
+    period: str
+    users: int = 0
+    trust_users: int = 0
+    bonus_users: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    skipped: bool = False
+
+
+def create_monthly_accrual_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """Таблица запусков по месяцам и отметка месяца роста trust credit у ученика."""
+    ensure_column(conn, "users", "last_trust_month", "TEXT")
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS monthly_accruals (
+            period TEXT PRIMARY KEY,
+            started_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+            finished_at TEXT,
+            users INTEGER,
+            trust_users INTEGER,
+            bonus_users INTEGER,
+            seconds REAL
+        )
+        """
+    )
+    conn.commit()
+
+
+def _next_bound(conn: sqlite3.Connection, after: int, chunk_size: int) -> int | None:
+    """Верхняя граница user_id очередного диапазона или None, если учеников больше нет."""
+    row = conn.execute(
+        "SELECT MAX(user_id) FROM (SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)",
+        (after, chunk_size),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _accrue_chunk(cursor: sqlite3.Cursor, low: int, high: int, period: str, today: str,
+                  trust_increase: int, bonus: int) -> tuple[int, int, int]:
+    """Начисления для user_id в (low, high]. Возвращает (учеников, trust, бонусов)."""
+    in_range = "user_id > :low AND user_id <= :high"
+    trust_due = f"{in_range} AND last_trust_month IS NOT :period"
+    bonus_due = f"{in_range} AND (last_bonus_date IS NULL OR substr(last_bonus_date, 1, 7) != :period)"
+    params = {"low": low, "high": high, "period": period, "today": today,
+              "trust": trust_increase, "bonus": bonus,
+              "trust_reason": TRUST_REASON, "bonus_reason": BONUS_REASON}
+
+    users = cursor.execute(f"SELECT COUNT(*) FROM users WHERE {in_range}", params).fetchone()[0]
+
+    trust_users = 0
+    if trust_increase:
+        cursor.execute(
+            f"""
+            INSERT INTO transactions (user_id, action, amount, reason)
+            SELECT user_id, 'trust', :trust, :trust_reason FROM users WHERE {trust_due}
+            """,
+            params,
+        )
+        cursor.execute(
+            f"""
+            UPDATE users SET trust_credit = COALESCE(trust_credit, 0) + :trust, last_trust_month = :period
+            WHERE {trust_due}
+            """,
+            params,
+        )
+        trust_users = cursor.rowcount
+
+    bonus_users = 0
+    if bonus:
+        cursor.execute(
+            f"""
+            INSERT INTO transactions (user_id, action, amount, reason)
+            SELECT user_id, 'earn', :bonus, :bonus_reason FROM users WHERE {bonus_due}
+            """,
+            params,
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO user_tokens (user_id, tokens)
+            SELECT user_id, :bonus FROM users WHERE {bonus_due}
+            ON CONFLICT(user_id) DO UPDATE SET tokens = tokens + excluded.tokens
+            """,
+            params,
+        )
+        cursor.execute(f"UPDATE users SET last_bonus_date = :today WHERE {bonus_due}", params)
+        bonus_users = cursor.rowcount
+    return users, trust_users, bonus_users
+
+
+def run_monthly_accrual(conn: sqlite3.Connection, bonus: int, trust_increase: int = MONTHLY_TRUST_INCREASE,
+                        today: date | None = None, chunk_size: int = ACCRUAL_CHUNK_SIZE) -> AccrualReport:
+    """Начисляет trust credit и ежемесячный бонус всем ученикам за месяц today (один раз)."""
+    today = today or date.today()
+    period = today.strftime("%Y-%m")
+    report = AccrualReport(period=period)
+
+    row = conn.execute("SELECT finished_at FROM monthly_accruals WHERE period = ?", (period,)).fetchone()
+    if row and row[0]:
+        report.skipped = True
+        logger.info(f"run_monthly_accrual: начисление за {period} уже выполнено {row[0]}")
+        return report
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO monthly_accruals (period) VALUES (?)", (period,))
+
+    started = time.monotonic()
+    cursor = conn.cursor()
+    low = 0
+    while (high := _next_bound(conn, low, chunk_size)) is not None:
+        with conn:
+            users, trust_users, bonus_users = _accrue_chunk(
+                cursor, low, high, period, today.strftime("%Y-%m-%d"), trust_increase, bonus
+            )
+        report.users += users
+        report.trust_users += trust_users
+        report.bonus_users += bonus_users
+        report.chunks += 1
+        low = high
+    report.seconds = round(time.monotonic() - started, 3)
+
+    with conn:
+        conn.execute(
+            """
+            UPDATE monthly_accruals
+            SET finished_at = strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'),
+                users = ?, trust_users = ?, bonus_users = ?, seconds = ?
+            WHERE period = ?
+            """,
+            (report.users, report.trust_users, report.bonus_users, report.seconds, period),
+        )
+    logger.info(f"run_monthly_accrual: {report}")
+    return report
+
+
+def format_accrual_report(report: AccrualReport) -> str:
+    """Текст для админов."""
+    if report.skipped:
+        return f"Начисление за {report.period} уже выполнено ранее."
+    return (f"💰 Ежемесячное начисление за {report.period}:\n"
+            f"Учеников обработано: {report.users} ({report.chunks} пачек)\n"
+            f"Кредит доверия увеличен: {report.trust_users}\n"
+            f"Ежемесячный бонус начислен: {report.bonus_users}\n"
+            f"Время: {report.seconds:.2f} с")
@@ -0,0 +1,205 @@
+# preliminary_materials.py
+"""Предварительные материалы к следующему уроку: манифест и прогретые file_id.
+
+Раньше каждое нажатие "Предварительные материалы" листало папку курса
+(os.listdir) и загружало каждый файл lessonN_p* с диска заново.
+
+Теперь:
+- манифест {(папка курса, урок): (LessonFile, ...)} строится один раз на
+  старте одним проходом по папкам courses/*;
+- file_id материалов хранятся в preliminary_file_ids по пути файла вместе
+  с mtime и размером: изменился файл - file_id перевыпускается;
+- как только ученику отправлен урок N, материалы урока N+1 в фоне
+  загружаются в служебный чат (PRELIMINARY_CACHE_CHAT_ID, по умолчанию
+  группа админов), file_id запоминается, служебное сообщение удаляется;
+- по кнопке уходят только file_id, альбомами (sendMediaGroup) где можно:
+  фото и видео вместе, документы и аудио - отдельными альбомами.
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.error import TelegramError
+
+from models import LessonFile
+
+logger = logging.getLogger(__name__)
+
+COURSES_DIR = "courses"
+MEDIA_GROUP_MAX = 10
+MATERIAL_PATTERN = re.compile(r"^lesson(\d+)_p")
+EXTENSION_TYPES = {
+    ".jpg": "photo", ".jpeg": "photo", ".png": "photo", ".gif": "photo",
+    ".mp4": "video", ".avi": "video", ".mov": "video",
+    ".mp3": "audio", ".wav": "audio", ".ogg": "audio",
+}
+# Какие типы Telegram разрешает смешивать в одном альбоме
+ALBUM_KIND = {"photo": "visual", "video": "visual", "audio": "audio", "document": "document"}
+SEND_METHODS = {"photo": "send_photo", "video": "send_video", "audio": "send_audio", "document": "send_document"}
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "audio": InputMediaAudio,
+               "document": InputMediaDocument}
+
+
+def create_preliminary_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS preliminary_file_ids (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            file_type TEXT NOT NULL,
+            file_id TEXT NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    conn.commit()
+
+
+def material_type(filename: str) -> str:
+    return EXTENSION_TYPES.get(os.path.splitext(filename)[1].lower(), "document")
+
+
+def build_manifest(courses_dir: str = COURSES_DIR) -> dict:
+    """{(папка курса, номер урока): (LessonFile, ...)} в порядке имён файлов (p1, p2, ...)."""
+    manifest = {}
+    if not os.path.isdir(courses_dir):
+        return manifest
+    for course_dir in sorted(os.listdir(courses_dir)):
+        course_path = os.path.join(courses_dir, course_dir)
+        if not os.path.isdir(course_path):
+            continue
+        for filename in sorted(os.listdir(course_path)):
+            match = MATERIAL_PATTERN.match(filename)
+            path = os.path.join(course_path, filename)
+            if match and os.path.isfile(path):
+                key = (course_dir, int(match.group(1)))
+                manifest[key] = manifest.get(key, ()) + (LessonFile(path, material_type(filename)),)
+    logger.info(f"build_manifest: {sum(len(v) for v in manifest.values())} материалов для {len(manifest)} уроков")
+    return manifest
+
+
+def media_groups(items: list) -> list:
+    """[(LessonFile, file_id)] -> пачки для отправки: подряд идущие совместимые типы, не больше 10."""
+    groups = []
+    for item in items:
+        kind = ALBUM_KIND[item[0].type]
+        if groups and ALBUM_KIND[groups[-1][0][0].type] == kind and len(groups[-1]) < MEDIA_GROUP_MAX:
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    return groups
+
+
+def file_id_from_message(message, file_type: str) -> str | None:
+    if file_type == "photo":
+        return message.photo[-1].file_id if message.photo else None
+    attachment = getattr(message, file_type, None) or message.document
+    return attachment.file_id if attachment else None
+
+
+class PreliminaryMaterials:
+    """Манифест материалов и кэш их file_id."""
+
+    def __init__(self, conn: sqlite3.Connection, courses_dir: str = COURSES_DIR):
+        self.conn = conn
+        self.courses_dir = courses_dir
+        self.manifest = build_manifest(courses_dir)
+        self._warming = {}  # (курс, урок) -> Task: повторный запрос не запускает второй прогрев
+
+    def reload(self):
+        self.manifest = build_manifest(self.courses_dir)
+
+    def materials(self, course_dir: str, lesson: int) -> tuple:
+        return self.manifest.get((course_dir, lesson), ())
+
+    def cached_file_id(self, material: LessonFile) -> str | None:
+        """file_id, если он выпущен для текущей версии файла на диске."""
+        try:
+            stat = os.stat(material.path)
+        except OSError:
+            return None
+        row = self.conn.execute(
+            "SELECT file_id FROM preliminary_file_ids WHERE path = ? AND mtime_ns = ? AND size = ?",
+            (material.path, stat.st_mtime_ns, stat.st_size),
+        ).fetchone()
+        return row[0] if row else None
+
+    def remember(self, material: LessonFile, file_id: str):
+        stat = os.stat(material.path)
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO preliminary_file_ids (path, mtime_ns, size, file_type, file_id) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size,
+                    file_type = excluded.file_type, file_id = excluded.file_id
+                """,
+                (material.path, stat.st_mtime_ns, stat.st_size, material.type, file_id),
+            )
+
+    async def _upload(self, bot, chat_id: int, material: LessonFile, caption: str | None = None,
+                      silent: bool = False):
+        """Загружает файл с диска, запоминает file_id, возвращает сообщение."""
+        with open(material.path, "rb") as f:
+            send = getattr(bot, SEND_METHODS[material.type])
+            message = await send(chat_id, f, caption=caption, disable_notification=silent)
+        file_id = file_id_from_message(message, material.type)
+        if file_id:
+            self.remember(material, file_id)
+        return message
+
+    async def warm(self, bot, cache_chat_id: int, course_dir: str, lesson: int) -> int:
+        """Выпускает file_id для материалов урока, которых ещё нет в кэше. Возвращает число загрузок."""
+        uploaded = 0
+        for material in self.materials(course_dir, lesson):
+            if self.cached_file_id(material):
+                continue
+            try:
+                message = await self._upload(bot, cache_chat_id, material, silent=True)
+                uploaded += 1
+                await bot.delete_message(cache_chat_id, message.message_id)
+            except (OSError, TelegramError) as e:
+                logger.warning(f"PreliminaryMaterials: {material.path} не прогрет: {e}")
+        if uploaded:
+            logger.info(f"PreliminaryMaterials: прогрето {uploaded} файлов урока {lesson} курса {course_dir}")
+        return uploaded
+
+    def warm_in_background(self, bot, cache_chat_id: int, course_dir: str, lesson: int):
+        """Прогрев без ожидания - вызывается сразу после отправки предыдущего урока."""
+        key = (course_dir, lesson)
+        if not self.materials(course_dir, lesson) or (key in self._warming and not self._warming[key].done()):
+            return
+        task = asyncio.create_task(self.warm(bot, cache_chat_id, course_dir, lesson))
+        self._warming[key] = task
+        task.add_done_callback(lambda _: self._warming.pop(key, None))
+
+    async def send(self, bot, chat_id: int, course_dir: str, lesson: int, caption: str) -> int:
+        """Отправляет материалы урока. Возвращает число отправленных файлов.
+
+        Прогретые файлы уходят по file_id альбомами; не прогретые (прогрев не
+        успел или упал) загружаются с диска напрямую ученику по одному.
+        """
+        pending = self._warming.get((course_dir, lesson))
+        if pending and not pending.done():
+            await asyncio.shield(pending)  # прогрев уже идёт - дождаться, а не грузить второй раз
+        items = [(material, self.cached_file_id(material)) for material in self.materials(course_dir, lesson)]
+        sent = 0
+        for group in media_groups(items):
+            group_caption = caption if sent == 0 else None
+            if len(group) > 1 and all(file_id for _, file_id in group):
+                media = [INPUT_MEDIA[material.type](file_id, caption=group_caption if i == 0 else None)
+                         for i, (material, file_id) in enumerate(group)]
+                await bot.send_media_group(chat_id, media)
+                sent += len(group)
+                continue
+            for material, file_id in group:
+                item_caption = caption if sent == 0 else None
+                if file_id:
+                    await getattr(bot, SEND_METHODS[material.type])(chat_id, file_id, caption=item_caption)
+                else:
+                    await self._upload(bot, chat_id, material, caption=item_caption)
+                sent += 1
+        return sent
+
@@ -0,0 +1,845 @@
+# repository.py
+"""Слой репозиториев: пользователи, курсы, домашки, жетоны, настройки, отказы.
+
+Один контракт (BaseRepository) и три бэкенда:
+- SQLiteRepository   - текущая база bot_db.sqlite (по умолчанию);
+- InMemoryRepository - словари в памяти, для тестов и бенчмарков;
+- PostgresRepository - пул соединений asyncpg для больших инсталляций.
+
+Бот работает только на SQLite: через репозиторий идёт лишь часть
+обработчиков, остальные пишут в bot_db.sqlite напрямую. Поэтому
+main.get_repository отказывается стартовать с другим DB_BACKEND: иначе
+данные разошлись бы по двум базам. PostgresRepository и
+InMemoryRepository проверяются общим контрактным набором тестов.
+
+Все методы асинхронные, чтобы PostgreSQL-бэкенд не блокировал event loop.
+Строки возвращаются обычными dict с именами колонок как в SQLite-схеме.
+"""
+import abc
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+from data_tiering import ARCHIVE_DB_DIR, archived_months, read_tiered
+from db_schema import BASE_SCHEMA
+
+try:
+    import asyncpg  # опционально - нужен только для DB_BACKEND=postgres
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+DB_BACKEND = os.getenv("DB_BACKEND", "sqlite")
+POSTGRES_DSN = os.getenv("POSTGRES_DSN")
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "2"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+NOTIFICATION_COLUMNS = {"morning": "morning_notification", "evening": "evening_notification"}
+
+
+class InsufficientTokensError(ValueError):
+    """Недостаточно жетонов для списания."""
+
+
+def _now_str():
+    return datetime.now().strftime(TIME_FORMAT)
+
+
+class BaseRepository(abc.ABC):
+    """Контракт репозитория. Все бэкенды обязаны вести себя одинаково."""
+
+    @abc.abstractmethod
+    async def init_schema(self):
+        """Создаёт таблицы, если их нет."""
+
+    async def close(self):
+        """Освобождает ресурсы бэкенда."""
+
+    # users
+    @abc.abstractmethod
+    async def get_user(self, user_id: int) -> dict | None:
+        """Возвращает строку users или None."""
+
+    @abc.abstractmethod
+    async def upsert_user(self, user_id: int, full_name: str, registration_date: str | None = None):
+        """Создаёт пользователя или обновляет его имя."""
+
+    @abc.abstractmethod
+    async def set_active_course(self, user_id: int, course_id: str | None):
+        """Устанавливает active_course_id пользователя."""
+
+    # user_courses
+    @abc.abstractmethod
+    async def get_user_course(self, user_id: int, course_id: str) -> dict | None:
+        """Возвращает запись user_courses или None."""
+
+    @abc.abstractmethod
+    async def add_user_course(self, user_id: int, course_id: str, course_type: str, tariff: str, progress: int = 1):
+        """Добавляет курс пользователю (повторная запись игнорируется)."""
+
+    @abc.abstractmethod
+    async def list_user_courses(self, user_id: int) -> list[dict]:
+        """Список курсов пользователя в порядке course_id."""
+
+    @abc.abstractmethod
+    async def set_progress(self, user_id: int, course_id: str, progress: int) -> bool:
+        """Обновляет номер текущего урока. True, если запись найдена."""
+
+    @abc.abstractmethod
+    async def set_course_tariff(self, user_id: int, course_id: str, tariff: str) -> bool:
+        """Меняет тариф курса пользователя. True, если запись найдена."""
+
+    # homeworks
+    @abc.abstractmethod
+    async def add_homework(self, user_id: int, course_id: str, lesson: int, file_id: str | None,
+                           file_type: str | None, status: str = "pending") -> int:
+        """Сохраняет домашку и возвращает hw_id."""
+
+    @abc.abstractmethod
+    async def get_homework(self, hw_id: int) -> dict | None:
+        """Возвращает домашку по hw_id."""
+
+    @abc.abstractmethod
+    async def get_last_homework(self, user_id: int, course_id: str) -> dict | None:
+        """Последняя домашка по курсу (наибольший урок, затем наибольший hw_id)."""
+
+    @abc.abstractmethod
+    async def set_homework_status(self, hw_id: int, status: str, admin_comment: str | None = None) -> bool:
+        """Меняет статус домашки. True, если домашка найдена."""
+
+    @abc.abstractmethod
+    async def list_homeworks(self, user_id: int, course_id: str | None = None) -> list[dict]:
+        """Домашки пользователя, новые первыми."""
+
+    # tokens
+    @abc.abstractmethod
+    async def get_tokens(self, user_id: int) -> int:
+        """Баланс жетонов (0, если записи нет)."""
+
+    @abc.abstractmethod
+    async def add_tokens(self, user_id: int, amount: int, reason: str, action: str = "earn") -> int:
+        """Начисляет жетоны, пишет транзакцию и возвращает новый баланс."""
+
+    @abc.abstractmethod
+    async def spend_tokens(self, user_id: int, amount: int, reason: str) -> int:
+        """Списывает жетоны или бросает InsufficientTokensError. Возвращает новый баланс."""
+
+    @abc.abstractmethod
+    async def list_transactions(self, user_id: int) -> list[dict]:
+        """Транзакции пользователя в порядке записи."""
+
+    # user_settings
+    @abc.abstractmethod
+    async def get_settings(self, user_id: int) -> dict | None:
+        """Настройки напоминаний или None."""
+
+    @abc.abstractmethod
+    async def set_notification(self, user_id: int, kind: str, value: str | None):
+        """Устанавливает утреннее ('morning') или вечернее ('evening') напоминание."""
+
+    # homework_rejections
+    @abc.abstractmethod
+    async def add_rejection(self, user_id: int, course_id: str, lesson: int, reason: str) -> int:
+        """Записывает отказ и возвращает rejection_id."""
+
+    @abc.abstractmethod
+    async def list_rejections(self, user_id: int, course_id: str, lesson: int | None = None) -> list[dict]:
+        """Отказы по курсу (или по уроку), новые первыми."""
+
+
+def _notification_column(kind: str) -> str:
+    if kind not in NOTIFICATION_COLUMNS:
+        raise ValueError(f"Неизвестный тип напоминания: {kind}")
+    return NOTIFICATION_COLUMNS[kind]
+
+
+class SQLiteRepository(BaseRepository):
+    """Бэкенд поверх sqlite3. Может работать на соединении DatabaseConnection."""
+
+    def __init__(self, conn: sqlite3.Connection | None = None, db_file: str | None = None,
+                 archive_dir: str = ARCHIVE_DB_DIR):
+        self._owns_connection = conn is None
+        self.conn = conn if conn is not None else sqlite3.connect(db_file or ":memory:")
+        self.archive_dir = archive_dir
+
+    def _fetchone(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cursor.description], row))
+
+    def _fetchall(self, sql, params=()):
+        cursor = self.conn.execute(sql, params)
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _fetchall_tiered(self, table, where, params, order_by, descending=False, user_id=None, columns=None):
+        """Как _fetchall, но вместе со строками ученика из месячных архивов (data_tiering)."""
+        columns = columns or [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+        db_file = next(row[2] for row in self.conn.execute("PRAGMA database_list") if row[1] == "main")
+        if db_file and archived_months(self.conn, table, user_id):
+            rows = read_tiered(db_file, table, columns, where, params, order_by, descending, user_id,
+                               archive_dir=self.archive_dir)
+            return [dict(zip(columns, row)) for row in rows]
+        direction = " DESC" if descending else ""
+        return self._fetchall(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE {where}"
+            f" ORDER BY {', '.join(column + direction for column in order_by)}",
+            params,
+        )
+
+    async def init_schema(self):
+        # Та же схема, что у create_all_tables; на рабочей базе всё уже создано
+        self.conn.executescript(BASE_SCHEMA)
+        self.conn.commit()
+
+    async def close(self):
+        if self._owns_connection:
+            self.conn.close()
+
+    async def get_user(self, user_id):
+        return self._fetchone("SELECT * FROM users WHERE user_id = ?", (user_id,))
+
+    async def upsert_user(self, user_id, full_name, registration_date=None):
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO users (user_id, full_name, registration_date)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET full_name = excluded.full_name
+                """,
+                (user_id, full_name, registration_date or _now_str()),
+            )
+
+    async def set_active_course(self, user_id, course_id):
+        with self.conn:
+            self.conn.execute("UPDATE users SET active_course_id = ? WHERE user_id = ?", (course_id, user_id))
+
+    async def get_user_course(self, user_id, course_id):
+        return self._fetchone(
+            "SELECT * FROM user_courses WHERE user_id = ? AND course_id = ?", (user_id, course_id)
+        )
+
+    async def add_user_course(self, user_id, course_id, course_type, tariff, progress=1):
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT OR IGNORE INTO user_courses (user_id, course_id, course_type, progress, tariff)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (user_id, course_id, course_type, progress, tariff),
+            )
+
+    async def list_user_courses(self, user_id):
+        return self._fetchall("SELECT * FROM user_courses WHERE user_id = ? ORDER BY course_id", (user_id,))
+
+    async def set_progress(self, user_id, course_id, progress):
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE user_courses SET progress = ? WHERE user_id = ? AND course_id = ?",
+                (progress, user_id, course_id),
+            )
+        return cursor.rowcount > 0
+
+    async def set_course_tariff(self, user_id, course_id, tariff):
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE user_courses SET tariff = ? WHERE user_id = ? AND course_id = ?",
+                (tariff, user_id, course_id),
+            )
+        return cursor.rowcount > 0
+
+    async def add_homework(self, user_id, course_id, lesson, file_id, file_type, status="pending"):
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                INSERT INTO homeworks (user_id, course_id, lesson, file_id, file_type, status, submission_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, course_id, lesson, file_id, file_type, status, _now_str()),
+            )
+        return cursor.lastrowid
+
+    async def get_homework(self, hw_id):
+        return self._fetchone("SELECT * FROM homeworks WHERE hw_id = ?", (hw_id,))
+
+    async def get_last_homework(self, user_id, course_id):
+        return self._fetchone(
+            """
+            SELECT * FROM homeworks WHERE user_id = ? AND course_id = ?
+            ORDER BY lesson DESC, hw_id DESC LIMIT 1
+            """,
+            (user_id, course_id),
+        )
+
+    async def set_homework_status(self, hw_id, status, admin_comment=None):
+        approval_time = _now_str() if status == "approved" else None
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                UPDATE homeworks
+                SET status = ?, admin_comment = COALESCE(?, admin_comment),
+                    approval_time = COALESCE(?, approval_time)
+                WHERE hw_id = ?
+                """,
+                (status, admin_comment, approval_time, hw_id),
+            )
+        return cursor.rowcount > 0
+
+    async def list_homeworks(self, user_id, course_id=None):
+        order_by = ("submission_time", "hw_id")  # история - по времени сдачи, как в hw_history
+        if course_id is None:
+            return self._fetchall_tiered("homeworks", "user_id = ?", (user_id,), order_by, True, user_id)
+        return self._fetchall_tiered(
+            "homeworks", "user_id = ? AND course_id = ?", (user_id, course_id), order_by, True, user_id
+        )
+
+    async def get_tokens(self, user_id):
+        row = self.conn.execute("SELECT tokens FROM user_tokens WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    async def add_tokens(self, user_id, amount, reason, action="earn"):
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO user_tokens (user_id, tokens) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET tokens = tokens + excluded.tokens
+                """,
+                (user_id, amount),
+            )
+            self.conn.execute(
+                "INSERT INTO transactions (user_id, action, amount, reason) VALUES (?, ?, ?, ?)",
+                (user_id, action, amount, reason),
+            )
+        return await self.get_tokens(user_id)
+
+    async def spend_tokens(self, user_id, amount, reason):
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE user_tokens SET tokens = tokens - ? WHERE user_id = ? AND tokens >= ?",
+                (amount, user_id, amount),
+            )
+            if cursor.rowcount == 0:
+                raise InsufficientTokensError("Недостаточно жетонов")
+            self.conn.execute(
+                "INSERT INTO transactions (user_id, action, amount, reason) VALUES (?, ?, ?, ?)",
+                (user_id, "spend", amount, reason),
+            )
+        return await self.get_tokens(user_id)
+
+    async def list_transactions(self, user_id):
+        return self._fetchall_tiered(
+            "transactions", "user_id = ?", (user_id,), ("id",), user_id=user_id,
+            columns=["id", "user_id", "action", "amount", "reason"],
+        )
+
+    async def get_settings(self, user_id):
+        return self._fetchone(
+            "SELECT morning_notification, evening_notification FROM user_settings WHERE user_id = ?",
+            (user_id,),
+        )
+
+    async def set_notification(self, user_id, kind, value):
+        column = _notification_column(kind)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO user_settings (user_id) VALUES (?)", (user_id,))
+            self.conn.execute(f"UPDATE user_settings SET {column} = ? WHERE user_id = ?", (value, user_id))
+
+    async def add_rejection(self, user_id, course_id, lesson, reason):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO homework_rejections (user_id, course_id, lesson, reason) VALUES (?, ?, ?, ?)",
+                (user_id, course_id, lesson, reason),
+            )
+        return cursor.lastrowid
+
+    async def list_rejections(self, user_id, course_id, lesson=None):
+        if lesson is None:
+            return self._fetchall_tiered(
+                "homework_rejections", "user_id = ? AND course_id = ?", (user_id, course_id),
+                ("rejection_id",), True, user_id,
+            )
+        return self._fetchall_tiered(
+            "homework_rejections", "user_id = ? AND course_id = ? AND lesson = ?", (user_id, course_id, lesson),
+            ("rejection_id",), True, user_id,
+        )
+
+
+class InMemoryRepository(BaseRepository):
+    """Бэкенд на словарях. Без I/O - для тестов и бенчмарков."""
+
+    def __init__(self):
+        self.users = {}
+        self.user_courses = {}
+        self.homeworks = {}
+        self.tokens = {}
+        self.transactions = []
+        self.settings = {}
+        self.rejections = {}
+        self._hw_seq = 0
+        self._tx_seq = 0
+        self._rejection_seq = 0
+
+    async def init_schema(self):
+        pass
+
+    async def get_user(self, user_id):
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+    async def upsert_user(self, user_id, full_name, registration_date=None):
+        if user_id in self.users:
+            self.users[user_id]["full_name"] = full_name
+        else:
+            self.users[user_id] = {
+                "user_id": user_id,
+                "full_name": full_name,
+                "registration_date": registration_date or _now_str(),
+                "active_course_id": None,
+                "tariff": None,
+                "trust_credit": 0,
+            }
+
+    async def set_active_course(self, user_id, course_id):
+        if user_id in self.users:
+            self.users[user_id]["active_course_id"] = course_id
+
+    async def get_user_course(self, user_id, course_id):
+        record = self.user_courses.get((user_id, course_id))
+        return dict(record) if record else None
+
+    async def add_user_course(self, user_id, course_id, course_type, tariff, progress=1):
+        self.user_courses.setdefault((user_id, course_id), {
+            "user_id": user_id,
+            "course_id": course_id,
+            "course_type": course_type,
+            "progress": progress,
+            "purchase_date": _now_str(),
+            "tariff": tariff,
+        })
+
+    async def list_user_courses(self, user_id):
+        return [dict(r) for key, r in sorted(self.user_courses.items()) if key[0] == user_id]
+
+    async def set_progress(self, user_id, course_id, progress):
+        record = self.user_courses.get((user_id, course_id))
+        if record is None:
+            return False
+        record["progress"] = progress
+        return True
+
+    async def set_course_tariff(self, user_id, course_id, tariff):
+        record = self.user_courses.get((user_id, course_id))
+        if record is None:
+            return False
+        record["tariff"] = tariff
+        return True
+
+    async def add_homework(self, user_id, course_id, lesson, file_id, file_type, status="pending"):
+        self._hw_seq += 1
+        self.homeworks[self._hw_seq] = {
+            "hw_id": self._hw_seq,
+            "user_id": user_id,
+            "course_id": course_id,
+            "lesson": lesson,
+            "file_id": file_id,
+            "file_type": file_type,
+            "status": status,
+            "submission_time": _now_str(),
+            "approval_time": None,
+            "admin_comment": None,
+        }
+        return self._hw_seq
+
+    async def get_homework(self, hw_id):
+        hw = self.homeworks.get(hw_id)
+        return dict(hw) if hw else None
+
+    async def get_last_homework(self, user_id, course_id):
+        candidates = [hw for hw in self.homeworks.values()
+                      if hw["user_id"] == user_id and hw["course_id"] == course_id]
+        if not candidates:
+            return None
+        return dict(max(candidates, key=lambda hw: (hw["lesson"], hw["hw_id"])))
+
+    async def set_homework_status(self, hw_id, status, admin_comment=None):
+        hw = self.homeworks.get(hw_id)
+        if hw is None:
+            return False
+        hw["status"] = status
+        if admin_comment is not None:
+            hw["admin_comment"] = admin_comment
+        if status == "approved":
+            hw["approval_time"] = _now_str()
+        return True
+
+    async def list_homeworks(self, user_id, course_id=None):
+        result = [dict(hw) for hw in self.homeworks.values()
+                  if hw["user_id"] == user_id and (course_id is None or hw["course_id"] == course_id)]
+        return sorted(result, key=lambda hw: (hw["submission_time"] is not None, hw["submission_time"] or "",
+                                              hw["hw_id"]), reverse=True)
+
+    async def get_tokens(self, user_id):
+        return self.tokens.get(user_id, 0)
+
+    def _log_transaction(self, user_id, action, amount, reason):
+        self._tx_seq += 1
+        self.transactions.append(
+            {"id": self._tx_seq, "user_id": user_id, "action": action, "amount": amount, "reason": reason}
+        )
+
+    async def add_tokens(self, user_id, amount, reason, action="earn"):
+        self.tokens[user_id] = self.tokens.get(user_id, 0) + amount
+        self._log_transaction(user_id, action, amount, reason)
+        return self.tokens[user_id]
+
+    async def spend_tokens(self, user_id, amount, reason):
+        balance = self.tokens.get(user_id)
+        if balance is None or balance < amount:
+            raise InsufficientTokensError("Недостаточно жетонов")
+        self.tokens[user_id] = balance - amount
+        self._log_transaction(user_id, "spend", amount, reason)
+        return self.tokens[user_id]
+
+    async def list_transactions(self, user_id):
+        return [dict(t) for t in self.transactions if t["user_id"] == user_id]
+
+    async def get_settings(self, user_id):
+        settings = self.settings.get(user_id)
+        return dict(settings) if settings else None
+
+    async def set_notification(self, user_id, kind, value):
+        column = _notification_column(kind)
+        settings = self.settings.setdefault(
+            user_id, {"morning_notification": None, "evening_notification": None}
+        )
+        settings[column] = value
+
+    async def add_rejection(self, user_id, course_id, lesson, reason):
+        self._rejection_seq += 1
+        self.rejections[self._rejection_seq] = {
+            "rejection_id": self._rejection_seq,
+            "user_id": user_id,
+            "course_id": course_id,
+            "lesson": lesson,
+            "reason": reason,
+            "rejected_at": _now_str(),
+        }
+        return self._rejection_seq
+
+    async def list_rejections(self, user_id, course_id, lesson=None):
+        result = [dict(r) for r in self.rejections.values()
+                  if r["user_id"] == user_id and r["course_id"] == course_id
+                  and (lesson is None or r["lesson"] == lesson)]
+        return sorted(result, key=lambda r: r["rejection_id"], reverse=True)
+
+
+class PostgresRepository(BaseRepository):
+    """Бэкенд PostgreSQL на пуле соединений asyncpg."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            full_name TEXT NOT NULL DEFAULT 'ЧЕБУРАШКА',
+            birthday TEXT,
+            registration_date TEXT,
+            referral_count INTEGER DEFAULT 0,
+            tariff TEXT,
+            next_lesson_time TEXT,
+            active_course_id TEXT,
+            last_bonus_date TEXT,
+            trust_credit INTEGER DEFAULT 0,
+            support_requests INTEGER DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS user_courses (
+            user_id BIGINT,
+            course_id TEXT,
+            course_type TEXT,
+            progress INTEGER DEFAULT 0,
+            purchase_date TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS'),
+            tariff TEXT,
+            PRIMARY KEY (user_id, course_id)
+        );
+        CREATE TABLE IF NOT EXISTS homeworks (
+            hw_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            course_id TEXT,
+            lesson INTEGER,
+            file_id TEXT,
+            file_type TEXT,
+            status TEXT DEFAULT 'pending',
+            submission_time TEXT,
+            approval_time TEXT,
+            admin_comment TEXT
+        );
+        CREATE TABLE IF NOT EXISTS user_tokens (
+            user_id BIGINT PRIMARY KEY,
+            tokens INTEGER DEFAULT 3
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT,
+            action TEXT,
+            amount INTEGER,
+            reason TEXT,
+            timestamp TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+        );
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id BIGINT PRIMARY KEY,
+            morning_notification TEXT,
+            evening_notification TEXT,
+            show_example_homework BOOLEAN DEFAULT TRUE
+        );
+        CREATE TABLE IF NOT EXISTS homework_rejections (
+            rejection_id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            course_id TEXT NOT NULL,
+            lesson INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            rejected_at TEXT DEFAULT to_char(now(), 'YYYY-MM-DD HH24:MI:SS')
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_courses ON user_courses(user_id, course_id);
+        CREATE INDEX IF NOT EXISTS idx_homeworks ON homeworks(user_id, course_id, lesson);
+        CREATE INDEX IF NOT EXISTS idx_rejections ON homework_rejections(user_id, course_id, lesson);
+    """
+
+    def __init__(self, dsn: str, min_size: int = POSTGRES_POOL_MIN, max_size: int = POSTGRES_POOL_MAX):
+        if asyncpg is None:
+            raise RuntimeError("Для DB_BACKEND=postgres установите пакет asyncpg")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    async def _get_pool(self):
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+            logger.info(f"PostgresRepository: пул {self.min_size}..{self.max_size} соединений создан")
+        return self.pool
+
+    async def _fetchone(self, sql, *args):
+        pool = await self._get_pool()
+        row = await pool.fetchrow(sql, *args)
+        return dict(row) if row else None
+
+    async def _fetchall(self, sql, *args):
+        pool = await self._get_pool()
+        return [dict(row) for row in await pool.fetch(sql, *args)]
+
+    async def _execute(self, sql, *args):
+        pool = await self._get_pool()
+        status = await pool.execute(sql, *args)
+        # asyncpg возвращает тег команды вида "UPDATE 1"
+        return int(status.split()[-1]) if status and status.split()[-1].isdigit() else 0
+
+    async def init_schema(self):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(self.SCHEMA)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def get_user(self, user_id):
+        return await self._fetchone("SELECT * FROM users WHERE user_id = $1", user_id)
+
+    async def upsert_user(self, user_id, full_name, registration_date=None):
+        await self._execute(
+            """
+            INSERT INTO users (user_id, full_name, registration_date) VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE SET full_name = excluded.full_name
+            """,
+            user_id, full_name, registration_date or _now_str(),
+        )
+
+    async def set_active_course(self, user_id, course_id):
+        await self._execute("UPDATE users SET active_course_id = $1 WHERE user_id = $2", course_id, user_id)
+
+    async def get_user_course(self, user_id, course_id):
+        return await self._fetchone(
+            "SELECT * FROM user_courses WHERE user_id = $1 AND course_id = $2", user_id, course_id
+        )
+
+    async def add_user_course(self, user_id, course_id, course_type, tariff, progress=1):
+        await self._execute(
+            """
+            INSERT INTO user_courses (user_id, course_id, course_type, progress, tariff)
+            VALUES ($1, $2, $3, $4, $5) ON CONFLICT DO NOTHING
+            """,
+            user_id, course_id, course_type, progress, tariff,
+        )
+
+    async def list_user_courses(self, user_id):
+        return await self._fetchall("SELECT * FROM user_courses WHERE user_id = $1 ORDER BY course_id", user_id)
+
+    async def set_progress(self, user_id, course_id, progress):
+        return await self._execute(
+            "UPDATE user_courses SET progress = $1 WHERE user_id = $2 AND course_id = $3",
+            progress, user_id, course_id,
+        ) > 0
+
+    async def set_course_tariff(self, user_id, course_id, tariff):
+        return await self._execute(
+            "UPDATE user_courses SET tariff = $1 WHERE user_id = $2 AND course_id = $3",
+            tariff, user_id, course_id,
+        ) > 0
+
+    async def add_homework(self, user_id, course_id, lesson, file_id, file_type, status="pending"):
+        pool = await self._get_pool()
+        return await pool.fetchval(
+            """
+            INSERT INTO homeworks (user_id, course_id, lesson, file_id, file_type, status, submission_time)
+            VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING hw_id
+            """,
+            user_id, course_id, lesson, file_id, file_type, status, _now_str(),
+        )
+
+    async def get_homework(self, hw_id):
+        return await self._fetchone("SELECT * FROM homeworks WHERE hw_id = $1", hw_id)
+
+    async def get_last_homework(self, user_id, course_id):
+        return await self._fetchone(
+            """
+            SELECT * FROM homeworks WHERE user_id = $1 AND course_id = $2
+            ORDER BY lesson DESC, hw_id DESC LIMIT 1
+            """,
+            user_id, course_id,
+        )
+
+    async def set_homework_status(self, hw_id, status, admin_comment=None):
+        approval_time = _now_str() if status == "approved" else None
+        return await self._execute(
+            """
+            UPDATE homeworks
+            SET status = $1, admin_comment = COALESCE($2, admin_comment),
+                approval_time = COALESCE($3, approval_time)
+            WHERE hw_id = $4
+            """,
+            status, admin_comment, approval_time, hw_id,
+        ) > 0
+
+    async def list_homeworks(self, user_id, course_id=None):
+        if course_id is None:
+            return await self._fetchall(
+                "SELECT * FROM homeworks WHERE user_id = $1 ORDER BY submission_time DESC NULLS LAST, hw_id DESC",
+                user_id,
+            )
+        return await self._fetchall(
+            "SELECT * FROM homeworks WHERE user_id = $1 AND course_id = $2"
+            " ORDER BY submission_time DESC NULLS LAST, hw_id DESC",
+            user_id, course_id,
+        )
+
+    async def get_tokens(self, user_id):
+        pool = await self._get_pool()
+        tokens = await pool.fetchval("SELECT tokens FROM user_tokens WHERE user_id = $1", user_id)
+        return tokens or 0
+
+    async def add_tokens(self, user_id, amount, reason, action="earn"):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                balance = await conn.fetchval(
+                    """
+                    INSERT INTO user_tokens (user_id, tokens) VALUES ($1, $2)
+                    ON CONFLICT (user_id) DO UPDATE SET tokens = user_tokens.tokens + excluded.tokens
+                    RETURNING tokens
+                    """,
+                    user_id, amount,
+                )
+                await conn.execute(
+                    "INSERT INTO transactions (user_id, action, amount, reason) VALUES ($1, $2, $3, $4)",
+                    user_id, action, amount, reason,
+                )
+        return balance
+
+    async def spend_tokens(self, user_id, amount, reason):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                balance = await conn.fetchval(
+                    """
+                    UPDATE user_tokens SET tokens = tokens - $1
+                    WHERE user_id = $2 AND tokens >= $1 RETURNING tokens
+                    """,
+                    amount, user_id,
+                )
+                if balance is None:
+                    raise InsufficientTokensError("Недостаточно жетонов")
+                await conn.execute(
+                    "INSERT INTO transactions (user_id, action, amount, reason) VALUES ($1, $2, $3, $4)",
+                    user_id, "spend", amount, reason,
+                )
+        return balance
+
+    async def list_transactions(self, user_id):
+        return await self._fetchall(
+            "SELECT id, user_id, action, amount, reason FROM transactions WHERE user_id = $1 ORDER BY id",
+            user_id,
+        )
+
+    async def get_settings(self, user_id):
+        return await self._fetchone(
+            "SELECT morning_notification, evening_notification FROM user_settings WHERE user_id = $1",
+            user_id,
+        )
+
+    async def set_notification(self, user_id, kind, value):
+        column = _notification_column(kind)
+        await self._execute(
+            f"""
+            INSERT INTO user_settings (user_id, {column}) VALUES ($1, $2)
+            ON CONFLICT (user_id) DO UPDATE SET {column} = excluded.{column}
+            """,
+            user_id, value,
+        )
+
+    async def add_rejection(self, user_id, course_id, lesson, reason):
+        pool = await self._get_pool()
+        return await pool.fetchval(
+            """
+            INSERT INTO homework_rejections (user_id, course_id, lesson, reason)
+            VALUES ($1, $2, $3, $4) RETURNING rejection_id
+            """,
+            user_id, course_id, lesson, reason,
+        )
+
+    async def list_rejections(self, user_id, course_id, lesson=None):
+        if lesson is None:
+            return await self._fetchall(
+                """
+                SELECT * FROM homework_rejections WHERE user_id = $1 AND course_id = $2
+                ORDER BY rejection_id DESC
+                """,
+                user_id, course_id,
+            )
+        return await self._fetchall(
+            """
+            SELECT * FROM homework_rejections WHERE user_id = $1 AND course_id = $2 AND lesson = $3
+            ORDER BY rejection_id DESC
+            """,
+            user_id, course_id, lesson,
+        )
+
+
+def create_repository(backend: str | None = None, conn: sqlite3.Connection | None = None,
+                      db_file: str | None = None, dsn: str | None = None) -> BaseRepository:
+    """Создаёт репозиторий выбранного бэкенда (по умолчанию из DB_BACKEND)."""
+    backend = (backend or DB_BACKEND).lower()
+    logger.info(f"create_repository: бэкенд {backend}")
+    if backend == "sqlite":
+        return SQLiteRepository(conn=conn, db_file=db_file)
+    if backend == "memory":
+        return InMemoryRepository()
+    if backend == "postgres":
+        dsn = dsn or POSTGRES_DSN
+        if not dsn:
+            raise ValueError("Для DB_BACKEND=postgres задайте POSTGRES_DSN")
+        return PostgresRepository(dsn)
+    raise ValueError(f"Неизвестный бэкенд базы данных: {backend}")
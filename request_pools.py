@@ -0,0 +1,203 @@
+# request_pools.py
+"""Раздельные HTTP-пулы Bot API: быстрые вызовы и загрузки файлов.
+
+По умолчанию у Application один HTTPXRequest на всё. Несколько загрузок
+видео и аудио из send_as_new_file занимают его соединения, и
+query.answer(), send_message ждут в очереди пула до pool_timeout.
+
+RoutedRequest держит два пула и выбирает пул для каждого вызова:
+- upload - вызовы, в которых реально есть файл (RequestData.contains_files):
+  sendVideo/sendAudio/sendDocument/sendMediaGroup с содержимым с диска;
+- interactive - всё остальное, включая отправку по file_id.
+
+У каждого пула свои размер, keep-alive и таймауты (переменные окружения
+BOT_API_<ПУЛ>_*), и свои метрики: запросы, ошибки, таймауты ожидания
+соединения, одновременные запросы, задержки. getUpdates идёт отдельным
+запросом PTB и сюда не попадает.
+
+Методы загрузки PTB (send_video, send_document, ...) сами передают
+write_timeout=20, и таймаут пула до них не доходил бы. Поэтому для вызова
+с файлом write_timeout не меньше настроенного у пула; больший, указанный
+в месте вызова, сохраняется.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import httpx
+from telegram.error import NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class PoolConfig:
+    name: str
+    size: int
+    keepalive: int  # сколько простаивающих соединений держать открытыми
+    keepalive_expiry: float  # через сколько секунд простоя закрывать соединение
+    connect_timeout: float
+    read_timeout: float
+    write_timeout: float
+    pool_timeout: float  # ожидание свободного соединения
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "PoolConfig":
+        """BOT_API_INTERACTIVE_SIZE=16, BOT_API_UPLOAD_WRITE_TIMEOUT=120 и т.п. поверх defaults."""
+        values = {}
+        for field, default in defaults.items():
+            raw = os.getenv(f"BOT_API_{name.upper()}_{field.upper()}")
+            values[field] = type(default)(raw) if raw else default
+        return cls(name=name, **values)
+
+
+INTERACTIVE_POOL = PoolConfig.from_env(
+    "interactive", size=16, keepalive=8, keepalive_expiry=30.0,
+    connect_timeout=5.0, read_timeout=10.0, write_timeout=10.0, pool_timeout=2.0,
+)
+UPLOAD_POOL = PoolConfig.from_env(
+    "upload", size=4, keepalive=2, keepalive_expiry=15.0,
+    connect_timeout=10.0, read_timeout=120.0, write_timeout=120.0, pool_timeout=30.0,
+)
+
+
+class PoolMetrics:
+    """Счётчики одного пула."""
+
+    __slots__ = ("requests", "errors", "timeouts", "pool_timeouts", "in_flight", "max_in_flight", "total_seconds",
+                 "max_seconds", "methods")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.pool_timeouts = 0  # не дождались свободного соединения - пул мал для нагрузки
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.methods = Counter()
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "pool_timeouts": self.pool_timeouts,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "avg_ms": self.total_seconds / self.requests * 1000 if self.requests else None,
+            "max_ms": self.max_seconds * 1000,
+            "top_methods": self.methods.most_common(5),
+        }
+
+
+class PooledRequest(HTTPXRequest):
+    """HTTPXRequest с настройкой keep-alive и метриками."""
+
+    def __init__(self, config: PoolConfig):
+        super().__init__(
+            connection_pool_size=config.size,
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+            write_timeout=config.write_timeout,
+            pool_timeout=config.pool_timeout,
+        )
+        self.config = config
+        self.metrics = PoolMetrics()
+        # HTTPXRequest задаёт keep-alive равным размеру пула и без срока - пересобираем клиент со своими лимитами
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=config.size,
+            max_keepalive_connections=config.keepalive,
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        self._client = self._build_client()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        if request_data is not None and request_data.contains_files and isinstance(write_timeout, (int, float)):
+            write_timeout = max(write_timeout, self.config.write_timeout)
+        metrics = self.metrics
+        metrics.requests += 1
+        metrics.methods[url.rsplit("/", 1)[-1]] += 1
+        metrics.in_flight += 1
+        metrics.max_in_flight = max(metrics.max_in_flight, metrics.in_flight)
+        started = time.monotonic()
+        try:
+            return await super().do_request(url, method, request_data, read_timeout, write_timeout,
+                                            connect_timeout, pool_timeout)
+        except TimedOut as e:
+            metrics.errors += 1
+            metrics.timeouts += 1
+            if "pool" in str(e).lower():
+                metrics.pool_timeouts += 1
+            raise
+        except NetworkError:
+            metrics.errors += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            metrics.in_flight -= 1
+            metrics.total_seconds += elapsed
+            metrics.max_seconds = max(metrics.max_seconds, elapsed)
+
+
+class RoutedRequest(BaseRequest):
+    """Отправляет вызовы с файлами в пул загрузок, остальные - в интерактивный пул."""
+
+    def __init__(self, interactive: BaseRequest, upload: BaseRequest):
+        self.interactive = interactive
+        self.upload = upload
+
+    @property
+    def pools(self) -> dict:
+        return {"interactive": self.interactive, "upload": self.upload}
+
+    async def initialize(self):
+        await self.interactive.initialize()
+        await self.upload.initialize()
+
+    async def shutdown(self):
+        await self.interactive.shutdown()
+        await self.upload.shutdown()
+
+    def route(self, request_data) -> BaseRequest:
+        return self.upload if request_data is not None and request_data.contains_files else self.interactive
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        return await self.route(request_data).do_request(url, method, request_data, read_timeout, write_timeout,
+                                                         connect_timeout, pool_timeout)
+
+    def metrics(self) -> dict:
+        return {name: pool.metrics.snapshot() for name, pool in self.pools.items() if hasattr(pool, "metrics")}
+
+
+def build_bot_request(interactive: PoolConfig = INTERACTIVE_POOL, upload: PoolConfig = UPLOAD_POOL) -> RoutedRequest:
+    logger.info(f"build_bot_request: пулы Bot API {interactive} и {upload}")
+    return RoutedRequest(PooledRequest(interactive), PooledRequest(upload))
+
+
+def format_pool_metrics(request: RoutedRequest) -> str:
+    """Текст для админа: по пулу - лимиты, нагрузка и задержки."""
+    text = "🌐 Пулы Bot API:\n"
+    for name, pool in request.pools.items():
+        config = getattr(pool, "config", None)
+        if config is None:
+            continue
+        stats = pool.metrics.snapshot()
+        avg = f"{stats['avg_ms']:.0f}" if stats["avg_ms"] is not None else "-"
+        text += (f"\n{name}: {config.size} соединений, keep-alive {config.keepalive}"
+                 f" на {config.keepalive_expiry:g} с, ожидание соединения {config.pool_timeout:g} с\n")
+        text += (f"Запросов: {stats['requests']}, ошибок: {stats['errors']} (таймаутов {stats['timeouts']},"
+                 f" из них ожидания соединения {stats['pool_timeouts']})\n"
+                 f"Сейчас в работе: {stats['in_flight']}, максимум: {stats['max_in_flight']}\n"
+                 f"Задержка: средняя {avg} мс, максимум {stats['max_ms']:.0f} мс\n")
+        if stats["top_methods"]:
+            text += "Методы: " + ", ".join(f"{method} {count}" for method, count in stats["top_methods"]) + "\n"
+    return text.rstrip()
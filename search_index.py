@@ -0,0 +1,324 @@
+# search_index.py
+"""Полнотекстовый поиск FTS5 для админов.
+
+Что ищется:
+- support - обращения в поддержку. Раньше они только пересылались в
+  группу админов, теперь сохраняются в support_tickets;
+- rejections - причины отказов (homework_rejections.reason);
+- comments - комментарии админов к домашкам (homeworks.admin_comment);
+- lessons - тексты уроков из courses/*/lesson*.{md,html,txt}.
+
+Первые три индекса - FTS5 с внешним содержимым (content=...). Текст не
+дублируется, индекс держат в актуальном состоянии триггеры на вставку,
+изменение и удаление.
+
+Отказы и комментарии старых домашек data_tiering переносит в месячные
+архивы, и триггер удаления убирает их из индексов с внешним содержимым.
+Чтобы старые причины и комментарии находились, перед удалением их текст
+копируется в archived_fts (keep_archived_text, в той же транзакции, что и
+удаление). Это FTS5 со своим текстом: копируется только текст и ключи
+попадания, а не строки целиком. Архивы, сделанные до появления archived_fts,
+индексируются при его создании (index_archive_files).
+
+Уроки лежат в файлах, поэтому lessons_fts хранит свой текст (без разметки)
+и переиндексируется sync_lesson_index при старте, только для файлов с
+изменившимися mtime или размером.
+
+search() возвращает одну страницу результатов по всем источникам,
+упорядоченных по bm25, со сниппетами.
+"""
+import glob
+import logging
+import os
+import re
+import sqlite3
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+SEARCH_PAGE_SIZE = 5
+SEARCH_SNIPPET_TOKENS = 12
+TOKENIZER = "unicode61 remove_diacritics 2"
+LESSON_FILE = re.compile(r"^lesson(\d+)\.(md|html|txt)$")
+MARKUP = re.compile(r"<[^>]+>|[*_`~\[\]]")
+
+# источник -> (подпись, FTS-таблица, таблица содержимого, ключ, колонка текста)
+SEARCH_SOURCES = {
+    "support": ("Поддержка", "support_fts", "support_tickets", "ticket_id", "text"),
+    "rejections": ("Отказ", "rejections_fts", "homework_rejections", "rejection_id", "reason"),
+    "comments": ("Комментарий", "homework_comments_fts", "homeworks", "hw_id", "admin_comment"),
+    "lessons": ("Урок", "lessons_fts", None, None, "body"),
+}
+# источники, строки которых data_tiering переносит в архивы
+ARCHIVED_SOURCES = ("rejections", "comments")
+ARCHIVE_FILES = "archive_*.sqlite"
+
+
+@dataclass(frozen=True, slots=True)
+class SearchHit:
+    source: str
+    ref_id: int
+    score: float
+    snippet: str
+    user_id: int | None
+    course_id: str | None
+    lesson: int | None
+
+
+def _exists(conn: sqlite3.Connection, name: str) -> bool:
+    return _exists_in(conn, "main", name)
+
+
+def _exists_in(conn: sqlite3.Connection, schema: str, name: str) -> bool:
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def _external_index(conn: sqlite3.Connection, fts: str, table: str, key: str, column: str):
+    """FTS5 с внешним содержимым и триггеры синхронизации. Новый индекс заполняется из таблицы."""
+    created = not _exists(conn, fts)
+    conn.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            {column}, content='{table}', content_rowid='{key}', tokenize='{TOKENIZER}'
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_ai AFTER INSERT ON {table}
+        WHEN NEW.{column} IS NOT NULL BEGIN
+            INSERT INTO {fts}(rowid, {column}) VALUES (NEW.{key}, NEW.{column});
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_ad AFTER DELETE ON {table}
+        WHEN OLD.{column} IS NOT NULL BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', OLD.{key}, OLD.{column});
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_{fts}_au AFTER UPDATE OF {column} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {column}) SELECT 'delete', OLD.{key}, OLD.{column}
+                WHERE OLD.{column} IS NOT NULL;
+            INSERT INTO {fts}(rowid, {column}) SELECT NEW.{key}, NEW.{column} WHERE NEW.{column} IS NOT NULL;
+        END;
+        """
+    )
+    if created:
+        # rebuild индексировал бы и NULL-строки как пустые - заполняем сами, как триггер вставки
+        conn.execute(f"INSERT INTO {fts}(rowid, {column}) SELECT {key}, {column} FROM {table}"
+                     f" WHERE {column} IS NOT NULL")
+        logger.info(f"search_index: индекс {fts} построен по {table}")
+
+
+def _archived_rows_sql(schema: str, source: str) -> str:
+    """SELECT строк источника для archived_fts (без условия по ключам)."""
+    _, _, table, key, column = SEARCH_SOURCES[source]
+    return (f"SELECT '{source}', {key}, user_id, course_id, lesson, {column} FROM {schema}.{table}"
+            f" WHERE {column} IS NOT NULL")
+
+
+def keep_archived_text(conn: sqlite3.Connection, table: str, keys: list):
+    """Копирует в archived_fts текст строк table, уходящих в архив (коммит - на вызывающей стороне)."""
+    if not keys or not _exists(conn, "archived_fts"):
+        return
+    marks = ", ".join("?" * len(keys))
+    for source in ARCHIVED_SOURCES:
+        _, _, source_table, key, _ = SEARCH_SOURCES[source]
+        if source_table == table:
+            conn.execute(f"INSERT INTO archived_fts {_archived_rows_sql('main', source)} AND {key} IN ({marks})",
+                         keys)
+
+
+def index_archive_files(conn: sqlite3.Connection, archive_dir: str) -> int:
+    """Индексирует в archived_fts строки уже существующих месячных архивов. Возвращает число строк."""
+    conn.commit()  # ATTACH невозможен внутри открытой транзакции
+    indexed = 0
+    for path in sorted(glob.glob(os.path.join(archive_dir, ARCHIVE_FILES))):
+        conn.execute("ATTACH DATABASE ? AS cold_search", (path,))
+        try:
+            with conn:
+                for source in ARCHIVED_SOURCES:
+                    table = SEARCH_SOURCES[source][2]
+                    if _exists_in(conn, "cold_search", table):
+                        indexed += conn.execute(f"INSERT INTO archived_fts {_archived_rows_sql('cold_search', source)}"
+                                                ).rowcount
+        finally:
+            conn.execute("DETACH DATABASE cold_search")
+    if indexed:
+        logger.info(f"search_index: в archived_fts проиндексировано строк архивов: {indexed}")
+    return indexed
+
+
+def create_search_tables(conn: sqlite3.Connection, cursor: sqlite3.Cursor, archive_dir: str | None = None):
+    """Обращения в поддержку и индексы FTS5 (homeworks и homework_rejections должны уже существовать).
+
+    archive_dir - каталог месячных архивов: при создании archived_fts в него попадут уже архивные строки.
+    """
+    cursor.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS support_tickets (
+            ticket_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            text TEXT,
+            photo_file_id TEXT,
+            created_at INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_support_tickets_user ON support_tickets(user_id, created_at);
+
+        CREATE TABLE IF NOT EXISTS lesson_search_files (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        """
+    )
+    for _, fts, table, key, column in SEARCH_SOURCES.values():
+        if table is not None:
+            _external_index(conn, fts, table, key, column)
+    cursor.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS lessons_fts USING fts5(
+            course_id UNINDEXED, lesson UNINDEXED, path UNINDEXED, body, tokenize='{TOKENIZER}'
+        )
+        """
+    )
+    archived_created = not _exists(conn, "archived_fts")
+    cursor.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS archived_fts USING fts5(
+            source UNINDEXED, ref_id UNINDEXED, user_id UNINDEXED, course_id UNINDEXED, lesson UNINDEXED, body,
+            tokenize='{TOKENIZER}'
+        )
+        """
+    )
+    conn.commit()
+    if archived_created and archive_dir is not None:
+        index_archive_files(conn, archive_dir)
+
+
+def add_support_ticket(cursor: sqlite3.Cursor, user_id: int, text: str | None, photo_file_id: str | None,
+                       created_at: int) -> int:
+    """Сохраняет обращение (коммит - на вызывающей стороне). Индекс обновит триггер."""
+    cursor.execute(
+        "INSERT INTO support_tickets (user_id, text, photo_file_id, created_at) VALUES (?, ?, ?, ?)",
+        (user_id, text, photo_file_id, created_at),
+    )
+    return cursor.lastrowid
+
+
+def _plain_text(text: str) -> str:
+    return MARKUP.sub(" ", text.lstrip("\ufeff"))
+
+
+def sync_lesson_index(conn: sqlite3.Connection, courses_dir: str = "courses") -> dict:
+    """Переиндексирует изменившиеся файлы уроков. Возвращает {'indexed': n, 'removed': n, 'unchanged': n}."""
+    known = {path: (mtime, size) for path, mtime, size in conn.execute("SELECT * FROM lesson_search_files")}
+    seen = set()
+    stats = {"indexed": 0, "removed": 0, "unchanged": 0}
+    with conn:
+        for course_id in sorted(os.listdir(courses_dir)) if os.path.isdir(courses_dir) else []:
+            course_path = os.path.join(courses_dir, course_id)
+            if not os.path.isdir(course_path):
+                continue
+            for name in sorted(os.listdir(course_path)):
+                match = LESSON_FILE.match(name)
+                if not match:
+                    continue
+                path = os.path.join(course_path, name)
+                stat = os.stat(path)
+                seen.add(path)
+                if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                    stats["unchanged"] += 1
+                    continue
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        body = _plain_text(f.read())
+                except UnicodeDecodeError:
+                    logger.warning(f"sync_lesson_index: {path} не в utf-8, пропущен")
+                    continue
+                conn.execute("DELETE FROM lessons_fts WHERE path = ?", (path,))
+                conn.execute("INSERT INTO lessons_fts (course_id, lesson, path, body) VALUES (?, ?, ?, ?)",
+                             (course_id, int(match.group(1)), path, body))
+                conn.execute("INSERT OR REPLACE INTO lesson_search_files VALUES (?, ?, ?)",
+                             (path, stat.st_mtime_ns, stat.st_size))
+                stats["indexed"] += 1
+        for path in set(known) - seen:
+            conn.execute("DELETE FROM lessons_fts WHERE path = ?", (path,))
+            conn.execute("DELETE FROM lesson_search_files WHERE path = ?", (path,))
+            stats["removed"] += 1
+    logger.info(f"sync_lesson_index: {stats}")
+    return stats
+
+
+def match_expression(query: str) -> str | None:
+    """Запрос пользователя -> безопасное выражение MATCH: все слова, каждое как префикс."""
+    words = re.findall(r"\w+", query.lower())
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def search_statements(query: str, sources=None, page: int = 0, page_size: int = SEARCH_PAGE_SIZE) -> list | None:
+    """Запросы (страница результатов, общее число) для AnalyticsPool.fetch_snapshot или None для пустого запроса."""
+    expression = match_expression(query)
+    if expression is None:
+        return None
+    sources = sources or list(SEARCH_SOURCES)
+    parts, params = [], []
+    snippet = f"'[', ']', '…', {SEARCH_SNIPPET_TOKENS}"
+    if "support" in sources:
+        parts.append(f"""SELECT 'support', t.ticket_id, bm25(support_fts), snippet(support_fts, 0, {snippet}),
+                            t.user_id, NULL, NULL
+                     FROM support_fts JOIN support_tickets t ON t.ticket_id = support_fts.rowid
+                     WHERE support_fts MATCH ?""")
+    if "rejections" in sources:
+        parts.append(f"""SELECT 'rejections', r.rejection_id, bm25(rejections_fts), snippet(rejections_fts, 0, {snippet}),
+                            r.user_id, r.course_id, r.lesson
+                     FROM rejections_fts JOIN homework_rejections r ON r.rejection_id = rejections_fts.rowid
+                     WHERE rejections_fts MATCH ?""")
+    if "comments" in sources:
+        parts.append(f"""SELECT 'comments', h.hw_id, bm25(homework_comments_fts),
+                            snippet(homework_comments_fts, 0, {snippet}), h.user_id, h.course_id, h.lesson
+                     FROM homework_comments_fts JOIN homeworks h ON h.hw_id = homework_comments_fts.rowid
+                     WHERE homework_comments_fts MATCH ?""")
+    if "lessons" in sources:
+        parts.append(f"""SELECT 'lessons', rowid, bm25(lessons_fts), snippet(lessons_fts, 3, {snippet}),
+                            NULL, course_id, lesson
+                     FROM lessons_fts WHERE lessons_fts MATCH ?""")
+    params = [expression] * len(parts)
+    archived = [source for source in ARCHIVED_SOURCES if source in sources]
+    if archived:
+        parts.append(f"""SELECT source, ref_id, bm25(archived_fts), snippet(archived_fts, 5, {snippet}),
+                            user_id, course_id, lesson
+                     FROM archived_fts WHERE archived_fts MATCH ?
+                         AND source IN ({", ".join("?" * len(archived))})""")
+        params += [expression, *archived]
+    union = " UNION ALL ".join(parts)
+    return [
+        (f"SELECT * FROM ({union}) ORDER BY 3, 1, 2 LIMIT ? OFFSET ?", (*params, page_size, page * page_size)),
+        (f"SELECT COUNT(*) FROM ({union})", params),
+    ]
+
+
+def parse_results(results: list) -> tuple[list[SearchHit], int]:
+    """Результаты search_statements -> (попадания страницы, всего попаданий)."""
+    rows, ((total,),) = results
+    return [SearchHit(*row) for row in rows], total
+
+
+def search(conn: sqlite3.Connection, query: str, sources=None, page: int = 0,
+           page_size: int = SEARCH_PAGE_SIZE) -> tuple[list[SearchHit], int]:
+    """Одна страница результатов на обычном соединении."""
+    statements = search_statements(query, sources, page, page_size)
+    if statements is None:
+        return [], 0
+    return parse_results([conn.execute(sql, params).fetchall() for sql, params in statements])
+
+
+def format_search_results(query: str, hits: list[SearchHit], total: int, page: int,
+                          page_size: int = SEARCH_PAGE_SIZE) -> str:
+    if not total:
+        return f"🔎 По запросу «{query}» ничего не найдено."
+    pages = (total + page_size - 1) // page_size
+    text = f"🔎 «{query}»: найдено {total}, страница {page + 1} из {pages}\n"
+    for hit in hits:
+        label = SEARCH_SOURCES[hit.source][0]
+        where = []
+        if hit.user_id is not None:
+            where.append(f"ученик {hit.user_id}")
+        if hit.course_id is not None:
+            where.append(f"{hit.course_id}, урок {hit.lesson}")
+        details = f" ({'; '.join(where)})" if where else ""
+        text += f"\n{label} #{hit.ref_id}{details}:\n{' '.join(hit.snippet.split())}\n"
+    return text.rstrip()
@@ -0,0 +1,95 @@
+# tests/test_analytics.py
+"""Тесты read-only пула для отчётов."""
+import sqlite3
+
+import pytest
+
+from analytics import AnalyticsPool, AnalyticsTimeoutError
+from db_maintenance import apply_profile
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    """База в WAL с таблицей users на три записи."""
+    path = tmp_path / "bot_db.sqlite"
+    conn = sqlite3.connect(path)
+    apply_profile(conn)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, full_name TEXT)")
+    conn.executemany("INSERT INTO users VALUES (?, ?)", [(1, "А"), (2, "Б"), (3, "В")])
+    conn.commit()
+    yield str(path), conn
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_queries_and_snapshot(db_file):
+    """fetchall/fetchone/scalar и несколько запросов одним снимком."""
+    path, _ = db_file
+    pool = AnalyticsPool(path, size=1)
+    assert await pool.scalar("SELECT COUNT(*) FROM users") == 3
+    assert await pool.fetchone("SELECT full_name FROM users WHERE user_id = ?", (2,)) == ("Б",)
+    assert await pool.fetchone("SELECT full_name FROM users WHERE user_id = ?", (9,)) is None
+    count, names = await pool.fetch_snapshot([
+        ("SELECT COUNT(*) FROM users", ()),
+        ("SELECT full_name FROM users ORDER BY user_id", ()),
+    ])
+    assert count == [(3,)]
+    assert [n for (n,) in names] == ["А", "Б", "В"]
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_read_only(db_file):
+    """Через пул нельзя ничего записать."""
+    path, _ = db_file
+    pool = AnalyticsPool(path, size=1)
+    with pytest.raises(sqlite3.OperationalError):
+        await pool.fetchall("DELETE FROM users")
+    assert await pool.scalar("SELECT COUNT(*) FROM users") == 3
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl(db_file):
+    """С ttl результат берётся из кэша, invalidate сбрасывает кэш."""
+    path, writer = db_file
+    pool = AnalyticsPool(path, size=1)
+    assert await pool.scalar("SELECT COUNT(*) FROM users", ttl=60) == 3
+    writer.execute("INSERT INTO users VALUES (4, 'Г')")
+    writer.commit()
+    assert await pool.scalar("SELECT COUNT(*) FROM users", ttl=60) == 3
+    assert await pool.scalar("SELECT COUNT(*) FROM users") == 4
+    pool.invalidate()
+    assert await pool.scalar("SELECT COUNT(*) FROM users", ttl=60) == 4
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout_and_slow_log(db_file, caplog):
+    """Долгий запрос прерывается, медленные попадают в журнал."""
+    path, _ = db_file
+    pool = AnalyticsPool(path, size=1, statement_timeout=0.05, slow_query_seconds=0)
+    endless = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c"
+    with pytest.raises(AnalyticsTimeoutError):
+        await pool.scalar(endless)
+    assert pool.timeouts == 1
+
+    # после таймаута соединение вернулось в пул и работает
+    assert await pool.scalar("SELECT COUNT(*) FROM users") == 3
+    assert pool.slow_queries >= 1
+    assert "медленный запрос" in caplog.text
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_writer_not_blocked_by_open_snapshot(db_file):
+    """Пока отчёт держит снимок, запись проходит и отчёт её не видит."""
+    path, writer = db_file
+    reader = AnalyticsPool(path, size=1)._connect()
+    reader.execute("BEGIN")
+    assert reader.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 3
+    writer.execute("INSERT INTO users VALUES (5, 'Д')")
+    writer.commit()
+    assert reader.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 3
+    reader.execute("ROLLBACK")
+    reader.close()
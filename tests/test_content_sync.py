@@ -0,0 +1,85 @@
+# tests/test_content_sync.py
+import json
+import sqlite3
+
+import pytest
+
+from content_sync import StartupTimer, create_content_sync_table, sync_content
+
+
+@pytest.fixture
+def env(tmp_path):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE courses (course_id TEXT PRIMARY KEY, course_name TEXT, course_type TEXT, code_word TEXT,
+            price_rub INTEGER);
+        CREATE TABLE lessons (lesson_id INTEGER PRIMARY KEY AUTOINCREMENT, course_id TEXT, lesson INTEGER,
+            lesson_name TEXT, description TEXT, video_url TEXT, video_file_id TEXT);
+        """
+    )
+    courses_file = tmp_path / "courses.json"
+    courses_file.write_text(json.dumps([{"course_id": "femininity_premium", "course_name": "Ж", "course_type": "main",
+                                         "code_word": "лепесток", "price_rub": 100}]), encoding="utf-8")
+    course = tmp_path / "courses" / "femininity"
+    course.mkdir(parents=True)
+    yield conn, str(courses_file), course
+    conn.close()
+
+
+def lessons(*numbers, name="Урок"):
+    return json.dumps([{"lesson": n, "lesson_name": f"{name} {n}", "description": "", "video_url": ""}
+                       for n in numbers], ensure_ascii=False)
+
+
+def test_duplicates_collapsed_keeping_cached_file_id(env):
+    conn, _, _ = env
+    conn.executemany("INSERT INTO lessons (course_id, lesson, video_file_id) VALUES ('femininity', ?, ?)",
+                     [(1, None), (1, "file-1"), (1, None), (2, None)])
+    create_content_sync_table(conn, conn.cursor())
+    assert conn.execute("SELECT lesson, video_file_id FROM lessons ORDER BY lesson").fetchall() == \
+        [(1, "file-1"), (2, None)]
+    create_content_sync_table(conn, conn.cursor())  # повторный вызов ничего не меняет
+
+
+def test_unchanged_inputs_skipped_and_changes_applied(env):
+    conn, courses_file, course = env
+    create_content_sync_table(conn, conn.cursor())
+    (course / "lessons.json").write_text(lessons(1, 2, 3), encoding="utf-8")
+    courses_dir = str(course.parent)
+
+    results = sync_content(conn, courses_file, courses_dir)
+    assert [(r.changed, r.rows) for r in results] == [(True, 1), (True, 3)]
+    conn.execute("UPDATE lessons SET video_file_id = 'cached' WHERE lesson = 1")
+    conn.commit()
+    assert not any(r.changed for r in sync_content(conn, courses_file, courses_dir))
+
+    (course / "lessons.json").write_text(lessons(1, 2, name="Новый"), encoding="utf-8")
+    results = sync_content(conn, courses_file, courses_dir)
+    assert [(r.source.endswith("lessons.json"), r.changed, r.removed) for r in results] == \
+        [(False, False, 0), (True, True, 1)]
+    assert conn.execute("SELECT lesson, lesson_name, video_file_id FROM lessons ORDER BY lesson").fetchall() == \
+        [(1, "Новый 1", "cached"), (2, "Новый 2", None)]
+
+
+def test_bad_input_not_recorded_and_file_untouched(env):
+    conn, courses_file, course = env
+    create_content_sync_table(conn, conn.cursor())
+    (course / "lessons.json").write_text('[{"lesson_name": "без номера"}]', encoding="utf-8")
+    results = sync_content(conn, courses_file, str(course.parent))
+    assert len(results) == 1  # урок без номера - файл пропущен и будет перечитан на следующем старте
+    assert conn.execute("SELECT COUNT(*) FROM lessons").fetchone()[0] == 0
+
+    latin = '[{"lesson": 1, "lesson_name": "Caf\xe9", "description": "", "video_url": ""}]'.encode("ISO-8859-1")
+    (course / "lessons.json").write_bytes(latin)
+    sync_content(conn, courses_file, str(course.parent))
+    assert conn.execute("SELECT lesson_name FROM lessons").fetchone()[0] == "Café"
+    assert (course / "lessons.json").read_bytes() == latin
+
+
+def test_startup_timer_report():
+    timer = StartupTimer()
+    timer.mark("схема")
+    timer.mark("курсы и уроки")
+    report = timer.report()
+    assert report.startswith("Старт за ") and "схема" in report and "курсы и уроки" in report
@@ -0,0 +1,60 @@
+# tests/test_course_catalog.py
+import sqlite3
+
+import pytest
+
+from course_catalog import (CourseCatalog, base_course_sql, create_base_course_column, owned_variant,
+                            split_course_id)
+from models import Course
+
+IDS = ["femininity_self_check", "femininity_admin_check", "femininity_premium", "autogenic_premium",
+       "bonus_course", "bonus_course_new", "premium"]
+
+
+def test_split_course_id_only_strips_known_tariffs():
+    assert split_course_id("femininity_self_check") == ("femininity", "self_check")
+    assert split_course_id("femininity_premium") == ("femininity", "premium")
+    assert split_course_id("bonus_course") == ("bonus_course", "default")
+    assert split_course_id("premium") == ("premium", "default")
+    assert Course("autogenic_admin_check", "Курс", "main", "слива").tariff == "admin_check"
+
+
+def test_sql_rule_matches_python():
+    conn = sqlite3.connect(":memory:")
+    for course_id in IDS:
+        assert conn.execute(f"SELECT {base_course_sql('c')} FROM (SELECT ? AS c)", (course_id,)).fetchone()[0] \
+            == split_course_id(course_id)[0]
+
+
+def test_catalog_indexes():
+    catalog = CourseCatalog(Course(cid, cid, "main", f"w{i}") for i, cid in enumerate(IDS))
+    assert len(catalog) == len(IDS)
+    assert [c.course_id for c in catalog.variants("femininity")] == IDS[:3]
+    assert catalog.by_code("w4").course_id == "bonus_course"
+    assert catalog.get("autogenic_premium").code_word == "w3"
+    assert catalog.variants("bonus") == []
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE user_courses (user_id INTEGER, course_id TEXT, course_type TEXT, progress INTEGER,"
+                 " tariff TEXT, PRIMARY KEY (user_id, course_id))")
+    conn.execute("INSERT INTO user_courses VALUES (1, 'femininity_premium', 'main', 3, 'premium')")
+    create_base_course_column(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_base_course_column_backfilled_and_maintained(conn):
+    assert owned_variant(conn.cursor(), 1, "femininity") == ("femininity_premium", "premium")
+    conn.execute("INSERT INTO user_courses (user_id, course_id, tariff) VALUES (1, 'bonus_course_new', 'default')")
+    # префикс bonus_course больше не совпадает с bonus_course_new
+    assert owned_variant(conn.cursor(), 1, "bonus_course") is None
+    assert owned_variant(conn.cursor(), 1, "bonus_course_new")[0] == "bonus_course_new"
+    conn.execute("UPDATE user_courses SET course_id = 'autogenic_self_check' WHERE course_id = 'femininity_premium'")
+    assert owned_variant(conn.cursor(), 1, "femininity") is None
+    assert owned_variant(conn.cursor(), 1, "autogenic")[0] == "autogenic_self_check"
+    plan = " ".join(row[-1] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT progress FROM user_courses WHERE user_id = 1 AND base_course_id = 'autogenic'"))
+    assert "idx_user_courses_base" in plan
@@ -0,0 +1,150 @@
+# tests/test_data_tiering.py
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import data_tiering
+from analytics import AnalyticsPool
+from data_tiering import (archive_closed, archive_path, archived_months, count_tiered, create_tiering_tables,
+                          read_tiered, row_at_tiered, tier_stats)
+from export_data import export_table
+from repository import SQLiteRepository
+
+NOW = datetime(2025, 12, 1)
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "bot.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, course_id TEXT,
+            lesson INTEGER, status TEXT DEFAULT 'pending', timestamp TEXT, submission_time DATETIME,
+            approval_time DATETIME, final_approval_time DATETIME);
+        CREATE TABLE homework_attachments (hw_id INTEGER NOT NULL, position INTEGER NOT NULL, file_id TEXT,
+            PRIMARY KEY (hw_id, position));
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, action TEXT,
+            amount INTEGER, reason TEXT, timestamp TEXT);
+        CREATE TABLE homework_rejections (rejection_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            course_id TEXT NOT NULL, lesson INTEGER NOT NULL, reason TEXT NOT NULL, rejected_at TIMESTAMP);
+        """
+    )
+    create_tiering_tables(conn, conn.cursor())
+    homeworks = [
+        (1, 7, "c", 1, "approved", "2025-01-03 10:00:00", "2025-01-05 10:00:00"),
+        (2, 7, "c", 2, "approved", "2025-02-01 10:00:00", "2025-02-10 10:00:00"),
+        (3, 7, "c", 3, "pending", "2025-02-11 10:00:00", None),
+        (4, 8, "c", 1, "approved", "2025-01-20 10:00:00", "2025-03-02 10:00:00"),
+        (5, 7, "c", 4, "approved", "2025-11-20 10:00:00", "2025-11-21 10:00:00"),
+    ]
+    conn.executemany("INSERT INTO homeworks (hw_id, user_id, course_id, lesson, status, submission_time,"
+                     " approval_time) VALUES (?, ?, ?, ?, ?, ?, ?)", homeworks)
+    conn.executemany("INSERT INTO homework_attachments VALUES (?, ?, ?)", [(1, 0, "a"), (1, 1, "b"), (5, 0, "c")])
+    conn.executemany("INSERT INTO transactions (user_id, action, amount, reason, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     [(7, "earn", 5, "дз", "2025-01-05 10:00:00"), (7, "spend", 2, "приз", "2025-11-01 10:00:00")])
+    conn.commit()
+    yield conn, path, str(tmp_path / "archive")
+    conn.close()
+
+
+def test_closed_rows_moved_to_monthly_files(db):
+    conn, _, archive_dir = db
+    moved = archive_closed(conn, archive_dir, older_than_days=90, batch_size=2, now=NOW)
+    assert moved == {"homeworks": 3, "transactions": 1, "homework_rejections": 0}
+    assert [r[0] for r in conn.execute("SELECT hw_id FROM homeworks ORDER BY hw_id")] == [3, 5]
+    assert conn.execute("SELECT hw_id, position FROM homework_attachments").fetchall() == [(5, 0)]
+    assert archived_months(conn, "homeworks", 7) == ["2025-01", "2025-02"]
+    assert archived_months(conn, "homeworks") == ["2025-01", "2025-02", "2025-03"]
+
+    cold = sqlite3.connect(archive_path(archive_dir, "2025-01"))
+    assert cold.execute("SELECT hw_id FROM homeworks").fetchall() == [(1,)]
+    assert cold.execute("SELECT file_id FROM homework_attachments ORDER BY position").fetchall() == [("a",), ("b",)]
+    assert cold.execute("SELECT amount FROM transactions").fetchall() == [(5,)]
+    cold.close()
+    # повторный запуск ничего не дублирует
+    assert archive_closed(conn, archive_dir, older_than_days=90, now=NOW)["homeworks"] == 0
+    assert tier_stats(conn, archive_dir)["cold"] == {"homeworks": 3, "transactions": 1}
+
+
+def test_history_reads_hot_and_cold(db, monkeypatch):
+    conn, path, archive_dir = db
+    archive_closed(conn, archive_dir, older_than_days=90, now=NOW)
+    rows = read_tiered(path, "homeworks", ["hw_id", "status"], "user_id = ?", (7,), ("hw_id",), user_id=7,
+                       archive_dir=archive_dir)
+    assert rows == [(1, "approved"), (2, "approved"), (3, "pending"), (5, "approved")]
+
+    # архивов больше, чем можно подключить к одному соединению - сливаем несколько потоков
+    monkeypatch.setattr(data_tiering, "MAX_ATTACHED", 1)
+    rows = read_tiered(path, "homeworks", ["hw_id", "approval_time"], "course_id = ?", ("c",), ("hw_id",),
+                       descending=True, archive_dir=archive_dir)
+    assert [r[0] for r in rows] == [5, 4, 3, 2, 1]
+
+
+def test_column_added_after_archiving_reads_as_null(db):
+    conn, path, archive_dir = db
+    archive_closed(conn, archive_dir, older_than_days=90, now=NOW)
+    conn.execute("ALTER TABLE homeworks ADD COLUMN file_unique_id TEXT")
+    conn.execute("UPDATE homeworks SET file_unique_id = 'u5' WHERE hw_id = 5")
+    conn.commit()
+    rows = read_tiered(path, "homeworks", ["hw_id", "file_unique_id"], "user_id = ?", (7,), ("hw_id",), user_id=7,
+                       archive_dir=archive_dir)
+    assert rows == [(1, None), (2, None), (3, None), (5, "u5")]
+
+
+def test_export_includes_archives(db, tmp_path):
+    conn, _, archive_dir = db
+    archive_closed(conn, archive_dir, older_than_days=90, now=NOW)
+    out = str(tmp_path / "homeworks.jsonl.gz")
+    result = export_table(conn, "homeworks", out, "jsonl", batch_size=2, archive_dir=archive_dir)
+    with gzip.open(out, "rt", encoding="utf-8") as f:
+        assert [json.loads(line)["hw_id"] for line in f] == [1, 2, 3, 4, 5]
+    assert (result.rows, result.last_key) == (5, 5)
+    hot_only = export_table(conn, "homeworks", str(tmp_path / "hot.csv.gz"), "csv")
+    assert hot_only.rows == 2
+
+
+def test_repository_lists_archived_rows(db):
+    conn, _, archive_dir = db
+    archive_closed(conn, archive_dir, older_than_days=90, now=NOW)
+    repo = SQLiteRepository(conn=conn, archive_dir=archive_dir)
+    homeworks = asyncio.run(repo.list_homeworks(7))
+    assert [hw["hw_id"] for hw in homeworks] == [5, 3, 2, 1]
+    assert [t["amount"] for t in asyncio.run(repo.list_transactions(7))] == [5, 2]
+    assert [hw["hw_id"] for hw in asyncio.run(repo.list_homeworks(8))] == [4]
+    assert not os.path.exists(archive_path(archive_dir, "2025-04"))
+
+
+def test_analytics_pool_reads_archived_rows(db):
+    conn, path, archive_dir = db
+    archive_closed(conn, archive_dir, older_than_days=90, now=NOW)
+    pool = AnalyticsPool(path, size=1, archive_dir=archive_dir)
+    approved = asyncio.run(pool.fetch_tiered("homeworks", ["hw_id"], "status = 'approved'"))
+    assert sorted(hw_id for (hw_id,) in approved) == [1, 2, 4, 5]
+    mine = asyncio.run(pool.fetch_tiered("homeworks", ["hw_id"], "user_id = ?", (8,), user_id=8))
+    assert mine == [(4,)]
+    ordered = asyncio.run(pool.fetch_tiered("homeworks", ["hw_id"], "user_id = ?", (7,), ("hw_id",), True, user_id=7))
+    assert ordered == [(5,), (3,), (2,), (1,)]
+    work = asyncio.run(pool.fetch_random_tiered("homeworks", ["hw_id", "status"], "status = 'approved'"))
+    assert work[0] in (1, 2, 4, 5) and work[1] == "approved"
+    pool.close()
+
+
+def test_row_at_tiered_reads_one_row_per_index(db):
+    """Случайная строка выбирается по счётчикам слоёв: каждый индекс - ровно одна строка своего слоя."""
+    conn, _, archive_dir = db
+    archive_closed(conn, archive_dir, older_than_days=90, now=NOW)
+    counts = count_tiered(conn, "homeworks", "status = 'approved'", archive_dir=archive_dir)
+    assert counts == [(None, 1), ("2025-01", 1), ("2025-02", 1), ("2025-03", 1)]
+    picked = [row_at_tiered(conn, "homeworks", ["hw_id"], "status = 'approved'", (), counts, i, archive_dir)[0]
+              for i in range(4)]
+    assert sorted(picked) == [1, 2, 4, 5]
+    assert row_at_tiered(conn, "homeworks", ["hw_id"], "status = 'approved'", (), counts, 4, archive_dir) is None
+    assert conn.execute("PRAGMA database_list").fetchall()[1:] == []  # архивы отключены
+    assert count_tiered(conn, "homeworks", "user_id = ?", (8,), user_id=8, archive_dir=archive_dir) == \
+        [("2025-03", 1)]
@@ -0,0 +1,117 @@
+# tests/test_db_backup.py
+"""Тесты резервного копирования базы."""
+import gzip
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from db_backup import (BackupError, backup_files, format_backup_report, restore_backup, rotate_backups, run_backup,
+                       snapshot_copy, verify_backup)
+from db_maintenance import apply_profile
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "bot_db.sqlite")
+    conn = sqlite3.connect(path, check_same_thread=False)
+    apply_profile(conn)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, payload TEXT)")
+    conn.executemany("INSERT INTO t (payload) VALUES (?)", [("x" * 500,) for _ in range(2000)])
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+def test_stepwise_copy_is_consistent_snapshot_under_writes(db, tmp_path):
+    path, conn = db
+    target = str(tmp_path / "copy.sqlite")
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            conn.execute("INSERT INTO t (payload) VALUES ('y')")
+            conn.commit()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        pages, steps = snapshot_copy(path, target, pages=5, pause=0.001)
+    finally:
+        stop.set()
+        thread.join()
+    assert steps > 10 and pages > 200
+    copy = sqlite3.connect(target)
+    assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert copy.execute("SELECT COUNT(*) FROM t").fetchone()[0] >= 2000
+    copy.close()
+
+
+def test_run_backup_compresses_and_verifies(db, tmp_path):
+    path, _ = db
+    backup_dir = str(tmp_path / "backups")
+    result = run_backup(path, backup_dir, pages=50, pause=0)
+    assert result.row_counts == {"t": 2000}
+    assert result.compressed_bytes < result.raw_bytes
+    assert os.listdir(backup_dir) == [os.path.basename(result.path)]  # несжатая копия удалена
+    assert verify_backup(result.path) == {"t": 2000}
+    restored = str(tmp_path / "restored.sqlite")
+    restore_backup(result.path, restored)
+    assert sqlite3.connect(restored).execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2000
+    assert "проверена восстановлением" in format_backup_report(result)
+
+
+def test_verify_detects_mismatch_and_corruption(db, tmp_path):
+    path, _ = db
+    result = run_backup(path, str(tmp_path / "backups"), pause=0)
+    with pytest.raises(BackupError):
+        verify_backup(result.path, {"t": 1999})
+    broken = str(tmp_path / "broken.sqlite.gz")
+    with gzip.open(result.path, "rb") as src:
+        data = bytearray(src.read())
+    data[len(data) // 2:len(data) // 2 + 4096] = b"\xff" * 4096
+    with gzip.open(broken, "wb") as dst:
+        dst.write(bytes(data))
+    with pytest.raises((BackupError, sqlite3.DatabaseError)):
+        verify_backup(broken)
+
+
+def test_rotation_keeps_daily_and_weekly(tmp_path):
+    backup_dir = str(tmp_path)
+    start = datetime(2025, 3, 31, 3, 15)
+    for day in range(40):
+        stamp = (start - timedelta(days=day)).strftime("%Y%m%d-%H%M%S")
+        open(os.path.join(backup_dir, f"bot_db-{stamp}.sqlite.gz"), "wb").close()
+    removed = rotate_backups(backup_dir, keep_daily=7, keep_weekly=4)
+    kept = [stamp for stamp, _ in backup_files(backup_dir)]
+    assert len(removed) == 40 - len(kept)
+    assert kept[:7] == [start - timedelta(days=day) for day in range(7)]
+    assert len({stamp.isocalendar()[:2] for stamp in kept}) == 4
+
+
+def test_archives_backed_up_in_same_set_and_rotated_with_it(db, tmp_path):
+    path, _ = db
+    archive_dir = tmp_path / "archive_db"
+    archive_dir.mkdir()
+    archive = sqlite3.connect(str(archive_dir / "archive_2025-01.sqlite"))
+    archive.execute("CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY)")
+    archive.executemany("INSERT INTO homeworks VALUES (?)", [(i,) for i in range(30)])
+    archive.commit()
+    archive.close()
+    (archive_dir / "notes.txt").write_text("не архив")
+
+    backup_dir = str(tmp_path / "backups")
+    result = run_backup(path, backup_dir, pause=0, now=datetime(2025, 3, 1, 3, 15), archive_dir=str(archive_dir))
+    archive_gz = result.path[:-len(".sqlite.gz")] + ".archive_2025-01.sqlite.gz"
+    assert result.archives == {archive_gz: {"homeworks": 30}}
+    assert verify_backup(archive_gz) == {"homeworks": 30}
+    assert "Месячных архивов: 1, строк в них: 30" in format_backup_report(result)
+    assert [p for _, p in backup_files(backup_dir)] == [result.path]  # копия архива - не отдельный набор
+
+    run_backup(path, backup_dir, pause=0, now=datetime(2025, 3, 2, 3, 15), archive_dir=str(archive_dir))
+    removed = rotate_backups(backup_dir, keep_daily=1, keep_weekly=0)
+    assert removed == [result.path]
+    assert not os.path.exists(archive_gz)
+    assert len(os.listdir(backup_dir)) == 2
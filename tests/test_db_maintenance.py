@@ -0,0 +1,67 @@
+# tests/test_db_maintenance.py
+"""Тесты профиля SQLite и обслуживания базы."""
+import sqlite3
+
+import pytest
+
+from db_maintenance import apply_profile, db_stats, format_db_stats, run_maintenance, run_maintenance_file
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "bot_db.sqlite")
+    conn = sqlite3.connect(path)
+    apply_profile(conn)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, payload TEXT)")
+    conn.executemany("INSERT INTO t (payload) VALUES (?)", [("x" * 500,) for _ in range(2000)])
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+def test_profile_applied(db):
+    path, conn = db
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    assert conn.execute("PRAGMA cache_size").fetchone()[0] == -16384
+
+    reader = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    applied = apply_profile(reader, read_only=True)
+    assert "journal_mode" not in applied
+    reader.close()
+
+
+def test_maintenance_reclaims_free_pages(db):
+    path, conn = db
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    timings = run_maintenance(conn)
+    assert set(timings) == {"checkpoint", "analyze", "optimize", "auto_vacuum", "incremental_vacuum"}
+    stats = db_stats(conn, path)
+    assert stats["auto_vacuum"] == "INCREMENTAL"
+    assert stats["freelist_count"] == 0
+    assert stats["wal_bytes"] == 0  # TRUNCATE-checkpoint обнулил WAL
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] >= 0
+
+
+def test_stats_text(db):
+    path, conn = db
+    conn.execute("SELECT COUNT(*) FROM t").fetchone()
+    stats = db_stats(conn, path)
+    text = format_db_stats(stats)
+    assert "Файл базы" in text and "wal_autocheckpoint" in text
+
+
+def test_maintenance_on_own_connection_keeps_shared_transaction(db, monkeypatch):
+    import db_maintenance
+
+    path, conn = db
+    # шаги с записью упрутся в чужую транзакцию - не ждём busy_timeout целиком
+    monkeypatch.setattr(db_maintenance, "TUNING_PROFILE",
+                        tuple((p, 50 if p == "busy_timeout" else v) for p, v in db_maintenance.TUNING_PROFILE))
+    conn.execute("INSERT INTO t (payload) VALUES ('не закоммичено')")  # чужая открытая транзакция
+    run_maintenance_file(path)
+    assert conn.in_transaction
+    conn.rollback()
+    assert conn.execute("SELECT COUNT(*) FROM t WHERE payload = 'не закоммичено'").fetchone()[0] == 0
@@ -0,0 +1,93 @@
+# tests/test_export_data.py
+"""Тесты потоковой выгрузки таблиц."""
+import csv
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from export_data import export_table, split_file
+
+
+@pytest.fixture
+def conn():
+    """База с пятью домашками за разные дни."""
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY, user_id INTEGER, lesson INTEGER, submission_time TEXT)"
+    )
+    conn.executemany(
+        "INSERT INTO homeworks VALUES (?, ?, ?, ?)",
+        [(i, 100 + i, i, f"2025-01-0{i} 12:00:00") for i in range(1, 6)],
+    )
+    yield conn
+    conn.close()
+
+
+def test_csv_export(conn, tmp_path):
+    """CSV с заголовком, пачками меньше таблицы."""
+    path = str(tmp_path / "homeworks.csv.gz")
+    result = export_table(conn, "homeworks", path, "csv", batch_size=2)
+    assert (result.rows, result.last_key, result.resumed) == (5, 5, False)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["hw_id", "user_id", "lesson", "submission_time"]
+    assert [r[0] for r in rows[1:]] == ["1", "2", "3", "4", "5"]
+
+
+def test_jsonl_time_filter(conn, tmp_path):
+    """JSONL с фильтром [since, until)."""
+    path = str(tmp_path / "homeworks.jsonl.gz")
+    result = export_table(conn, "homeworks", path, "jsonl",
+                          since="2025-01-02 00:00:00", until="2025-01-04 00:00:00")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert result.rows == 2
+    assert [r["hw_id"] for r in records] == [2, 3]
+
+
+def test_resume_after_crash_is_readable_without_duplicates(conn, tmp_path, monkeypatch):
+    """Обрыв после записи пачки, но до state, плюс недописанный член: продолжение обрезает хвост."""
+    import export_data
+
+    path = str(tmp_path / "homeworks.csv.gz")
+    save_state = export_data._save_state
+    calls = []
+
+    def crash_on_second_save(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise KeyboardInterrupt  # процесс убит: вторая пачка в файле, state - после первой
+        save_state(*args)
+
+    monkeypatch.setattr(export_data, "_save_state", crash_on_second_save)
+    with pytest.raises(KeyboardInterrupt):
+        export_table(conn, "homeworks", path, "csv", batch_size=2)
+    monkeypatch.setattr(export_data, "_save_state", save_state)
+    with open(path, "ab") as f:
+        f.write(gzip.compress(b"5,105,5,2025-01-05 12:00:00\r\n")[:20])  # член без окончания
+
+    result = export_table(conn, "homeworks", path, "csv", batch_size=2)
+    assert (result.resumed, result.rows) == (True, 5)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert [r[0] for r in rows] == ["hw_id", "1", "2", "3", "4", "5"]
+
+
+def test_unknown_table_and_format(conn, tmp_path):
+    with pytest.raises(ValueError):
+        export_table(conn, "admins", str(tmp_path / "a.gz"))
+    with pytest.raises(ValueError):
+        export_table(conn, "homeworks", str(tmp_path / "a.gz"), "xml")
+
+
+def test_split_file(tmp_path):
+    """Части не больше лимита и склеиваются в исходный файл."""
+    path = tmp_path / "big.bin"
+    data = bytes(range(256)) * 40
+    path.write_bytes(data)
+    parts = split_file(str(path), chunk_bytes=4096)
+    assert len(parts) == 3
+    assert b"".join(open(p, "rb").read() for p in parts) == data
+    assert split_file(str(path), chunk_bytes=len(data)) == [str(path)]
@@ -0,0 +1,109 @@
+# tests/test_flood_control.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ApplicationHandlerStop
+
+from flood_control import COALESCED, HIGH, LOW, NORMAL, PASSED, RATE_LIMITED, SHED, FloodControl, classify, \
+    format_flood_metrics
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def control(clock, **kwargs):
+    params = dict(rate=1.0, burst=3, coalesce_seconds=2.0, queue_limit=10, hard_limit=20, clock=clock)
+    params.update(kwargs)
+    return FloodControl(admin_ids=["777"], admin_chat_id=-100, **params)
+
+
+def message(text=None, photo=()):
+    return SimpleNamespace(text=text, photo=list(photo), document=None, contact=None, successful_payment=None)
+
+
+def update(user_id=1, chat_id=1, text=None, data=None, photo=()):
+    answers = []
+
+    async def answer(notice=None):
+        answers.append(notice)
+
+    query = SimpleNamespace(data=data, answer=answer) if data is not None else None
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id), effective_chat=SimpleNamespace(id=chat_id),
+        callback_query=query, message=None if query else message(text, photo), answers=answers,
+    )
+
+
+def test_classify():
+    assert classify(update(data="gallery_next")) == (LOW, "cb:gallery_next")
+    assert classify(update(data="tariff_es1")) == (NORMAL, "cb:tariff_es1")
+    assert classify(update(text="/start@bot")) == (HIGH, None)
+    assert classify(update(text="/menu")) == (LOW, None)
+    assert classify(update(photo=["p"])) == (HIGH, None)
+    assert classify(update(text="привет")) == (NORMAL, None)
+
+
+def test_token_bucket_refills(clock):
+    flood = control(clock)
+    verdicts = [flood.admit(1, NORMAL, None, 0) for _ in range(4)]
+    assert verdicts == [PASSED, PASSED, PASSED, RATE_LIMITED]
+    assert flood.admit(2, NORMAL, None, 0) == PASSED  # у другого ученика свой лимит
+    clock.now = 1.0
+    assert flood.admit(1, NORMAL, None, 0) == PASSED
+    assert flood.admit(1, NORMAL, None, 0) == RATE_LIMITED
+
+
+def test_repeated_callback_coalesced(clock):
+    flood = control(clock)
+    assert flood.admit(1, LOW, "cb:menu_back", 0) == PASSED
+    clock.now = 1.0
+    assert flood.admit(1, LOW, "cb:menu_back", 0) == COALESCED
+    assert flood.admit(1, LOW, "cb:gallery", 0) == PASSED
+    clock.now = 3.5
+    assert flood.admit(1, LOW, "cb:menu_back", 0) == PASSED
+
+
+def test_shedding_by_backlog(clock):
+    flood = control(clock, burst=100)
+    assert flood.admit(1, LOW, None, 11) == SHED
+    assert flood.admit(1, NORMAL, None, 11) == PASSED
+    assert flood.admit(1, NORMAL, None, 21) == SHED
+    assert flood.admit(1, HIGH, None, 500) == PASSED
+
+
+def test_high_priority_ignores_rate_limit(clock):
+    flood = control(clock, burst=1)
+    assert flood.admit(1, NORMAL, None, 0) == PASSED
+    assert flood.admit(1, NORMAL, None, 0) == RATE_LIMITED
+    assert flood.admit(1, HIGH, None, 0) == PASSED
+
+
+def test_gate_admins_pass_and_students_stopped(clock):
+    flood = control(clock, burst=1)
+    context = SimpleNamespace(application=SimpleNamespace(update_queue=asyncio.Queue()))
+
+    async def scenario():
+        for _ in range(5):
+            await flood.gate(update(user_id=777, data="statistics"), context)
+            await flood.gate(update(user_id=5, chat_id=-100, text="текст"), context)
+        await flood.gate(update(data="statistics"), context)
+        repeated = update(data="statistics")
+        with pytest.raises(ApplicationHandlerStop):
+            await flood.gate(repeated, context)
+        return repeated.answers
+
+    assert asyncio.run(scenario()) == [None]  # склеенной кнопке - пустой answer
+    metrics = flood.metrics()
+    assert metrics["totals"] == {PASSED: 11, COALESCED: 1}
+    assert "склеено повторов: 1" in format_flood_metrics(metrics)
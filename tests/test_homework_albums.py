@@ -0,0 +1,99 @@
+# tests/test_homework_albums.py
+"""Тесты сборки альбомов домашних заданий."""
+import asyncio
+import sqlite3
+
+import pytest
+
+from homework_albums import (AlbumCollector, Attachment, append_attachments, create_homework_attachments_table,
+                             insert_attachments)
+
+
+@pytest.mark.asyncio
+async def test_album_flushed_once_after_debounce():
+    """Части одного альбома приходят в обработчик одним списком, другие альбомы - отдельно."""
+    calls = []
+
+    async def handler(update, context, attachments):
+        calls.append((update, [a.file_id for a in attachments]))
+
+    collector = AlbumCollector(handler, debounce=0.05)
+    collector.add((1, "g1"), Attachment("f1", "u1", "photo"), "update-1", None)
+    await asyncio.sleep(0.02)
+    collector.add((1, "g1"), Attachment("f2", "u2", "photo"), "update-2", None)
+    collector.add((2, "g2"), Attachment("f3", "u3", "document"), "update-3", None)
+    await asyncio.sleep(0.02)
+    collector.add((1, "g1"), Attachment("f4", "u4", "video"), "update-4", None)
+    assert calls == []
+
+    await asyncio.sleep(0.1)
+    assert sorted(calls) == [("update-1", ["f1", "f2", "f4"]), ("update-3", ["f3"])]
+    assert collector.pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_handler_error_does_not_leak_album():
+    async def handler(update, context, attachments):
+        raise RuntimeError("boom")
+
+    collector = AlbumCollector(handler, debounce=0.01)
+    collector.add((1, "g"), Attachment("f", "u", "photo"), None, None)
+    await asyncio.sleep(0.05)
+    assert collector.pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_late_parts_attached_to_saved_homework():
+    """Части, пришедшие после паузы, уходят в late_handler с hw_id первой части, а не создают домашку."""
+    calls, late = [], []
+
+    async def handler(update, context, attachments):
+        calls.append([a.file_id for a in attachments])
+        await asyncio.sleep(0.03)  # сохранение ещё идёт, когда приходят опоздавшие части
+        return 42
+
+    async def late_handler(update, context, hw_id, attachments):
+        late.append((hw_id, [a.file_id for a in attachments]))
+
+    collector = AlbumCollector(handler, late_handler, debounce=0.01, late_window=0.2)
+    collector.add((1, "g"), Attachment("f1", "u1", "photo"), None, None)
+    await asyncio.sleep(0.02)
+    collector.add((1, "g"), Attachment("f2", "u2", "photo"), None, None)
+    collector.add((1, "g"), Attachment("f3", "u3", "photo"), None, None)
+    await asyncio.sleep(0.05)
+    assert calls == [["f1"]]
+    assert late == [(42, ["f2", "f3"])]
+
+    await asyncio.sleep(0.2)  # окно истекло - тот же media_group_id снова новая домашка
+    collector.add((1, "g"), Attachment("f4", "u4", "photo"), None, None)
+    await asyncio.sleep(0.06)
+    assert calls == [["f1"], ["f4"]]
+
+
+@pytest.mark.asyncio
+async def test_late_parts_saved_as_homework_when_first_failed():
+    calls, late = [], []
+
+    async def handler(update, context, attachments):
+        calls.append([a.file_id for a in attachments])
+        return None if len(calls) == 1 else 7
+
+    async def late_handler(update, context, hw_id, attachments):
+        late.append(hw_id)
+
+    collector = AlbumCollector(handler, late_handler, debounce=0.01)
+    collector.add((1, "g"), Attachment("f1", "u1", "photo"), None, None)
+    await asyncio.sleep(0.03)
+    collector.add((1, "g"), Attachment("f2", "u2", "photo"), None, None)
+    await asyncio.sleep(0.03)
+    assert calls == [["f1"], ["f2"]] and late == []
+
+
+def test_insert_attachments_keeps_order():
+    conn = sqlite3.connect(":memory:")
+    create_homework_attachments_table(conn, conn.cursor())
+    insert_attachments(conn.cursor(), 7, [Attachment("a", "ua", "photo"), Attachment("b", "ub", "document")])
+    rows = conn.execute("SELECT position, file_id, file_type FROM homework_attachments WHERE hw_id = 7").fetchall()
+    assert rows == [(0, "a", "photo"), (1, "b", "document")]
+    append_attachments(conn.cursor(), 7, [Attachment("c", "uc", "video")])
+    assert conn.execute("SELECT MAX(position) FROM homework_attachments WHERE hw_id = 7").fetchone()[0] == 2
@@ -0,0 +1,64 @@
+# tests/test_idempotency.py
+"""Тесты однократной обработки действий."""
+import asyncio
+import sqlite3
+
+import pytest
+
+from idempotency import action_key, claim_action, create_processed_actions_table, is_processed
+from write_coordinator import WriteCoordinator
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)  # писатель работает в рабочем потоке
+    conn.execute("CREATE TABLE user_tokens (user_id INTEGER PRIMARY KEY, tokens INTEGER)")
+    create_processed_actions_table(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_action_key():
+    assert action_key("approve_homework", 42) == "approve_homework:42"
+    assert action_key("approve_purchase", 7, "femininity_premium") == "approve_purchase:7:femininity_premium"
+
+
+def test_claim_once(conn):
+    key = action_key("approve_homework", 1)
+    assert not is_processed(conn, key)
+    with conn:
+        assert claim_action(conn.cursor(), key, 100)
+    assert is_processed(conn, key)
+    with conn:
+        assert not claim_action(conn.cursor(), key, 100)
+
+
+@pytest.mark.asyncio
+async def test_duplicate_taps_credit_once(conn):
+    """Два нажатия в одной пачке записи: начисление одно, ключ записан вместе с ним."""
+    writer = WriteCoordinator(conn)
+    key = action_key("approve_homework", 5)
+
+    def unit(cur):
+        if not claim_action(cur, key, 1):
+            return False
+        cur.execute("INSERT INTO user_tokens VALUES (9, 3) ON CONFLICT(user_id) DO UPDATE SET tokens = tokens + 3")
+        return True
+
+    results = await asyncio.gather(writer.submit(unit), writer.submit(unit))
+    assert sorted(results) == [False, True]
+    assert conn.execute("SELECT tokens FROM user_tokens").fetchone()[0] == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_effect_releases_key(conn):
+    writer = WriteCoordinator(conn)
+    key = action_key("approve_purchase", 1, "x")
+
+    def failing(cur):
+        claim_action(cur, key, 1)
+        raise LookupError("x")
+
+    with pytest.raises(LookupError):
+        await writer.submit(failing)
+    assert not is_processed(conn, key)
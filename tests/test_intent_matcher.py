@@ -0,0 +1,66 @@
+# tests/test_intent_matcher.py
+"""Тесты распознавания намерений и кодовых слов."""
+import pytest
+
+from intent_matcher import CodeWordMatcher, IntentMatcher, bounded_levenshtein, normalize
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return IntentMatcher()
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Текущий урок", "current_lesson"),
+    ("ТУ", "current_lesson"),
+    ("покажи предварительные материалы", "preliminary"),
+    ("пм", "preliminary"),
+    ("Галерея ДЗ", "gallery"),
+    ("тарифы?", "tariffs"),
+    ("нужна поддержка!", "support"),
+    ("тут что-то не так", None),
+    ("туман и ветер", None),
+    ("галерея", None),
+    ("", None),
+])
+def test_intents_on_word_boundaries(matcher, text, intent):
+    """Короткие сокращения не срабатывают внутри обычных слов."""
+    assert matcher.match(text) == intent
+
+
+def test_priority_follows_table_order(matcher):
+    assert matcher.find_all("тарифы и текущий урок") == {"tariffs", "current_lesson"}
+    assert matcher.match("тарифы и текущий урок") == "current_lesson"
+
+
+def test_overlapping_phrases():
+    """Фраза внутри более длинной находится через failure-ссылки."""
+    matcher = IntentMatcher((("long", ("а б в",)), ("short", ("б в г",)), ("single", ("в",))))
+    assert matcher.find_all("а б в г") == {"long", "short", "single"}
+    assert matcher.find_all("а б г") == set()
+
+
+def test_normalize():
+    assert normalize("  Ёлка,  ЁЖ!! ") == "елка еж"
+
+
+def test_bounded_levenshtein():
+    assert bounded_levenshtein("роза", "роза", 1) == 0
+    assert bounded_levenshtein("розa", "роза", 1) == 1
+    assert bounded_levenshtein("лепесток", "лепсток", 2) == 1
+    assert bounded_levenshtein("роза", "слива", 1) is None
+
+
+@pytest.mark.parametrize("text, code", [
+    ("роза", "роза"),
+    (" Роза! ", "роза"),
+    ("фиалко", "фиалка"),
+    ("лепестокк", "лепесток"),
+    ("бонус2", "бонус2"),
+    ("бонус3", None),  # одинаково близко к "бонус" и "бонус2"
+    ("мир", None),
+    ("", None),
+])
+def test_code_words(text, code):
+    matcher = CodeWordMatcher(["роза", "фиалка", "лепесток", "слива", "бонус", "бонус2"])
+    assert matcher.match(text) == code
@@ -0,0 +1,114 @@
+# tests/test_leaderboard.py
+"""Тесты инкрементальных рейтингов."""
+import sqlite3
+
+import pytest
+
+from leaderboard import Leaderboard, Ranking, create_leaderboard_tables
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE user_tokens (user_id INTEGER PRIMARY KEY, tokens INTEGER DEFAULT 3);
+        CREATE TABLE homeworks (
+            hw_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER, course_id TEXT, lesson INTEGER,
+            status TEXT DEFAULT 'pending',
+            timestamp TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+            submission_time DATETIME, approval_time DATETIME
+        );
+        """
+    )
+    conn.executemany("INSERT INTO user_tokens VALUES (?, ?)", [(1, 10), (2, 30), (3, 20)])
+    conn.commit()
+    create_leaderboard_tables(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def approve(conn, user_id, course_id, submitted, approved):
+    cur = conn.execute(
+        "INSERT INTO homeworks (user_id, course_id, lesson, submission_time) VALUES (?, ?, 1, ?)",
+        (user_id, course_id, submitted),
+    )
+    conn.execute("UPDATE homeworks SET status = 'approved', approval_time = ? WHERE hw_id = ?",
+                 (approved, cur.lastrowid))
+    conn.commit()
+
+
+def test_ranking_update_and_rank():
+    ranking = Ranking()
+    for user_id, key in [(1, 5), (2, 1), (3, 3)]:
+        ranking.update(user_id, key)
+    assert ranking.top(2) == [(1, 2), (3, 3)]
+    assert ranking.rank(1) == 3
+    ranking.update(1, 0)
+    assert ranking.rank(1) == 1 and len(ranking) == 3
+    ranking.update(2, None)
+    assert ranking.rank(2) is None and len(ranking) == 2
+
+
+def test_tokens_incremental(conn):
+    board = Leaderboard(conn, snapshot_path="/nonexistent/leaderboard.pkl")
+    assert board.load() == "rebuild"
+    assert board.top_tokens() == [(2, 30), (3, 20), (1, 10)]
+    assert board.token_rank(1) == (3, 3)
+
+    conn.execute("UPDATE user_tokens SET tokens = 50 WHERE user_id = 1")
+    conn.execute("INSERT INTO user_tokens VALUES (4, 25)")
+    conn.commit()
+    assert board.refresh() == 2
+    assert board.top_tokens(2) == [(1, 50), (2, 30)]
+    assert board.token_rank(4) == (3, 4)
+    assert board.refresh() == 0
+
+
+def test_speed_by_course(conn):
+    board = Leaderboard(conn, snapshot_path="/nonexistent/leaderboard.pkl")
+    board.load()
+    approve(conn, 1, "c1", "2024-01-01 10:00:00", "2024-01-01 12:00:00")
+    approve(conn, 2, "c1", "2024-01-01 10:00:00", "2024-01-01 11:00:00")
+    approve(conn, 1, "c1", "2024-01-02 10:00:00", "2024-01-02 10:00:00")
+    board.refresh()
+    assert board.top_speed("c1") == [(1, 3600.0), (2, 3600.0)]
+    approve(conn, 3, "c1", "2024-01-01 10:00:00", "2024-01-01 10:30:00")
+    board.refresh()
+    assert board.top_speed("c1", 1) == [(3, 1800.0)]
+    assert board.speed_rank("c1", 3) == (1, 3)
+    assert board.speed_rank("c2", 3) == (None, 0)
+
+
+def test_backfill_speed_from_existing_homeworks():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE user_tokens (user_id INTEGER PRIMARY KEY, tokens INTEGER DEFAULT 3);
+        CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY, user_id INTEGER, course_id TEXT, lesson INTEGER,
+            status TEXT, timestamp TEXT, submission_time DATETIME, approval_time DATETIME);
+        INSERT INTO homeworks VALUES (1, 7, 'c1', 1, 'approved', NULL, '2024-01-01 10:00:00', '2024-01-01 10:10:00');
+        INSERT INTO homeworks VALUES (2, 7, 'c1', 2, 'pending', NULL, '2024-01-01 10:00:00', NULL);
+        """
+    )
+    create_leaderboard_tables(conn, conn.cursor())
+    board = Leaderboard(conn, snapshot_path="/nonexistent/leaderboard.pkl")
+    board.load()
+    assert board.top_speed("c1") == [(7, 600.0)]
+
+
+def test_snapshot_roundtrip_catches_up(conn, tmp_path):
+    path = str(tmp_path / "leaderboard.pkl")
+    board = Leaderboard(conn, snapshot_path=path)
+    board.load()
+    board.save()
+    assert conn.execute("SELECT COUNT(*) FROM leaderboard_changes").fetchone()[0] == 0
+
+    # изменение после сохранения снимка - новый процесс догоняет его по журналу
+    conn.execute("UPDATE user_tokens SET tokens = 99 WHERE user_id = 3")
+    conn.commit()
+    restored = Leaderboard(conn, snapshot_path=path)
+    assert restored.load() == "snapshot"
+    assert restored.top_tokens(1) == [(3, 99)]
+    assert restored.token_rank(1) == (3, 3)
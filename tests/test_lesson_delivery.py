@@ -0,0 +1,102 @@
+# tests/test_lesson_delivery.py
+import asyncio
+import sqlite3
+
+import pytest
+
+from lesson_delivery import DELIVERY_MAX_ATTEMPTS, LessonDelivery, build_plan, create_lesson_delivery_tables
+from models import LessonFile
+
+FILES = [LessonFile("courses/femininity/lesson2_1.jpeg", "photo", 0),
+         LessonFile("courses/femininity/lesson2_3.mp3", "audio", 5),
+         LessonFile("courses/femininity/lesson2_4.png", "photo", 0)]
+
+
+@pytest.fixture
+def delivery():
+    conn = sqlite3.connect(":memory:")
+    create_lesson_delivery_tables(conn, conn.cursor())
+    return LessonDelivery(conn)
+
+
+def plan():
+    return build_plan(("Урок 2", "Markdown"), FILES, lambda: "Подождите...")
+
+
+class Sender:
+    """send_item: записывает отправленное; fail_on - ключи, на которых "падает сеть"."""
+
+    def __init__(self, fail_on=(), crash_on=None):
+        self.sent = []
+        self.fail_on = set(fail_on)
+        self.crash_on = crash_on
+
+    async def __call__(self, item):
+        if item.key in self.fail_on:
+            return False
+        self.sent.append(item.key)
+        if item.key == self.crash_on:
+            raise KeyboardInterrupt  # процесс умер сразу после отправки, до отметки
+        return True
+
+
+def test_plan_keys():
+    assert [item.key for item in plan()] == [
+        "text", "file:lesson2_1.jpeg", "delay:lesson2_3.mp3", "file:lesson2_3.mp3", "file:lesson2_4.png"]
+
+
+def test_resume_after_failure_skips_delivered(delivery):
+    first = Sender(fail_on={"file:lesson2_3.mp3"})
+    report = asyncio.run(delivery.deliver(1, "femininity", 2, plan(), first))
+    assert not report.completed and report.sent == 3
+    assert first.sent == ["text", "file:lesson2_1.jpeg", "delay:lesson2_3.mp3"]
+    position = delivery.conn.execute("SELECT position FROM lesson_delivery").fetchone()[0]
+    assert position == 3
+
+    second = Sender()
+    report = asyncio.run(delivery.deliver(1, "femininity", 2, plan(), second))
+    assert report.completed and report.resumed_from == 3
+    assert second.sent == ["file:lesson2_3.mp3", "file:lesson2_4.png"]
+    assert delivery.pending(stale_seconds=0) == []
+
+
+def test_crash_between_send_and_checkpoint_is_flagged(delivery):
+    with pytest.raises(KeyboardInterrupt):
+        asyncio.run(delivery.deliver(1, "femininity", 2, plan(), Sender(crash_on="file:lesson2_1.jpeg")))
+    # "после перезапуска" - новый объект на той же базе
+    restarted = LessonDelivery(delivery.conn)
+    assert restarted.pending(stale_seconds=0) == [(1, "femininity", 2)]
+    sender = Sender()
+    assert asyncio.run(restarted.deliver(1, "femininity", 2, plan(), sender)).completed
+    assert sender.sent[0] == "file:lesson2_1.jpeg"
+    assert restarted.duplicates() == [(1, "femininity", 2, 1, "file:lesson2_1.jpeg", 1)]
+
+
+def test_item_skipped_after_max_attempts(delivery):
+    broken = Sender(fail_on={"file:lesson2_4.png"})
+    for _ in range(DELIVERY_MAX_ATTEMPTS):
+        assert not asyncio.run(delivery.deliver(1, "femininity", 2, plan(), broken)).completed
+    report = asyncio.run(delivery.deliver(1, "femininity", 2, plan(), broken))
+    assert report.completed and report.skipped == 1
+    assert delivery.duplicates() == []  # явные сбои - не дубли
+
+
+def test_redelivery_of_completed_lesson_starts_new_run(delivery):
+    asyncio.run(delivery.deliver(1, "femininity", 2, plan(), Sender()))
+    sender = Sender()
+    report = asyncio.run(delivery.deliver(1, "femininity", 2, plan(), sender))
+    assert report.run == 2 and report.completed and len(sender.sent) == 5
+
+
+def test_concurrent_call_for_same_lesson_is_ignored(delivery):
+    async def slow(item):
+        await asyncio.sleep(0.01)
+        return True
+
+    async def scenario():
+        return await asyncio.gather(delivery.deliver(1, "femininity", 2, plan(), slow),
+                                    delivery.deliver(1, "femininity", 2, plan(), slow))
+
+    first, second = asyncio.run(scenario())
+    assert first.completed and first.sent == 5
+    assert second.sent == 0 and not second.completed
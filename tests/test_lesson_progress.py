@@ -0,0 +1,89 @@
+# tests/test_lesson_progress.py
+"""Тесты битовых масок уроков."""
+import sqlite3
+
+import pytest
+
+from lesson_progress import (
+    create_lesson_mask_columns,
+    format_ranges,
+    lesson_count,
+    lessons_in_mask,
+    missing_lessons,
+    remaining_lessons,
+)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE user_courses (user_id INTEGER, course_id TEXT, progress INTEGER,
+                                   PRIMARY KEY (user_id, course_id));
+        CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY, user_id INTEGER, course_id TEXT,
+                                lesson INTEGER, status TEXT DEFAULT 'pending');
+        INSERT INTO user_courses VALUES (1, 'femininity_premium', 6), (2, 'femininity_premium', 1);
+        INSERT INTO homeworks (user_id, course_id, lesson, status) VALUES
+            (1, 'femininity_premium', 1, 'approved'),
+            (1, 'femininity_premium', 1, 'pending'),
+            (1, 'femininity_premium', 4, 'pending');
+        """
+    )
+    create_lesson_mask_columns(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def masks(conn, user_id):
+    return conn.execute(
+        "SELECT submitted_mask, approved_mask FROM user_courses WHERE user_id = ?", (user_id,)
+    ).fetchone()
+
+
+def test_backfill_from_existing_homeworks(conn):
+    submitted, approved = masks(conn, 1)
+    assert lessons_in_mask(submitted) == [1, 4]
+    assert lessons_in_mask(approved) == [1]
+    assert masks(conn, 2) == (0, 0)
+
+
+def test_triggers_maintain_masks(conn):
+    conn.execute("INSERT INTO homeworks (user_id, course_id, lesson) VALUES (1, 'femininity_premium', 5)")
+    conn.execute("UPDATE homeworks SET status = 'approved' WHERE lesson = 4")
+    conn.execute("UPDATE homeworks SET status = 'rejected' WHERE lesson = 5")
+    conn.execute("INSERT INTO homeworks (user_id, course_id, lesson) VALUES (1, 'other_course', 2)")
+    submitted, approved = masks(conn, 1)
+    assert lessons_in_mask(submitted) == [1, 4, 5]
+    assert lessons_in_mask(approved) == [1, 4]
+
+    # повторный запуск миграции не трогает заполненные маски
+    create_lesson_mask_columns(conn, conn.cursor())
+    assert masks(conn, 1) == (submitted, approved)
+
+
+def test_missing_lessons_and_ranges(conn):
+    submitted, _ = masks(conn, 1)
+    assert missing_lessons(submitted, 6) == [2, 3, 5]
+    assert format_ranges(missing_lessons(submitted, 6)) == "2..3, 5"
+    assert missing_lessons(None, 3) == [1, 2]
+    assert format_ranges([]) == ""
+    assert format_ranges([1, 2, 3, 5, 7, 8]) == "1..3, 5, 7..8"
+
+
+def test_lesson_count_sees_new_files(tmp_path):
+    course = tmp_path / "yoga"
+    course.mkdir()
+    for name in ("lesson1.txt", "lesson2.md", "lesson3.html", "lesson5.txt", "lesson3_p.txt"):
+        (course / name).write_text("x")
+    assert lesson_count("yoga", str(tmp_path)) == 3
+    (course / "lesson4.txt").write_text("x")
+    assert lesson_count("yoga", str(tmp_path)) == 5
+    assert lesson_count("nope", str(tmp_path)) == 0
+
+
+def test_remaining_lessons_by_approved_mask(conn):
+    _, approved = masks(conn, 1)
+    assert remaining_lessons(approved, 4) == [2, 3, 4]  # принят только урок 1
+    assert remaining_lessons((1 << 1) | (1 << 2), 2) == []
+    assert remaining_lessons(None, 2) == [1, 2]
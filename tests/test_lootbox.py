@@ -0,0 +1,100 @@
+# tests/test_lootbox.py
+"""Тесты лутбоксов: проверка таблиц, алиасы и распределение наград."""
+import random
+import sqlite3
+from collections import Counter
+
+import pytest
+
+from lootbox import AliasTable, LootboxEngine, LootboxTableError, create_lootbox_tables, normalize_rewards
+
+# Критические значения хи-квадрат для уровня 0.001 по числу степеней свободы
+CHI2_CRITICAL_0_001 = {1: 10.828, 2: 13.816, 3: 16.266, 4: 18.467, 5: 20.515}
+
+
+def chi_square(observed: Counter, expected: dict, total: int) -> float:
+    return sum((observed[k] - p * total) ** 2 / (p * total) for k, p in expected.items())
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE lootboxes (id INTEGER PRIMARY KEY AUTOINCREMENT, box_type TEXT, reward TEXT,"
+                 " probability REAL)")
+    create_lootbox_tables(conn, conn.cursor())
+    conn.executemany("INSERT INTO lootboxes (box_type, reward, probability) VALUES (?, ?, ?)", [
+        ("light", "скидка", 0.8), ("light", "товар", 0.2),
+        ("full", "курс", 1), ("full", "скидка", 2), ("full", "товар", 5),
+    ])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_normalize_rewards():
+    assert normalize_rewards("x", [("a", 1), ("b", 3)]) == [("a", 0.25), ("b", 0.75)]
+    # повторы складываются, нулевые выпадают
+    assert normalize_rewards("x", [("a", 0.5), ("a", 0.5), ("b", 0)]) == [("a", 1.0)]
+    for bad in ([], [("a", 0)], [("a", -0.1), ("b", 1)], [("a", float("nan"))], [("a", "много")], [("", 1)]):
+        with pytest.raises(LootboxTableError):
+            normalize_rewards("x", bad)
+
+
+def test_alias_table_mass_matches_probabilities():
+    """Суммарная масса каждой награды по столбцам равна её вероятности - без розыгрышей."""
+    rewards = [("a", 0.1), ("b", 0.2), ("c", 0.3), ("d", 0.4)]
+    table = AliasTable(rewards)
+    n = len(table)
+    mass = Counter()
+    for column in range(n):
+        mass[table.rewards[column]] += table.accept[column] / n
+        mass[table.rewards[table.alias[column]]] += (1 - table.accept[column]) / n
+    for reward, probability in rewards:
+        assert mass[reward] == pytest.approx(probability)
+
+
+@pytest.mark.parametrize("weights", [
+    {"скидка": 0.8, "товар": 0.2},
+    {"a": 0.5, "b": 0.25, "c": 0.125, "d": 0.0625, "e": 0.0625},
+    {"редкая": 0.01, "обычная": 0.99},
+])
+def test_distribution_chi_square(weights):
+    table = AliasTable(list(weights.items()))
+    rng = random.Random(12345)
+    total = 100_000
+    observed = Counter(table.sample_many(total, rng))
+    assert set(observed) <= set(weights)
+    assert chi_square(observed, weights, total) < CHI2_CRITICAL_0_001[len(weights) - 1]
+
+
+def test_engine_normalises_and_rolls_batches(conn):
+    engine = LootboxEngine(conn, rng=random.Random(7))
+    assert engine.box_types() == ["full", "light"]
+    # веса 1:2:5 нормированы, "ничего" не выпадает
+    total = 40_000
+    observed = Counter(engine.roll_many("full", 50) + [engine.roll("full") for _ in range(total - 50)])
+    assert "ничего" not in observed
+    expected = {"курс": 1 / 8, "скидка": 2 / 8, "товар": 5 / 8}
+    assert chi_square(observed, expected, total) < CHI2_CRITICAL_0_001[2]
+
+    with pytest.raises(LootboxTableError):
+        engine.roll("gold")
+    with pytest.raises(LootboxTableError):
+        engine.roll_many("light", 0)
+
+
+def test_engine_refreshes_on_table_change(conn):
+    engine = LootboxEngine(conn, rng=random.Random(1), check_interval=0)
+    assert engine.roll("light") in {"скидка", "товар"}
+    conn.execute("DELETE FROM lootboxes WHERE box_type = 'light'")
+    conn.execute("INSERT INTO lootboxes (box_type, reward, probability) VALUES ('light', 'стикер', 1)")
+    conn.commit()
+    assert set(engine.roll_many("light", 20)) == {"стикер"}
+
+
+def test_engine_skips_invalid_box(conn):
+    conn.execute("INSERT INTO lootboxes (box_type, reward, probability) VALUES ('broken', 'x', -1)")
+    conn.commit()
+    engine = LootboxEngine(conn)
+    assert not engine.has_box("broken")
+    assert engine.has_box("light")
@@ -0,0 +1,103 @@
+# tests/test_media_archiver.py
+"""Тесты фонового архиватора медиа домашек."""
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from media_archiver import MediaArchiver, create_media_archive_tables, enqueue_media, write_blob
+
+
+class FakeFile:
+    def __init__(self, data):
+        self.data = data
+
+    async def download_as_bytearray(self):
+        await asyncio.sleep(0)
+        return bytearray(self.data)
+
+
+class FakeBot:
+    """Бот с заданным содержимым файлов; считает вызовы и параллельность."""
+
+    def __init__(self, files):
+        self.files = files
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    async def get_file(self, file_id):
+        self.calls.append(file_id)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        if file_id not in self.files:
+            raise RuntimeError("file expired")
+        return FakeFile(self.files[file_id])
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY, file_id TEXT)")
+    create_media_archive_tables(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_archive_and_dedupe(conn, tmp_path):
+    """Повтор file_unique_id ставится один раз, одинаковое содержимое хранится одним файлом."""
+    cursor = conn.cursor()
+    enqueue_media(cursor, "fid-a", "uniq-a")
+    enqueue_media(cursor, "fid-a2", "uniq-a")
+    enqueue_media(cursor, "fid-b", "uniq-b")
+    conn.commit()
+    bot = FakeBot({"fid-a": b"same bytes", "fid-b": b"same bytes"})
+
+    archiver = MediaArchiver(bot, conn, store_dir=str(tmp_path))
+    counters = await archiver.run_once()
+    assert counters == {"archived": 2, "deduplicated": 1, "failed": 0}
+    assert sorted(bot.calls) == ["fid-a", "fid-b"]
+
+    rows = conn.execute("SELECT status, sha256, path FROM media_archive ORDER BY file_unique_id").fetchall()
+    assert {r[0] for r in rows} == {"archived"}
+    assert rows[0][1] == rows[1][1] and rows[0][2] == rows[1][2]
+    assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 1
+
+    # повторный проход ничего не качает
+    assert (await archiver.run_once())["archived"] == 0
+
+
+@pytest.mark.asyncio
+async def test_failures_are_retried_up_to_limit(conn, tmp_path):
+    enqueue_media(conn.cursor(), "gone", "uniq-gone")
+    conn.commit()
+    archiver = MediaArchiver(FakeBot({}), conn, store_dir=str(tmp_path), max_attempts=2)
+    assert (await archiver.run_once())["failed"] == 1
+    assert (await archiver.run_once())["failed"] == 1
+    assert (await archiver.run_once())["failed"] == 0
+    status, attempts, error = conn.execute("SELECT status, attempts, error FROM media_archive").fetchone()
+    assert (status, attempts, error) == ("failed", 2, "file expired")
+
+
+@pytest.mark.asyncio
+async def test_bounded_concurrency(conn, tmp_path):
+    cursor = conn.cursor()
+    files = {}
+    for i in range(10):
+        enqueue_media(cursor, f"fid-{i}", f"uniq-{i}")
+        files[f"fid-{i}"] = f"content {i}".encode()
+    conn.commit()
+    bot = FakeBot(files)
+    await MediaArchiver(bot, conn, store_dir=str(tmp_path), concurrency=3).run_once()
+    assert bot.max_active == 3
+
+
+def test_parallel_writes_of_same_blob(tmp_path):
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: write_blob(str(tmp_path), b"same content" * 1000), range(32)))
+    assert len({path for _, path, _ in results}) == 1
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [results[0][0]]  # временных файлов не осталось
@@ -0,0 +1,26 @@
+# tests/test_models.py
+"""Тесты общих моделей."""
+import dataclasses
+import pickle
+
+import pytest
+
+from models import Course, LessonFile, MediaItem
+
+
+def test_course_tariff_and_str():
+    course = Course("femininity_premium", "Женственность", "main", "роза", price_rub=1500)
+    assert course.tariff == "premium"
+    assert Course("solo", "Курс", "main", "слово").tariff == "default"
+    assert "code=роза" in str(course)
+
+
+@pytest.mark.parametrize("model", [
+    Course("a_b", "n", "main", "w"), LessonFile("p", "text"), MediaItem("f", "u", "photo"),
+])
+def test_models_are_slotted_frozen_and_picklable(model):
+    assert not hasattr(model, "__dict__")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        model.__setattr__(dataclasses.fields(model)[0].name, "x")
+    assert pickle.loads(pickle.dumps(model)) == model
+
@@ -0,0 +1,63 @@
+# tests/test_monthly_accrual.py
+"""Тесты ежемесячного массового начисления."""
+import sqlite3
+from datetime import date
+
+import pytest
+
+from monthly_accrual import create_monthly_accrual_tables, format_accrual_report, run_monthly_accrual
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, last_bonus_date TEXT, trust_credit INTEGER DEFAULT 0);
+        CREATE TABLE user_tokens (user_id INTEGER PRIMARY KEY, tokens INTEGER DEFAULT 3);
+        CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, action TEXT,
+                                   amount INTEGER, reason TEXT);
+        """
+    )
+    conn.executemany("INSERT INTO users (user_id, last_bonus_date) VALUES (?, ?)",
+                     [(i, None) for i in range(1, 8)])
+    # ученику 3 бонус за октябрь уже начислен лениво в add_tokens
+    conn.execute("UPDATE users SET last_bonus_date = '2026-10-05' WHERE user_id = 3")
+    conn.execute("INSERT INTO user_tokens VALUES (1, 10)")
+    conn.commit()
+    create_monthly_accrual_tables(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_accrual_in_chunks(conn):
+    report = run_monthly_accrual(conn, bonus=5, trust_increase=2, today=date(2026, 10, 1), chunk_size=3)
+    assert (report.users, report.trust_users, report.bonus_users, report.chunks) == (7, 7, 6, 3)
+    assert conn.execute("SELECT SUM(trust_credit) FROM users").fetchone()[0] == 14
+    assert conn.execute("SELECT tokens FROM user_tokens WHERE user_id = 1").fetchone()[0] == 15
+    assert conn.execute("SELECT tokens FROM user_tokens WHERE user_id = 2").fetchone()[0] == 5
+    assert conn.execute("SELECT COUNT(*) FROM user_tokens WHERE user_id = 3").fetchone()[0] == 0
+    ledger = dict(conn.execute("SELECT action, COUNT(*) FROM transactions GROUP BY action").fetchall())
+    assert ledger == {"trust": 7, "earn": 6}
+    assert "Учеников обработано: 7" in format_accrual_report(report)
+
+
+def test_idempotent_per_month(conn):
+    run_monthly_accrual(conn, bonus=5, today=date(2026, 10, 1))
+    again = run_monthly_accrual(conn, bonus=5, today=date(2026, 10, 20))
+    assert again.skipped
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 13
+
+    november = run_monthly_accrual(conn, bonus=5, today=date(2026, 11, 1))
+    assert (november.trust_users, november.bonus_users) == (7, 7)
+
+
+def test_interrupted_run_does_not_double_credit(conn):
+    # запуск оборвался: запись о месяце есть, часть учеников уже получила начисление
+    conn.execute("INSERT INTO monthly_accruals (period) VALUES ('2026-10')")
+    conn.execute("UPDATE users SET trust_credit = 2, last_trust_month = '2026-10' WHERE user_id <= 2")
+    conn.commit()
+    report = run_monthly_accrual(conn, bonus=0, trust_increase=2, today=date(2026, 10, 1))
+    assert report.trust_users == 5 and report.bonus_users == 0
+    assert conn.execute("SELECT MAX(trust_credit) FROM users").fetchone()[0] == 2
+    assert conn.execute("SELECT finished_at IS NOT NULL FROM monthly_accruals").fetchone()[0] == 1
@@ -0,0 +1,110 @@
+# tests/test_preliminary_materials.py
+import asyncio
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from preliminary_materials import (PreliminaryMaterials, build_manifest, create_preliminary_tables,
+                                   media_groups)
+
+
+class FakeBot:
+    """Записывает вызовы; загрузка файла выдаёт новый file_id, отправка по file_id - нет."""
+
+    def __init__(self):
+        self.calls = []
+        self.uploads = 0
+
+    def _message(self, kind, payload):
+        if hasattr(payload, "read"):
+            self.uploads += 1
+            file_id = f"fid-{self.uploads}"
+        else:
+            file_id = payload
+        attachment = SimpleNamespace(file_id=file_id)
+        return SimpleNamespace(message_id=len(self.calls), photo=[attachment] if kind == "photo" else None,
+                               document=attachment if kind == "document" else None,
+                               video=attachment if kind == "video" else None,
+                               audio=attachment if kind == "audio" else None)
+
+    def __getattr__(self, name):
+        if not name.startswith("send_") or name == "send_media_group":
+            raise AttributeError(name)
+        kind = name[len("send_"):]
+
+        async def send(chat_id, payload, caption=None, disable_notification=False):
+            self.calls.append((name, chat_id, "upload" if hasattr(payload, "read") else payload, caption))
+            return self._message(kind, payload)
+        return send
+
+    async def send_media_group(self, chat_id, media):
+        self.calls.append(("send_media_group", chat_id, [m.media for m in media], media[0].caption))
+
+    async def delete_message(self, chat_id, message_id):
+        self.calls.append(("delete_message", chat_id, message_id, None))
+
+
+@pytest.fixture
+def store(tmp_path):
+    course = tmp_path / "femininity"
+    course.mkdir()
+    for name in ("lesson2_p1.jpg", "lesson2_p2.png", "lesson2_p3.txt", "lesson2.txt", "lesson3_p.txt"):
+        (course / name).write_bytes(name.encode())
+    conn = sqlite3.connect(":memory:")
+    create_preliminary_tables(conn, conn.cursor())
+    return PreliminaryMaterials(conn, str(tmp_path))
+
+
+def test_manifest_built_once_per_lesson(store, tmp_path):
+    manifest = build_manifest(str(tmp_path))
+    assert set(manifest) == {("femininity", 2), ("femininity", 3)}
+    assert [(os.path.basename(m.path), m.type) for m in manifest[("femininity", 2)]] == [
+        ("lesson2_p1.jpg", "photo"), ("lesson2_p2.png", "photo"), ("lesson2_p3.txt", "document")]
+    assert store.materials("femininity", 9) == ()
+
+
+def test_media_groups_split_incompatible_types(store):
+    items = [(m, "id") for m in store.materials("femininity", 2)]
+    assert [len(g) for g in media_groups(items)] == [2, 1]
+
+
+def test_warm_then_send_uses_only_file_ids(store):
+    bot = FakeBot()
+    assert asyncio.run(store.warm(bot, -100, "femininity", 2)) == 3
+    assert [c[0] for c in bot.calls].count("delete_message") == 3
+    # повторный прогрев ничего не грузит
+    assert asyncio.run(store.warm(bot, -100, "femininity", 2)) == 0
+
+    bot.calls.clear()
+    sent = asyncio.run(store.send(bot, 42, "femininity", 2, "к уроку 2"))
+    assert sent == 3 and bot.uploads == 3
+    assert bot.calls == [
+        ("send_media_group", 42, ["fid-1", "fid-2"], "к уроку 2"),
+        ("send_document", 42, "fid-3", None),
+    ]
+
+
+def test_send_without_warmup_uploads_and_remembers(store):
+    bot = FakeBot()
+    asyncio.run(store.send(bot, 42, "femininity", 3, "к уроку 3"))
+    assert bot.calls == [("send_document", 42, "upload", "к уроку 3")]
+    material = store.materials("femininity", 3)[0]
+    assert store.cached_file_id(material) == "fid-1"
+
+    # файл изменился - старый file_id больше не подходит
+    with open(material.path, "ab") as f:
+        f.write(b" v2")
+    assert store.cached_file_id(material) is None
+
+
+def test_background_warmup_is_awaited_by_send(store):
+    bot = FakeBot()
+
+    async def scenario():
+        store.warm_in_background(bot, -100, "femininity", 2)
+        return await store.send(bot, 42, "femininity", 2, "к уроку 2")
+
+    assert asyncio.run(scenario()) == 3
+    assert bot.uploads == 3  # ученику ничего не загружалось повторно
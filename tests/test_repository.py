@@ -0,0 +1,156 @@
+# tests/test_repository.py
+"""Общий контрактный набор тестов для всех бэкендов репозитория."""
+import os
+
+import pytest
+import pytest_asyncio
+
+from repository import (
+    InMemoryRepository,
+    InsufficientTokensError,
+    SQLiteRepository,
+    asyncpg,
+    create_repository,
+)
+
+TEST_POSTGRES_DSN = os.getenv("TEST_POSTGRES_DSN")
+
+
+@pytest_asyncio.fixture(params=["sqlite", "memory", "postgres"])
+async def repo(request):
+    """Репозиторий каждого бэкенда на чистой схеме."""
+    if request.param == "postgres":
+        if asyncpg is None or not TEST_POSTGRES_DSN:
+            pytest.skip("нужны asyncpg и TEST_POSTGRES_DSN")
+        repository = create_repository("postgres", dsn=TEST_POSTGRES_DSN)
+        await repository.init_schema()
+        pool = await repository._get_pool()
+        await pool.execute(
+            "TRUNCATE users, user_courses, homeworks, user_tokens, transactions,"
+            " user_settings, homework_rejections RESTART IDENTITY"
+        )
+    else:
+        repository = create_repository(request.param)
+        await repository.init_schema()
+    yield repository
+    await repository.close()
+
+
+def test_factory_selects_backend():
+    """Фабрика возвращает нужный класс и отвергает неизвестный бэкенд."""
+    assert isinstance(create_repository("sqlite"), SQLiteRepository)
+    assert isinstance(create_repository("memory"), InMemoryRepository)
+    with pytest.raises(ValueError):
+        create_repository("oracle")
+
+
+@pytest.mark.asyncio
+async def test_users(repo):
+    """Создание пользователя, смена имени и активного курса."""
+    assert await repo.get_user(1) is None
+    await repo.upsert_user(1, "Анна")
+    await repo.upsert_user(1, "Анна Петровна")
+    await repo.set_active_course(1, "femininity_premium")
+    user = await repo.get_user(1)
+    assert user["full_name"] == "Анна Петровна"
+    assert user["active_course_id"] == "femininity_premium"
+
+
+@pytest.mark.asyncio
+async def test_user_courses(repo):
+    """Курсы пользователя: добавление без дублей, прогресс и тариф."""
+    await repo.add_user_course(1, "femininity_premium", "main", "premium")
+    await repo.add_user_course(1, "femininity_premium", "main", "premium", progress=5)
+    await repo.add_user_course(1, "autogenic_self_check", "auxiliary", "self_check")
+    courses = await repo.list_user_courses(1)
+    assert [c["course_id"] for c in courses] == ["autogenic_self_check", "femininity_premium"]
+    assert courses[1]["progress"] == 1
+
+    assert await repo.set_progress(1, "femininity_premium", 3)
+    assert await repo.set_course_tariff(1, "femininity_premium", "admin_check")
+    course = await repo.get_user_course(1, "femininity_premium")
+    assert (course["progress"], course["tariff"]) == (3, "admin_check")
+    assert not await repo.set_progress(2, "femininity_premium", 3)
+    assert await repo.get_user_course(2, "femininity_premium") is None
+
+
+@pytest.mark.asyncio
+async def test_homeworks(repo):
+    """Домашки: вставка, последняя по уроку, смена статуса."""
+    first = await repo.add_homework(1, "femininity_premium", 1, "file1", "photo")
+    second = await repo.add_homework(1, "femininity_premium", 2, "file2", "document")
+    await repo.add_homework(1, "autogenic_premium", 7, "file3", "photo")
+    assert second > first
+
+    last = await repo.get_last_homework(1, "femininity_premium")
+    assert (last["hw_id"], last["lesson"], last["status"]) == (second, 2, "pending")
+
+    assert await repo.set_homework_status(first, "approved", admin_comment="Отлично")
+    hw = await repo.get_homework(first)
+    assert hw["status"] == "approved"
+    assert hw["admin_comment"] == "Отлично"
+    assert hw["approval_time"] is not None
+    assert not await repo.set_homework_status(9999, "approved")
+
+    assert len(await repo.list_homeworks(1)) == 3
+    assert [hw["hw_id"] for hw in await repo.list_homeworks(1, "femininity_premium")] == [second, first]
+
+
+@pytest.mark.asyncio
+async def test_tokens(repo):
+    """Жетоны: начисление, списание и журнал транзакций."""
+    assert await repo.get_tokens(1) == 0
+    assert await repo.add_tokens(1, 5, "homework") == 5
+    assert await repo.add_tokens(1, 2, "bonus") == 7
+    assert await repo.spend_tokens(1, 4, "lootbox") == 3
+    with pytest.raises(InsufficientTokensError):
+        await repo.spend_tokens(1, 10, "lootbox")
+    with pytest.raises(InsufficientTokensError):
+        await repo.spend_tokens(2, 1, "lootbox")
+    assert await repo.get_tokens(1) == 3
+
+    transactions = await repo.list_transactions(1)
+    assert [(t["action"], t["amount"], t["reason"]) for t in transactions] == [
+        ("earn", 5, "homework"),
+        ("earn", 2, "bonus"),
+        ("spend", 4, "lootbox"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_settings(repo):
+    """Напоминания: установка, отключение и неизвестный тип."""
+    assert await repo.get_settings(1) is None
+    await repo.set_notification(1, "morning", "08:00")
+    await repo.set_notification(1, "evening", "20:30")
+    assert await repo.get_settings(1) == {"morning_notification": "08:00", "evening_notification": "20:30"}
+    await repo.set_notification(1, "morning", None)
+    assert (await repo.get_settings(1))["morning_notification"] is None
+    with pytest.raises(ValueError):
+        await repo.set_notification(1, "night", "23:00")
+
+
+@pytest.mark.asyncio
+async def test_rejections(repo):
+    """Отказы: новые первыми, фильтр по уроку."""
+    first = await repo.add_rejection(1, "femininity_premium", 1, "Плохо видно")
+    second = await repo.add_rejection(1, "femininity_premium", 2, "Не то задание")
+    rejections = await repo.list_rejections(1, "femininity_premium")
+    assert [r["rejection_id"] for r in rejections] == [second, first]
+    by_lesson = await repo.list_rejections(1, "femininity_premium", lesson=1)
+    assert [r["reason"] for r in by_lesson] == ["Плохо видно"]
+    assert await repo.list_rejections(2, "femininity_premium") == []
+
+
+@pytest.mark.asyncio
+async def test_sqlite_history_ordered_by_submission_time():
+    """История домашек - по времени сдачи, а не по hw_id (старые записи могли сдаваться позже)."""
+    repo = create_repository("sqlite")
+    await repo.init_schema()
+    early = await repo.add_homework(1, "femininity_premium", 1, "f1", "photo")
+    late = await repo.add_homework(1, "femininity_premium", 2, "f2", "photo")
+    repo.conn.execute("UPDATE homeworks SET submission_time = '2025-02-01 10:00:00' WHERE hw_id = ?", (early,))
+    repo.conn.execute("UPDATE homeworks SET submission_time = '2025-01-01 10:00:00' WHERE hw_id = ?", (late,))
+    assert [hw["hw_id"] for hw in await repo.list_homeworks(1)] == [early, late]
+    assert "timestamp" in (await repo.get_homework(early))  # полная схема create_all_tables
+    await repo.close()
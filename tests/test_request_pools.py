@@ -0,0 +1,110 @@
+# tests/test_request_pools.py
+import asyncio
+import json
+
+import httpx
+import pytest
+from telegram import InputFile
+from telegram.error import TimedOut
+from telegram.request import RequestData
+from telegram.request._requestparameter import RequestParameter
+
+from request_pools import PoolConfig, PooledRequest, RoutedRequest, format_pool_metrics
+
+URL = "https://api.telegram.org/bot1:x/"
+OK = json.dumps({"ok": True, "result": True}).encode()
+
+
+def config(name, size=2):
+    return PoolConfig(name, size=size, keepalive=1, keepalive_expiry=5.0, connect_timeout=1.0, read_timeout=1.0,
+                      write_timeout=1.0, pool_timeout=0.5)
+
+
+def pooled(name, handler):
+    request = PooledRequest(config(name))
+    request._client_kwargs["transport"] = httpx.MockTransport(handler)
+    request._client = request._build_client()
+    return request
+
+
+def data(**params):
+    return RequestData([RequestParameter.from_input(key, value) for key, value in params.items()])
+
+
+def test_keepalive_limits_applied():
+    request = PooledRequest(config("upload", size=4))
+    limits = request._client_kwargs["limits"]
+    assert (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry) == (4, 1, 5.0)
+
+
+def test_uploads_routed_to_upload_pool():
+    seen = []
+
+    def handler(name):
+        def respond(request):
+            seen.append((name, request.url.path.rsplit("/", 1)[-1]))
+            return httpx.Response(200, content=OK)
+        return respond
+
+    routed = RoutedRequest(pooled("interactive", handler("interactive")), pooled("upload", handler("upload")))
+
+    async def scenario():
+        await routed.initialize()
+        await routed.post(URL + "sendVideo", data(chat_id=1, video=InputFile(b"\x00" * 1024, filename="v.mp4")))
+        await routed.post(URL + "sendVideo", data(chat_id=1, video="file-id-123"))
+        await routed.post(URL + "answerCallbackQuery", data(callback_query_id="1"))
+        await routed.shutdown()
+
+    asyncio.run(scenario())
+    assert seen == [("upload", "sendVideo"), ("interactive", "sendVideo"), ("interactive", "answerCallbackQuery")]
+    metrics = routed.metrics()
+    assert metrics["upload"]["requests"] == 1 and metrics["interactive"]["requests"] == 2
+    assert metrics["interactive"]["top_methods"] == [("sendVideo", 1), ("answerCallbackQuery", 1)]
+    assert metrics["upload"]["max_in_flight"] == 1 and metrics["upload"]["in_flight"] == 0
+
+
+def test_upload_write_timeout_not_capped_by_ptb_default():
+    seen = []
+
+    def respond(request):
+        seen.append(request.extensions["timeout"]["write"])
+        return httpx.Response(200, content=OK)
+
+    upload = PooledRequest(PoolConfig("upload", size=1, keepalive=1, keepalive_expiry=5.0, connect_timeout=1.0,
+                                      read_timeout=1.0, write_timeout=120.0, pool_timeout=0.5))
+    upload._client_kwargs["transport"] = httpx.MockTransport(respond)
+    upload._client = upload._build_client()
+    video = InputFile(b"\x00" * 1024, filename="v.mp4")
+
+    async def scenario():
+        await upload.initialize()
+        await upload.post(URL + "sendVideo", data(chat_id=1, video=video), write_timeout=20)  # как в Bot.send_video
+        await upload.post(URL + "sendVideo", data(chat_id=1, video=video), write_timeout=300)
+        await upload.post(URL + "sendMessage", data(chat_id=1, text="x"), write_timeout=5)
+        await upload.shutdown()
+
+    asyncio.run(scenario())
+    assert seen == [120.0, 300, 5]
+
+
+def test_pool_timeout_counted():
+    def handler(request):
+        raise httpx.PoolTimeout("pool exhausted")
+
+    request = pooled("interactive", handler)
+
+    async def scenario():
+        await request.initialize()
+        with pytest.raises(TimedOut):
+            await request.post(URL + "sendMessage", data(chat_id=1, text="hi"))
+        await request.shutdown()
+
+    asyncio.run(scenario())
+    stats = request.metrics.snapshot()
+    assert (stats["errors"], stats["timeouts"], stats["pool_timeouts"]) == (1, 1, 1)
+
+
+def test_format_pool_metrics_lists_both_pools():
+    routed = RoutedRequest(PooledRequest(config("interactive")), PooledRequest(config("upload")))
+    text = format_pool_metrics(routed)
+    assert "interactive: 2 соединений" in text and "upload: 2 соединений" in text
@@ -0,0 +1,118 @@
+# tests/test_search_index.py
+import os
+import sqlite3
+
+import pytest
+
+from data_tiering import TIERED_TABLES, archive_batch
+from search_index import (add_support_ticket, create_search_tables, format_search_results, match_expression, search,
+                          sync_lesson_index)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, course_id TEXT,
+            lesson INTEGER, status TEXT, admin_comment TEXT);
+        CREATE TABLE homework_rejections (rejection_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            course_id TEXT NOT NULL, lesson INTEGER NOT NULL, reason TEXT NOT NULL, rejected_at TIMESTAMP);
+        INSERT INTO homework_rejections (user_id, course_id, lesson, reason)
+            VALUES (7, 'femininity', 2, 'Фото размыто, пересними при дневном свете');
+        """
+    )
+    create_search_tables(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_existing_rows_indexed_and_triggers_follow_changes(conn):
+    # отказ был до создания индекса - попал при построении
+    hits, total = search(conn, "размыто")
+    assert total == 1 and hits[0].source == "rejections" and hits[0].user_id == 7
+    assert "[размыто]" in hits[0].snippet
+
+    conn.execute("INSERT INTO homeworks (user_id, course_id, lesson, status) VALUES (8, 'c', 1, 'pending')")
+    assert search(conn, "свет")[1] == 1
+    conn.execute("UPDATE homeworks SET admin_comment = 'Отличный свет и композиция' WHERE hw_id = 1")
+    hits, total = search(conn, "композиц")  # префиксный поиск
+    assert total == 1 and (hits[0].source, hits[0].ref_id) == ("comments", 1)
+    assert search(conn, "свет")[1] == 2
+    conn.execute("UPDATE homeworks SET admin_comment = 'Переделать' WHERE hw_id = 1")
+    assert search(conn, "композиция")[1] == 0
+    conn.execute("DELETE FROM homework_rejections")
+    assert search(conn, "размыто")[1] == 0
+
+
+def test_support_tickets_ranked_and_paginated(conn):
+    for i in range(7):
+        add_support_ticket(conn.cursor(), 100 + i, f"Не приходит урок номер {i}" + (" урок урок" if i == 3 else ""),
+                           None, 1700000000 + i)
+    add_support_ticket(conn.cursor(), 200, None, "photo-id", 1700000100)  # только фото - без текста
+    hits, total = search(conn, "урок", sources=["support"], page_size=5)
+    assert total == 7 and len(hits) == 5
+    assert hits[0].user_id == 103  # больше совпадений - выше bm25
+    second, _ = search(conn, "урок", sources=["support"], page=1, page_size=5)
+    assert len(second) == 2 and not {h.ref_id for h in hits} & {h.ref_id for h in second}
+    text = format_search_results("урок", second, total, 1)
+    assert "страница 2 из 2" in text and "Поддержка #" in text
+
+
+def test_lesson_files_reindexed_only_when_changed(conn, tmp_path):
+    course = tmp_path / "femininity"
+    course.mkdir()
+    (course / "lesson1.html").write_text("<b>Дыхательная</b> практика", encoding="utf-8")
+    (course / "lesson1_1m.txt").write_text("не урок", encoding="utf-8")
+    assert sync_lesson_index(conn, str(tmp_path)) == {"indexed": 1, "removed": 0, "unchanged": 0}
+    hits, _ = search(conn, "дыхательн")
+    assert (hits[0].source, hits[0].course_id, hits[0].lesson) == ("lessons", "femininity", 1)
+    assert sync_lesson_index(conn, str(tmp_path))["unchanged"] == 1
+
+    (course / "lesson1.html").write_text("Новая медитация", encoding="utf-8")
+    os.utime(course / "lesson1.html", ns=(1, 1))
+    assert sync_lesson_index(conn, str(tmp_path))["indexed"] == 1
+    assert search(conn, "дыхательная")[1] == 0 and search(conn, "медитация")[1] == 1
+    (course / "lesson1.html").unlink()
+    assert sync_lesson_index(conn, str(tmp_path))["removed"] == 1
+    assert search(conn, "медитация")[1] == 0
+
+
+def test_archived_rows_stay_searchable(tmp_path):
+    path = str(tmp_path / "bot.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, course_id TEXT,
+            lesson INTEGER, status TEXT, admin_comment TEXT, timestamp TEXT, submission_time DATETIME,
+            approval_time DATETIME, final_approval_time DATETIME);
+        CREATE TABLE homework_rejections (rejection_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+            course_id TEXT NOT NULL, lesson INTEGER NOT NULL, reason TEXT NOT NULL, rejected_at TIMESTAMP);
+        CREATE TABLE archived_rows (table_name TEXT, user_id INTEGER, month TEXT, rows INTEGER,
+            PRIMARY KEY (table_name, user_id, month));
+        INSERT INTO homework_rejections (user_id, course_id, lesson, reason, rejected_at)
+            VALUES (7, 'c', 1, 'Старое размытое фото', '2024-01-02 10:00:00');
+        INSERT INTO homeworks (user_id, course_id, lesson, status, admin_comment, approval_time)
+            VALUES (7, 'c', 1, 'approved', 'Чудесная композиция', '2024-01-03 10:00:00');
+        """
+    )
+    archive_dir = str(tmp_path / "archive")
+    # архив, сделанный до появления archived_fts, индексируется при его создании
+    archive_batch(conn, TIERED_TABLES["homework_rejections"], "2025-01-01 00:00:00", archive_dir)
+    create_search_tables(conn, conn.cursor(), archive_dir)
+    hits, total = search(conn, "размыт")
+    assert total == 1 and (hits[0].source, hits[0].ref_id, hits[0].user_id) == ("rejections", 1, 7)
+
+    assert search(conn, "композиц")[1] == 1
+    archive_batch(conn, TIERED_TABLES["homeworks"], "2025-01-01 00:00:00", archive_dir)
+    assert conn.execute("SELECT COUNT(*) FROM homeworks").fetchone()[0] == 0
+    hits, total = search(conn, "композиц", sources=["comments"])
+    assert total == 1 and (hits[0].source, hits[0].ref_id, hits[0].lesson) == ("comments", 1, 1)
+    assert "[композиция]" in hits[0].snippet
+    assert search(conn, "композиц", sources=["rejections"])[1] == 0
+    conn.close()
+
+
+def test_match_expression_escapes_syntax():
+    assert match_expression('урок" OR * NEAR(') == '"урок"* "or"* "near"*'
+    assert match_expression("  !!! ") is None
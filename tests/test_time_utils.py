@@ -0,0 +1,113 @@
+# tests/test_time_utils.py
+"""Тесты целочисленных колонок времени."""
+import sqlite3
+from datetime import date, datetime
+
+import pytest
+
+from time_utils import create_epoch_columns, format_epoch, from_epoch, month_day, to_epoch
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, birthday TEXT, next_lesson_time DATETIME);
+        CREATE TABLE homeworks (
+            hw_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, course_id TEXT, lesson INTEGER,
+            file_id TEXT, status TEXT DEFAULT 'pending',
+            timestamp TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+            lesson_sent_time DATETIME, submission_time DATETIME, approval_time DATETIME, final_approval_time DATETIME
+        );
+        INSERT INTO users VALUES (1, '1990-03-14', '2026-10-19 12:00:00');
+        INSERT INTO homeworks (user_id, course_id, lesson, file_id, timestamp, submission_time, lesson_sent_time)
+        VALUES (1, 'c1', 1, 'f1', '2026-10-01 08:00:00', NULL, '2026-10-01 07:00:00.123456');
+        """
+    )
+    create_epoch_columns(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_conversions():
+    moment = datetime(2026, 10, 19, 12, 30, 15)
+    ts = to_epoch(moment)
+    assert to_epoch("2026-10-19 12:30:15") == ts
+    assert from_epoch(ts) == moment
+    assert format_epoch(ts, "%d.%m %H:%M") == "19.10 12:30"
+    assert to_epoch(date(2026, 10, 19)) == to_epoch("2026-10-19")
+    assert to_epoch(None) is None and to_epoch("не дата") is None
+    assert month_day(date(1990, 3, 14)) == 314
+
+
+def test_backfill(conn):
+    assert conn.execute("SELECT next_lesson_at, birthday_md FROM users").fetchone() == (
+        to_epoch("2026-10-19 12:00:00"), 314)
+    # submission_time пуст - берётся timestamp вставки
+    submitted_at, sent_at = conn.execute("SELECT submitted_at, lesson_sent_at FROM homeworks").fetchone()
+    assert submitted_at == to_epoch("2026-10-01 08:00:00")
+    assert sent_at == to_epoch("2026-10-01 07:00:00")
+
+
+def test_lesson_sent_row_is_not_a_submission(conn):
+    # строка pending при отправке урока: файла нет - и времени сдачи нет
+    conn.execute("INSERT INTO homeworks (user_id, course_id, lesson, lesson_sent_time)"
+                 " VALUES (1, 'c1', 2, '2026-10-02 07:00:00')")
+    assert conn.execute("SELECT submitted_at FROM homeworks WHERE lesson = 2").fetchone()[0] is None
+    conn.execute("UPDATE homeworks SET file_id = 'f2', submission_time = '2026-10-02 09:00:00' WHERE lesson = 2")
+    assert conn.execute("SELECT submitted_at FROM homeworks WHERE lesson = 2").fetchone()[0] == \
+        to_epoch("2026-10-02 09:00:00")
+
+
+def test_old_trigger_replaced_and_column_refilled():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(
+        """
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, birthday TEXT, next_lesson_time DATETIME);
+        CREATE TABLE homeworks (hw_id INTEGER PRIMARY KEY, user_id INTEGER, course_id TEXT, file_id TEXT, timestamp TEXT,
+            submission_time DATETIME,
+            approval_time DATETIME, final_approval_time DATETIME, lesson_sent_time DATETIME,
+            submitted_at INTEGER);
+        CREATE TRIGGER trg_homeworks_submitted_at_insert AFTER INSERT ON homeworks BEGIN
+            UPDATE homeworks SET submitted_at = CAST(strftime('%s', NEW.timestamp, 'utc') AS INTEGER)
+            WHERE rowid = NEW.rowid;
+        END;
+        INSERT INTO homeworks (hw_id, timestamp) VALUES (1, '2026-10-01 07:00:00');
+        """
+    )
+    assert conn.execute("SELECT submitted_at FROM homeworks").fetchone()[0] is not None
+    create_epoch_columns(conn, conn.cursor())
+    assert conn.execute("SELECT submitted_at FROM homeworks").fetchone()[0] is None
+    conn.execute("INSERT INTO homeworks (hw_id, timestamp) VALUES (2, '2026-10-01 08:00:00')")
+    assert conn.execute("SELECT submitted_at FROM homeworks WHERE hw_id = 2").fetchone()[0] is None
+
+
+def test_triggers_follow_text_writes(conn):
+    conn.execute("INSERT INTO users (user_id, birthday) VALUES (2, '2001-12-31')")
+    conn.execute("UPDATE users SET next_lesson_time = '2026-11-01 09:00:00' WHERE user_id = 2")
+    assert conn.execute("SELECT next_lesson_at, birthday_md FROM users WHERE user_id = 2").fetchone() == (
+        to_epoch("2026-11-01 09:00:00"), 1231)
+
+    conn.execute("UPDATE homeworks SET status = 'approved', approval_time = '2026-10-01 10:00:00',"
+                 " final_approval_time = '2026-10-01 10:00:00' WHERE hw_id = 1")
+    approved_at, final_at, submitted_at = conn.execute(
+        "SELECT approved_at, final_approved_at, submitted_at FROM homeworks").fetchone()
+    assert approved_at == final_at == to_epoch("2026-10-01 10:00:00")
+    assert approved_at - submitted_at == 2 * 3600
+
+    # повторный запуск миграции ничего не ломает
+    create_epoch_columns(conn, conn.cursor())
+    assert conn.execute("SELECT approved_at FROM homeworks").fetchone()[0] == approved_at
+
+
+@pytest.mark.parametrize("query, params, index", [
+    ("SELECT user_id FROM users WHERE birthday_md = ?", (314,), "idx_users_birthday_md"),
+    ("SELECT user_id FROM users WHERE next_lesson_at <= ?", (0,), "idx_users_next_lesson_at"),
+    ("SELECT COUNT(*) FROM homeworks WHERE submitted_at >= ?", (0,), "idx_homeworks_submitted_at"),
+    ("SELECT MAX(submitted_at) FROM homeworks WHERE user_id = ? AND course_id = ?", (1, "c1"),
+     "idx_homeworks_user_course_submitted"),
+])
+def test_queries_use_indexes(conn, query, params, index):
+    plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+    assert index in plan
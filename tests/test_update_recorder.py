@@ -0,0 +1,134 @@
+# tests/test_update_recorder.py
+import gzip
+import sqlite3
+
+from update_recorder import (ADMIN_GROUP_PSEUDO_ID, ADMIN_PSEUDO_BASE, UpdateAnonymizer, UpdateRecorder,
+                             read_records, remap_user_ids, session_path)
+
+USER_ID = 5512345678
+ADMIN_ID = 4400000001
+GROUP_ID = -1009876543210
+
+
+def message_update(text, user_id=USER_ID, **extra):
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 7, "date": 1_792_000_000, "text": text,
+            "chat": {"id": user_id, "type": "private", "first_name": "Анна", "username": "anna"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Анна", "last_name": "Иванова",
+                     "username": "anna", "language_code": "ru"},
+            **extra,
+        },
+    }
+
+
+def make_anonymizer():
+    return UpdateAnonymizer("salt", [str(ADMIN_ID)], GROUP_ID, code_words=["роза", "фиалка"])
+
+
+def test_personal_data_removed_and_ids_stable():
+    anonymizer = make_anonymizer()
+    first = anonymizer.anonymize(message_update("Анна Иванова, Москва"))
+    second = anonymizer.anonymize(message_update("/start"))
+    user = first["message"]["from"]
+    assert user["first_name"] == "user" and "last_name" not in user and "username" not in user
+    assert user["id"] != USER_ID and user["id"] == second["message"]["from"]["id"]
+    assert first["message"]["chat"]["id"] == user["id"]
+    assert first["message"]["text"] == "х" * len("Анна Иванова, Москва")
+    assert second["message"]["text"] == "/start"
+    # другая соль - другие псевдо-id
+    assert UpdateAnonymizer("other").pseudo_id(USER_ID) != user["id"]
+
+
+def test_only_known_words_kept_numbers_masked_ids_replaced():
+    anonymizer = make_anonymizer()
+
+    def text(value):
+        return anonymizer.anonymize(message_update(value))["message"]["text"]
+
+    assert text("роза") == "роза"
+    assert text("Фиалко") == "Фиалко"  # опечатка в кодовом слове - бот её распознаёт
+    assert text("ПМ") == "ПМ" and text("галерея дз") == "галерея дз"
+    assert text("79161234567") == "00000000000"
+    assert text("+79161234567") == "х" * 12
+    assert text("anna@mail.ru") == "х" * 12
+    assert text("Москва") == "х" * 6
+    assert text("/start 79161234567") == f"/start {anonymizer.pseudo_id(79161234567)}"
+    assert text("/search Иванова") == "/search ххххххх"
+    pseudo = anonymizer.pseudo_id(USER_ID)
+    callback = {
+        "update_id": 2,
+        "callback_query": {"id": "1", "chat_instance": "c", "data": f"approve_admin_check_{USER_ID}_3",
+                           "from": {"id": USER_ID, "is_bot": False, "first_name": "Анна"}},
+    }
+    assert anonymizer.anonymize(callback)["callback_query"]["data"] == f"approve_admin_check_{pseudo}_3"
+
+
+def test_admins_get_fixed_ids_and_location_dropped():
+    anonymizer = make_anonymizer()
+    update = anonymizer.anonymize(message_update("/stats", user_id=ADMIN_ID, location={"latitude": 55.7}))
+    assert update["message"]["from"]["id"] == ADMIN_PSEUDO_BASE
+    assert "location" not in update["message"]
+    assert anonymizer.pseudo_id(GROUP_ID) == ADMIN_GROUP_PSEUDO_ID
+
+
+def test_each_session_gets_own_file_and_killed_session_stays_readable(tmp_path):
+    base = str(tmp_path / "updates.jsonl.gz")
+    first = session_path(base, now=0)
+    recorder = UpdateRecorder(first, make_anonymizer())
+    recorder.record(message_update("/start"))
+    recorder._file.flush()  # процесс убит: gzip без концевика
+    second = session_path(base, now=0)
+    assert second != first and second.endswith(".jsonl.gz")
+    recorder2 = UpdateRecorder(second, make_anonymizer())
+    recorder2.record(message_update("/menu"))
+    recorder2.close()
+    assert [r["update"]["message"]["text"] for r in read_records(first)[1]] == ["/start"]
+    assert [r["update"]["message"]["text"] for r in read_records(second)[1]] == ["/menu"]
+
+    # старый журнал "в один файл": хвост убитой сессии и дописанная следующая
+    legacy = str(tmp_path / "legacy.jsonl.gz")
+    with open(legacy, "wb") as f:
+        f.write(open(first, "rb").read() + open(second, "rb").read())
+    assert [r["update"]["message"]["text"] for r in read_records(legacy)[1]] in ([], ["/start"])
+
+
+def test_recorder_roundtrip_and_truncated_tail(tmp_path):
+    path = str(tmp_path / "updates.jsonl.gz")
+    recorder = UpdateRecorder(path, make_anonymizer())
+    recorder.record(message_update("/start"))
+    recorder.record(message_update("/menu"))
+    recorder.close()
+
+    header, records = read_records(path)
+    assert header["admin_ids"] == [ADMIN_PSEUDO_BASE] and header["admin_group_id"] == ADMIN_GROUP_PSEUDO_ID
+    records = list(records)
+    assert [r["update"]["message"]["text"] for r in records] == ["/start", "/menu"]
+    assert records[0]["t"] <= records[1]["t"]
+
+    # оборванный при падении бота хвост не мешает прочитать начало
+    data = open(path, "rb").read()
+    with open(path, "wb") as f:
+        f.write(data[:-10])
+    assert len(list(read_records(path)[1])) <= 2
+
+
+def test_remap_user_ids_matches_recording():
+    anonymizer = make_anonymizer()
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, full_name TEXT)")
+    conn.execute("CREATE TABLE admin_codes (code_id INTEGER PRIMARY KEY, admin_id INTEGER)")
+    conn.executemany("INSERT INTO users VALUES (?, ?)", [(USER_ID, "Анна"), (ADMIN_ID, "Админ")])
+    conn.execute("INSERT INTO admin_codes VALUES (1, ?)", (ADMIN_ID,))
+    assert remap_user_ids(conn, anonymizer) == 3
+    ids = {row[0] for row in conn.execute("SELECT user_id FROM users")}
+    assert ids == {anonymizer.pseudo_id(USER_ID), ADMIN_PSEUDO_BASE}
+    assert conn.execute("SELECT admin_id FROM admin_codes").fetchone()[0] == ADMIN_PSEUDO_BASE
+
+
+def test_recording_is_gzip(tmp_path):
+    path = str(tmp_path / "u.jsonl.gz")
+    UpdateRecorder(path, make_anonymizer()).close()
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert '"format": 1' in f.readline()
@@ -0,0 +1,103 @@
+# tests/test_write_coordinator.py
+"""Тесты координатора записи."""
+import asyncio
+import sqlite3
+
+import pytest
+
+from write_coordinator import WriteCoordinator
+
+
+class CountingConnection(sqlite3.Connection):
+    """Соединение, считающее коммиты."""
+
+    commits = 0
+
+    def commit(self):
+        type(self).commits += 1
+        super().commit()
+
+
+@pytest.fixture
+def conn():
+    CountingConnection.commits = 0
+    conn = sqlite3.connect(":memory:", factory=CountingConnection, check_same_thread=False)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT UNIQUE)")
+    yield conn
+    conn.close()
+
+
+def insert(value):
+    def unit(cur):
+        cur.execute("INSERT INTO t (value) VALUES (?)", (value,))
+        return cur.lastrowid
+    return unit
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_one_commit(conn):
+    writer = WriteCoordinator(conn)
+    ids = await asyncio.gather(*(writer.submit(insert(f"v{i}")) for i in range(20)))
+    assert sorted(ids) == list(range(1, 21))
+    assert CountingConnection.commits == 1
+    assert (writer.batches, writer.units) == (1, 20)
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 20
+
+
+@pytest.mark.asyncio
+async def test_failed_unit_rolls_back_only_itself(conn):
+    writer = WriteCoordinator(conn)
+
+    def two_rows_then_fail(cur):
+        cur.execute("INSERT INTO t (value) VALUES ('partial')")
+        cur.execute("INSERT INTO t (value) VALUES ('a')")  # дубликат UNIQUE
+
+    results = await asyncio.gather(
+        writer.submit(insert("a")),
+        writer.submit(two_rows_then_fail),
+        writer.submit(insert("b")),
+        return_exceptions=True,
+    )
+    assert results[0] == 1
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert results[2] == 2
+    values = [v for (v,) in conn.execute("SELECT value FROM t ORDER BY id")]
+    assert values == ["a", "b"]
+    assert not conn.in_transaction
+
+
+@pytest.mark.asyncio
+async def test_max_batch_splits_queue(conn):
+    writer = WriteCoordinator(conn, max_batch=3)
+    ids = await asyncio.wait_for(asyncio.gather(*(writer.submit(insert(f"x{i}")) for i in range(5))), 1)
+    assert len(ids) == 5
+    assert CountingConnection.commits == 2
+
+
+@pytest.mark.asyncio
+async def test_sequential_writes_not_delayed(conn):
+    writer = WriteCoordinator(conn)
+    await writer.submit(insert("one"))
+    await writer.submit(insert("two"))
+    assert writer.batches == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_connection_transaction_untouched(tmp_path):
+    """Чужая незакоммиченная запись не коммитится и не откатывается писателем, а его ожидание не держит loop."""
+    path = str(tmp_path / "bot.sqlite")
+    shared = sqlite3.connect(path, timeout=5)
+    shared.execute("PRAGMA journal_mode=WAL")
+    shared.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value TEXT UNIQUE)")
+    shared.commit()
+    shared.execute("INSERT INTO t (value) VALUES ('shared')")  # транзакция общего соединения открыта
+    writer = WriteCoordinator(sqlite3.connect(path, timeout=5, check_same_thread=False))
+
+    pending = asyncio.ensure_future(writer.submit(insert("writer")))
+    await asyncio.sleep(0.05)  # писатель ждёт блокировку в потоке, loop свободен
+    assert not pending.done()
+    shared.rollback()
+    await asyncio.wait_for(pending, 5)
+    assert [v for (v,) in shared.execute("SELECT value FROM t")] == ["writer"]
+    writer.close()
+    shared.close()
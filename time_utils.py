@@ -0,0 +1,124 @@
+# time_utils.py
+"""Время как целые секунды эпохи вместо строк в разных форматах.
+
+Рядом со старыми текстовыми колонками хранятся INTEGER-колонки:
+- users.next_lesson_at      <- next_lesson_time
+- users.birthday_md         <- birthday, как число ММДД (0314 -> 314)
+- homeworks.submitted_at    <- COALESCE(submission_time, timestamp), только если
+  есть file_id: строка со статусом pending создаётся и при отправке урока,
+  и без файла это ещё не сдача
+- homeworks.approved_at     <- approval_time
+- homeworks.final_approved_at <- final_approval_time
+- homeworks.lesson_sent_at  <- lesson_sent_time
+
+Их поддерживают триггеры на вставку и изменение текстовых колонок, так
+что старые обработчики, которые пишут строки, ничего не ломают. Запросы
+"пора ли", "за последние сутки", "средняя длительность" и "у кого сегодня
+день рождения" становятся сравнениями целых по индексу, без strptime и
+JULIANDAY().
+
+Текстовые времена в базе записаны в локальном времени сервера, поэтому
+пересчёт идёт через strftime('%s', ..., 'utc').
+"""
+import logging
+import sqlite3
+import time
+from datetime import date, datetime
+
+from db_schema import ensure_column
+
+logger = logging.getLogger(__name__)
+
+# (таблица, INTEGER-колонка, SQL-выражение от строки NEW, исходные текстовые колонки)
+EPOCH_COLUMNS = (
+    ("users", "next_lesson_at", "CAST(strftime('%s', NEW.next_lesson_time, 'utc') AS INTEGER)", ("next_lesson_time",)),
+    ("users", "birthday_md", "CAST(strftime('%m%d', NEW.birthday) AS INTEGER)", ("birthday",)),
+    ("homeworks", "submitted_at",
+     "CASE WHEN NEW.file_id IS NOT NULL"
+     " THEN CAST(strftime('%s', COALESCE(NEW.submission_time, NEW.timestamp), 'utc') AS INTEGER) END",
+     ("submission_time", "timestamp", "file_id")),
+    ("homeworks", "approved_at", "CAST(strftime('%s', NEW.approval_time, 'utc') AS INTEGER)", ("approval_time",)),
+    ("homeworks", "final_approved_at", "CAST(strftime('%s', NEW.final_approval_time, 'utc') AS INTEGER)",
+     ("final_approval_time",)),
+    ("homeworks", "lesson_sent_at", "CAST(strftime('%s', NEW.lesson_sent_time, 'utc') AS INTEGER)",
+     ("lesson_sent_time",)),
+)
+
+EPOCH_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_users_next_lesson_at ON users(next_lesson_at)",
+    "CREATE INDEX IF NOT EXISTS idx_users_birthday_md ON users(birthday_md)",
+    "CREATE INDEX IF NOT EXISTS idx_homeworks_submitted_at ON homeworks(submitted_at)",
+    "CREATE INDEX IF NOT EXISTS idx_homeworks_user_course_submitted ON homeworks(user_id, course_id, submitted_at)",
+    "CREATE INDEX IF NOT EXISTS idx_homeworks_course_final_approved ON homeworks(course_id, final_approved_at)",
+)
+
+
+def create_epoch_columns(conn: sqlite3.Connection, cursor: sqlite3.Cursor):
+    """INTEGER-колонки времени, триггеры синхронизации, разовое заполнение и индексы.
+
+    Если выражение колонки поменялось, её триггеры пересоздаются, а колонка
+    заполняется заново.
+    """
+    for table, column, expression, sources in EPOCH_COLUMNS:
+        added = ensure_column(conn, table, column, "INTEGER")
+        source_list = ", ".join(sources)
+        stored = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                (f"trg_{table}_{column}_insert",)).fetchone()
+        changed = stored is not None and expression not in stored[0]
+        if changed:
+            cursor.execute(f"DROP TRIGGER trg_{table}_{column}_insert")
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{column}_update")
+        cursor.executescript(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE {table} SET {column} = {expression} WHERE rowid = NEW.rowid;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_update AFTER UPDATE OF {source_list} ON {table}
+            BEGIN
+                UPDATE {table} SET {column} = {expression} WHERE rowid = NEW.rowid;
+            END;
+            """
+        )
+        if added or changed:
+            # в выражении NEW.x -> x: то же преобразование для всех существующих строк
+            cursor.execute(f"UPDATE {table} SET {column} = {expression.replace('NEW.', '')}")
+            logger.info(f"create_epoch_columns: {table}.{column} заполнена для {cursor.rowcount} строк")
+    for statement in EPOCH_INDEXES:
+        cursor.execute(statement)
+    conn.commit()
+
+
+def now_epoch() -> int:
+    return int(time.time())
+
+
+def to_epoch(value) -> int | None:
+    """datetime/date/строка ISO (локальное время) -> секунды эпохи. None для пустых и нераспознанных."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return int(datetime(value.year, value.month, value.day).timestamp())
+    try:
+        return int(datetime.fromisoformat(str(value)).timestamp())
+    except ValueError:
+        logger.warning(f"to_epoch: не удалось разобрать время {value!r}")
+        return None
+
+
+def from_epoch(ts: int | None) -> datetime | None:
+    """Секунды эпохи -> локальный datetime без tzinfo (как в остальном коде бота)."""
+    return datetime.fromtimestamp(ts) if ts is not None else None
+
+
+def format_epoch(ts: int | None, fmt: str = "%Y-%m-%d %H:%M:%S") -> str | None:
+    return datetime.fromtimestamp(ts).strftime(fmt) if ts is not None else None
+
+
+def month_day(day: date) -> int:
+    """date -> ММДД как число (14 марта -> 314), формат users.birthday_md."""
+    return day.month * 100 + day.day
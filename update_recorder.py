@@ -0,0 +1,260 @@
+# update_recorder.py
+"""Запись входящих Update для последующего воспроизведения (benchmarks/replay_updates.py).
+
+Включается переменной UPDATE_RECORD_PATH. Каждый запуск бота пишет свой
+файл: к имени добавляется метка времени старта (updates-YYYYmmdd-HHMMSS.jsonl.gz).
+Убитый процесс оставляет gzip без концевика, и дописанные после него
+сессии в том же файле уже не прочитать. Каждый update пишется строкой
+JSON: {"t": секунды от начала записи, "update": {...}}.
+Первая строка - заголовок с форматом и псевдо-id админов и группы
+админов, чтобы при воспроизведении прошли проверки прав.
+
+Анонимизация:
+- id пользователей и чатов заменяются стабильными псевдо-id (HMAC с
+  солью UPDATE_RECORD_SALT) и в полях id, и внутри callback_data и текста;
+- имена, username, телефоны, геопозиции и контакты удаляются;
+- текст сохраняется, только если это известное боту слово: кодовое слово
+  курса (с опечатками, как его распознаёт CodeWordMatcher) или фраза
+  намерения из intent_matcher.INTENTS. У команд сохраняется сама команда,
+  числовые аргументы считаются id и заменяются псевдо-id. Всё остальное
+  маскируется с той же длиной: свободный текст, ФИО, почта, подписи - "х",
+  числа (телефоны, карты) - нулями;
+- file_id остаются: без них не воспроизвести альбомы и домашки.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+from intent_matcher import INTENTS, CodeWordMatcher, normalize
+
+logger = logging.getLogger(__name__)
+
+RECORD_FORMAT = 1
+FLUSH_EVERY = 20
+# Ключи, которые удаляются целиком
+DROP_KEYS = {"last_name", "username", "phone_number", "location", "contact", "venue", "bio", "invite_link",
+             "language_code"}
+# Обязательные для Telegram-объектов поля - заменяются заглушкой
+PLACEHOLDER_KEYS = {"first_name": "user", "title": "chat"}
+TEXT_KEYS = {"text", "caption"}
+ADMIN_PSEUDO_BASE = 1000
+ADMIN_GROUP_PSEUDO_ID = -1000000000001
+# Колонки с id пользователей Telegram - переписываются в копии базы для воспроизведения
+USER_ID_COLUMNS = ("user_id", "admin_id", "actor_id")
+
+
+class UpdateAnonymizer:
+    """Заменяет id и персональные данные в словаре update."""
+
+    def __init__(self, salt: str, admin_ids=(), admin_group_id: int | None = None, code_words=()):
+        self.salt = salt.encode()
+        self.code_words = CodeWordMatcher(code_words)
+        self.phrases = {normalize(phrase) for _, phrases in INTENTS for phrase in phrases}
+        # админы и группа админов получают фиксированные псевдо-id - их записываем в заголовок
+        self.fixed = {int(admin_id): ADMIN_PSEUDO_BASE + i for i, admin_id in enumerate(admin_ids) if str(admin_id)}
+        if admin_group_id is not None:
+            self.fixed[int(admin_group_id)] = ADMIN_GROUP_PSEUDO_ID
+
+    def pseudo_id(self, real_id: int) -> int:
+        if real_id in self.fixed:
+            return self.fixed[real_id]
+        digest = hmac.new(self.salt, str(abs(real_id)).encode(), hashlib.sha256).digest()
+        pseudo = 10 ** 9 + int.from_bytes(digest[:5], "big")
+        return -pseudo if real_id < 0 else pseudo
+
+    def anonymize(self, update: dict) -> dict:
+        ids = {}
+        self._collect_ids(update, ids)
+        return self._rewrite(update, ids)
+
+    def _collect_ids(self, node, ids: dict):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in ("id", "user_id", "chat_id") and isinstance(value, int) and not isinstance(value, bool):
+                    ids[value] = self.pseudo_id(value)
+                else:
+                    self._collect_ids(value, ids)
+        elif isinstance(node, list):
+            for item in node:
+                self._collect_ids(item, ids)
+
+    def _replace_ids_in_string(self, text: str, ids: dict) -> str:
+        for real, pseudo in ids.items():
+            text = re.sub(rf"(?<!\d){re.escape(str(real))}(?!\d)", str(pseudo), text)
+        return text
+
+    def _rewrite(self, node, ids: dict):
+        if isinstance(node, dict):
+            result = {}
+            for key, value in node.items():
+                if key in DROP_KEYS:
+                    continue
+                if key in PLACEHOLDER_KEYS and isinstance(value, str):
+                    result[key] = PLACEHOLDER_KEYS[key]
+                    continue
+                if isinstance(value, int) and value in ids and key in ("id", "user_id", "chat_id"):
+                    result[key] = ids[value]
+                elif key in TEXT_KEYS and isinstance(value, str):
+                    result[key] = self._anonymize_text(value, ids)
+                elif key == "data" and isinstance(value, str):  # callback_data
+                    result[key] = self._replace_ids_in_string(value, ids)
+                elif key == "entities" or key == "caption_entities":
+                    result[key] = [e for e in value if e.get("type") in ("bot_command",)]
+                else:
+                    result[key] = self._rewrite(value, ids)
+            return result
+        if isinstance(node, list):
+            return [self._rewrite(item, ids) for item in node]
+        return node
+
+    def _anonymize_text(self, text: str, ids: dict) -> str:
+        if text.startswith("/"):
+            command, _, args = text.partition(" ")
+            return " ".join([command, *(self._mask_argument(word, ids) for word in args.split())])
+        if self._is_known(text):
+            return text
+        return self._mask_word(text, ids)
+
+    def _is_known(self, text: str) -> bool:
+        """Кодовое слово или фраза намерения - то, на что бот реагирует и что не является данными человека."""
+        return normalize(text) in self.phrases or self.code_words.match(text) is not None
+
+    def _mask_argument(self, word: str, ids: dict) -> str:
+        """Числовой аргумент команды - id (/ban 123): псевдо-id, как и в копии базы."""
+        if word.lstrip("-").isdigit():
+            return str(ids.get(int(word)) or self.pseudo_id(int(word)))
+        return word if self._is_known(word) else "х" * len(word)
+
+    def _mask_word(self, text: str, ids: dict) -> str:
+        replaced = self._replace_ids_in_string(text, ids)
+        if replaced.lstrip("-").isdigit():
+            # псевдо-id оставляем, прочие числа - телефоны, карты - зануляем
+            return replaced if int(replaced) in ids.values() else "0" * len(text)
+        return "х" * len(text)
+
+
+def session_path(path: str, now: float | None = None) -> str:
+    """updates.jsonl.gz -> updates-YYYYmmdd-HHMMSS.jsonl.gz (с номером, если такой файл уже есть)."""
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+    candidate, number = os.path.join(directory, f"{stem}-{stamp}{dot}{suffix}"), 1
+    while os.path.exists(candidate):
+        number += 1
+        candidate = os.path.join(directory, f"{stem}-{stamp}-{number}{dot}{suffix}")
+    return candidate
+
+
+class UpdateRecorder:
+    """Пишет анонимизированные update в сжатый журнал."""
+
+    def __init__(self, path: str, anonymizer: UpdateAnonymizer):
+        """path - файл этой сессии записи; существующий файл не дописывается."""
+        self.path = path
+        self.anonymizer = anonymizer
+        self.started = time.monotonic()
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "xt", encoding="utf-8")
+        header = {
+            "format": RECORD_FORMAT,
+            "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "admin_ids": sorted(v for v in anonymizer.fixed.values() if v > 0),
+            "admin_group_id": ADMIN_GROUP_PSEUDO_ID if ADMIN_GROUP_PSEUDO_ID in anonymizer.fixed.values() else None,
+        }
+        self._file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        self._file.flush()
+        logger.info(f"UpdateRecorder: запись update в {path}")
+
+    @classmethod
+    def from_env(cls, admin_ids=(), admin_group_id: int | None = None, code_words=()):
+        """Рекордер, если задан UPDATE_RECORD_PATH, иначе None. Файл сессии - session_path(UPDATE_RECORD_PATH)."""
+        path = os.getenv("UPDATE_RECORD_PATH")
+        if not path:
+            return None
+        salt = os.getenv("UPDATE_RECORD_SALT") or os.urandom(16).hex()
+        return cls(session_path(path), UpdateAnonymizer(salt, admin_ids, admin_group_id, code_words))
+
+    def record(self, update_dict: dict):
+        line = {"t": round(time.monotonic() - self.started, 4), "update": self.anonymizer.anonymize(update_dict)}
+        self._file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0:
+            self._file.flush()
+
+    async def handle(self, update, context):
+        """Обработчик PTB (TypeHandler в отдельной группе) - не мешает остальным."""
+        try:
+            self.record(update.to_dict())
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"UpdateRecorder: update не записан: {e}")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            logger.info(f"UpdateRecorder: записано {self.count} update в {self.path}")
+
+
+def remap_user_ids(conn: sqlite3.Connection, anonymizer: UpdateAnonymizer) -> int:
+    """Переписывает id пользователей в КОПИИ базы теми же псевдо-id, что и в записи.
+
+    Иначе воспроизведённые update приходят от "незнакомых" пользователей и
+    идут по ветке регистрации вместо реальных сценариев.
+    """
+    conn.create_function("pseudo_id", 1, lambda value: anonymizer.pseudo_id(value) if isinstance(value, int) else value,
+                         deterministic=True)
+    changed = 0
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    for table in tables:
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info('{table}')")}
+        for column in USER_ID_COLUMNS:
+            if column in columns:
+                cursor = conn.execute(f'UPDATE "{table}" SET {column} = pseudo_id({column}) WHERE {column} IS NOT NULL')
+                changed += cursor.rowcount
+    conn.commit()
+    logger.info(f"remap_user_ids: заменено {changed} id пользователей")
+    return changed
+
+
+def read_records(path: str):
+    """(заголовок, итератор записей). Недописанный хвост (бот упал) пропускается.
+
+    В старых журналах "в один файл" после убитой сессии шёл gzip-член без
+    концевика, и распаковка дальше него падает - читаем до этого места.
+    """
+    f = gzip.open(path, "rt", encoding="utf-8")
+
+    def lines():
+        try:
+            yield from f
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            logger.warning(f"read_records: журнал {path} оборван, читаем до места обрыва")
+        finally:
+            f.close()
+
+    stream = lines()
+    try:
+        header = json.loads(next(stream, "{}"))
+    except json.JSONDecodeError:
+        header = {}
+
+    def records():
+        try:
+            for line in stream:
+                data = json.loads(line)
+                if "update" in data:  # заголовки сессий из старых журналов "в один файл" пропускаем
+                    yield data
+        except json.JSONDecodeError:  # последняя строка записана наполовину
+            logger.warning(f"read_records: журнал {path} оборван, читаем до места обрыва")
+        finally:
+            stream.close()
+
+    return header, records()